@@ -0,0 +1,203 @@
+"""
+Benchmarks the cvxpy solvers available for markowitz_mvo and cvxpy_rebalance on synthetic data and
+writes the solver policy used at runtime by select_solver.
+
+Usage (from the repository root):
+    python -m portfolio_balancer.scripts.benchmark_solvers --sizes 10 50 100 500 1000 5000
+    python -m portfolio_balancer.scripts.benchmark_solvers --sizes 10 100 --no-policy --results bench.json
+"""
+import argparse
+import json
+import statistics
+from datetime import datetime
+import cvxpy as cp
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
+from portfolio_balancer.src.optimization.cvxpy_rebalancer import cvxpy_rebalance, _get_rebalance_problem
+from portfolio_balancer.src.optimization.solver_policy import save_solver_policy, get_solver_policy_path
+
+DEFAULT_SIZES = [10, 50, 100, 500, 1000, 2000, 5000]
+DEFAULT_SOLVERS = ['OSQP', 'CLARABEL', 'ECOS', 'SCS']
+
+# Relative objective gap to the best optimal answer above which a solver is not trusted for a size.
+ACCURACY_TOLERANCE = 1e-3
+
+def synthetic_price_history(num_assets: int, num_days: int = 756, seed: int = 0) -> pd.DataFrame:
+    """Generates daily closing prices from a three-factor return model."""
+    rng = np.random.default_rng(seed)
+    loadings = rng.normal(0.0, 1.0, (num_assets, 3))
+    factor_returns = rng.normal(0.0002, 0.006, (num_days, 3))
+    idiosyncratic = rng.normal(0.0001, 0.01, (num_days, num_assets)) * rng.uniform(0.3, 1.5, num_assets)
+    daily_returns = factor_returns @ loadings.T * 0.5 + idiosyncratic
+    prices = 100 * np.cumprod(1 + daily_returns, axis=0)
+    dates = pd.bdate_range('2020-01-01', periods=num_days)
+    return pd.DataFrame(prices, index=dates, columns=[f"A{i:05d}" for i in range(num_assets)])
+
+def mvo_constraint_sets(price_history: pd.DataFrame, seed: int = 0) -> dict:
+    """Keyword arguments for markowitz_mvo covering its constraint variants."""
+    rng = np.random.default_rng(seed)
+    classes = rng.choice(['equities', 'bonds', 'cash'], size=price_history.shape[1], p=[0.6, 0.3, 0.1])
+    asset_class_mapping = dict(zip(price_history.columns, classes))
+    annual_returns = (1 + price_history.pct_change().dropna().mean())**252 - 1
+    return {
+        "long_only": {},
+        "class_limits": {
+            "asset_class_mapping": asset_class_mapping,
+            "max_equities_weight": 0.6,
+            "max_bonds_weight": 0.5,
+            "max_cash_weight": 0.2
+        },
+        "target_return": {"target_return": float(annual_returns.median())}
+    }
+
+def synthetic_rebalance_inputs(num_assets: int, seed: int = 0) -> dict:
+    """Generates a drifted portfolio and target weights for cvxpy_rebalance."""
+    rng = np.random.default_rng(seed)
+    tickers = [f"A{i:05d}" for i in range(num_assets)]
+    prices = rng.uniform(10, 500, num_assets)
+    target = rng.dirichlet(np.ones(num_assets)) * 0.97
+    drifted = target * rng.lognormal(0.0, 0.2, num_assets)
+    total_value = 1_000_000.0
+    holdings = drifted / drifted.sum() * 0.97 * total_value / prices
+    current_portfolio = {t: {'amount': holdings[i], 'price': prices[i]} for i, t in enumerate(tickers)}
+    current_portfolio['CASH'] = {'value': 0.03 * total_value}
+    target_weights = {t: target[i] for i, t in enumerate(tickers)}
+    target_weights['CASH'] = 1 - target.sum()
+    return {
+        "current_portfolio": current_portfolio,
+        "target_weights": target_weights,
+        "total_value": total_value,
+        "asset_prices": dict(zip(tickers, prices))
+    }
+
+def rebalance_constraint_sets(total_value: float) -> dict:
+    """Keyword arguments for cvxpy_rebalance covering its constraint variants."""
+    return {
+        "band": {"epsilon": 0.01},
+        "fees_reserve": {"epsilon": 0.02, "fees_per_trade": 5.0, "min_cash_reserve": 0.02 * total_value, "min_trade_threshold": 50.0},
+        "tight_band": {"epsilon": 0.001}
+    }
+
+def _run_mvo(price_history, solver, constraint_kwargs, time_limit):
+    result = markowitz_mvo(price_history, solver=solver, time_limit=time_limit, **constraint_kwargs)
+    objective = (result['expected_volatility'] / np.sqrt(252))**2 if result['optimal_weights'] else None
+    return result, objective
+
+def _run_rebalance(inputs, solver, constraint_kwargs, time_limit):
+    result = cvxpy_rebalance(**inputs, solver=solver, time_limit=time_limit, **constraint_kwargs)
+    problem = _get_rebalance_problem(len(inputs['asset_prices']))["problem"]
+    objective = problem.value if result.get('solve_path') in ['solver', 'solver_partial'] else None
+    return result, objective
+
+def benchmark(sizes: list, solvers: list, repeats: int = 3, time_limit: float = 120.0, kinds: list = None) -> list:
+    """
+    Runs every (problem kind, size, constraint set, solver) combination.
+
+    Returns:
+        list: One record per combination with median/first solve time, iterations, status,
+              solve path, objective and relative objective gap to the best optimal answer.
+    """
+    kinds = kinds or ['mvo', 'rebalance']
+    installed = set(cp.installed_solvers())
+    solvers = [s for s in solvers if s in installed]
+    records = []
+
+    for kind in kinds:
+        for size in sizes:
+            if kind == 'mvo':
+                data = synthetic_price_history(size, seed=size)
+                constraint_sets = mvo_constraint_sets(data, seed=size)
+                run = _run_mvo
+            else:
+                data = synthetic_rebalance_inputs(size, seed=size)
+                constraint_sets = rebalance_constraint_sets(data['total_value'])
+                run = _run_rebalance
+
+            for set_name, constraint_kwargs in constraint_sets.items():
+                set_records = []
+                for solver in solvers:
+                    times = []
+                    result, objective = None, None
+                    for _ in range(repeats):
+                        result, objective = run(data, solver, constraint_kwargs, time_limit)
+                        times.append(result['solve_time_ms'])
+                    record = {
+                        "problem": kind,
+                        "num_assets": size,
+                        "constraint_set": set_name,
+                        "solver": solver,
+                        "first_solve_ms": times[0],
+                        "median_solve_ms": statistics.median(times),
+                        "iterations": result.get('solver_iterations'),
+                        "status": result.get('status', result.get('solver_status')),
+                        "solve_path": result.get('solve_path'),
+                        "objective": objective
+                    }
+                    print(f"{kind:9s} n={size:<5d} {set_name:13s} {solver:9s} "
+                          f"{record['median_solve_ms']:10.1f} ms  iters={record['iterations']}  path={record['solve_path']}")
+                    set_records.append(record)
+
+                optimal = [r['objective'] for r in set_records if r['solve_path'] == 'solver' and r['objective'] is not None]
+                reference = min(optimal) if optimal else None
+                for record in set_records:
+                    if reference is None or record['objective'] is None:
+                        record['relative_gap'] = None
+                    else:
+                        record['relative_gap'] = abs(record['objective'] - reference) / max(abs(reference), 1e-12)
+                records.extend(set_records)
+
+    return records
+
+def build_policy(records: list, accuracy_tolerance: float = ACCURACY_TOLERANCE) -> dict:
+    """
+    Picks, for each problem kind and size, the solver with the lowest total median solve time among
+    solvers that solved every constraint set to optimality within the accuracy tolerance.
+    """
+    problems = {}
+    for kind in sorted({r['problem'] for r in records}):
+        buckets = []
+        for size in sorted({r['num_assets'] for r in records if r['problem'] == kind}):
+            totals = {}
+            for solver in sorted({r['solver'] for r in records if r['problem'] == kind}):
+                runs = [r for r in records if r['problem'] == kind and r['num_assets'] == size and r['solver'] == solver]
+                if runs and all(r['solve_path'] == 'solver' and r['relative_gap'] is not None
+                                and r['relative_gap'] <= accuracy_tolerance for r in runs):
+                    totals[solver] = sum(r['median_solve_ms'] for r in runs)
+            if totals:
+                best = min(totals, key=totals.get)
+                buckets.append({"max_assets": size, "solver": best, "total_median_solve_ms": round(totals[best], 3)})
+        problems[kind] = buckets
+
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "cvxpy_version": cp.__version__,
+        "accuracy_tolerance": accuracy_tolerance,
+        "problems": problems
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cvxpy solvers for MVO and rebalance problems.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of assets to benchmark.")
+    parser.add_argument('--solvers', nargs='+', default=DEFAULT_SOLVERS, help="Solvers to compare (uninstalled ones are skipped).")
+    parser.add_argument('--problems', nargs='+', default=['mvo', 'rebalance'], choices=['mvo', 'rebalance'])
+    parser.add_argument('--repeats', type=int, default=3, help="Solves per combination; the median is reported.")
+    parser.add_argument('--time-limit', type=float, default=120.0, help="Per-solve wall-clock limit in seconds.")
+    parser.add_argument('--results', default=None, help="Write the raw benchmark records to this JSON file.")
+    parser.add_argument('--policy', default=get_solver_policy_path(), help="Where to write the solver policy.")
+    parser.add_argument('--no-policy', action='store_true', help="Do not write a solver policy.")
+    args = parser.parse_args()
+
+    records = benchmark(args.sizes, args.solvers, repeats=args.repeats, time_limit=args.time_limit, kinds=args.problems)
+
+    if args.results:
+        with open(args.results, 'w') as f:
+            json.dump(records, f, indent=2)
+        print(f"Wrote {len(records)} benchmark records to {args.results}")
+
+    if not args.no_policy:
+        path = save_solver_policy(build_policy(records), args.policy)
+        print(f"Wrote solver policy to {path}")
+
+if __name__ == "__main__":
+    main()
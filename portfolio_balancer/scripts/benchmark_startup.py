@@ -0,0 +1,100 @@
+"""
+Measures how long the API and job modules take to import in a fresh interpreter, and which heavy
+dependencies the import loads.
+
+Every measurement runs in its own subprocess so module caches of earlier runs do not hide the cost.
+No database credentials are needed: the Supabase client is only created on first use.
+
+Usage (from the repository root):
+    python -m portfolio_balancer.scripts.benchmark_startup
+    python -m portfolio_balancer.scripts.benchmark_startup --modules portfolio_balancer.src.api.app --repeats 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    'portfolio_balancer.src.api.app',
+    'portfolio_balancer.src.api.services',
+    'portfolio_balancer.src.jobs.daily_jobs',
+    'portfolio_balancer.src.jobs.nightly_jobs'
+]
+
+# Dependencies that should only be loaded by the code paths that use them
+HEAVY_MODULES = ['cvxpy', 'supabase', 'yfinance', 'pycoingecko', 'apscheduler', 'pandas', 'numpy', 'scipy']
+
+# Runs in the child interpreter: imports the module and reports the time taken and the heavy modules loaded
+_CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+error = None
+try:
+    import {module}
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed_ms": elapsed * 1000,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+    "error": error
+}}))
+"""
+
+def measure_import(module: str, repeats: int = 5) -> dict:
+    """
+    Imports a module in fresh interpreters and summarizes the runs.
+
+    Args:
+        module (str): Dotted module path.
+        repeats (int): Number of interpreters started; the median time is reported.
+
+    Returns:
+        dict: A dictionary containing:
+            - "module": The module path.
+            - "median_ms", "min_ms": Import time over the runs.
+            - "loaded": Heavy dependencies loaded by the import.
+            - "error": Import error of the last run, if any.
+    """
+    code = _CHILD_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        lines = completed.stdout.strip().splitlines()
+        if completed.returncode != 0 or not lines:
+            runs.append({"elapsed_ms": float('nan'), "loaded": [], "error": (completed.stderr.strip().splitlines() or ["no output"])[-1]})
+            continue
+        runs.append(json.loads(lines[-1]))
+    times = [run["elapsed_ms"] for run in runs]
+    return {
+        "module": module,
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "loaded": runs[-1]["loaded"],
+        "error": runs[-1]["error"]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import (startup) time of the API and job modules.")
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES, help="Modules to import.")
+    parser.add_argument('--repeats', type=int, default=5, help="Fresh interpreters per module; the median is reported.")
+    parser.add_argument('--results', default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules:
+        result = measure_import(module, args.repeats)
+        results.append(result)
+        print(f"{module:45s} median {result['median_ms']:8.1f} ms  min {result['min_ms']:8.1f} ms  "
+              f"loads: {', '.join(result['loaded']) or '-'}")
+        if result["error"]:
+            print(f"    import failed: {result['error']}")
+
+    if args.results:
+        with open(args.results, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {len(results)} startup measurements to {args.results}")
+
+if __name__ == "__main__":
+    main()
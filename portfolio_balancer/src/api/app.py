@@ -1,34 +1,54 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from supabase import create_client, Client
+import json
 import os
+import tempfile
 import pandas as pd # Added for risk metrics
 import numpy as np # Added for risk metrics
 
 load_dotenv() # Load environment variables from .env file
 
-# Initialize Supabase client
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
+# Logging is configured after .env is loaded so LOG_LEVEL / LOG_FORMAT set there apply
+from portfolio_balancer.src.api.structured_logging import configure_logging, get_logger
+configure_logging()
+logger = get_logger(__name__)
+
+# Default wall-clock budget (seconds) for optimizer solves inside request handlers
+DEFAULT_SOLVER_TIME_LIMIT = float(os.environ.get("SOLVER_TIME_LIMIT", 10))
+
+# Shared Supabase client, created on first use (see db.py)
+from portfolio_balancer.src.api.db import supabase
+from portfolio_balancer.src.data.repository import repository
+from portfolio_balancer.src.api.loader import get_loader
+from portfolio_balancer.src.api.snapshot_cache import snapshot_cache
+from portfolio_balancer.src.api import instrumentation, tracing
+from portfolio_balancer.src.api.portfolio_import import ImportFileError, import_holdings_csv
+from portfolio_balancer.src.api.price_export import PRICE_FORMATS, MAX_PRICE_PAGE_SIZE, price_validators, is_not_modified, iter_price_pages, ndjson_stream, arrow_stream
 from portfolio_balancer.src.api.price_service import price_service
-from portfolio_balancer.src.api.services import get_portfolio_snapshot, get_asset_class_mapping
+from portfolio_balancer.src.api.services import get_portfolio_snapshot, get_portfolio_snapshots, snapshot_position_values, get_batch_risk_metrics, get_asset_class_mapping, get_online_risk_metrics, get_scenario_price_history, output_fingerprint, get_stored_output, store_output
 from portfolio_balancer.src.api.models import User, RiskProfile, TargetAllocation, Holding, PriceHistory
-from portfolio_balancer.src.evaluation.metrics import calculate_risk_metrics
+from portfolio_balancer.src.evaluation.metrics import calculate_risk_metrics, calculate_daily_returns, calculate_covariance_matrix
+from portfolio_balancer.src.evaluation.monte_carlo import estimate_step_returns, monte_carlo_projection
+from portfolio_balancer.src.evaluation.risk_engine import VAR_METHODS, check_var_parameters, calculate_var_metrics, scenario_shocks, stress_test, portfolio_risk_report
 from portfolio_balancer.src.optimization.rebalancer import deterministic_rebalance
-from portfolio_balancer.src.optimization.cvxpy_rebalancer import cvxpy_rebalance
 from portfolio_balancer.src.optimization.recommendation_engine import generate_recommendations_mvp
-from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
-from portfolio_balancer.src.evaluation.backtest import compare_strategies, generate_backtest_report
+from portfolio_balancer.src.optimization.what_if import WhatIfSession, what_if_sessions
+from portfolio_balancer.src.optimization.mvo_cache import mvo_cache, mvo_params, mvo_window, get_cached_mvo, store_mvo_result
+# cvxpy_rebalancer, markowitz_mvo and backtest pull in cvxpy, the slowest import of the stack; they are
+# imported by the endpoints that use them so the server starts without loading the solvers.
+from portfolio_balancer.src.jobs.backtest_jobs import backtest_jobs, JobQueueFull
 from portfolio_balancer.src.api.auth import init_auth_routes
 
 app = Flask(__name__)
 CORS(app)
 
+# Per-route latency histograms, exposed with the stage timings at /metrics
+instrumentation.init_app(app)
+# Sampled span trees of requests; debug_trace=1 returns a request's tree with its response
+tracing.init_app(app)
+
 # Initialize authentication routes
 init_auth_routes(app, supabase)
 
@@ -42,8 +62,10 @@ def set_user_target_allocation(user_id):
     data = request.get_json()
     data['user_id'] = user_id
     try:
-        response = supabase.table('target_allocation').upsert(data).execute()
-        return jsonify({'message': 'Target allocation set successfully', 'data': response.data}), 200
+        stored = repository.upsert_target_allocation(data)
+        get_loader().clear('target_allocation', user_id)
+        snapshot_cache.invalidate_user(user_id)
+        return jsonify({'message': 'Target allocation set successfully', 'data': [stored]}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -59,6 +81,13 @@ def create_risk_profile(user_id):
 
 @app.route('/portfolio/import', methods=['POST'])
 def import_portfolio():
+    """
+    Imports holdings from a CSV upload (columns ticker, quantity, purchase_price, purchase_date), streaming
+    it in chunks. Rows that fail validation are skipped and reported with their line numbers.
+
+    Query parameters: strict_tickers=true rejects rows whose ticker has no stored price;
+    format=ndjson streams a progress event per inserted batch, ending with the summary.
+    """
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
@@ -69,36 +98,55 @@ def import_portfolio():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    
-    if file and file.filename.endswith('.csv'):
-        try:
-            df = pd.read_csv(file)
-            # Expected columns: ticker, quantity, purchase_price, purchase_date
-            required_columns = ['ticker', 'quantity', 'purchase_price', 'purchase_date']
-            if not all(col in df.columns for col in required_columns):
-                return jsonify({'error': f'CSV must contain columns: {", ".join(required_columns)}'}), 400
-
-            holdings_to_insert = []
-            for index, row in df.iterrows():
-                holdings_to_insert.append({
-                    'user_id': user_id,
-                    'ticker': row['ticker'],
-                    'quantity': row['quantity'],
-                    'purchase_price': row['purchase_price'],
-                    'purchase_date': row['purchase_date']
-                })
-            
-            if holdings_to_insert:
-                response = supabase.table('holding').insert(holdings_to_insert).execute()
-                return jsonify({"message": "Portfolio imported", "holdings": response.data}), 200
-            else:
-                return jsonify({"message": "No holdings to import"}), 200
-
-        except Exception as e:
-            return jsonify({'error': f'Error processing CSV: {str(e)}'}), 500
-    else:
+    if not file.filename.endswith('.csv'):
         return jsonify({'error': 'Invalid file type, only CSV is supported'}), 400
 
+    output_format = request.args.get('format', 'json')
+    if output_format not in ['json', 'ndjson']:
+        return jsonify({'error': "format must be 'json' or 'ndjson'"}), 400
+    strict_tickers = request.args.get('strict_tickers', 'false').lower() == 'true'
+
+    upload = file.stream
+    if output_format == 'ndjson':
+        # Flask closes uploaded files when the view returns, before a streamed body is produced,
+        # so the streaming import reads a private copy (kept in memory up to 1 MB, then on disk)
+        upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        file.save(upload)
+        upload.seek(0)
+
+    try:
+        events = import_holdings_csv(upload, user_id, strict_tickers=strict_tickers)
+        first_event = next(events) # A file that cannot be imported fails here, before anything is written
+    except ImportFileError as e:
+        upload.close()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        upload.close()
+        return jsonify({'error': f'Error processing CSV: {str(e)}'}), 500
+
+    def run_import():
+        event = first_event
+        try:
+            yield event
+            for event in events:
+                yield event
+        finally:
+            upload.close()
+            if event.get("rows_imported"):
+                get_loader().clear('holding', user_id)
+                snapshot_cache.invalidate_user(user_id)
+
+    if output_format == 'ndjson':
+        lines = (json.dumps(event) + '\n' for event in run_import())
+        return app.response_class(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    for summary in run_import():
+        pass
+    if summary["event"] == "error":
+        return jsonify({**summary, 'error': f'Error importing CSV: {summary["error"]}'}), 500
+    message = "Portfolio imported" if summary["rows_imported"] else "No holdings to import"
+    return jsonify({"message": message, **{key: value for key, value in summary.items() if key != "event"}}), 200
+
 @app.route('/holdings', methods=['POST'])
 def add_holdings():
     user_id = request.args.get('user_id')
@@ -128,8 +176,10 @@ def add_holdings():
         })
     
     try:
-        response = supabase.table('holding').insert(holdings_to_insert).execute()
-        return jsonify({"message": "Holdings added", "holdings": response.data}), 200
+        inserted = repository.add_holdings(holdings_to_insert)
+        get_loader().clear('holding', user_id)
+        snapshot_cache.invalidate_user(user_id)
+        return jsonify({"message": "Holdings added", "holdings": inserted}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -142,21 +192,30 @@ def set_target_allocation():
     data['user_id'] = user_id
     try:
         # Supabase upsert: try to update if exists, else insert
-        response = supabase.table('target_allocation').upsert(data).execute()
-        return jsonify({'message': 'Target allocation set successfully', 'data': response.data}), 200
+        stored = repository.upsert_target_allocation(data)
+        get_loader().clear('target_allocation', user_id)
+        snapshot_cache.invalidate_user(user_id)
+        return jsonify({'message': 'Target allocation set successfully', 'data': [stored]}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/<int:user_id>/portfolio', methods=['GET'])
 def get_portfolio(user_id):
     try:
-        response = supabase.table('holding').select("*").eq("user_id", user_id).execute()
-        return jsonify(response.data)
+        return jsonify(get_loader().holdings(user_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/prices/<ticker>', methods=['GET'])
 def get_price_history_by_date(ticker):
+    """
+    Stored closing prices of a ticker from a date on.
+
+    Query parameters: from (required), format ('json', 'ndjson' or 'arrow'), limit and cursor for
+    pagination (the next page's cursor is returned as "next_cursor", or the X-Next-Cursor header when
+    streaming). Responses carry an ETag and Last-Modified derived from the ticker's last stored date,
+    and conditional requests for unchanged data get 304 Not Modified.
+    """
     from_date_str = request.args.get('from')
     if not from_date_str:
         return jsonify({'error': 'from date is required'}), 400
@@ -166,30 +225,57 @@ def get_price_history_by_date(ticker):
     except ValueError:
         return jsonify({'error': 'Invalid date format for "from". Use YYYY-MM-DD.'}), 400
 
+    output_format = request.args.get('format', 'json').lower()
+    if output_format not in PRICE_FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(PRICE_FORMATS)}'}), 400
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            datetime.strptime(cursor, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor.'}), 400
+    limit = request.args.get('limit', type=int)
+    if 'limit' in request.args and (limit is None or not 1 <= limit <= MAX_PRICE_PAGE_SIZE):
+        return jsonify({'error': f'limit must be an integer between 1 and {MAX_PRICE_PAGE_SIZE}'}), 400
+
     # Fetch historical prices from the 'price_history' table
     # Assuming 'date' column is stored as a string in 'YYYY-MM-DD' format or similar
     try:
-        response = supabase.table('price_history') \
-            .select("date, close") \
-            .eq("ticker", ticker) \
-            .gte("date", from_date_str) \
-            .order("date", desc=False) \
-            .execute()
-        
-        prices_data = response.data
-        
-        # Format the output as specified
-        formatted_prices = []
-        for item in prices_data:
-            formatted_prices.append({
-                "date": item['date'],
-                "close": item['close']
-            })
-
-        return jsonify({
-            "ticker": ticker,
-            "prices": formatted_prices
-        }), 200
+        last_date = repository.get_last_price_date(ticker)
+        etag, last_modified = price_validators(ticker, last_date, from_date_str, output_format, cursor, limit)
+        if is_not_modified(request, etag, last_modified):
+            response = app.response_class(status=304)
+        else:
+            next_cursor = None
+            if limit:
+                page = repository.get_price_page(ticker, from_date_str, cursor, limit)
+                next_cursor = page[-1]['date'] if len(page) == limit else None
+                pages = [page]
+            else:
+                pages = iter_price_pages(ticker, from_date_str, cursor)
+
+            if output_format == 'json':
+                body = {
+                    "ticker": ticker,
+                    "prices": [{"date": row['date'], "close": row['close']} for page in pages for row in page]
+                }
+                if limit:
+                    body["next_cursor"] = next_cursor
+                response = jsonify(body)
+            else:
+                try:
+                    stream = ndjson_stream(pages) if output_format == 'ndjson' else arrow_stream(pages)
+                except ImportError:
+                    return jsonify({'error': 'Arrow output requires pyarrow, which is not installed.'}), 406
+                response = app.response_class(stream_with_context(stream), mimetype=PRICE_FORMATS[output_format])
+                if next_cursor:
+                    response.headers['X-Next-Cursor'] = next_cursor
+
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache' # Clients may keep the data but must revalidate
+        return response
 
     except Exception as e:
         return jsonify({'error': f'Error fetching price history: {str(e)}'}), 500
@@ -212,6 +298,19 @@ def portfolio_snapshot():
     snapshot = get_portfolio_snapshot(user_id)
     return jsonify(snapshot)
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of this worker's caches."""
+    return jsonify({
+        "snapshots": snapshot_cache.stats(),
+        "mvo": mvo_cache.stats()
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request latencies, stage timings and cache lookups of this worker, in the Prometheus text format."""
+    return Response(instrumentation.registry.render(), content_type=instrumentation.PROMETHEUS_CONTENT_TYPE)
+
 @app.route('/api/user/<int:user_id>/historical-allocation', methods=['GET'])
 def get_historical_allocation(user_id):
     try:
@@ -220,14 +319,49 @@ def get_historical_allocation(user_id):
     except Exception as e:
         return jsonify({'error': f'Error fetching historical allocation: {str(e)}'}), 500
 
+def _var_parameters(source):
+    """
+    Validated VaR confidence and horizon_days from request arguments or a body (defaults 0.95 and 1 day).
+
+    Returns:
+        tuple: (confidence, horizon_days, None) or (None, None, error response).
+    """
+    try:
+        confidence = float(source.get('confidence', 0.95))
+        horizon_days = float(source.get('horizon_days', 1))
+    except (TypeError, ValueError):
+        return None, None, (jsonify({"error": "confidence and horizon_days must be numbers."}), 400)
+    try:
+        check_var_parameters(confidence, horizon_days)
+    except ValueError as e:
+        return None, None, (jsonify({"error": str(e)}), 400)
+    return confidence, int(horizon_days), None
+
 @app.route('/portfolio/risk', methods=['GET'])
 def portfolio_risk():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
 
+    # mode=online serves the incrementally maintained metrics instead of recomputing over the full history
+    if request.args.get('mode') == 'online':
+        try:
+            online_metrics = get_online_risk_metrics(user_id)
+        except Exception as e:
+            return jsonify({"error": f"Error updating online risk metrics: {str(e)}"}), 500
+        if online_metrics is None:
+            return jsonify({"error": "No holdings with price history found for this user."}), 404
+        return jsonify(online_metrics)
+
+    # include=var,stress adds VaR/CVaR (historical, parametric, Monte Carlo) and historical stress scenarios
+    include = [part.strip() for part in request.args.get('include', '').split(',') if part.strip()]
+    if 'var' in include:
+        confidence, horizon_days, error_response = _var_parameters(request.args)
+        if error_response:
+            return error_response
+
     # Fetch user's holdings
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
+    holdings_data = get_loader().holdings(user_id)
     
     if not holdings_data:
         return jsonify({"error": "No holdings found for this user."}), 404
@@ -270,8 +404,8 @@ def portfolio_risk():
     snapshot = get_portfolio_snapshot(user_id)
     current_portfolio_value = snapshot['total_value']
     current_weights = {}
-    for item in snapshot['breakdown']:
-        current_weights[item['ticker']] = item['value'] / current_portfolio_value if current_portfolio_value > 0 else 0
+    for ticker, value in snapshot_position_values(snapshot).items():
+        current_weights[ticker] = value / current_portfolio_value if current_portfolio_value > 0 else 0
     
     # Align weights with the assets in price_history_df
     aligned_weights = np.array([current_weights.get(col, 0) for col in price_history_df.columns])
@@ -285,10 +419,240 @@ def portfolio_risk():
 
     try:
         risk_metrics = calculate_risk_metrics(price_history_df, aligned_weights)
+
+        var_metrics = None
+        stress_results = None
+        if 'var' in include:
+            var_metrics = calculate_var_metrics(
+                price_history_df, aligned_weights, confidence=confidence, horizon_days=horizon_days,
+                seed=0 # Same inputs, same figures
+            )
+        if 'stress' in include:
+            scenario_history = get_scenario_price_history(list(price_history_df.columns))
+            shocks, covered = scenario_shocks(scenario_history.reindex(columns=price_history_df.columns))
+            stress_results = stress_test(shocks, aligned_weights, covered)
+        if var_metrics is not None or stress_results is not None:
+            risk_metrics.update(portfolio_risk_report(var_metrics, stress_results))
+
         return jsonify(risk_metrics)
     except Exception as e:
         return jsonify({"error": f"Error calculating risk metrics: {str(e)}"}), 500
 
+# Accounts per advisor batch request
+MAX_BATCH_USERS = int(os.environ.get("MAX_BATCH_USERS", 1000))
+
+SNAPSHOT_TABLE_COLUMNS = ["user_id", "total_value", "holdings"]
+HOLDING_TABLE_COLUMNS = ["user_id", "ticker", "value", "weight", "target", "drift"]
+RISK_TABLE_COLUMNS = ["user_id", "risk_score", "volatility", "sharpe_ratio", "mean_daily_return"]
+
+def _batch_user_ids(data):
+    """
+    Validated, de-duplicated user ids from a batch request body.
+
+    Returns:
+        tuple: (user ids, None) or (None, error response).
+    """
+    user_ids = (data or {}).get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return None, (jsonify({"error": "user_ids must be a non-empty list."}), 400)
+    if len(user_ids) > MAX_BATCH_USERS:
+        return None, (jsonify({"error": f"At most {MAX_BATCH_USERS} user_ids per request."}), 400)
+    return list(dict.fromkeys(str(user_id) for user_id in user_ids)), None
+
+def _batch_errors(errors: dict) -> list:
+    return [{"user_id": user_id, "error": message} for user_id, message in errors.items()]
+
+@app.route('/advisor/snapshots', methods=['POST'])
+def advisor_snapshots():
+    """
+    Snapshots of many accounts in one call, as compact tables: one row per account and, unless
+    include_holdings is false, one row per holding. Accounts that cannot be valued are listed in "errors".
+    """
+    data = request.get_json(silent=True) or {}
+    user_ids, error_response = _batch_user_ids(data)
+    if error_response:
+        return error_response
+
+    try:
+        snapshots, errors = get_portfolio_snapshots(user_ids)
+    except Exception as e:
+        return jsonify({"error": f"Error computing snapshots: {str(e)}"}), 500
+
+    accounts = [[user_id, snapshots[user_id]['total_value'], len(snapshots[user_id]['breakdown'])]
+                for user_id in user_ids if user_id in snapshots]
+    response = {
+        "accounts": {"columns": SNAPSHOT_TABLE_COLUMNS, "rows": accounts},
+        "errors": _batch_errors(errors)
+    }
+    if data.get('include_holdings', True):
+        response["holdings"] = {
+            "columns": HOLDING_TABLE_COLUMNS,
+            "rows": [[user_id] + [item[column] for column in HOLDING_TABLE_COLUMNS[1:]]
+                     for user_id in user_ids if user_id in snapshots for item in snapshots[user_id]['breakdown']]
+        }
+    return jsonify(response), 200
+
+@app.route('/advisor/risk', methods=['POST'])
+def advisor_risk():
+    """
+    Risk metrics of many accounts from one shared price history and covariance, as a compact table.
+
+    Body: user_ids, and optionally risk_free_rate, include (["var"]) with confidence and horizon_days.
+    Accounts that cannot be evaluated are listed in "errors".
+    """
+    data = request.get_json(silent=True) or {}
+    user_ids, error_response = _batch_user_ids(data)
+    if error_response:
+        return error_response
+
+    include_var = 'var' in (data.get('include') or [])
+    try:
+        risk_free_rate = float(data.get('risk_free_rate', 0.01))
+    except (TypeError, ValueError):
+        return jsonify({"error": "risk_free_rate must be a number."}), 400
+    confidence, horizon_days, error_response = _var_parameters(data)
+    if error_response:
+        return error_response
+
+    try:
+        results, errors, window = get_batch_risk_metrics(user_ids, risk_free_rate, include_var=include_var,
+                                                         confidence=confidence, horizon_days=horizon_days)
+    except Exception as e:
+        return jsonify({"error": f"Error calculating risk metrics: {str(e)}"}), 500
+
+    columns = list(RISK_TABLE_COLUMNS)
+    if include_var:
+        columns += [f"{method}_{measure}" for method in VAR_METHODS for measure in ('var', 'cvar')]
+    rows = []
+    for user_id in user_ids:
+        if user_id not in results:
+            continue
+        result = results[user_id]
+        row = [user_id] + [result[column] for column in RISK_TABLE_COLUMNS[1:]]
+        if include_var:
+            row += [result['var'][method][measure] for method in VAR_METHODS for measure in ('var', 'cvar')]
+        rows.append(row)
+
+    return jsonify({
+        "columns": columns,
+        "rows": rows,
+        "price_window": window,
+        "errors": _batch_errors(errors)
+    }), 200
+
+# Projection requests run synchronously and are capped so a single call cannot tie up the web process
+# (60 years of 20000 paths take about 2 s)
+MAX_PROJECTION_PATHS = int(os.environ.get("MAX_PROJECTION_PATHS", 20000))
+MAX_PROJECTION_YEARS = 60
+PROJECTION_REBALANCE_STEPS = {"monthly": 1, "quarterly": 3, "annually": 12, "none": 0}
+
+def _run_projection(price_history_df, weights, initial_value, options):
+    """
+    Runs a Monte Carlo projection of a portfolio with the options given in a request body.
+
+    Args:
+        price_history_df (pd.DataFrame): Historical prices of the portfolio's assets.
+        weights (np.ndarray): Portfolio weights aligned with price_history_df's columns.
+        initial_value (float): Current portfolio value.
+        options (dict): Request options: years, num_paths, target_value, annual_contribution,
+                        rebalance_frequency ('monthly', 'quarterly', 'annually' or 'none') and seed.
+
+    Returns:
+        dict: The monte_carlo_projection result.
+    """
+    rebalance_frequency = options.get('rebalance_frequency', 'monthly')
+    if rebalance_frequency not in PROJECTION_REBALANCE_STEPS:
+        raise ValueError(f"rebalance_frequency must be one of {', '.join(PROJECTION_REBALANCE_STEPS)}")
+    years = int(options.get('years', 30))
+    num_paths = int(options.get('num_paths', 10000))
+    if not 1 <= years <= MAX_PROJECTION_YEARS:
+        raise ValueError(f"years must be between 1 and {MAX_PROJECTION_YEARS}")
+    if not 1 <= num_paths <= MAX_PROJECTION_PATHS:
+        raise ValueError(f"num_paths must be between 1 and {MAX_PROJECTION_PATHS}")
+    seed = options.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        raise ValueError("seed must be a non-negative integer")
+    target_value = options.get('target_value')
+
+    mean_returns, cov_matrix = estimate_step_returns(price_history_df)
+    return monte_carlo_projection(
+        weights, mean_returns, cov_matrix, initial_value,
+        years=years,
+        num_paths=num_paths,
+        rebalance_every=PROJECTION_REBALANCE_STEPS[rebalance_frequency],
+        annual_contribution=float(options.get('annual_contribution', 0.0)),
+        goal_value=float(target_value) if target_value is not None else None,
+        seed=seed
+    )
+
+def _snapshot_weights(snapshot, columns):
+    """Current snapshot weights aligned with the given tickers, normalized (equal weights if none are held)."""
+    total_value = snapshot['total_value']
+    current_weights = {ticker: value / total_value if total_value > 0 else 0 for ticker, value in snapshot_position_values(snapshot).items()}
+    aligned_weights = np.array([current_weights.get(col, 0) for col in columns])
+    if np.sum(aligned_weights) > 0:
+        return aligned_weights / np.sum(aligned_weights)
+    return np.array([1/len(columns)] * len(columns))
+
+@app.route('/portfolio/projection', methods=['POST'])
+def portfolio_projection():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    data = request.get_json() or {}
+
+    # Fetch user's holdings
+    holdings_data = get_loader().holdings(user_id)
+
+    if not holdings_data:
+        return jsonify({"error": "No holdings found for this user."}), 404
+
+    tickers = [h['ticker'] for h in holdings_data]
+
+    # Fetch historical prices for all tickers
+    price_history_data = {}
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365 * 5) # Last 5 years of data
+
+    for ticker in tickers:
+        history = price_service.get_historical_prices(ticker, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        if history:
+            df = pd.DataFrame(history)
+            df['date'] = pd.to_datetime(df['date'])
+            df.set_index('date', inplace=True)
+            price_history_data[ticker] = df['close']
+
+    price_history_df = pd.DataFrame(price_history_data).dropna()
+    if price_history_df.empty:
+        return jsonify({"error": "Not enough overlapping historical price data for a projection."}), 500
+
+    snapshot = get_portfolio_snapshot(user_id)
+
+    # Project the requested target weights if given, otherwise the current ones
+    target_weights = data.get('target_weights')
+    if target_weights:
+        weights = np.array([float(target_weights.get(col, 0)) for col in price_history_df.columns])
+        if np.sum(weights) <= 0:
+            return jsonify({"error": "target_weights must include at least one asset with price history."}), 400
+        weights = weights / np.sum(weights)
+    else:
+        weights = _snapshot_weights(snapshot, price_history_df.columns)
+
+    initial_value = float(data.get('initial_value', snapshot['total_value']))
+
+    try:
+        projection = _run_projection(price_history_df, weights, initial_value, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error running projection: {str(e)}"}), 500
+
+    projection["tickers"] = list(price_history_df.columns)
+    projection["weights"] = weights.tolist()
+    projection["initial_value"] = initial_value
+    return jsonify(projection), 200
+
 @app.route('/recommend', methods=['POST'])
 def recommend_assets():
     user_id = request.args.get('user_id')
@@ -312,7 +676,7 @@ def recommend_assets():
     user_risk_tolerance = risk_tolerance_map.get(risk_level.lower(), 0.10) # Default to moderate
 
     # Fetch user's holdings (needed for generate_recommendations_mvp)
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
+    holdings_data = get_loader().holdings(user_id)
     
     if not holdings_data:
         # If no holdings, we can still recommend based on goals/risk, but the MVP engine needs a snapshot
@@ -320,7 +684,14 @@ def recommend_assets():
         return jsonify({"error": "No holdings found for this user. Recommendations require an existing portfolio."}), 404
 
     tickers = [h['ticker'] for h in holdings_data]
-    
+    snapshot = get_portfolio_snapshot(user_id)
+
+    # Recommendations computed from the same holdings, prices and request are served as stored
+    input_fingerprint = output_fingerprint('recommendation', holdings_data, None, snapshot, data)
+    stored_recommendation = get_stored_output('recommendation', user_id, input_fingerprint)
+    if stored_recommendation is not None:
+        return jsonify({**stored_recommendation, "input_fingerprint": input_fingerprint}), 200
+
     # Fetch historical prices for all tickers (needed for generate_recommendations_mvp)
     price_history_data = {}
     end_date = datetime.now()
@@ -351,8 +722,6 @@ def recommend_assets():
 
     price_history_df = pd.DataFrame(price_history_data).dropna()
 
-    snapshot = get_portfolio_snapshot(user_id)
-
     try:
         recommendations = generate_recommendations_mvp(snapshot, user_risk_tolerance, price_history_df)
         
@@ -364,10 +733,25 @@ def recommend_assets():
                 "reason": rec.get('reason', 'Based on your goals and risk level.')
             })
 
-        return jsonify({
+        response = {
             "recommended_assets": formatted_recommendations,
             "justification": f"Based on your {risk_level} risk tolerance and {goals} goals."
-        }), 200
+        }
+
+        # Goals given as {"target_value": ..., "years": ..., "annual_contribution": ...} are checked
+        # against a Monte Carlo projection of the current portfolio
+        if isinstance(goals, dict) and goals.get('target_value') is not None:
+            weights = _snapshot_weights(snapshot, price_history_df.columns)
+            projection = _run_projection(price_history_df, weights, snapshot['total_value'], goals)
+            response["goal_projection"] = projection
+            response["justification"] = (
+                f"Based on your {risk_level} risk tolerance, your current portfolio has a "
+                f"{projection['goal_probability']:.0%} chance of reaching {float(goals['target_value']):,.0f} "
+                f"in {len(projection['years']) - 1} years."
+            )
+
+        store_output('recommendation', user_id, input_fingerprint, response)
+        return jsonify({**response, "input_fingerprint": input_fingerprint}), 200
 
     except Exception as e:
         return jsonify({"error": f"Error generating recommendations: {str(e)}"}), 500
@@ -395,19 +779,30 @@ def rebalance_suggest():
     fees_per_trade = data.get('fees_per_trade', 0.0) # Default to $0.0
     round_to_nearest_share = data.get('round_to_nearest_share', False)
     epsilon = data.get('epsilon', 0.01) # For cvxpy optimization
+    solver_time_limit = data.get('solver_time_limit', DEFAULT_SOLVER_TIME_LIMIT)
+    solver_max_iters = data.get('solver_max_iters', None)
 
     # Fetch current portfolio snapshot
     snapshot = get_portfolio_snapshot(user_id)
     current_portfolio_value = snapshot['total_value']
+    holdings_data = get_loader().holdings(user_id) or []
+    # A ticker can be held in several lots (one holding row each), so quantities and values are summed per ticker
+    quantities = {}
+    for h in holdings_data:
+        quantities[h['ticker']] = quantities.get(h['ticker'], 0) + h['quantity']
+    position_values = snapshot_position_values(snapshot)
     
     current_portfolio_dict = {}
     asset_prices = {}
     # Also collect all tickers for price history fetching
     all_tickers_in_portfolio = []
-    for item in snapshot['breakdown']:
-        current_portfolio_dict[item['ticker']] = {'amount': item['quantity'], 'price': item['latest_price']}
-        asset_prices[item['ticker']] = item['latest_price']
-        all_tickers_in_portfolio.append(item['ticker'])
+    for ticker, value in position_values.items():
+        # The snapshot reports values; the latest price is recovered from the held quantity
+        quantity = quantities.get(ticker, 0)
+        latest_price = value / quantity if quantity else None
+        current_portfolio_dict[ticker] = {'amount': quantity, 'price': latest_price}
+        asset_prices[ticker] = latest_price
+        all_tickers_in_portfolio.append(ticker)
     
     # Add cash to current portfolio if not already present
     # Assuming cash is part of the breakdown if it exists, otherwise initialize to 0
@@ -415,17 +810,22 @@ def rebalance_suggest():
         current_portfolio_dict['CASH'] = {'value': 0} # Or fetch actual cash balance
 
     # Fetch target allocation
-    target_allocation_data = supabase.table('target_allocation').select("*").eq("user_id", user_id).limit(1).execute().data
-    if not target_allocation_data:
+    target_alloc = get_loader().target_allocation(user_id)
+    if not target_alloc:
         return jsonify({"error": "Target allocation not set for this user."}), 400
-    
-    target_alloc = target_allocation_data[0]
+
     target_weights = {
         'equities': target_alloc.get('equities', 0),
         'bonds': target_alloc.get('bonds', 0),
         'cash': target_alloc.get('cash', 0)
     }
 
+    # A plan computed from the same holdings, targets, prices and parameters is served as stored
+    input_fingerprint = output_fingerprint('rebalance_plan', holdings_data, target_alloc, snapshot, data)
+    stored_plan = get_stored_output('rebalance_plan', user_id, input_fingerprint)
+    if stored_plan is not None:
+        return jsonify({**stored_plan, "input_fingerprint": input_fingerprint})
+
     # Map current holdings to asset classes to get target weights per ticker
     # This is a crucial step that needs a proper mapping mechanism
     # For now, we'll use a simplified mapping or assume target_weights are per ticker
@@ -438,9 +838,7 @@ def rebalance_suggest():
     
     # Distribute target asset class weights to individual tickers
     final_target_weights_per_ticker = {}
-    for item in snapshot['breakdown']:
-        ticker = item['ticker']
-        current_value = item['value']
+    for ticker, current_value in position_values.items():
         asset_class = asset_class_mapping.get(ticker)
         
         if asset_class and asset_class in target_weights and current_portfolio_value > 0: # Check total_value > 0 to avoid division by zero
@@ -450,10 +848,10 @@ def rebalance_suggest():
             
             # First, calculate current value per asset class
             current_value_per_asset_class = {'equities': 0, 'bonds': 0, 'cash': 0, 'crypto': 0, 'other': 0}
-            for holding_item in snapshot['breakdown']:
-                holding_asset_class = asset_class_mapping.get(holding_item['ticker'])
+            for holding_ticker, holding_value in position_values.items():
+                holding_asset_class = asset_class_mapping.get(holding_ticker)
                 if holding_asset_class in current_value_per_asset_class:
-                    current_value_per_asset_class[holding_asset_class] += holding_item['value']
+                    current_value_per_asset_class[holding_asset_class] += holding_value
             
             if current_value_per_asset_class[asset_class] > 0:
                 proportion_in_class = current_value / current_value_per_asset_class[asset_class]
@@ -493,6 +891,7 @@ def rebalance_suggest():
                 asset_prices=asset_prices
             )
         elif rebalance_type == 'cvxpy':
+            from portfolio_balancer.src.optimization.cvxpy_rebalancer import cvxpy_rebalance
             rebalance_result = cvxpy_rebalance(
                 current_portfolio=current_portfolio_dict,
                 target_weights=final_target_weights_per_ticker,
@@ -501,15 +900,132 @@ def rebalance_suggest():
                 min_trade_threshold=min_trade_threshold,
                 min_cash_reserve=min_cash_reserve,
                 fees_per_trade=fees_per_trade,
-                epsilon=epsilon
+                epsilon=epsilon,
+                time_limit=solver_time_limit,
+                max_iters=solver_max_iters,
+                round_to_nearest_share=round_to_nearest_share
             )
         else:
             return jsonify({"error": "Invalid rebalance_type. Must be 'deterministic' or 'cvxpy'."}), 400
-            
-        return jsonify(rebalance_result)
+
+        store_output('rebalance_plan', user_id, input_fingerprint, rebalance_result)
+        return jsonify({**rebalance_result, "input_fingerprint": input_fingerprint})
     except Exception as e:
         return jsonify({"error": f"Error rebalancing portfolio: {str(e)}"}), 500
 
+@app.route('/rebalance/what-if', methods=['POST'])
+def what_if_create():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    data = request.get_json() or {}
+    target_weights = data.get('target_weights') # Ticker-level targets (e.g. those of a /rebalance/suggest proposal)
+    fees_per_trade = data.get('fees_per_trade', 0.0)
+    initial_trades = data.get('trades', [])
+
+    snapshot = get_portfolio_snapshot(user_id)
+    current_values = snapshot_position_values(snapshot)
+    cash = data.get('cash', current_values.pop('CASH', 0.0))
+
+    # Tickers that are not held yet but may be bought in the session
+    extra_tickers = list(data.get('extra_tickers', [])) + [trade.get('ticker') for trade in initial_trades]
+    tickers = list(dict.fromkeys(list(current_values) + [t for t in extra_tickers if t and t != 'CASH']))
+    if not tickers:
+        return jsonify({"error": "No holdings or tickers to simulate."}), 404
+
+    # Covariance slice of the session's tickers; tickers without price history are treated as riskless
+    price_history_data = {}
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=365 * 5) # Last 5 years of data
+    for ticker in tickers:
+        history = price_service.get_historical_prices(ticker, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        if history:
+            df = pd.DataFrame(history)
+            df['date'] = pd.to_datetime(df['date'])
+            df.set_index('date', inplace=True)
+            price_history_data[ticker] = df['close']
+    price_history_df = pd.DataFrame(price_history_data).dropna()
+    cov_matrix = pd.DataFrame(0.0, index=tickers, columns=tickers)
+    if len(price_history_df) > 2:
+        priced_cov = calculate_covariance_matrix(calculate_daily_returns(price_history_df))
+        cov_matrix.loc[priced_cov.index, priced_cov.columns] = priced_cov
+    unpriced_tickers = [t for t in tickers if t not in price_history_df.columns or len(price_history_df) <= 2]
+
+    session = WhatIfSession(
+        tickers,
+        [current_values.get(t, 0.0) for t in tickers],
+        cash,
+        cov_matrix.to_numpy(),
+        target_weights=target_weights,
+        fees_per_trade=fees_per_trade
+    )
+    try:
+        for trade in initial_trades:
+            session.apply_trade(trade.get('ticker'), trade.get('action'), trade.get('amount'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid trade: {str(e)}"}), 400
+
+    session_id = what_if_sessions.create(user_id, session)
+    return jsonify({"session_id": session_id, "unpriced_tickers": unpriced_tickers, **session.summary()}), 201
+
+@app.route('/rebalance/what-if/<session_id>', methods=['GET'])
+def what_if_get(session_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    session = what_if_sessions.get(session_id, user_id)
+    if session is None:
+        return jsonify({"error": "What-if session not found or expired."}), 404
+    return jsonify({"session_id": session_id, **session.summary()}), 200
+
+@app.route('/rebalance/what-if/<session_id>/trades', methods=['POST'])
+def what_if_trade(session_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    session = what_if_sessions.get(session_id, user_id)
+    if session is None:
+        return jsonify({"error": "What-if session not found or expired."}), 404
+
+    # Accepts one trade ({ticker, action, amount}) or {"trades": [...]}, applied all or nothing
+    data = request.get_json() or {}
+    trades = data.get('trades', [data])
+    applied = 0
+    with session.lock:
+        try:
+            for trade in trades:
+                session.apply_trade(trade.get('ticker'), trade.get('action'), trade.get('amount'))
+                applied += 1
+        except (TypeError, ValueError) as e:
+            for _ in range(applied):
+                session.undo()
+            return jsonify({"error": f"Invalid trade: {str(e)}"}), 400
+        return jsonify({"session_id": session_id, **session.summary()}), 200
+
+@app.route('/rebalance/what-if/<session_id>/undo', methods=['POST'])
+def what_if_undo(session_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    session = what_if_sessions.get(session_id, user_id)
+    if session is None:
+        return jsonify({"error": "What-if session not found or expired."}), 404
+    return jsonify({"session_id": session_id, **session.undo()}), 200
+
+@app.route('/rebalance/what-if/<session_id>', methods=['DELETE'])
+def what_if_delete(session_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    if not what_if_sessions.delete(session_id, user_id):
+        return jsonify({"error": "What-if session not found or expired."}), 404
+    return jsonify({"message": "What-if session deleted."}), 200
+
 @app.route('/api/portfolio/mvo/<int:user_id>', methods=['POST'])
 def portfolio_mvo(user_id):
     data = request.get_json()
@@ -518,21 +1034,29 @@ def portfolio_mvo(user_id):
     max_equities_weight = data.get('max_equities_weight', None)
     max_bonds_weight = data.get('max_bonds_weight', None)
     max_cash_weight = data.get('max_cash_weight', None)
+    solver_time_limit = data.get('solver_time_limit', DEFAULT_SOLVER_TIME_LIMIT)
+    solver_max_iters = data.get('solver_max_iters', None)
 
     # Fetch user's holdings to get tickers
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
+    holdings_data = get_loader().holdings(user_id)
     if not holdings_data:
         return jsonify({"error": "No holdings found for this user."}), 404
     
     tickers = [h['ticker'] for h in holdings_data]
-    
+
+    # Users holding the same tickers share results, usually precomputed by the nightly MVO job
+    params = mvo_params(risk_free_rate, target_return, max_equities_weight, max_bonds_weight, max_cash_weight)
+    window = mvo_window() # Last 5 years of data for MVO
+    cached_result = get_cached_mvo(tickers, params, window)
+    if cached_result is not None:
+        return jsonify(cached_result)
+
     # Fetch historical prices for all tickers
     price_history_data = {}
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365 * 5) # Last 5 years of data for MVO
-    
+    start_date_str, end_date_str = window
+
     for ticker in tickers:
-        history = price_service.get_historical_prices(ticker, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        history = price_service.get_historical_prices(ticker, start_date_str, end_date_str)
         if history:
             df = pd.DataFrame(history)
             df['date'] = pd.to_datetime(df['date'])
@@ -560,6 +1084,7 @@ def portfolio_mvo(user_id):
     asset_class_mapping = get_asset_class_mapping(tickers)
 
     try:
+        from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
         mvo_result = markowitz_mvo(
             price_history=price_history_df,
             risk_free_rate=risk_free_rate,
@@ -567,31 +1092,35 @@ def portfolio_mvo(user_id):
             max_equities_weight=max_equities_weight,
             max_bonds_weight=max_bonds_weight,
             max_cash_weight=max_cash_weight,
-            asset_class_mapping=asset_class_mapping
+            asset_class_mapping=asset_class_mapping,
+            time_limit=solver_time_limit,
+            max_iters=solver_max_iters
         )
+        store_mvo_result(tickers, params, window, mvo_result)
         return jsonify(mvo_result)
     except Exception as e:
         return jsonify({"error": f"Error performing Markowitz MVO: {str(e)}"}), 500
 
-@app.route('/backtest/run', methods=['POST'])
-def backtest_run():
-    user_id = request.args.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'user_id is required'}), 400
+def _prepare_backtest_inputs(user_id, data: dict) -> tuple:
+    """
+    Loads the user's holdings, targets and price history and builds the compare_strategies arguments.
 
-    data = request.get_json()
+    Returns:
+        tuple: (compare_strategies keyword arguments, None) on success,
+               or (None, (error response, status code)) when the inputs cannot be built.
+    """
     strategy = data.get('strategy')
     from_date_str = data.get('from')
     to_date_str = data.get('to')
 
     if not all([strategy, from_date_str, to_date_str]):
-        return jsonify({'error': 'strategy, from, and to dates are required'}), 400
+        return None, (jsonify({'error': 'strategy, from, and to dates are required'}), 400)
 
     try:
         from_date = datetime.strptime(from_date_str, '%Y-%m-%d')
         to_date = datetime.strptime(to_date_str, '%Y-%m-%d')
     except ValueError:
-        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+        return None, (jsonify({'error': 'Invalid date format. Use YYYY-MM-DD.'}), 400)
 
     rebalance_frequency = data.get('rebalance_frequency', 'quarterly')
     drift_threshold = data.get('drift_threshold', 0.05)
@@ -600,11 +1129,10 @@ def backtest_run():
     risk_free_rate = data.get('risk_free_rate', 0.01)
     
     # Target weights for the user's strategy
-    target_allocation_data = supabase.table('target_allocation').select("*").eq("user_id", user_id).limit(1).execute().data
-    if not target_allocation_data:
-        return jsonify({"error": "Target allocation not set for this user."}), 400
-    
-    target_alloc = target_allocation_data[0]
+    target_alloc = get_loader().target_allocation(user_id)
+    if not target_alloc:
+        return None, (jsonify({"error": "Target allocation not set for this user."}), 400)
+
     user_target_weights_asset_class = {
         'equities': target_alloc.get('equities', 0),
         'bonds': target_alloc.get('bonds', 0),
@@ -622,13 +1150,15 @@ def backtest_run():
         'max_equities_weight': data.get('mvo_max_equities_weight', None),
         'max_bonds_weight': data.get('mvo_max_bonds_weight', None),
         'max_cash_weight': data.get('mvo_max_cash_weight', None),
+        'time_limit': data.get('solver_time_limit', DEFAULT_SOLVER_TIME_LIMIT),
+        'max_iters': data.get('solver_max_iters', None),
         # asset_class_mapping will be passed dynamically inside compare_strategies
     }
 
     # Fetch user's holdings to get initial portfolio and all tickers
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
+    holdings_data = get_loader().holdings(user_id)
     if not holdings_data:
-        return jsonify({"error": "No holdings found for this user."}), 404
+        return None, (jsonify({"error": "No holdings found for this user."}), 404)
     
     initial_portfolio = {}
     all_tickers = []
@@ -638,7 +1168,7 @@ def backtest_run():
         # Fetch latest price for initial portfolio value calculation
         latest_price = price_service.get_latest_price(ticker)
         if latest_price is None:
-            print(f"Warning: Could not get latest price for {ticker}. Skipping from initial portfolio.")
+            logger.warning("Could not get latest price for %s. Skipping from initial portfolio.", ticker)
             continue
         initial_portfolio[ticker] = {'amount': quantity, 'price': latest_price}
         all_tickers.append(ticker)
@@ -666,12 +1196,12 @@ def backtest_run():
     # Filter out illiquid assets (those with no price history)
     liquid_tickers_for_history = [t for t in all_tickers_for_history if t in price_history_data]
     if not liquid_tickers_for_history:
-        return jsonify({"error": "No liquid assets found for backtesting. All assets are illiquid or have no price history."}), 500
+        return None, (jsonify({"error": "No liquid assets found for backtesting. All assets are illiquid or have no price history."}), 500)
     
     price_history_df = pd.DataFrame({t: price_history_data[t] for t in liquid_tickers_for_history}).dropna()
 
     if price_history_df.empty:
-        return jsonify({"error": "Not enough overlapping historical price data for backtesting after dropping NaNs."}), 500
+        return None, (jsonify({"error": "Not enough overlapping historical price data for backtesting after dropping NaNs."}), 500)
 
     price_history_df = pd.DataFrame(price_history_data).dropna()
 
@@ -711,27 +1241,79 @@ def backtest_run():
     if 'CASH' not in user_target_weights_ticker_level and 'cash' in user_target_weights_asset_class:
         user_target_weights_ticker_level['CASH'] = user_target_weights_asset_class['cash']
 
+    return {
+        "price_history": price_history_df,
+        "initial_portfolio": initial_portfolio,
+        "target_weights": user_target_weights_ticker_level,
+        "baseline_weights": baseline_weights,
+        "rebalance_frequency": rebalance_frequency,
+        "drift_threshold": drift_threshold,
+        "fees_per_trade": fees_per_trade,
+        "min_trade_threshold": min_trade_threshold,
+        "risk_free_rate": risk_free_rate,
+        "mvo_params": mvo_params
+    }, None
+
+@app.route('/backtest/run', methods=['POST'])
+def backtest_run():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    backtest_kwargs, error_response = _prepare_backtest_inputs(user_id, request.get_json())
+    if error_response:
+        return error_response
 
     try:
-        backtest_results = compare_strategies(
-            price_history=price_history_df,
-            initial_portfolio=initial_portfolio,
-            target_weights=user_target_weights_ticker_level,
-            baseline_weights=baseline_weights,
-            rebalance_frequency=rebalance_frequency,
-            drift_threshold=drift_threshold,
-            fees_per_trade=fees_per_trade,
-            min_trade_threshold=min_trade_threshold,
-            risk_free_rate=risk_free_rate,
-            mvo_params=mvo_params
-        )
-        
+        from portfolio_balancer.src.evaluation.backtest import compare_strategies, generate_backtest_report
+        backtest_results = compare_strategies(**backtest_kwargs)
         report = generate_backtest_report(backtest_results)
         return jsonify(report)
 
     except Exception as e:
         return jsonify({"error": f"Error running backtest: {str(e)}"}), 500
 
+@app.route('/backtest/jobs', methods=['POST'])
+def submit_backtest_job():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    backtest_kwargs, error_response = _prepare_backtest_inputs(user_id, request.get_json())
+    if error_response:
+        return error_response
+
+    try:
+        job = backtest_jobs.submit(user_id, backtest_kwargs)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        return jsonify({"error": f"Error submitting backtest: {str(e)}"}), 500
+
+    return jsonify({**job, "status_url": f"/backtest/jobs/{job['job_id']}?user_id={user_id}"}), 202
+
+@app.route('/backtest/jobs/<job_id>', methods=['GET'])
+def get_backtest_job(job_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    job = backtest_jobs.get_job(job_id)
+    if job is None or job.get('user_id') != str(user_id):
+        return jsonify({"error": "Backtest job not found."}), 404
+    return jsonify(job), 200
+
+@app.route('/backtest/jobs/<job_id>', methods=['DELETE'])
+def cancel_backtest_job(job_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    job = backtest_jobs.get_job(job_id, include_result=False)
+    if job is None or job.get('user_id') != str(user_id):
+        return jsonify({"error": "Backtest job not found."}), 404
+    return jsonify(backtest_jobs.cancel(job_id)), 200
+
 @app.route('/report/latest', methods=['GET'])
 def get_latest_report():
     user_id = request.args.get('user_id')
@@ -771,16 +1353,17 @@ def refresh_all_prices():
         # For now, let's use some mock tickers
         mock_tickers = ['AAPL', 'GOOGL', 'BND', 'BTC-USD']
         for ticker in mock_tickers:
-            print(f"Refreshing latest price for {ticker}...")
+            logger.info("Refreshing latest price for %s...", ticker)
             price_service.get_latest_price(ticker)
             # Also refresh historical data for the last 10 years
             end_date = datetime.now().strftime('%Y-%m-%d')
             start_date = (datetime.now() - timedelta(days=365 * 10)).strftime('%Y-%m-%d')
-            print(f"Refreshing historical data for {ticker} from {start_date} to {end_date}...")
+            logger.info("Refreshing historical data for %s from %s to %s...", ticker, start_date, end_date)
             price_service.get_historical_prices(ticker, start_date, end_date)
 
 if __name__ == '__main__':
     # db.create_all() # No longer using SQLAlchemy
+    from apscheduler.schedulers.background import BackgroundScheduler
 
     scheduler = BackgroundScheduler()
     scheduler.add_job(func=refresh_all_prices, trigger="interval", days=1) # Run daily
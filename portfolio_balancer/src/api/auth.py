@@ -1,9 +1,8 @@
 from flask import jsonify, request
-from supabase import Client
 import os
 
 # Supabase client will be initialized in app.py and passed here
-supabase: Client = None
+supabase = None
 
 def init_auth_routes(app, sb_client):
     global supabase
@@ -0,0 +1,44 @@
+import os
+import threading
+
+# One Supabase client is shared by the whole process. It is created on first use, so importing the API,
+# services or jobs modules neither needs credentials nor pays for importing the supabase package.
+_client = None
+_lock = threading.Lock()
+
+def get_supabase():
+    """
+    Returns the shared Supabase client, creating it from SUPABASE_URL and SUPABASE_KEY on first use.
+
+    Raises:
+        RuntimeError: If the credentials are not configured.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from supabase import create_client # Imported here: the supabase package is slow to import
+
+                supabase_url = os.environ.get("SUPABASE_URL")
+                supabase_key = os.environ.get("SUPABASE_KEY")
+                if not supabase_url or not supabase_key:
+                    raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set to access the database.")
+                _client = create_client(supabase_url, supabase_key)
+    return _client
+
+def set_supabase(client):
+    """Injects the client every module uses (e.g. a test double or a preconfigured client)."""
+    global _client
+    with _lock:
+        _client = client
+
+class _LazySupabase:
+    """Stand-in for the shared client that modules import; each attribute access resolves get_supabase()."""
+
+    def __getattr__(self, name):
+        return getattr(get_supabase(), name)
+
+    def __repr__(self):
+        return f"<shared Supabase client ({'connected' if _client is not None else 'not created yet'})>"
+
+supabase = _LazySupabase()
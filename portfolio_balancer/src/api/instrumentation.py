@@ -0,0 +1,210 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from portfolio_balancer.src.api.tracing import span
+
+# Set METRICS_ENABLED=0 to turn recording off; /metrics then only reports what was recorded before
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# Upper bounds (seconds) of the latency histogram buckets, from a cache hit to a long backtest
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_number(value)}")
+        return lines
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label combination.
+
+    observe() is a bisect and three additions under a lock, so it is cheap enough for every request and
+    every database call. Buckets are stored as plain counts and made cumulative only when rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts (last one is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def summary(self, *label_values) -> dict:
+        """Count and sum of one label combination, e.g. for tests and the benchmark scripts."""
+        with self._lock:
+            series = self._series.get(label_values)
+            return {"count": series[2], "sum": series[1]} if series else {"count": 0, "sum": 0.0}
+
+    def render(self) -> list:
+        with self._lock:
+            series_list = sorted((label_values, (list(series[0]), series[1], series[2])) for label_values, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in series_list:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """The metrics of this process, rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to produce the response of an API request, by route.",
+    ("route", "method", "status")
+))
+STAGE_LATENCY = registry.register(Histogram(
+    "stage_duration_seconds", "Time spent in a stage of request processing (db_query, provider, solver, backtest).",
+    ("stage", "name")
+))
+CACHE_REQUESTS = registry.register(Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit, disk_hit, miss).",
+    ("cache", "result")
+))
+
+def record_stage(stage: str, name: str, seconds: float):
+    """Records the duration of a stage measured by the caller."""
+    STAGE_LATENCY.observe(seconds, stage, name)
+
+def record_cache(cache: str, result: str):
+    """Counts one lookup of a cache: result is 'hit', 'disk_hit' or 'miss'."""
+    CACHE_REQUESTS.inc(cache, result)
+
+@contextmanager
+def timed_stage(stage: str, name: str):
+    """Times the enclosed block as one stage, whether it returns or raises, and traces it as a span."""
+    started_at = time.perf_counter()
+    try:
+        with span(f"{stage}:{name}"):
+            yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started_at, stage, name)
+
+def timed(stage: str, name: str = None):
+    """Decorator timing every call of a function as a stage (and a span when traced), named after the function by default."""
+    def decorator(func):
+        stage_name = name or func.__name__
+        span_name = f"{stage}:{stage_name}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                with span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                STAGE_LATENCY.observe(time.perf_counter() - started_at, stage, stage_name)
+        return wrapper
+    return decorator
+
+def instrument_methods(stage: str, prefix: str):
+    """
+    Class decorator timing each public method the class defines as stage, named '<prefix>.<method>'.
+
+    Methods inherited from a base class are timed only where the subclass overrides them.
+    """
+    def decorator(cls):
+        for attr_name, attr in list(vars(cls).items()):
+            if not attr_name.startswith('_') and callable(attr):
+                setattr(cls, attr_name, timed(stage, f"{prefix}.{attr_name}")(attr))
+        return cls
+    return decorator
+
+def init_app(app):
+    """
+    Records the latency of every request of a Flask app by route template, method and status.
+
+    The route is the URL rule (e.g. '/prices/<ticker>'), not the path, so the number of series stays
+    bounded. Streamed responses are timed until their headers are ready.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def _record_request_latency(response):
+        started_at = g.pop('request_started_at', None)
+        if started_at is not None:
+            route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+            REQUEST_LATENCY.observe(time.perf_counter() - started_at, route, request.method, str(response.status_code))
+        return response
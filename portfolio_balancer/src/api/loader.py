@@ -0,0 +1,94 @@
+from portfolio_balancer.src.data.repository import repository
+
+class DataLoader:
+    """
+    Deduplicates and batches the per-user reads of one request.
+
+    Each (table, user id) is fetched at most once. Ids queued with prefetch() are fetched together
+    with the next load of the same table, in one 'in' query per batch, instead of one query each.
+    Writes made through the request must call clear() so later reads see them.
+    """
+
+    # table -> (repository method reading several user ids, whether a user has many rows)
+    BATCH_READS = {
+        'holding': ('get_holdings_for_users', True),
+        'target_allocation': ('get_target_allocations', False)
+    }
+
+    def __init__(self, repo=None):
+        """
+        Args:
+            repo: Repository to read from. Defaults to the shared repository.
+        """
+        self.repo = repo or repository
+        self._cache = {} # (table, user id) -> rows (list) or row (dict or None)
+        self._pending = {table: [] for table in self.BATCH_READS}
+        self.queries = 0 # Repository reads issued, for tests and tracing
+
+    def prefetch(self, table: str, user_ids):
+        """Queues user ids to be fetched with the next load of table."""
+        for user_id in user_ids:
+            key = str(user_id)
+            if (table, key) not in self._cache and key not in self._pending[table]:
+                self._pending[table].append(key)
+
+    def _dispatch(self, table: str):
+        keys = self._pending[table]
+        self._pending[table] = []
+        if not keys:
+            return
+        method, many = self.BATCH_READS[table]
+        rows = getattr(self.repo, method)(keys)
+        self.queries += 1
+        grouped = {key: [] for key in keys}
+        for row in rows:
+            grouped.setdefault(str(row.get('user_id')), []).append(row)
+        for key in keys:
+            self._cache[(table, key)] = grouped[key] if many else (grouped[key][0] if grouped[key] else None)
+
+    def load(self, table: str, user_id):
+        """
+        Returns the rows of table for one user, fetching them (and any queued ids) on first use.
+
+        Returns:
+            list | dict | None: Holding rows (a new list each call), or the target allocation row or None.
+        """
+        key = str(user_id)
+        if (table, key) not in self._cache:
+            self.prefetch(table, [key])
+            self._dispatch(table)
+        value = self._cache[(table, key)]
+        return list(value) if isinstance(value, list) else value
+
+    def load_many(self, table: str, user_ids) -> dict:
+        """Returns {user id: rows} for several users, with one batched read for those not loaded yet."""
+        user_ids = list(user_ids)
+        self.prefetch(table, user_ids)
+        self._dispatch(table)
+        return {user_id: self.load(table, user_id) for user_id in user_ids}
+
+    def holdings(self, user_id) -> list:
+        return self.load('holding', user_id)
+
+    def target_allocation(self, user_id):
+        return self.load('target_allocation', user_id)
+
+    def clear(self, table: str, user_id=None):
+        """Forgets the cached rows of one user (or of every user) of table after a write."""
+        if user_id is None:
+            self._cache = {cache_key: value for cache_key, value in self._cache.items() if cache_key[0] != table}
+        else:
+            self._cache.pop((table, str(user_id)), None)
+
+def get_loader() -> DataLoader:
+    """
+    The DataLoader of the current request, stored in flask.g. Outside a request (jobs, scripts) a new
+    loader is returned on each call, so nothing is cached across calls.
+    """
+    from flask import g, has_app_context
+
+    if not has_app_context():
+        return DataLoader()
+    if 'data_loader' not in g:
+        g.data_loader = DataLoader()
+    return g.data_loader
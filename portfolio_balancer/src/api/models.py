@@ -47,15 +47,17 @@ class TargetAllocation:
         self.weight = weight
 
 class RebalancePlan:
-    def __init__(self, id, user_id, created_at, payload_json):
+    def __init__(self, id, user_id, created_at, payload_json, input_fingerprint=None):
         self.id = id
         self.user_id = user_id
         self.created_at = created_at
         self.payload_json = payload_json
+        self.input_fingerprint = input_fingerprint # Fingerprint of the inputs the payload was computed from
 
 class Recommendation:
-    def __init__(self, id, user_id, created_at, payload_json):
+    def __init__(self, id, user_id, created_at, payload_json, input_fingerprint=None):
         self.id = id
         self.user_id = user_id
         self.created_at = created_at
-        self.payload_json = payload_json
\ No newline at end of file
+        self.payload_json = payload_json
+        self.input_fingerprint = input_fingerprint # Fingerprint of the inputs the payload was computed from
\ No newline at end of file
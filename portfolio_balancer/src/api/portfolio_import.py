@@ -0,0 +1,182 @@
+from portfolio_balancer.src.data.repository import repository
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# CSV rows parsed at a time, holding rows per insert, and per-row errors returned (the rest are only counted)
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_WRITE_BATCH = 500
+MAX_IMPORT_ERRORS = 1000
+
+IMPORT_COLUMNS = ['ticker', 'quantity', 'purchase_price', 'purchase_date']
+
+class ImportFileError(ValueError):
+    """Raised when an uploaded CSV cannot be imported at all (empty, unreadable or missing columns)."""
+
+def read_csv_header(stream) -> list:
+    """Returns the column names of a CSV upload and rewinds it."""
+    import pandas as pd
+
+    try:
+        columns = list(pd.read_csv(stream, nrows=0).columns)
+    except pd.errors.EmptyDataError:
+        raise ImportFileError("CSV is empty")
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ImportFileError(f"CSV could not be parsed: {e}")
+    finally:
+        stream.seek(0)
+    missing = [column for column in IMPORT_COLUMNS if column not in columns]
+    if missing:
+        raise ImportFileError(f'CSV must contain columns: {", ".join(IMPORT_COLUMNS)}')
+    return columns
+
+def _read_chunks(stream, columns: list, chunk_size: int):
+    import pandas as pd
+
+    stream.seek(0)
+    # Everything is read as text and coerced per column, so one bad value does not change a column's type
+    return pd.read_csv(stream, usecols=columns, dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+def collect_tickers(stream, chunk_size: int = IMPORT_CHUNK_ROWS) -> list:
+    """Distinct tickers of a CSV upload, reading only the ticker column."""
+    tickers = set()
+    for chunk in _read_chunks(stream, ['ticker'], chunk_size):
+        tickers.update(chunk['ticker'].str.strip())
+    tickers.discard('')
+    return sorted(tickers)
+
+def _to_number(values):
+    """Parses numbers as brokerage exports write them ('1,234.50', '$12'); anything else becomes NaN."""
+    import pandas as pd
+    return pd.to_numeric(values.str.replace(r'[\s,$]', '', regex=True), errors='coerce')
+
+def _to_date(values):
+    """Parses dates as ISO 8601 (vectorized); only values in other formats are retried with per-value format inference."""
+    import pandas as pd
+
+    dates = pd.to_datetime(values, format='ISO8601', errors='coerce')
+    retry = dates.isna() & (values.str.strip() != '')
+    if retry.any():
+        dates = dates.copy()
+        dates[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce')
+    return dates
+
+def validate_chunk(chunk, known_tickers: set = None) -> tuple:
+    """
+    Coerces and validates a chunk of CSV rows column by column.
+
+    Args:
+        chunk (pd.DataFrame): Raw text columns of IMPORT_COLUMNS, indexed by data row (0 = first row after the header).
+        known_tickers (set): If given, tickers outside it are rejected.
+
+    Returns:
+        tuple: (valid rows as a DataFrame of ticker, quantity, purchase_price and purchase_date,
+                list of {"line": CSV line number, "errors": [messages]} for the rejected rows).
+    """
+    import pandas as pd
+
+    ticker = chunk['ticker'].str.strip()
+    quantity = _to_number(chunk['quantity'])
+    purchase_price = _to_number(chunk['purchase_price'])
+    purchase_date = _to_date(chunk['purchase_date'])
+
+    checks = [
+        (ticker == '', "ticker is missing"),
+        (quantity.isna(), "quantity is not a number"),
+        (quantity <= 0, "quantity must be positive"),
+        (purchase_price.isna(), "purchase_price is not a number"),
+        (purchase_price < 0, "purchase_price must not be negative"),
+        (purchase_date.isna(), "purchase_date is not a valid date")
+    ]
+    if known_tickers is not None:
+        checks.append(((ticker != '') & ~ticker.isin(known_tickers), "ticker has no known price"))
+
+    invalid = pd.Series(False, index=chunk.index)
+    for mask, _ in checks:
+        invalid |= mask.fillna(False)
+
+    errors = []
+    if invalid.any():
+        failed = {row: [] for row in chunk.index[invalid]}
+        for mask, message in checks:
+            for row in chunk.index[mask.fillna(False)]:
+                failed[row].append(message)
+        # The header is line 1, so data row i is on line i + 2 (for files without multi-line fields)
+        errors = [{"line": int(row) + 2, "errors": messages} for row, messages in failed.items()]
+
+    valid = pd.DataFrame({
+        'ticker': ticker,
+        'quantity': quantity.astype(float),
+        'purchase_price': purchase_price.astype(float),
+        'purchase_date': purchase_date.dt.strftime('%Y-%m-%d')
+    })[~invalid]
+    return valid, errors
+
+def import_holdings_csv(stream, user_id, strict_tickers: bool = False, repo=None,
+                        chunk_size: int = IMPORT_CHUNK_ROWS, write_batch: int = IMPORT_WRITE_BATCH):
+    """
+    Imports the holdings of a CSV upload in chunks, yielding progress events as it goes.
+
+    The file is read twice: once for the ticker column, so every ticker is checked against the stored
+    latest prices in one bulk lookup, then in chunks of chunk_size rows that are validated vectorized and
+    inserted in batches of at most write_batch rows. Memory use is bounded by the chunk size, not the file.
+
+    Args:
+        stream: Seekable binary or text file object with the CSV (e.g. a Flask upload's stream).
+        user_id: Owner of the imported holdings.
+        strict_tickers (bool): Reject rows whose ticker has no stored price, instead of only reporting the tickers.
+        repo: Repository to write to. Defaults to the shared repository.
+
+    Yields:
+        dict: {"event": "progress", "rows_read", "rows_imported", "rows_rejected"} after each inserted batch, then one
+              final {"event": "done", ...} summary, or {"event": "error", "error", ...} if an insert failed (rows
+              inserted by earlier batches stay). The summary also holds "errors" (per-row, at most MAX_IMPORT_ERRORS),
+              "errors_truncated" and "unknown_tickers".
+
+    Raises:
+        ImportFileError: If the file is empty, unreadable or lacks a required column (before anything is written).
+    """
+    repo = repo or repository
+    read_csv_header(stream)
+    tickers = collect_tickers(stream, chunk_size)
+    known_tickers = set(repo.get_latest_prices(tickers)) if tickers else set()
+    unknown_tickers = [ticker for ticker in tickers if ticker not in known_tickers]
+
+    counts = {"rows_read": 0, "rows_imported": 0, "rows_rejected": 0}
+    errors = []
+    pending = []
+
+    def summary(event: str, **fields) -> dict:
+        return {
+            "event": event, **counts, **fields,
+            "errors": errors, "errors_truncated": counts["rows_rejected"] > len(errors),
+            "unknown_tickers": unknown_tickers
+        }
+
+    def write(rows: list):
+        repo.add_holdings(rows)
+        counts["rows_imported"] += len(rows)
+
+    try:
+        for chunk in _read_chunks(stream, IMPORT_COLUMNS, chunk_size):
+            valid, chunk_errors = validate_chunk(chunk, known_tickers if strict_tickers else None)
+            counts["rows_read"] += len(chunk)
+            counts["rows_rejected"] += len(chunk_errors)
+            errors.extend(chunk_errors[:MAX_IMPORT_ERRORS - len(errors)])
+
+            valid.insert(0, 'user_id', user_id)
+            pending.extend(valid.to_dict('records'))
+            while len(pending) >= write_batch:
+                batch, pending = pending[:write_batch], pending[write_batch:]
+                write(batch)
+                yield {"event": "progress", **counts}
+        if pending:
+            write(pending)
+            yield {"event": "progress", **counts}
+    except Exception as e:
+        logger.error("Portfolio import for user %s stopped after %d rows: %s", user_id, counts["rows_imported"], e)
+        yield summary("error", error=str(e))
+        return
+
+    logger.info("Imported %d holdings for user %s (%d rows rejected).", counts["rows_imported"], user_id, counts["rows_rejected"])
+    yield summary("done")
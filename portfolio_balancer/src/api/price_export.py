@@ -0,0 +1,101 @@
+import json
+from datetime import datetime, timezone
+from portfolio_balancer.src.data.repository import repository
+from portfolio_balancer.src.data.result_cache import fingerprint
+
+# Rows per repository read while streaming (one PostgREST page), and the largest page a client may request
+PRICE_STREAM_CHUNK = 1000
+MAX_PRICE_PAGE_SIZE = 1000
+
+PRICE_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+def price_validators(ticker: str, last_date: str, *variant) -> tuple:
+    """
+    Cache validators of a ticker's price history response.
+
+    Stored prices only change when a new day is appended, so the ticker's last stored date identifies
+    the data; variant (the query parameters that shape the response) is folded into the ETag.
+
+    Returns:
+        tuple: (ETag value, Last-Modified datetime or None if the ticker has no prices).
+    """
+    etag = fingerprint("price_history", ticker, last_date, *variant)[:32]
+    last_modified = None
+    if last_date:
+        last_modified = datetime.strptime(str(last_date)[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+def is_not_modified(request, etag: str, last_modified) -> bool:
+    """Whether the request's If-None-Match / If-Modified-Since show the client already has this response."""
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def iter_price_pages(ticker: str, start_date: str = None, after: str = None, chunk_size: int = PRICE_STREAM_CHUNK):
+    """Yields a ticker's {"date", "close"} rows page by page, following the date cursor until exhausted."""
+    while True:
+        page = repository.get_price_page(ticker, start_date, after, chunk_size)
+        if not page:
+            return
+        yield page
+        if len(page) < chunk_size:
+            return
+        after = page[-1]['date']
+
+def ndjson_stream(pages):
+    """Encodes price pages as newline-delimited JSON, one {"date", "close"} object per line."""
+    for page in pages:
+        yield ''.join(json.dumps({"date": row['date'], "close": row['close']}) + '\n' for row in page)
+
+class _ChunkSink:
+    """Write-only file object collecting what pyarrow writes, so each record batch can be yielded as it is encoded."""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def arrow_stream(pages):
+    """
+    Encodes price pages as an Arrow IPC stream with one record batch per page.
+
+    Raises:
+        ImportError: If pyarrow is not installed (checked before the first byte is produced).
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([('date', pa.string()), ('close', pa.float64())])
+
+    def generate():
+        sink = _ChunkSink()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for page in pages:
+                writer.write_batch(pa.record_batch([
+                    pa.array([row['date'] for row in page], type=pa.string()),
+                    pa.array([row['close'] for row in page], type=pa.float64())
+                ], schema=schema))
+                yield sink.take()
+        yield sink.take() # End-of-stream marker
+
+    return generate()
@@ -1,14 +1,11 @@
 from datetime import datetime, timedelta
 from portfolio_balancer.src.api.models import PriceHistory, LatestPrice
 from portfolio_balancer.src.data.market_data import fetch_yfinance_data, fetch_coingecko_data, get_latest_yfinance_price, get_latest_coingecko_price
-import pandas as pd
-from supabase import create_client, Client
-import os
-from datetime import datetime, timedelta
+from portfolio_balancer.src.data.repository import repository
+from portfolio_balancer.src.api.tracing import traced
+from portfolio_balancer.src.api.structured_logging import get_logger
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger(__name__)
 
 class PriceService:
     def __init__(self):
@@ -16,6 +13,7 @@ class PriceService:
 
     def _prices_to_dataframe(self, prices_dict):
         """Converts a dictionary of prices {date: price} to a pandas DataFrame."""
+        import pandas as pd
         df = pd.DataFrame.from_dict(prices_dict, orient='index', columns=['close_price'])
         df.index = pd.to_datetime(df.index)
         df = df.sort_index()
@@ -23,11 +21,12 @@ class PriceService:
 
     def _get_historical_data_from_db(self, ticker, start_date, end_date):
         """Fetches historical price data for a given ticker from the database."""
-        response = supabase.table('price_history').select("*").eq("ticker", ticker).gte("date", start_date.isoformat()).lte("date", end_date.isoformat()).execute()
-        return [PriceHistory(ticker=item['ticker'], date=datetime.strptime(item['date'], '%Y-%m-%d').date(), close=item['close']) for item in response.data]
+        rows = repository.get_price_history([ticker], start_date.isoformat(), end_date.isoformat())
+        return [PriceHistory(ticker=item['ticker'], date=datetime.strptime(item['date'], '%Y-%m-%d').date(), close=item['close']) for item in rows]
 
     def _save_historical_data_to_db(self, ticker, df):
         """Saves historical price data to the database."""
+        import pandas as pd
         data_to_insert = []
         for index, row in df.iterrows():
             date = index.date() if isinstance(index, pd.Timestamp) else index
@@ -37,12 +36,13 @@ class PriceService:
                 "close": row['Close'] if 'Close' in row else row['close_price'] # Handle both 'Close' and 'close_price'
             })
         if data_to_insert:
-            response = supabase.table('price_history').insert(data_to_insert).execute()
-            if response.data:
-                print(f"Saved {len(response.data)} price entries to Supabase.")
+            saved = repository.save_price_history(data_to_insert)
+            if saved:
+                logger.debug("Saved %s price entries to the database.", saved)
             else:
-                print(f"Failed to save price entries to Supabase: {response.error}")
+                logger.warning("Failed to save price entries for %s to the database.", ticker)
 
+    @traced()
     def get_historical_prices(self, ticker, start_date_str, end_date_str):
         """
         Retrieves historical prices for a given ticker, fetching from providers if not cached.
@@ -64,7 +64,7 @@ class PriceService:
         missing_dates = list(all_dates - cached_dates)
         
         if missing_dates:
-            print(f"Missing data for {ticker} on dates: {missing_dates}. Fetching from provider.")
+            logger.info("Missing %d of %d dates for %s between %s and %s. Fetching from provider.", len(missing_dates), len(all_dates), ticker, start_date, end_date)
             # Determine if it's a stock/ETF or crypto based on ticker format (simple heuristic)
             if ticker.isupper() and not ticker.startswith('USD-'): # Assuming crypto tickers might be lower or have specific prefixes
                 fetched_df = fetch_yfinance_data(ticker, start_date, end_date)
@@ -79,23 +79,23 @@ class PriceService:
                 # Re-fetch all data including newly saved ones
                 cached_data = self._get_historical_data_from_db(ticker, start_date, end_date)
             else:
-                print(f"Could not fetch missing data for {ticker}.")
+                logger.warning("Could not fetch missing data for %s.", ticker)
 
         return [{'date': entry.date.strftime('%Y-%m-%d'), 'close': entry.close} for entry in cached_data]
 
+    @traced()
     def get_latest_price(self, ticker):
         """
         Retrieves the latest price for a given ticker, fetching from providers if not available.
         """
-        # First, try to get the latest price from Supabase's 'latest_price' table
-        response = supabase.table('latest_price').select("*").eq("ticker", ticker).limit(1).execute()
-        latest_db_entry_data = response.data[0] if response.data else None
+        # First, try to get the latest price from the 'latest_price' table
+        latest_db_entry_data = repository.get_latest_price(ticker)
         latest_db_entry = LatestPrice(ticker=latest_db_entry_data['ticker'], price=latest_db_entry_data['price'], as_of=datetime.fromisoformat(latest_db_entry_data['as_of'])) if latest_db_entry_data else None
 
         if latest_db_entry and latest_db_entry.as_of.date() == datetime.now().date():
             return latest_db_entry.price
         else:
-            print(f"Latest price for {ticker} not in cache or outdated. Fetching from provider.")
+            logger.info("Latest price for %s not in cache or outdated. Fetching from provider.", ticker)
             if ticker.isupper() and not ticker.startswith('USD-'):
                 fetched_price = get_latest_yfinance_price(ticker)
             else:
@@ -109,14 +109,17 @@ class PriceService:
                     "price": fetched_price,
                     "as_of": datetime.now().isoformat()
                 }
-                response = supabase.table('latest_price').upsert(price_entry).execute()
-                if response.data:
-                    print(f"Upserted latest price for {ticker} to Supabase.")
+                if repository.upsert_latest_price(price_entry):
+                    logger.debug("Upserted latest price for %s to the database.", ticker)
                 else:
-                    print(f"Failed to upsert latest price for {ticker} to Supabase: {response.error}")
+                    logger.warning("Failed to upsert latest price for %s to the database.", ticker)
+
+                # Snapshots valued with the previous price are stale now
+                from portfolio_balancer.src.api.snapshot_cache import snapshot_cache
+                snapshot_cache.invalidate_ticker(ticker)
                 return fetched_price
             else:
-                print(f"Could not fetch latest price for {ticker}.")
+                logger.warning("Could not fetch latest price for %s.", ticker)
                 return None
 
 price_service = PriceService()
\ No newline at end of file
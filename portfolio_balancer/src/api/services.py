@@ -1,76 +1,258 @@
-from portfolio_balancer.src.api.models import Holding, TargetAllocation
 from portfolio_balancer.src.api.price_service import price_service
-from supabase import create_client, Client
-import os
-import pandas as pd
+from portfolio_balancer.src.data.repository import repository
+from portfolio_balancer.src.api.loader import get_loader
+from portfolio_balancer.src.api.structured_logging import get_logger
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger(__name__)
+
+# pandas, numpy and the evaluation engines are imported inside the functions that need them,
+# so that importing this module (and the API) stays fast.
 
 def get_portfolio_snapshot(user_id):
-    # Fetch holdings from Supabase
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
-    holdings = [Holding(id=h['id'], user_id=h['user_id'], ticker=h['ticker'], quantity=h['quantity'], avg_cost=h['avg_cost']) for h in holdings_data]
+    """
+    Current value, weights and drift of a user's holdings.
+
+    Served from the snapshot cache (see snapshot_cache.py) until the user's holdings or targets change,
+    a held ticker's latest price is refreshed, or the day changes.
+    """
+    from portfolio_balancer.src.api.snapshot_cache import snapshot_cache
+
+    return snapshot_cache.get_or_compute(
+        user_id,
+        lambda: [holding['ticker'] for holding in get_loader().holdings(user_id)],
+        lambda: _compute_portfolio_snapshot(user_id)
+    )
+
+def snapshot_position_values(snapshot: dict) -> dict:
+    """Value per ticker of a portfolio snapshot (the breakdown has one entry per ticker, whatever the number of lots)."""
+    return {item['ticker']: item['value'] for item in snapshot['breakdown']}
 
-    # Fetch target allocation from Supabase
-    target_allocation_data = supabase.table('target_allocation').select("*").eq("user_id", user_id).limit(1).execute().data
-    target_allocation = TargetAllocation(id=t['id'], user_id=t['user_id'], equities=t['equities'], bonds=t['bonds'], cash=t['cash']) if target_allocation_data else None
+def _compute_portfolio_snapshot(user_id):
+    holdings_data = get_loader().holdings(user_id)
+    target_allocation = get_loader().target_allocation(user_id)
 
-    if not holdings:
+    if not holdings_data:
         return {"total_value": 0, "breakdown": []}
 
+    # Imports store one row per lot, so quantities are summed per ticker before valuing
+    quantities = {}
+    for holding in holdings_data:
+        quantities[holding['ticker']] = quantities.get(holding['ticker'], 0.0) + float(holding['quantity'])
+
     breakdown = []
     total_value = 0
 
-    for holding in holdings:
-        latest_price_obj = price_service.get_latest_price(holding.ticker)
-        if latest_price_obj is None:
-            print(f"Warning: Could not retrieve latest price for {holding.ticker}. Skipping this holding.")
+    for ticker, quantity in quantities.items():
+        latest_price = price_service.get_latest_price(ticker)
+        if latest_price is None:
+            logger.warning("Could not retrieve latest price for %s. Skipping this holding.", ticker)
             continue
-        
-        latest_price = latest_price_obj # Assuming get_latest_price now returns the price directly
-        value = holding.quantity * latest_price
+
+        value = quantity * latest_price
         total_value += value
-        breakdown.append({
-            "ticker": holding.ticker,
-            "value": value,
-            "quantity": holding.quantity,
-            "latest_price": latest_price
-        })
+        breakdown.append({"ticker": ticker, "value": value})
 
     # Compute weights and drift
     for item in breakdown:
         item["weight"] = item["value"] / total_value if total_value else 0
-        
-        # Determine target weight based on ticker type (simplified for now)
-        # This part needs to be more robust, potentially mapping tickers to asset classes
-        target_weight = 0
-        if target_allocation:
-            if item["ticker"] == "AAPL": # Example: map AAPL to equities
-                target_weight = target_allocation.equities
-            elif item["ticker"] == "BND": # Example: map BND to bonds
-                target_weight = target_allocation.bonds
-            elif item["ticker"] == "CASH": # Example: map CASH to cash
-                target_weight = target_allocation.cash
-            # For other tickers, a more sophisticated mapping would be needed
-            # For now, if no specific target, assume 0 or handle as needed
-        
+        target_weight = _target_weight(item["ticker"], target_allocation)
         item["target"] = target_weight
         item["drift"] = item["weight"] - target_weight
-        
-        # Remove quantity and latest_price from final output
-        # Ensure these keys exist before attempting to delete
-        if "quantity" in item:
-            del item["quantity"]
-        if "latest_price" in item:
-            del item["latest_price"]
 
     return {
         "total_value": round(total_value, 2),
         "breakdown": breakdown
     }
 
+def _target_weight(ticker: str, target_allocation: dict) -> float:
+    """Target weight of a holding given the user's target allocation row (None if not set)."""
+    # Determine target weight based on ticker type (simplified for now)
+    # This part needs to be more robust, potentially mapping tickers to asset classes
+    target_weight = 0
+    if target_allocation:
+        if ticker == "AAPL": # Example: map AAPL to equities
+            target_weight = target_allocation['equities']
+        elif ticker == "BND": # Example: map BND to bonds
+            target_weight = target_allocation['bonds']
+        elif ticker == "CASH": # Example: map CASH to cash
+            target_weight = target_allocation['cash']
+        # For other tickers, a more sophisticated mapping would be needed
+        # For now, if no specific target, assume 0 or handle as needed
+    return target_weight
+
+def get_latest_prices(tickers: list) -> dict:
+    """
+    Latest price of each ticker: one batched read of the 'latest_price' table, falling back to
+    price_service.get_latest_price (which fetches from the providers) only for missing or outdated entries.
+
+    Returns:
+        dict: ticker -> price, for the tickers with a price.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    stored = repository.get_latest_prices(tickers)
+    today = datetime.now().date()
+    prices = {}
+    for ticker in tickers:
+        row = stored.get(ticker)
+        if row and row.get('as_of') and datetime.fromisoformat(str(row['as_of'])).date() == today:
+            prices[ticker] = row['price']
+        else:
+            price = price_service.get_latest_price(ticker)
+            if price is not None:
+                prices[ticker] = price
+    return prices
+
+def get_portfolio_snapshots(user_ids: list) -> tuple:
+    """
+    get_portfolio_snapshot for many users at once.
+
+    Cached snapshots are reused. For the others, holdings and targets are read with one batched query
+    each, every distinct ticker is priced once, and all holdings are valued in one vectorized pass.
+
+    Args:
+        user_ids (list): Users to snapshot.
+
+    Returns:
+        tuple: (snapshots, errors): user id -> snapshot (as get_portfolio_snapshot) for the users that could
+               be valued, and user id -> error message for the others.
+    """
+    import numpy as np
+    from portfolio_balancer.src.api.snapshot_cache import snapshot_cache
+
+    snapshots = {}
+    errors = {}
+    missing = []
+    for user_id in user_ids:
+        cached = snapshot_cache.get(user_id)
+        if cached is not None:
+            snapshots[user_id] = cached
+        else:
+            missing.append(user_id)
+    if not missing:
+        return snapshots, errors
+
+    # Cache keys and price versions are read before the rows and prices they describe
+    cache_keys = {user_id: snapshot_cache.key(user_id) for user_id in missing}
+    loader = get_loader()
+    holdings_by_user = loader.load_many('holding', missing)
+    targets_by_user = loader.load_many('target_allocation', missing)
+
+    # Imports store one row per lot, so quantities are summed per (user, ticker) before valuing
+    positions = {}
+    for user_id in missing:
+        for holding in holdings_by_user[user_id]:
+            position = (user_id, holding['ticker'])
+            positions[position] = positions.get(position, 0.0) + float(holding['quantity'])
+    tickers = [ticker for _, ticker in positions]
+    price_versions = snapshot_cache.price_versions(tickers)
+    prices = get_latest_prices(tickers)
+    for ticker in set(tickers) - set(prices):
+        logger.warning("Could not retrieve latest price for %s. Skipping its holdings.", ticker)
+    positions = {position: quantity for position, quantity in positions.items() if position[1] in prices}
+
+    # Value every position at once, then total them per user
+    user_index = {user_id: i for i, user_id in enumerate(missing)}
+    owners = np.array([user_index[user_id] for user_id, _ in positions], dtype=int)
+    quantities = np.array(list(positions.values()), dtype=float)
+    latest_prices = np.array([float(prices[ticker]) for _, ticker in positions])
+    values = quantities * latest_prices
+    totals = np.bincount(owners, weights=values, minlength=len(missing))
+    weights = np.divide(values, totals[owners], out=np.zeros_like(values), where=totals[owners] != 0)
+
+    breakdowns = {user_id: [] for user_id in missing}
+    for (user_id, ticker), value, weight in zip(positions, values.tolist(), weights.tolist()):
+        target_weight = _target_weight(ticker, targets_by_user[user_id])
+        breakdowns[user_id].append({
+            "ticker": ticker,
+            "value": value,
+            "weight": weight,
+            "target": target_weight,
+            "drift": weight - target_weight
+        })
+
+    for user_id in missing:
+        if not holdings_by_user[user_id]:
+            errors[user_id] = "No holdings found for this user."
+            continue
+        snapshot = {"total_value": round(float(totals[user_index[user_id]]), 2), "breakdown": breakdowns[user_id]}
+        held_tickers = {holding['ticker'] for holding in holdings_by_user[user_id]}
+        snapshot_cache.set(cache_keys[user_id], snapshot, {ticker: price_versions[ticker] for ticker in held_tickers})
+        snapshots[user_id] = snapshot
+    return snapshots, errors
+
+def get_batch_risk_metrics(user_ids: list, risk_free_rate: float = 0.01, history_days: int = 365 * 5,
+                           include_var: bool = False, confidence: float = 0.95, horizon_days: int = 1) -> tuple:
+    """
+    Risk metrics of many users' portfolios from one shared price history and covariance.
+
+    The union of the users' tickers is loaded once; each portfolio is a row of one weight matrix over it
+    (current weights, normalized over the tickers with price history), valued with the batch metrics.
+    The window is the dates on which all of the union's tickers have a price (forward-filled), so an
+    account's figures can differ slightly from /portfolio/risk, which uses only its own tickers' overlap.
+
+    Returns:
+        tuple: (results, errors, window): user id -> metrics dict, user id -> error message, and
+               {"start", "end", "observations"} of the shared price window (None without one).
+    """
+    import numpy as np
+    import pandas as pd
+    from portfolio_balancer.src.evaluation.metrics import calculate_batch_risk_metrics
+    from portfolio_balancer.src.evaluation.risk_engine import calculate_var_metrics, portfolio_risk_report
+
+    snapshots, errors = get_portfolio_snapshots(user_ids)
+    user_weights = {}
+    for user_id, snapshot in snapshots.items():
+        if snapshot['total_value'] > 0:
+            user_weights[user_id] = {ticker: value / snapshot['total_value'] for ticker, value in snapshot_position_values(snapshot).items()}
+        else:
+            errors[user_id] = "Portfolio has no priced holdings."
+    if not user_weights:
+        return {}, errors, None
+
+    tickers = sorted({ticker for weights in user_weights.values() for ticker in weights})
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=history_days)
+    price_history_data = {}
+    for ticker in tickers:
+        history = price_service.get_historical_prices(ticker, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        if history:
+            df = pd.DataFrame(history)
+            df['date'] = pd.to_datetime(df['date'])
+            df.set_index('date', inplace=True)
+            price_history_data[ticker] = df['close']
+    price_history_df = pd.DataFrame(price_history_data).ffill().dropna()
+    if len(price_history_df) < 2:
+        for user_id in user_weights:
+            errors[user_id] = "Not enough overlapping historical price data for risk calculation."
+        return {}, errors, None
+
+    # One row per user, normalized over the tickers with price history
+    weight_matrix = np.array([[weights.get(ticker, 0.0) for ticker in price_history_df.columns] for weights in user_weights.values()])
+    weight_sums = weight_matrix.sum(axis=1, keepdims=True)
+    weight_matrix = np.divide(weight_matrix, weight_sums, out=np.zeros_like(weight_matrix), where=weight_sums > 0)
+
+    metrics = calculate_batch_risk_metrics(price_history_df, weight_matrix, risk_free_rate)
+    var_metrics = None
+    if include_var:
+        var_metrics = calculate_var_metrics(price_history_df, weight_matrix, confidence=confidence, horizon_days=horizon_days, seed=0)
+
+    results = {}
+    for index, user_id in enumerate(user_weights):
+        if weight_sums[index, 0] <= 0:
+            errors[user_id] = "No liquid holdings with price history for this user."
+            continue
+        result = {name: float(metrics[name][index]) for name in ('risk_score', 'volatility', 'sharpe_ratio', 'mean_daily_return')}
+        if var_metrics is not None:
+            result.update(portfolio_risk_report(var_metrics, None, index))
+        results[user_id] = result
+
+    window = {
+        "start": price_history_df.index[0].strftime('%Y-%m-%d'),
+        "end": price_history_df.index[-1].strftime('%Y-%m-%d'),
+        "observations": len(price_history_df) - 1
+    }
+    return results, errors, window
+
 def get_asset_class_mapping(tickers: list) -> dict:
     """
     Provides a simplified mapping of tickers to asset classes.
@@ -108,7 +290,7 @@ def get_historical_portfolio_by_asset_class(user_id: int, days: int = 365) -> li
     start_date = end_date - timedelta(days=days)
 
     # Fetch all holdings for the user
-    holdings_data = supabase.table('holding').select("*").eq("user_id", user_id).execute().data
+    holdings_data = get_loader().holdings(user_id)
     
     if not holdings_data:
         return []
@@ -142,17 +324,7 @@ def get_historical_portfolio_by_asset_class(user_id: int, days: int = 365) -> li
             
             # Fetch historical prices for a small range around the current_date
             # to find the closest available price.
-            price_history_response = supabase.table('price_history') \
-                .select("close") \
-                .eq("ticker", ticker) \
-                .lte("date", current_date.isoformat()) \
-                .order("date", desc=True) \
-                .limit(1) \
-                .execute()
-            
-            price_on_date = None
-            if price_history_response.data:
-                price_on_date = price_history_response.data[0]['close']
+            price_on_date = repository.get_close_on_or_before(ticker, current_date.isoformat())
             
             if price_on_date is not None:
                 value = quantity * price_on_date
@@ -165,9 +337,152 @@ def get_historical_portfolio_by_asset_class(user_id: int, days: int = 365) -> li
                     value = quantity * latest_price_obj
                     daily_asset_values[asset_class] += value
                 else:
-                    print(f"Warning: No price found for {ticker} on {current_date.isoformat()} or latest.")
+                    logger.warning("No price found for %s on %s or latest.", ticker, current_date.isoformat())
 
         historical_data.append(daily_asset_values)
         current_date += timedelta(days=1)
     
     return historical_data
+
+
+def get_online_risk_metrics(user_id, risk_free_rate: float = 0.01, history_days: int = 365 * 5) -> dict:
+    """
+    Updates and returns the user's online risk metrics (see evaluation/online_metrics.py).
+
+    When a saved state covers the user's current tickers, only the prices since its last update are
+    fetched; otherwise the state is rebuilt from history_days of prices.
+
+    Args:
+        user_id: The user whose holdings make up the portfolio.
+        risk_free_rate (float): Annualized risk-free rate for the Sharpe Ratio.
+        history_days (int): Days of price history used when the state is rebuilt.
+
+    Returns:
+        dict: The online metrics, or None if the user has no holdings with price history.
+    """
+    import numpy as np
+    import pandas as pd
+    from portfolio_balancer.src.evaluation.online_metrics import online_metrics_store, update_online_metrics
+
+    holdings_data = get_loader().holdings(user_id)
+    tickers = list(dict.fromkeys(h['ticker'] for h in holdings_data or []))
+    if not tickers:
+        return None
+
+    state = online_metrics_store.load(user_id)
+    end_date = datetime.now()
+    full_start_date = end_date - timedelta(days=history_days)
+    incremental = state is not None and state.last_date is not None and set(state.tickers) == set(tickers)
+    start_date = state.last_date if incremental else full_start_date
+
+    def fetch(start):
+        price_history_data = {}
+        for ticker in tickers:
+            history = price_service.get_historical_prices(ticker, start.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+            if history:
+                df = pd.DataFrame(history)
+                df['date'] = pd.to_datetime(df['date'])
+                df.set_index('date', inplace=True)
+                price_history_data[ticker] = df['close']
+        return pd.DataFrame(price_history_data).dropna()
+
+    price_history_df = fetch(start_date)
+    if incremental and set(price_history_df.columns) != set(state.tickers):
+        # A ticker has no recent prices, so the state cannot simply be extended
+        price_history_df = fetch(full_start_date)
+    if price_history_df.empty:
+        return None
+
+    snapshot = get_portfolio_snapshot(user_id)
+    total_value = snapshot['total_value']
+    current_weights = {ticker: value / total_value if total_value > 0 else 0 for ticker, value in snapshot_position_values(snapshot).items()}
+    weights = np.array([current_weights.get(col, 0) for col in price_history_df.columns])
+    if np.sum(weights) > 0:
+        weights = weights / np.sum(weights)
+    else:
+        weights = np.array([1/len(price_history_df.columns)] * len(price_history_df.columns))
+
+    return update_online_metrics(user_id, price_history_df, weights, risk_free_rate)
+
+def get_scenario_price_history(tickers: list, scenarios: dict = None) -> 'pd.DataFrame':
+    """
+    Stored closing prices of the given tickers over each stress scenario window (see evaluation/risk_engine.py).
+
+    Returns:
+        pd.DataFrame: Prices indexed by date, one column per ticker with any price in a window.
+    """
+    import pandas as pd
+    from portfolio_balancer.src.evaluation.risk_engine import STRESS_SCENARIOS
+
+    scenarios = STRESS_SCENARIOS if scenarios is None else scenarios
+    windows = []
+    for start, end, _ in scenarios.values():
+        # One range read for all tickers of the window
+        window = repository.price_history_frame(tickers, start, end)
+        if not window.empty:
+            windows.append(window)
+    if not windows:
+        return pd.DataFrame(columns=tickers)
+    scenario_history = pd.concat(windows).sort_index()
+    return scenario_history[~scenario_history.index.duplicated(keep='last')]
+
+# Bump when the rebalancing or recommendation logic changes, so outputs stored by older code are not served
+STORED_OUTPUT_VERSION = 1
+
+def output_fingerprint(kind: str, holdings_data: list, target_allocation: dict, snapshot: dict, params: dict) -> str:
+    """
+    Fingerprint of everything a stored rebalance plan or recommendation depends on.
+
+    Covers the holdings (ticker, quantity, cost), the target allocation, the latest prices (through the
+    snapshot values) with today's date as the as-of for price history, and the request parameters.
+    """
+    from portfolio_balancer.src.data.result_cache import fingerprint
+
+    holdings_version = sorted(
+        ({"ticker": h.get('ticker'), "quantity": h.get('quantity'), "avg_cost": h.get('avg_cost')} for h in holdings_data or []),
+        key=lambda h: str(h["ticker"])
+    )
+    if target_allocation:
+        target_allocation = {key: target_allocation.get(key) for key in ('equities', 'bonds', 'cash')}
+    prices_as_of = {
+        "date": datetime.now().date().isoformat(),
+        "values": sorted((item['ticker'], item['value']) for item in snapshot.get('breakdown', []))
+    }
+    return fingerprint(kind, STORED_OUTPUT_VERSION, holdings_version, target_allocation, prices_as_of, params)
+
+def get_stored_output(table: str, user_id, input_fingerprint: str):
+    """
+    Returns the payload of the user's latest row in table ('rebalance_plan' or 'recommendation')
+    computed from the same inputs, or None.
+    """
+    try:
+        row = repository.get_stored_output(table, user_id, input_fingerprint)
+    except Exception as e:
+        logger.warning("Could not read stored %s for user %s: %s", table, user_id, e)
+        return None
+    return row['payload_json'] if row else None
+
+def store_output(table: str, user_id, input_fingerprint: str, payload: dict) -> bool:
+    """
+    Persists an endpoint's output with the fingerprint of its inputs. Failures are logged, not raised.
+
+    Outputs with a solve_path other than "solver" (a solver fallback, or a partial solve cut short by
+    the time budget) are not stored: the same inputs may well be solved fully on the next request.
+
+    Returns:
+        bool: Whether the output was stored.
+    """
+    if payload.get('solve_path', 'solver') != 'solver':
+        return False
+    entry = {
+        "user_id": user_id,
+        "created_at": datetime.now().isoformat(),
+        "payload_json": payload,
+        "input_fingerprint": input_fingerprint
+    }
+    try:
+        repository.insert_stored_output(table, entry)
+    except Exception as e:
+        logger.warning("Could not store %s for user %s: %s", table, user_id, e)
+        return False
+    return True
@@ -0,0 +1,149 @@
+import os
+import re
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from portfolio_balancer.src.data.result_cache import ResultCache, RESULT_CACHE_DIR, ensure_private_dir, fingerprint, is_private_dir
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Bump when get_portfolio_snapshot's output changes, so stale snapshots are not served
+SNAPSHOT_CACHE_VERSION = 2
+
+class VersionStore:
+    """
+    Version tokens shared by all processes through small files in state_dir.
+
+    A token changes on every bump(), so cache entries recorded under an older token are recognized as
+    stale by every worker, including ones still holding the entry in their memory tier. Like the result
+    cache, state_dir must be private to the current user; tokens in a shared directory are not trusted.
+    """
+
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.state_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', name))
+
+    def get(self, name: str) -> str:
+        """Returns the current token of name ('0' if it was never bumped)."""
+        if os.path.exists(self.state_dir) and not is_private_dir(self.state_dir):
+            return uuid.uuid4().hex # Untrusted version: treat cached entries as stale
+        try:
+            with open(self._path(name), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return '0'
+        except OSError as e:
+            logger.warning("Could not read version %s: %s", name, e)
+            return uuid.uuid4().hex # Unknown version: treat cached entries as stale
+
+    def bump(self, name: str) -> str:
+        """Replaces the token of name atomically and returns the new one."""
+        token = uuid.uuid4().hex
+        try:
+            if not ensure_private_dir(self.state_dir):
+                raise PermissionError(f"{self.state_dir} is not private to this user")
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            os.replace(tmp_path, self._path(name))
+        except OSError as e:
+            logger.warning("Could not write version %s: %s", name, e)
+        return token
+
+class SnapshotCache:
+    """
+    Per-user cache of get_portfolio_snapshot results, shared across workers through the disk tier of ResultCache.
+
+    An entry is keyed by the user, the user's holdings version and the day (latest prices are refreshed
+    daily). It also records the price version of every held ticker, priced or not, and is discarded when
+    any of them was bumped since. Writes to a user's holdings or targets bump the user's version;
+    refreshing a ticker's latest price bumps the ticker's price version.
+
+    The key and the price versions are read before the holdings and prices they describe, so a write
+    made while a snapshot is computed leaves the entry under the older version, where it is never served.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, cache_dir: str = RESULT_CACHE_DIR):
+        self.cache = ResultCache("snapshots", max_bytes=max_bytes, cache_dir=cache_dir)
+        self.versions = VersionStore(os.path.join(cache_dir, "versions"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0 # Entries found but invalidated by a price refresh
+        self.invalidations = 0
+
+    def key(self, user_id) -> str:
+        """Cache key of a user's snapshot under the user's current holdings version. Read it before the holdings."""
+        return fingerprint("portfolio_snapshot", SNAPSHOT_CACHE_VERSION, str(user_id),
+                           self.versions.get(f"user-{user_id}"), datetime.now().date())
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, user_id):
+        """Returns the cached snapshot of a user, or None if there is none or it is stale."""
+        entry = self.cache.get(self.key(user_id))
+        if entry is None:
+            self._count('misses')
+            return None
+        if any(self.versions.get(f"price-{ticker}") != version for ticker, version in entry["price_versions"].items()):
+            self._count('stale')
+            self._count('misses')
+            return None
+        self._count('hits')
+        return entry["snapshot"]
+
+    def price_versions(self, tickers) -> dict:
+        """Current price versions of tickers. Read them before the prices."""
+        return {ticker: self.versions.get(f"price-{ticker}") for ticker in dict.fromkeys(tickers)}
+
+    def set(self, key: str, snapshot: dict, price_versions: dict):
+        """Stores a snapshot under the key and price versions read before its inputs (see key and price_versions)."""
+        self.cache.set(key, {"snapshot": snapshot, "price_versions": price_versions})
+
+    def get_or_compute(self, user_id, held_tickers, compute):
+        """
+        Returns the cached snapshot of a user, or computes and stores it.
+
+        Args:
+            user_id: The user.
+            held_tickers: Returns every ticker the user holds; called on a miss, before compute.
+            compute: Returns the snapshot.
+        """
+        snapshot = self.get(user_id)
+        if snapshot is None:
+            key = self.key(user_id)
+            price_versions = self.price_versions(held_tickers())
+            snapshot = compute()
+            self.set(key, snapshot, price_versions)
+        return snapshot
+
+    def invalidate_user(self, user_id):
+        """Marks a user's cached snapshots stale in every worker (after a holdings or target write)."""
+        self.versions.bump(f"user-{user_id}")
+        self._count('invalidations')
+
+    def invalidate_ticker(self, ticker: str):
+        """Marks every cached snapshot holding ticker stale (after its latest price was refreshed)."""
+        self.versions.bump(f"price-{ticker}")
+        self._count('invalidations')
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this process, with the underlying ResultCache's."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / requests if requests else None,
+                "result_cache": self.cache.stats()
+            }
+
+snapshot_cache = SnapshotCache(max_bytes=int(os.environ.get("SNAPSHOT_CACHE_BYTES", 16 * 1024 * 1024)))
@@ -0,0 +1,188 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# 'json' writes one object per line for the log pipeline; 'text' is easier to read in a terminal
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Records waiting for the writer thread; records beyond it are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# The same message (same logger, level and template) is written at most LOG_RATE_LIMIT_BURST times per window
+LOG_RATE_LIMIT_WINDOW = float(os.environ.get("LOG_RATE_LIMIT_WINDOW", 60))
+LOG_RATE_LIMIT_BURST = int(os.environ.get("LOG_RATE_LIMIT_BURST", 5))
+
+ROOT_LOGGER = "portfolio_balancer"
+
+# Attributes every LogRecord has; anything else on a record was passed through extra= and is a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger of a module, under the package's root logger.
+
+    Log with a %-style template and arguments (logger.info("Saved %d rows for %s", count, ticker)):
+    the template identifies repeated messages for rate limiting, and is only formatted if written.
+    Structured fields go in extra={...}.
+    """
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + '.'):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+def _record_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object: time, level, logger, message and the record's extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_record_fields(record)
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format, with the extra fields appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deduplicates repeated messages below ERROR.
+
+    Records with the same logger, level and template share a budget of burst records per window seconds;
+    the rest are dropped. The first record written after a drop carries the number dropped as "suppressed".
+    """
+
+    def __init__(self, window: float = LOG_RATE_LIMIT_WINDOW, burst: int = LOG_RATE_LIMIT_BURST, max_keys: int = 10000):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.max_keys = max_keys
+        self._budgets = {} # (logger, level, template) -> [window start, records written, records dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else repr(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            budget = self._budgets.get(key)
+            if budget is None or now - budget[0] >= self.window:
+                suppressed = budget[2] if budget else 0
+                if budget is None and len(self._budgets) >= self.max_keys:
+                    self._budgets.clear() # Bounded memory: forget every window rather than grow without limit
+                budget = self._budgets[key] = [now, 0, 0]
+            else:
+                suppressed = budget[2]
+            if budget[1] >= self.burst:
+                budget[2] += 1
+                return False
+            budget[1] += 1
+            budget[2] = 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks: when the queue is full the record is dropped and counted.
+
+    Records are prepared in the thread that logs them: the message is formatted, an exception becomes the
+    "exception" field, and the trace id of the current span (if any) is attached, since the context
+    is not visible from the listener thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        from portfolio_balancer.src.api.tracing import current_span
+
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exception = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+        record.exc_info, record.exc_text = None, None
+        span = current_span()
+        if span is not None and not hasattr(record, 'trace_id'):
+            record.trace_id = span.trace.trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_lock = threading.Lock()
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None) -> logging.Logger:
+    """
+    Sets up the package's root logger once per process (later calls only change the level).
+
+    Callers only put records on a bounded queue; a listener thread formats them and writes them to
+    stream (stdout by default), so slow log writes never hold up a request.
+
+    Args:
+        level (str): Minimum level written, e.g. 'DEBUG' or 'WARNING'.
+        fmt (str): 'json' or 'text'.
+        stream: File object written to. Defaults to sys.stdout.
+
+    Returns:
+        logging.Logger: The package's root logger.
+    """
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    with _lock:
+        if _listener is not None:
+            return root
+        if fmt not in ('json', 'text'):
+            raise ValueError(f"Unknown log format '{fmt}'. Use 'json' or 'text'.")
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+        handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    return root
+
+def shutdown_logging():
+    """Writes the records still queued and stops the writer thread (registered to run at exit)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -0,0 +1,344 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import nullcontext
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Fraction of requests traced and exported; requests with debug_trace=1 are always traced
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))
+# Where sampled traces go: '' (nowhere, only debug_trace responses), 'jsonl' or 'otlp'
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "portfolio_balancer")
+# Spans kept per trace; a long backtest makes thousands of database calls and rebalances
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", 2000))
+# Finished traces waiting for the exporter thread; traces beyond it are dropped rather than slowing requests
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 1000))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_NO_SPAN = nullcontext()
+
+class _Trace:
+    """Bookkeeping shared by the spans of one trace."""
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.span_count = 0
+        self.dropped = 0
+
+class Span:
+    """One timed operation of a trace, with the operations it called as children."""
+
+    __slots__ = ('trace', 'span_id', 'parent', 'name', 'attributes', 'start_time', 'started_at', 'duration', 'error', 'children')
+
+    def __init__(self, trace: _Trace, parent, name: str, attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.started_at = time.perf_counter()
+        self.duration = None # Seconds, set when the span ends
+        self.error = None
+        self.children = []
+
+    def set(self, **attributes):
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.perf_counter() - self.started_at
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self, root_started_at: float = None) -> dict:
+        """
+        The span and its children as a tree.
+
+        Returns:
+            dict: A dictionary containing:
+                - "name", "span_id", "attributes": The span's identity and attributes.
+                - "offset_ms": Start relative to the root span.
+                - "duration_ms": Duration, or None if the span did not end.
+                - "error": The exception that ended the span, if any.
+                - "children": Child spans in start order.
+        """
+        root_started_at = self.started_at if root_started_at is None else root_started_at
+        tree = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "offset_ms": round((self.started_at - root_started_at) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "children": [child.to_dict(root_started_at) for child in self.children]
+        }
+        if self.error:
+            tree["error"] = self.error
+        return tree
+
+    def walk(self):
+        """Yields the span and all its descendants."""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+class _ActiveSpan:
+    """Context manager making a new span the current one for its block."""
+
+    __slots__ = ('parent', 'name', 'attributes', 'span', 'token')
+
+    def __init__(self, parent: Span, name: str, attributes: dict):
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        trace = self.parent.trace
+        if trace.span_count >= TRACE_MAX_SPANS:
+            trace.dropped += 1
+            return None
+        trace.span_count += 1
+        self.span = Span(trace, self.parent, self.name, self.attributes)
+        self.parent.children.append(self.span)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.span is not None:
+            self.span.finish(exc_value)
+            _current_span.reset(self.token)
+        return False
+
+def current_span():
+    """The innermost span of the current context, or None when nothing is being traced."""
+    return _current_span.get()
+
+def span(name: str, **attributes):
+    """
+    Context manager recording its block as a child of the current span.
+
+    Outside a trace it is a shared no-op, so untraced requests only pay for one context variable lookup.
+    The span (or None) is returned by __enter__ so the block can add attributes with span.set().
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    return _ActiveSpan(parent, name, attributes)
+
+def start_span(name: str, **attributes):
+    """Starts a span that is ended explicitly with end_span(), for blocks that do not fit a with statement."""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    active = _ActiveSpan(parent, name, attributes)
+    active.__enter__()
+    return active
+
+def end_span(active, **attributes):
+    """Ends a span returned by start_span(), adding attributes first. Accepts None."""
+    if active is None:
+        return
+    if active.span is not None:
+        active.span.set(**attributes)
+    active.__exit__(None, None, None)
+
+def traced(name: str = None):
+    """Decorator recording every call of a function made within a trace as a span."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_trace(name: str, **attributes):
+    """
+    Starts a new trace with a root span that becomes the current span.
+
+    Returns:
+        tuple: (root span, context token to pass to finish_trace).
+    """
+    root = Span(_Trace(), None, name, attributes)
+    root.trace.span_count = 1
+    return root, _current_span.set(root)
+
+def finish_trace(root: Span, token, error: BaseException = None) -> Span:
+    """Ends a trace started with start_trace and restores the previous current span."""
+    root.finish(error)
+    if root.trace.dropped:
+        root.set(dropped_spans=root.trace.dropped)
+    _current_span.reset(token)
+    return root
+
+def trace_to_dict(root: Span) -> dict:
+    """A finished trace as {"trace_id", "duration_ms", "spans": span tree}, for debug responses and JSONL export."""
+    return {
+        "trace_id": root.trace.trace_id,
+        "start_time": root.start_time,
+        "duration_ms": round(root.duration * 1000, 3) if root.duration is not None else None,
+        "spans": root.to_dict()
+    }
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def trace_to_otlp(root: Span) -> dict:
+    """A finished trace as an OTLP/HTTP JSON ExportTraceServiceRequest."""
+    spans = []
+    for item in root.walk():
+        start_ns = int(item.start_time * 1e9)
+        end_ns = start_ns + int((item.duration or 0) * 1e9)
+        otlp_span = {
+            "traceId": item.trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 2 if item.parent is None else 1, # SERVER for the request, INTERNAL below it
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()],
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1}
+        }
+        if item.parent is not None:
+            otlp_span["parentSpanId"] = item.parent.span_id
+        spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "portfolio_balancer.tracing"}, "spans": spans}]
+    }]}
+
+class TraceExporter:
+    """
+    Writes finished traces from a background thread, so requests never wait on the file or the collector.
+
+    'jsonl' appends one trace_to_dict() line per trace to path; 'otlp' posts trace_to_otlp() to an
+    OTLP/HTTP collector endpoint (e.g. a local OpenTelemetry Collector or Jaeger on port 4318).
+    """
+
+    def __init__(self, kind: str, path: str = TRACE_FILE, endpoint: str = TRACE_OTLP_ENDPOINT, max_queue_size: int = TRACE_QUEUE_SIZE):
+        if kind not in ('jsonl', 'otlp'):
+            raise ValueError(f"Unknown trace exporter '{kind}'. Use 'jsonl' or 'otlp'.")
+        self.kind = kind
+        self.path = path
+        self.endpoint = endpoint
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, root: Span):
+        """Queues a finished trace; drops it if the queue is full."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            root = self._queue.get()
+            try:
+                self._write(root)
+                self.exported += 1
+            except Exception as e:
+                logger.warning("Could not export trace %s: %s", root.trace.trace_id, e)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, root: Span):
+        if self.kind == 'jsonl':
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(trace_to_dict(root), default=str) + '\n')
+        else:
+            import urllib.request
+            body = json.dumps(trace_to_otlp(root), default=str).encode('utf-8')
+            request = urllib.request.Request(self.endpoint, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+
+    def flush(self, timeout: float = None):
+        """Waits until the queued traces are written (for tests and scripts)."""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            time.sleep(0.01)
+
+exporter = TraceExporter(TRACE_EXPORTER) if TRACE_EXPORTER else None
+
+def _is_debug_trace(value) -> bool:
+    return value is not None and value.lower() in ('1', 'true', 'yes')
+
+def init_app(app):
+    """
+    Traces a sample of the requests of a Flask app, and every request with debug_trace=1.
+
+    A traced request gets an X-Trace-Id header. With debug_trace=1, a JSON object response also gets
+    its span tree under "trace". Sampled traces are sent to the configured exporter.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_trace():
+        debug = _is_debug_trace(request.args.get('debug_trace'))
+        if not debug and (exporter is None or random.random() >= TRACE_SAMPLE_RATE):
+            return
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        g.trace = start_trace(f"{request.method} {route}", route=route, method=request.method)
+        g.trace_debug = debug
+
+    def _finish_request_trace(status_code=None, error=None):
+        root, token = g.pop('trace')
+        if status_code is not None:
+            root.set(status_code=status_code)
+        finish_trace(root, token, error)
+        if exporter is not None:
+            exporter.export(root)
+        return root
+
+    @app.after_request
+    def _end_request_trace(response):
+        if 'trace' not in g:
+            return response
+        root = _finish_request_trace(status_code=response.status_code)
+        response.headers['X-Trace-Id'] = root.trace.trace_id
+        if g.pop('trace_debug', False) and response.is_json and not response.is_streamed:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body["trace"] = trace_to_dict(root)
+                response.set_data(json.dumps(body, default=str))
+        return response
+
+    @app.teardown_request
+    def _end_failed_request_trace(error=None):
+        # after_request does not run when the view raised
+        if 'trace' in g:
+            _finish_request_trace(error=error)
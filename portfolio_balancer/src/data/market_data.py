@@ -1,11 +1,15 @@
-import yfinance as yf
-from pycoingecko import CoinGeckoAPI
-import pandas as pd
 from datetime import datetime, timedelta
 import time
 import functools
 import os
 import json
+from portfolio_balancer.src.api.instrumentation import record_cache, timed
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# yfinance, pycoingecko and pandas are imported inside the fetchers: they are only needed when a provider
+# is actually called, and importing them slows down the start of every process that uses this module.
 
 # Define cache directory
 CACHE_DIR = "cache"
@@ -29,13 +33,15 @@ def on_disk_cache(func):
                 data = json.load(f)
                 timestamp = data.get('timestamp')
                 if time.time() - timestamp < _API_CACHE_TTL_SECONDS:
-                    print(f"On-disk cache hit for {func.__name__}")
+                    logger.debug("On-disk cache hit for %s", func.__name__)
+                    record_cache('api_disk', 'hit')
                     return data['value']
                 else:
-                    print(f"On-disk cache expired for {func.__name__}")
+                    logger.debug("On-disk cache expired for %s", func.__name__)
 
         # If not cached or expired, call the original function and cache the result
-        print(f"On-disk cache miss for {func.__name__}. Fetching data...")
+        logger.debug("On-disk cache miss for %s. Fetching data...", func.__name__)
+        record_cache('api_disk', 'miss')
         value = func(*args, **kwargs)
         with open(cache_file, 'w') as f:
             json.dump({'timestamp': time.time(), 'value': value}, f)
@@ -51,13 +57,15 @@ def cached_api_call(func):
         if key in _api_cache:
             timestamp, value = _api_cache[key]
             if time.time() - timestamp < _API_CACHE_TTL_SECONDS:
-                print(f"In-memory cache hit for {func.__name__} with key {key}")
+                logger.debug("In-memory cache hit for %s", func.__name__)
+                record_cache('api_memory', 'hit')
                 return value
             else:
-                print(f"In-memory cache expired for {func.__name__} with key {key}")
+                logger.debug("In-memory cache expired for %s", func.__name__)
                 del _api_cache[key]
         
-        print(f"In-memory cache miss for {func.__name__} with key {key}. Fetching data...")
+        logger.debug("In-memory cache miss for %s. Fetching data...", func.__name__)
+        record_cache('api_memory', 'miss')
         value = func(*args, **kwargs)
         _api_cache[key] = (time.time(), value)
         return value
@@ -65,23 +73,28 @@ def cached_api_call(func):
 
 @on_disk_cache
 @cached_api_call
+@timed('provider')
 def fetch_yfinance_data(ticker, start_date, end_date):
     """Fetches historical OHLCV data for a given stock/ETF ticker using yfinance."""
+    import yfinance as yf
     try:
         data = yf.download(ticker, start=start_date, end=end_date)
         if not data.empty:
             return data[['Open', 'High', 'Low', 'Close', 'Volume']]
         else:
-            print(f"No data found for {ticker} from {start_date} to {end_date}")
+            logger.warning("No data found for %s from %s to %s", ticker, start_date, end_date)
             return None
     except Exception as e:
-        print(f"Error fetching yfinance data for {ticker}: {e}")
+        logger.error("Error fetching yfinance data for %s: %s", ticker, e)
         return None
 
 @on_disk_cache
 @cached_api_call
+@timed('provider')
 def fetch_coingecko_data(coin_id, vs_currency, days):
     """Fetches historical price data for a given cryptocurrency using CoinGecko API."""
+    import pandas as pd
+    from pycoingecko import CoinGeckoAPI
     cg = CoinGeckoAPI()
     try:
         data = cg.get_coin_market_chart_by_id(id=coin_id, vs_currency=vs_currency, days=days)
@@ -94,39 +107,43 @@ def fetch_coingecko_data(coin_id, vs_currency, days):
             df['Open'] = df['High'] = df['Low'] = df['Volume'] = None # Placeholder for OHLCV
             return df[['Open', 'High', 'Low', 'Close', 'Volume']]
         else:
-            print(f"No data found for {coin_id} from CoinGecko.")
+            logger.warning("No data found for %s from CoinGecko.", coin_id)
             return None
     except Exception as e:
-        print(f"Error fetching CoinGecko data for {coin_id}: {e}")
+        logger.error("Error fetching CoinGecko data for %s: %s", coin_id, e)
         return None
 
 @on_disk_cache
 @cached_api_call
+@timed('provider')
 def get_latest_yfinance_price(ticker):
     """Fetches the latest closing price for a given stock/ETF ticker using yfinance."""
+    import yfinance as yf
     try:
         data = yf.download(ticker, period="1d")
         if not data.empty:
             return data['Close'].iloc[-1]
         else:
-            print(f"No latest price found for {ticker}")
+            logger.warning("No latest price found for %s", ticker)
             return None
     except Exception as e:
-        print(f"Error fetching latest yfinance price for {ticker}: {e}")
+        logger.error("Error fetching latest yfinance price for %s: %s", ticker, e)
         return None
 
 @on_disk_cache
 @cached_api_call
+@timed('provider')
 def get_latest_coingecko_price(coin_id, vs_currency):
     """Fetches the latest price for a given cryptocurrency using CoinGecko API."""
+    from pycoingecko import CoinGeckoAPI
     cg = CoinGeckoAPI()
     try:
         data = cg.get_price(ids=coin_id, vs_currencies=vs_currency)
         if data and coin_id in data and vs_currency in data[coin_id]:
             return data[coin_id][vs_currency]
         else:
-            print(f"No latest price found for {coin_id} in {vs_currency}")
+            logger.warning("No latest price found for %s in %s", coin_id, vs_currency)
             return None
     except Exception as e:
-        print(f"Error fetching latest CoinGecko price for {coin_id}: {e}")
+        logger.error("Error fetching latest CoinGecko price for %s: %s", coin_id, e)
         return None
\ No newline at end of file
@@ -0,0 +1,625 @@
+import json
+import os
+import sqlite3
+import threading
+from portfolio_balancer.src.api.instrumentation import instrument_methods
+
+# Backend used by get_repository(): 'supabase' (default) or 'sqlite' (embedded, for offline runs and benchmarks)
+DATA_BACKEND = os.environ.get("DATA_BACKEND", "supabase")
+SQLITE_DB_PATH = os.environ.get("SQLITE_DB_PATH", ":memory:")
+
+# PostgREST returns at most this many rows per request; longer reads are paged
+SUPABASE_PAGE_SIZE = 1000
+# Values per 'in' filter, keeping request URLs short
+SUPABASE_IN_BATCH = 50
+
+# Tables holding endpoint outputs keyed by a fingerprint of their inputs (see services.output_fingerprint)
+STORED_OUTPUT_TABLES = ('rebalance_plan', 'recommendation')
+
+def _check_stored_output_table(table: str):
+    if table not in STORED_OUTPUT_TABLES:
+        raise ValueError(f"Unknown stored output table: {table}")
+
+class PortfolioRepository:
+    """
+    Data access for holdings, target allocations, prices, snapshots, precomputed statistics, risk reports
+    and stored endpoint outputs.
+
+    Rows are plain dicts with the column names of the Supabase tables, so callers are independent of
+    the backend. Dates are 'YYYY-MM-DD' strings.
+    """
+
+    def get_holdings(self, user_id) -> list:
+        """Returns the user's holding rows."""
+        raise NotImplementedError
+
+    def get_all_holdings(self) -> list:
+        """Returns the holding rows of every user."""
+        raise NotImplementedError
+
+    def get_holdings_for_users(self, user_ids: list) -> list:
+        """Returns the holding rows of several users with one query per batch of ids."""
+        raise NotImplementedError
+
+    def add_holdings(self, rows: list) -> list:
+        """Inserts holding rows and returns them."""
+        raise NotImplementedError
+
+    def get_target_allocation(self, user_id):
+        """Returns the user's target allocation row, or None."""
+        raise NotImplementedError
+
+    def get_target_allocations(self, user_ids: list) -> list:
+        """Returns the target allocation rows of several users with one query per batch of ids."""
+        raise NotImplementedError
+
+    def upsert_target_allocation(self, row: dict) -> dict:
+        """Creates or replaces the target allocation of row['user_id']."""
+        raise NotImplementedError
+
+    def get_price_history(self, tickers: list, start_date: str = None, end_date: str = None) -> list:
+        """
+        Closing prices of several tickers.
+
+        Args:
+            tickers (list): Tickers to read.
+            start_date (str): First date (inclusive), or None for no bound.
+            end_date (str): Last date (inclusive), or None for no bound.
+
+        Returns:
+            list: {"ticker", "date", "close"} rows ordered by ticker and date.
+        """
+        raise NotImplementedError
+
+    def get_close_on_or_before(self, ticker: str, date: str):
+        """Returns the last closing price of the ticker on or before date, or None."""
+        raise NotImplementedError
+
+    def get_price_page(self, ticker: str, start_date: str = None, after: str = None, limit: int = 1000) -> list:
+        """
+        One page of a ticker's closing prices in date order, for cursor pagination.
+
+        Args:
+            ticker (str): Ticker to read.
+            start_date (str): First date (inclusive), or None for no bound.
+            after (str): Cursor: only dates strictly after it are returned (the last date of the previous page).
+            limit (int): Maximum number of rows.
+
+        Returns:
+            list: {"date", "close"} rows.
+        """
+        raise NotImplementedError
+
+    def get_last_price_date(self, ticker: str):
+        """Returns the most recent date with a stored price for the ticker, or None."""
+        raise NotImplementedError
+
+    def save_price_history(self, rows: list) -> int:
+        """Stores {"ticker", "date", "close"} rows and returns the number written."""
+        raise NotImplementedError
+
+    def get_latest_price(self, ticker: str):
+        """Returns the ticker's {"ticker", "price", "as_of"} row, or None."""
+        raise NotImplementedError
+
+    def get_latest_prices(self, tickers: list) -> dict:
+        """Returns {ticker: latest_price row} for the tickers that have one, with one query per batch."""
+        raise NotImplementedError
+
+    def upsert_latest_price(self, row: dict) -> dict:
+        """Creates or replaces the latest price of row['ticker']."""
+        raise NotImplementedError
+
+    def get_snapshots(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        """Returns the user's snapshot rows ordered by date."""
+        raise NotImplementedError
+
+    def insert_snapshot(self, row: dict) -> dict:
+        raise NotImplementedError
+
+    def get_latest_precomputed_stats(self):
+        """Returns the most recent precomputed_stats row, or None."""
+        raise NotImplementedError
+
+    def insert_precomputed_stats(self, row: dict) -> dict:
+        raise NotImplementedError
+
+    def get_risk_reports(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        """Returns the user's risk_reports rows ordered by date."""
+        raise NotImplementedError
+
+    def insert_risk_report(self, row: dict) -> dict:
+        raise NotImplementedError
+
+    def get_stored_output(self, table: str, user_id, input_fingerprint: str):
+        """
+        Returns the user's latest row in table (one of STORED_OUTPUT_TABLES) with the given
+        input_fingerprint, or None.
+        """
+        raise NotImplementedError
+
+    def insert_stored_output(self, table: str, row: dict) -> dict:
+        raise NotImplementedError
+
+    def price_history_frame(self, tickers: list, start_date: str = None, end_date: str = None):
+        """
+        Closing prices as a DataFrame indexed by date with one column per ticker (the layout the
+        analytics expect). Tickers without prices are left out.
+        """
+        import pandas as pd
+
+        rows = self.get_price_history(tickers, start_date, end_date)
+        if not rows:
+            return pd.DataFrame()
+        frame = pd.DataFrame(rows, columns=['ticker', 'date', 'close'])
+        frame['date'] = pd.to_datetime(frame['date'])
+        prices = frame.pivot_table(index='date', columns='ticker', values='close', aggfunc='last').sort_index()
+        return prices[[ticker for ticker in dict.fromkeys(tickers) if ticker in prices.columns]]
+
+@instrument_methods('db_query', 'supabase')
+class SupabaseRepository(PortfolioRepository):
+    """Repository over the Supabase tables (the production backend)."""
+
+    def __init__(self, client=None):
+        """
+        Args:
+            client: Supabase client. Defaults to the shared client of db.py.
+        """
+        if client is None:
+            from portfolio_balancer.src.api.db import supabase as client
+        self.client = client
+
+    def get_holdings(self, user_id) -> list:
+        return self.client.table('holding').select("*").eq("user_id", user_id).execute().data or []
+
+    def get_all_holdings(self) -> list:
+        return self.client.table('holding').select("*").execute().data or []
+
+    def _select_in(self, table: str, column: str, values: list) -> list:
+        values = list(dict.fromkeys(values))
+        rows = []
+        for i in range(0, len(values), SUPABASE_IN_BATCH):
+            rows.extend(self.client.table(table).select("*").in_(column, values[i:i + SUPABASE_IN_BATCH]).execute().data or [])
+        return rows
+
+    def get_holdings_for_users(self, user_ids: list) -> list:
+        return self._select_in('holding', "user_id", user_ids)
+
+    def add_holdings(self, rows: list) -> list:
+        return self.client.table('holding').insert(rows).execute().data or []
+
+    def get_target_allocation(self, user_id):
+        data = self.client.table('target_allocation').select("*").eq("user_id", user_id).limit(1).execute().data
+        return data[0] if data else None
+
+    def get_target_allocations(self, user_ids: list) -> list:
+        return self._select_in('target_allocation', "user_id", user_ids)
+
+    def upsert_target_allocation(self, row: dict) -> dict:
+        data = self.client.table('target_allocation').upsert(row).execute().data
+        return data[0] if data else row
+
+    def get_price_history(self, tickers: list, start_date: str = None, end_date: str = None) -> list:
+        tickers = list(dict.fromkeys(tickers))
+        rows = []
+        for i in range(0, len(tickers), SUPABASE_IN_BATCH):
+            offset = 0
+            while True:
+                query = self.client.table('price_history').select("ticker, date, close").in_("ticker", tickers[i:i + SUPABASE_IN_BATCH])
+                if start_date:
+                    query = query.gte("date", start_date)
+                if end_date:
+                    query = query.lte("date", end_date)
+                page = query.order("ticker").order("date").range(offset, offset + SUPABASE_PAGE_SIZE - 1).execute().data or []
+                rows.extend(page)
+                if len(page) < SUPABASE_PAGE_SIZE:
+                    break
+                offset += SUPABASE_PAGE_SIZE
+        return rows
+
+    def get_close_on_or_before(self, ticker: str, date: str):
+        data = self.client.table('price_history').select("close").eq("ticker", ticker).lte("date", date) \
+            .order("date", desc=True).limit(1).execute().data
+        return data[0]['close'] if data else None
+
+    def get_price_page(self, ticker: str, start_date: str = None, after: str = None, limit: int = 1000) -> list:
+        query = self.client.table('price_history').select("date, close").eq("ticker", ticker)
+        if start_date:
+            query = query.gte("date", start_date)
+        if after:
+            query = query.gt("date", after)
+        return query.order("date").limit(min(limit, SUPABASE_PAGE_SIZE)).execute().data or []
+
+    def get_last_price_date(self, ticker: str):
+        data = self.client.table('price_history').select("date").eq("ticker", ticker).order("date", desc=True).limit(1).execute().data
+        return data[0]['date'] if data else None
+
+    def save_price_history(self, rows: list) -> int:
+        if not rows:
+            return 0
+        return len(self.client.table('price_history').insert(rows).execute().data or [])
+
+    def get_latest_price(self, ticker: str):
+        data = self.client.table('latest_price').select("*").eq("ticker", ticker).limit(1).execute().data
+        return data[0] if data else None
+
+    def get_latest_prices(self, tickers: list) -> dict:
+        return {row['ticker']: row for row in self._select_in('latest_price', "ticker", tickers)}
+
+    def upsert_latest_price(self, row: dict) -> dict:
+        data = self.client.table('latest_price').upsert(row).execute().data
+        return data[0] if data else None
+
+    def get_snapshots(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        query = self.client.table('snapshots').select("*").eq("user_id", user_id)
+        if start_date:
+            query = query.gte("date", start_date)
+        if end_date:
+            query = query.lte("date", end_date)
+        return query.order("date").execute().data or []
+
+    def insert_snapshot(self, row: dict) -> dict:
+        data = self.client.table('snapshots').insert(row).execute().data
+        return data[0] if data else None
+
+    def get_latest_precomputed_stats(self):
+        data = self.client.table('precomputed_stats').select("*").order("date", desc=True).limit(1).execute().data
+        return data[0] if data else None
+
+    def insert_precomputed_stats(self, row: dict) -> dict:
+        data = self.client.table('precomputed_stats').insert(row).execute().data
+        return data[0] if data else None
+
+    def get_risk_reports(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        query = self.client.table('risk_reports').select("*").eq("user_id", user_id)
+        if start_date:
+            query = query.gte("date", start_date)
+        if end_date:
+            query = query.lte("date", end_date)
+        return query.order("date").execute().data or []
+
+    def insert_risk_report(self, row: dict) -> dict:
+        data = self.client.table('risk_reports').insert(row).execute().data
+        return data[0] if data else None
+
+    def get_stored_output(self, table: str, user_id, input_fingerprint: str):
+        _check_stored_output_table(table)
+        data = self.client.table(table).select("*").eq("user_id", user_id).eq("input_fingerprint", input_fingerprint) \
+            .order("created_at", desc=True).limit(1).execute().data
+        return data[0] if data else None
+
+    def insert_stored_output(self, table: str, row: dict) -> dict:
+        _check_stored_output_table(table)
+        data = self.client.table(table).insert(row).execute().data
+        return data[0] if data else None
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS holding (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    quantity REAL,
+    avg_cost REAL,
+    purchase_price REAL,
+    purchase_date TEXT
+);
+CREATE INDEX IF NOT EXISTS holding_user_idx ON holding (user_id);
+CREATE INDEX IF NOT EXISTS holding_ticker_idx ON holding (ticker);
+
+CREATE TABLE IF NOT EXISTS target_allocation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE,
+    equities REAL,
+    bonds REAL,
+    cash REAL
+);
+
+-- Clustered on (ticker, date): range reads of a ticker are a single index scan
+CREATE TABLE IF NOT EXISTS price_history (
+    ticker TEXT NOT NULL,
+    date TEXT NOT NULL,
+    close REAL,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS price_history_date_idx ON price_history (date);
+
+CREATE TABLE IF NOT EXISTS latest_price (
+    ticker TEXT PRIMARY KEY,
+    price REAL,
+    as_of TEXT
+);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    portfolio_id TEXT,
+    date TEXT NOT NULL,
+    total_value REAL,
+    asset_allocation TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_user_date_idx ON snapshots (user_id, date);
+
+CREATE TABLE IF NOT EXISTS precomputed_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    volatility TEXT,
+    correlations TEXT
+);
+CREATE INDEX IF NOT EXISTS precomputed_stats_date_idx ON precomputed_stats (date);
+
+CREATE TABLE IF NOT EXISTS risk_reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    report TEXT
+);
+CREATE INDEX IF NOT EXISTS risk_reports_user_date_idx ON risk_reports (user_id, date);
+
+CREATE TABLE IF NOT EXISTS rebalance_plan (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    payload_json TEXT,
+    input_fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rebalance_plan_lookup_idx ON rebalance_plan (user_id, input_fingerprint, created_at);
+
+CREATE TABLE IF NOT EXISTS recommendation (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    payload_json TEXT,
+    input_fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recommendation_lookup_idx ON recommendation (user_id, input_fingerprint, created_at);
+"""
+
+# Columns stored as JSON text in SQLite (JSONB in Supabase)
+_JSON_COLUMNS = {'snapshots': ('asset_allocation',), 'precomputed_stats': ('volatility', 'correlations'), 'risk_reports': ('report',),
+                 'rebalance_plan': ('payload_json',), 'recommendation': ('payload_json',)}
+
+# SQLite host parameters per statement are limited; larger ticker lists are queried in batches
+SQLITE_MAX_PARAMS = 900
+
+@instrument_methods('db_query', 'sqlite')
+class SQLiteRepository(PortfolioRepository):
+    """
+    Embedded repository with the same tables, for offline benchmarking and fast analytical reads.
+
+    price_history is keyed on (ticker, date), so multi-year reads of many tickers are index range scans
+    returning tuples instead of PostgREST JSON. User ids are stored as text, matching the string ids
+    the API receives in query parameters.
+    """
+
+    def __init__(self, path: str = SQLITE_DB_PATH):
+        """
+        Args:
+            path (str): Database file, or ':memory:' for a private in-memory database.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def _write(self, sql: str, params_list: list) -> int:
+        with self._lock, self._conn:
+            return self._conn.executemany(sql, params_list).rowcount
+
+    def _insert(self, table: str, row: dict, replace: bool = False) -> dict:
+        row = dict(row)
+        stored = {column: json.dumps(value) if column in _JSON_COLUMNS.get(table, ()) and not isinstance(value, str) else value
+                  for column, value in row.items()}
+        if 'user_id' in stored:
+            stored['user_id'] = str(stored['user_id'])
+        columns = ', '.join(stored)
+        placeholders = ', '.join('?' for _ in stored)
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        with self._lock, self._conn:
+            cursor = self._conn.execute(f"{verb} INTO {table} ({columns}) VALUES ({placeholders})", tuple(stored.values()))
+            if 'id' not in row and table != 'latest_price':
+                row['id'] = cursor.lastrowid
+        return row
+
+    def _decode(self, table: str, rows: list) -> list:
+        for row in rows:
+            for column in _JSON_COLUMNS.get(table, ()):
+                if isinstance(row.get(column), str):
+                    row[column] = json.loads(row[column])
+        return rows
+
+    def get_holdings(self, user_id) -> list:
+        return self._query("SELECT * FROM holding WHERE user_id = ? ORDER BY id", (str(user_id),))
+
+    def get_all_holdings(self) -> list:
+        return self._query("SELECT * FROM holding ORDER BY id")
+
+    def _select_in(self, table: str, column: str, values: list) -> list:
+        values = list(dict.fromkeys(str(value) for value in values))
+        rows = []
+        for i in range(0, len(values), SQLITE_MAX_PARAMS):
+            batch = values[i:i + SQLITE_MAX_PARAMS]
+            rows.extend(self._query(f"SELECT * FROM {table} WHERE {column} IN ({', '.join('?' for _ in batch)}) ORDER BY id", tuple(batch)))
+        return rows
+
+    def get_holdings_for_users(self, user_ids: list) -> list:
+        return self._select_in('holding', 'user_id', user_ids)
+
+    def add_holdings(self, rows: list) -> list:
+        return [self._insert('holding', row) for row in rows]
+
+    def get_target_allocation(self, user_id):
+        rows = self._query("SELECT * FROM target_allocation WHERE user_id = ? LIMIT 1", (str(user_id),))
+        return rows[0] if rows else None
+
+    def get_target_allocations(self, user_ids: list) -> list:
+        return self._select_in('target_allocation', 'user_id', user_ids)
+
+    def upsert_target_allocation(self, row: dict) -> dict:
+        row = {column: value for column, value in row.items() if column != 'id'}
+        return self._insert('target_allocation', row, replace=True)
+
+    def _price_history_queries(self, tickers: list, start_date: str = None, end_date: str = None):
+        """Yields (sql, params) reading the price history of tickers, one statement per batch of tickers."""
+        tickers = list(dict.fromkeys(tickers))
+        for i in range(0, len(tickers), SQLITE_MAX_PARAMS):
+            batch = tickers[i:i + SQLITE_MAX_PARAMS]
+            sql = f"SELECT ticker, date, close FROM price_history WHERE ticker IN ({', '.join('?' for _ in batch)})"
+            params = list(batch)
+            if start_date:
+                sql += " AND date >= ?"
+                params.append(str(start_date))
+            if end_date:
+                sql += " AND date <= ?"
+                params.append(str(end_date))
+            yield sql + " ORDER BY ticker, date", tuple(params)
+
+    def get_price_history(self, tickers: list, start_date: str = None, end_date: str = None) -> list:
+        rows = []
+        for sql, params in self._price_history_queries(tickers, start_date, end_date):
+            rows.extend(self._query(sql, params))
+        return rows
+
+    def get_close_on_or_before(self, ticker: str, date: str):
+        rows = self._query("SELECT close FROM price_history WHERE ticker = ? AND date <= ? ORDER BY date DESC LIMIT 1",
+                           (ticker, str(date)))
+        return rows[0]['close'] if rows else None
+
+    def get_price_page(self, ticker: str, start_date: str = None, after: str = None, limit: int = 1000) -> list:
+        sql = "SELECT date, close FROM price_history WHERE ticker = ?"
+        params = [ticker]
+        if start_date:
+            sql += " AND date >= ?"
+            params.append(str(start_date))
+        if after:
+            sql += " AND date > ?"
+            params.append(str(after))
+        params.append(int(limit))
+        return self._query(sql + " ORDER BY date LIMIT ?", tuple(params))
+
+    def get_last_price_date(self, ticker: str):
+        rows = self._query("SELECT MAX(date) AS date FROM price_history WHERE ticker = ?", (ticker,))
+        return rows[0]['date'] if rows else None
+
+    def save_price_history(self, rows: list) -> int:
+        if not rows:
+            return 0
+        self._write("INSERT OR REPLACE INTO price_history (ticker, date, close) VALUES (?, ?, ?)",
+                    [(row['ticker'], str(row['date']), row['close']) for row in rows])
+        return len(rows)
+
+    def get_latest_price(self, ticker: str):
+        rows = self._query("SELECT * FROM latest_price WHERE ticker = ?", (ticker,))
+        return rows[0] if rows else None
+
+    def get_latest_prices(self, tickers: list) -> dict:
+        tickers = list(dict.fromkeys(tickers))
+        rows = []
+        for i in range(0, len(tickers), SQLITE_MAX_PARAMS):
+            batch = tickers[i:i + SQLITE_MAX_PARAMS]
+            rows.extend(self._query(f"SELECT * FROM latest_price WHERE ticker IN ({', '.join('?' for _ in batch)})", tuple(batch)))
+        return {row['ticker']: row for row in rows}
+
+    def upsert_latest_price(self, row: dict) -> dict:
+        return self._insert('latest_price', row, replace=True)
+
+    def get_snapshots(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        sql = "SELECT * FROM snapshots WHERE user_id = ?"
+        params = [str(user_id)]
+        if start_date:
+            sql += " AND date >= ?"
+            params.append(str(start_date))
+        if end_date:
+            sql += " AND date <= ?"
+            params.append(str(end_date))
+        return self._decode('snapshots', self._query(sql + " ORDER BY date", tuple(params)))
+
+    def insert_snapshot(self, row: dict) -> dict:
+        return self._insert('snapshots', row)
+
+    def get_latest_precomputed_stats(self):
+        rows = self._decode('precomputed_stats', self._query("SELECT * FROM precomputed_stats ORDER BY date DESC, id DESC LIMIT 1"))
+        return rows[0] if rows else None
+
+    def insert_precomputed_stats(self, row: dict) -> dict:
+        return self._insert('precomputed_stats', row)
+
+    def get_risk_reports(self, user_id, start_date: str = None, end_date: str = None) -> list:
+        sql = "SELECT * FROM risk_reports WHERE user_id = ?"
+        params = [str(user_id)]
+        if start_date:
+            sql += " AND date >= ?"
+            params.append(str(start_date))
+        if end_date:
+            sql += " AND date <= ?"
+            params.append(str(end_date))
+        return self._decode('risk_reports', self._query(sql + " ORDER BY date, id", tuple(params)))
+
+    def insert_risk_report(self, row: dict) -> dict:
+        return self._insert('risk_reports', row)
+
+    def get_stored_output(self, table: str, user_id, input_fingerprint: str):
+        _check_stored_output_table(table)
+        rows = self._query(f"SELECT * FROM {table} WHERE user_id = ? AND input_fingerprint = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+                           (str(user_id), input_fingerprint))
+        return self._decode(table, rows)[0] if rows else None
+
+    def insert_stored_output(self, table: str, row: dict) -> dict:
+        _check_stored_output_table(table)
+        return self._insert(table, row)
+
+    def price_history_frame(self, tickers: list, start_date: str = None, end_date: str = None):
+        """As PortfolioRepository.price_history_frame, reading the index scan directly into arrays."""
+        import pandas as pd
+
+        records = []
+        for sql, params in self._price_history_queries(tickers, start_date, end_date):
+            with self._lock:
+                records.extend(tuple(row) for row in self._conn.execute(sql, params).fetchall())
+        if not records:
+            return pd.DataFrame()
+        frame = pd.DataFrame.from_records(records, columns=['ticker', 'date', 'close'])
+        frame['date'] = pd.to_datetime(frame['date'])
+        prices = frame.pivot(index='date', columns='ticker', values='close').sort_index()
+        return prices[[ticker for ticker in dict.fromkeys(tickers) if ticker in prices.columns]]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_repository = None
+_lock = threading.Lock()
+
+def get_repository() -> PortfolioRepository:
+    """Returns the process-wide repository for DATA_BACKEND, creating it on first use."""
+    global _repository
+    if _repository is None:
+        with _lock:
+            if _repository is None:
+                if DATA_BACKEND == 'sqlite':
+                    _repository = SQLiteRepository(SQLITE_DB_PATH)
+                elif DATA_BACKEND == 'supabase':
+                    _repository = SupabaseRepository()
+                else:
+                    raise ValueError(f"Unknown DATA_BACKEND '{DATA_BACKEND}'. Use 'supabase' or 'sqlite'.")
+    return _repository
+
+def set_repository(repository: PortfolioRepository):
+    """Replaces the repository every module uses (e.g. a SQLiteRepository for an offline benchmark)."""
+    global _repository
+    with _lock:
+        _repository = repository
+
+class _LazyRepository:
+    """Stand-in for the shared repository that modules import; attribute access resolves get_repository()."""
+
+    def __getattr__(self, name):
+        return getattr(get_repository(), name)
+
+repository = _LazyRepository()
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import pickle
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.api.instrumentation import record_cache
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Private to the user running the app: the disk tier holds pickles, and unpickling runs code
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "portfolio_balancer", "result_cache"))
+
+def _is_private(st: os.stat_result) -> bool:
+    """Whether a file or directory is owned by the current user and inaccessible to anyone else."""
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+def is_private_dir(path: str) -> bool:
+    """Whether path is a directory (not a symlink) that only the current user can read or write."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and _is_private(st)
+
+def ensure_private_dir(path: str) -> bool:
+    """
+    Creates path with mode 0700 if it does not exist.
+
+    Returns:
+        bool: Whether path is a private directory of the current user. An existing directory that other
+              users can access (or that someone else owns) is left alone and reported as not private.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    except OSError:
+        return False
+    return is_private_dir(path)
+
+def _canonical(value):
+    """Converts a value into a JSON-serializable form that is identical for equal inputs."""
+    if isinstance(value, dict):
+        return {str(key): _canonical(value[key]) for key in sorted(value, key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(item) for item in value), key=repr)
+    if isinstance(value, pd.DataFrame):
+        return {"dataframe": price_panel_version(value)}
+    if isinstance(value, pd.Series):
+        return {"series": price_panel_version(value.to_frame())}
+    if isinstance(value, np.ndarray):
+        return {"array": hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest(), "shape": list(value.shape), "dtype": str(value.dtype)}
+    if isinstance(value, np.generic):
+        return _canonical(value.item())
+    if isinstance(value, float):
+        return repr(value) # Keeps full precision and distinguishes 1.0 from 1
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def fingerprint(*parts) -> str:
+    """
+    Content hash of the given values, used as a cache key.
+
+    Dicts are hashed independently of key order, floats at full precision, and DataFrames by content.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    payload = json.dumps(_canonical(list(parts)), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def price_panel_version(price_history: pd.DataFrame) -> str:
+    """
+    Content hash of a price panel (index, columns and values).
+
+    Returns:
+        str: Hex SHA-256 digest that changes whenever any price, date or ticker changes.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in price_history.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(price_history, index=True).values.tobytes())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Two-tier cache for computed results, keyed by fingerprint().
+
+    The memory tier keeps pickled results in LRU order up to max_bytes, so every get returns a fresh copy
+    that callers can mutate freely. The optional disk tier keeps one pickle file per key under cache_dir,
+    shared by all processes using the same directory, and refills the memory tier on a hit. Disk hits
+    refresh the file's modification time, and the least recently used files beyond max_disk_entries are pruned.
+
+    Only files the current user owns, in directories (cache_dir and its subdirectory) no one else can
+    access, are unpickled. The directories are created with mode 0700; if an existing one is shared,
+    the disk tier is skipped.
+    """
+
+    def __init__(self, name: str, max_bytes: int = 64 * 1024 * 1024, cache_dir: str = RESULT_CACHE_DIR,
+                 use_disk: bool = True, max_disk_entries: int = 10000):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self._disk_writes = 0
+        self.root_dir = cache_dir if use_disk and cache_dir else None
+        self.cache_dir = os.path.join(cache_dir, name) if self.root_dir else None
+        self._warned_shared = False
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _disk_is_private(self, create: bool = False) -> bool:
+        """Whether the disk tier's directories are private to the current user, creating them if asked."""
+        check = ensure_private_dir if create else is_private_dir
+        if check(self.root_dir) and check(self.cache_dir):
+            return True
+        if os.path.exists(self.cache_dir) and not self._warned_shared:
+            self._warned_shared = True
+            logger.warning("Skipping the %s disk cache: %s is not private to this user.", self.name, self.cache_dir)
+        return False
+
+    def _read_disk(self, key: str) -> bytes:
+        """Reads a disk entry, refusing files that are symlinks or that another user owns or could have written."""
+        fd = os.open(self._disk_path(key), os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        with os.fdopen(fd, 'rb') as f:
+            if not _is_private(os.fstat(f.fileno())):
+                raise PermissionError("cache file is not private to this user")
+            return f.read()
+
+    def _remember(self, key: str, payload: bytes):
+        """Adds a payload to the memory tier, evicting least recently used entries to stay under max_bytes."""
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, key: str):
+        """Returns a copy of the cached result for key, or None on a miss."""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache(self.name, 'hit')
+                return pickle.loads(payload)
+
+        if self.cache_dir and self._disk_is_private():
+            try:
+                payload = self._read_disk(key)
+                result = pickle.loads(payload)
+                os.utime(self._disk_path(key))
+            except FileNotFoundError:
+                result = None
+            except Exception as e:
+                logger.warning("Could not read %s cache entry %s: %s", self.name, key, e)
+                result = None
+            if result is not None:
+                self._remember(key, payload)
+                with self._lock:
+                    self.disk_hits += 1
+                record_cache(self.name, 'disk_hit')
+                return result
+
+        with self._lock:
+            self.misses += 1
+        record_cache(self.name, 'miss')
+        return None
+
+    def set(self, key: str, result):
+        """Stores a result in the memory tier and, if enabled, on disk."""
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, payload)
+        if self.cache_dir and self._disk_is_private(create=True):
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                logger.warning("Could not write %s cache entry %s: %s", self.name, key, e)
+                return
+
+            # Listing the directory is not free, so the disk tier is only pruned every so often
+            self._disk_writes += 1
+            if self._disk_writes % 100 == 0:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        """Removes the least recently used files beyond max_disk_entries."""
+        entries = []
+        try:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.pkl'):
+                    entries.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return # Another process pruned the same directory concurrently
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_or_compute(self, key: str, compute):
+        """Returns the cached result for key, computing and storing it with compute() on a miss."""
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.set(key, result)
+        return result
+
+    def clear(self, disk: bool = False):
+        """Empties the memory tier, and the disk tier too if disk is True."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, file_name))
+                    except OSError:
+                        pass
+
+    def stats(self) -> dict:
+        """Hit/miss counters and memory usage."""
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses
+            }
@@ -1,3 +1,7 @@
+import copy
+import functools
+import os
+import time
 import pandas as pd
 import numpy as np
 from datetime import timedelta
@@ -5,7 +9,26 @@ from portfolio_balancer.src.evaluation.metrics import calculate_daily_returns, c
 from portfolio_balancer.src.optimization.rebalancer import deterministic_rebalance
 from portfolio_balancer.src.optimization.cvxpy_rebalancer import cvxpy_rebalance
 from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
+from portfolio_balancer.src.data.result_cache import ResultCache, fingerprint, price_panel_version
+from portfolio_balancer.src.api.instrumentation import record_stage
+from portfolio_balancer.src.api.tracing import traced, start_span, end_span
+from portfolio_balancer.src.api.structured_logging import get_logger
 
+logger = get_logger(__name__)
+
+# Bump when a change to the simulation makes previously cached results stale
+BACKTEST_CACHE_VERSION = 4
+backtest_cache = ResultCache("backtests", max_bytes=int(os.environ.get("BACKTEST_CACHE_BYTES", 128 * 1024 * 1024)))
+
+# The baseline leg is simulated at this notional, with fees and the minimum trade size expressed as
+# fractions of the user's portfolio value, and then scaled to the user's value.
+BASELINE_REFERENCE_VALUE = 1.0
+
+def _holding_value(holding: dict) -> float:
+    """Value of a portfolio entry: 'value' for cash, otherwise amount * price."""
+    return holding['value'] if 'value' in holding else holding.get('amount', 0) * holding.get('price', 0)
+
+@traced()
 def run_backtest(
     price_history: pd.DataFrame,
     initial_portfolio: dict, # {'ticker': {'amount': float, 'price': float}}
@@ -16,7 +39,10 @@ def run_backtest(
     mvo_params: dict = None, # Parameters for MVO if rebalance_engine is 'mvo'
     fees_per_trade: float = 0.0,
     min_trade_threshold: float = 0.01,
-    risk_free_rate: float = 0.01
+    risk_free_rate: float = 0.01,
+    progress_callback=None,
+    use_cache: bool = True,
+    round_to_nearest_share: bool = True
 ) -> dict:
     """
     Runs a rolling window backtest for a given rebalancing strategy.
@@ -29,34 +55,62 @@ def run_backtest(
         rebalance_frequency (str): How often to rebalance ('quarterly', 'monthly', 'drift').
         drift_threshold (float): Percentage drift from target to trigger rebalance (for 'drift' frequency).
         rebalance_engine (str): Which rebalancing engine to use ('deterministic', 'cvxpy', 'mvo').
-        mvo_params (dict): Dictionary of parameters for MVO (e.g., 'target_return', 'max_equities_weight').
+        mvo_params (dict): Dictionary of parameters for MVO (e.g., 'target_return', 'max_equities_weight',
+                           and the solver budget 'time_limit' / 'max_iters').
         fees_per_trade (float): Fixed fee per trade.
         min_trade_threshold (float): Minimum dollar amount for a trade.
         risk_free_rate (float): Annualized risk-free rate for Sharpe Ratio calculation.
+        progress_callback (callable): Optional function called after each simulated date as
+                                      progress_callback(dates_processed, total_dates, rebalances).
+                                      An exception raised by it aborts the backtest.
+        use_cache (bool): Reuse (and store) the result cached under a fingerprint of the price panel
+                          and every other argument.
+        round_to_nearest_share (bool): Trade whole shares (realistic). With fractional shares and fees and
+                                       min_trade_threshold scaled alike, results scale linearly with the
+                                       portfolio value.
 
     Returns:
         dict: A dictionary containing backtest results, including:
             - 'portfolio_value_history': List of (date, value) tuples.
             - 'metrics': Dictionary of performance metrics (CAGR, Sharpe, Max Drawdown, Turnover).
             - 'trades_history': List of trades executed at each rebalance.
+            - 'rebalance_count': Number of rebalances performed.
     """
-    
+    # Ensure price history is sorted by date
+    price_history = price_history.sort_index()
+
+    cache_key = None
+    if use_cache:
+        cache_key = fingerprint(
+            'run_backtest', BACKTEST_CACHE_VERSION, price_panel_version(price_history), initial_portfolio, target_weights,
+            rebalance_frequency, drift_threshold, rebalance_engine, mvo_params, fees_per_trade, min_trade_threshold, risk_free_rate,
+            round_to_nearest_share
+        )
+        cached_result = backtest_cache.get(cache_key)
+        if cached_result is not None:
+            if progress_callback:
+                total_dates = len(cached_result['portfolio_value_history']) - 1
+                progress_callback(total_dates, total_dates, cached_result.get('rebalance_count'))
+            return cached_result
+
+    simulation_started_at = time.perf_counter()
     portfolio_value_history = []
     trades_history = []
     
-    current_portfolio = initial_portfolio.copy()
-    
-    # Ensure price history is sorted by date
-    price_history = price_history.sort_index()
+    # Deep copy so simulating does not change the caller's holdings
+    current_portfolio = copy.deepcopy(initial_portfolio)
+    if 'CASH' not in current_portfolio:
+        current_portfolio['CASH'] = {'value': 0.0} # Trades settle through cash
 
     # Get unique dates for iteration
     dates = price_history.index.unique().tolist()
     
     # Initialize current portfolio value
-    current_total_value = sum(item['amount'] * item['price'] for item in current_portfolio.values())
+    current_total_value = sum(_holding_value(item) for item in current_portfolio.values())
     portfolio_value_history.append((dates[0], current_total_value))
 
     last_rebalance_date = dates[0]
+    rebalance_count = 0
 
     for i in range(1, len(dates)):
         current_date = dates[i]
@@ -72,7 +126,7 @@ def run_backtest(
                     holding['value'] = holding['amount'] # Assuming amount for cash is its value
             else:
                 # Handle missing price data for an asset
-                print(f"Warning: Price for {ticker} not available on {current_date}. Using last known price.")
+                logger.warning("Price for %s not available on %s. Using last known price.", ticker, current_date)
                 # For simplicity, use last known price or skip.
                 # A more robust solution might drop the asset or use a proxy.
                 pass # Already using last known price if not updated
@@ -113,11 +167,15 @@ def run_backtest(
                     break
 
         if perform_rebalance:
-            print(f"Rebalancing on {current_date} using {rebalance_engine} engine...")
+            logger.debug("Rebalancing on %s using %s engine...", current_date, rebalance_engine)
+            rebalance_count += 1
+            rebalance_span = start_span('backtest.rebalance', date=str(current_date)[:10], engine=rebalance_engine)
             
             # Prepare current portfolio for rebalancer
             rebalancer_current_portfolio = {}
-            asset_prices = {}
+            # Prices of every ticker in the panel, so targets not yet held can be bought
+            asset_prices = {ticker: price for ticker, price in price_history.loc[current_date].items()
+                            if ticker != 'CASH' and pd.notna(price)}
             for ticker, holding in current_portfolio.items():
                 if ticker == 'CASH':
                     rebalancer_current_portfolio[ticker] = {'value': holding.get('value', 0)}
@@ -133,7 +191,7 @@ def run_backtest(
                     total_value=current_total_value,
                     min_trade_threshold=min_trade_threshold,
                     fees_per_trade=fees_per_trade,
-                    round_to_nearest_share=True, # Always round to nearest share in backtest for realism
+                    round_to_nearest_share=round_to_nearest_share,
                     asset_prices=asset_prices
                 )
             elif rebalance_engine == 'cvxpy':
@@ -143,7 +201,8 @@ def run_backtest(
                     total_value=current_total_value,
                     asset_prices=asset_prices,
                     min_trade_threshold=min_trade_threshold,
-                    fees_per_trade=fees_per_trade
+                    fees_per_trade=fees_per_trade,
+                    round_to_nearest_share=round_to_nearest_share
                 )
             elif rebalance_engine == 'mvo':
                 # For MVO, we need to calculate optimal weights based on historical data up to current_date
@@ -152,7 +211,7 @@ def run_backtest(
                 mvo_price_history = price_history.loc[lookback_window_start:current_date].dropna(axis=1)
                 
                 if mvo_price_history.empty or mvo_price_history.shape[1] < 2:
-                    print(f"Not enough data for MVO on {current_date}. Skipping MVO rebalance.")
+                    logger.warning("Not enough data for MVO on %s. Skipping MVO rebalance.", current_date)
                     rebalance_result = {"trades": [], "post_trade_weights_est": {}}
                 else:
                     # Ensure mvo_params are passed correctly
@@ -163,10 +222,13 @@ def run_backtest(
                         max_equities_weight=mvo_params.get('max_equities_weight'),
                         max_bonds_weight=mvo_params.get('max_bonds_weight'),
                         max_cash_weight=mvo_params.get('max_cash_weight'),
-                        asset_class_mapping=mvo_params.get('asset_class_mapping')
+                        asset_class_mapping=mvo_params.get('asset_class_mapping'),
+                        time_limit=mvo_params.get('time_limit'),
+                        max_iters=mvo_params.get('max_iters')
                     )
                     
-                    if mvo_result['status'] in ["optimal", "optimal_near"]:
+                    # Weights are returned whenever the solver or its fallback produced an answer
+                    if mvo_result['optimal_weights']:
                         optimal_weights = mvo_result['optimal_weights']
                         # Convert optimal weights to target_weights format for rebalancer
                         mvo_target_weights = {k: v for k, v in optimal_weights.items() if v > 1e-6} # Filter tiny weights
@@ -177,11 +239,11 @@ def run_backtest(
                             total_value=current_total_value,
                             min_trade_threshold=min_trade_threshold,
                             fees_per_trade=fees_per_trade,
-                            round_to_nearest_share=True,
+                            round_to_nearest_share=round_to_nearest_share,
                             asset_prices=asset_prices
                         )
                     else:
-                        print(f"MVO failed on {current_date}. Status: {mvo_result['status']}. Skipping MVO rebalance.")
+                        logger.warning("MVO failed on %s. Status: %s. Skipping MVO rebalance.", current_date, mvo_result['status'])
                         rebalance_result = {"trades": [], "post_trade_weights_est": {}}
             
             if rebalance_result:
@@ -194,22 +256,23 @@ def run_backtest(
                     action = trade['action']
                     
                     if ticker == 'CASH':
-                        if action == 'BUY':
-                            current_portfolio['CASH']['value'] += amount
-                        elif action == 'SELL':
-                            current_portfolio['CASH']['value'] -= amount
+                        # A CASH trade only records that cash is being put to work; the asset trades move
+                        # the money, so like the rebalancers' estimate it only costs its fee.
+                        current_portfolio['CASH']['value'] -= fees_per_trade
                     else:
+                        holding = current_portfolio.setdefault(ticker, {'amount': 0, 'price': asset_prices.get(ticker, 0)})
                         if action == 'BUY':
                             # Assuming amount is in dollars, convert to shares
                             shares_to_trade = amount / asset_prices[ticker] if asset_prices.get(ticker) else 0
-                            current_portfolio[ticker]['amount'] = current_portfolio.get(ticker, {}).get('amount', 0) + shares_to_trade
+                            holding['amount'] = holding.get('amount', 0) + shares_to_trade
                             current_portfolio['CASH']['value'] -= amount + fees_per_trade
                         elif action == 'SELL':
                             shares_to_trade = amount / asset_prices[ticker] if asset_prices.get(ticker) else 0
-                            current_portfolio[ticker]['amount'] = current_portfolio.get(ticker, {}).get('amount', 0) - shares_to_trade
+                            holding['amount'] = holding.get('amount', 0) - shares_to_trade
                             current_portfolio['CASH']['value'] += amount - fees_per_trade
                 
                 last_rebalance_date = current_date
+            end_span(rebalance_span, trades=len(rebalance_result['trades']) if rebalance_result else 0)
         
         # Record portfolio value at end of day
         current_total_value = 0
@@ -221,7 +284,13 @@ def run_backtest(
         
         portfolio_value_history.append((current_date, current_total_value))
 
+        if progress_callback:
+            progress_callback(i, len(dates) - 1, rebalance_count)
+
+    record_stage('backtest', f"simulate.{rebalance_engine}", time.perf_counter() - simulation_started_at)
+
     # Calculate performance metrics
+    metrics_started_at = time.perf_counter()
     portfolio_df = pd.DataFrame(portfolio_value_history, columns=['Date', 'Value']).set_index('Date')
     portfolio_returns = portfolio_df['Value'].pct_change().dropna()
 
@@ -248,13 +317,27 @@ def run_backtest(
         "Max_Drawdown": max_drawdown,
         "Turnover": turnover
     }
+    record_stage('backtest', 'metrics', time.perf_counter() - metrics_started_at)
 
-    return {
+    result = {
         "portfolio_value_history": portfolio_value_history,
         "metrics": metrics,
-        "trades_history": trades_history
+        "trades_history": trades_history,
+        "rebalance_count": rebalance_count
     }
+    if cache_key:
+        backtest_cache.set(cache_key, result)
+    return result
 
+def _scale_backtest_result(result: dict, factor: float) -> dict:
+    """Scales a backtest's values and trade amounts by factor. The metrics are scale-free and stay as they are."""
+    return {
+        **result,
+        "portfolio_value_history": [(date, value * factor) for date, value in result['portfolio_value_history']],
+        "trades_history": [{**trade, "amount": trade['amount'] * factor} for trade in result['trades_history']]
+    }
+
+@traced()
 def compare_strategies(
     price_history: pd.DataFrame,
     initial_portfolio: dict,
@@ -265,7 +348,9 @@ def compare_strategies(
     fees_per_trade: float = 0.0,
     min_trade_threshold: float = 0.01,
     risk_free_rate: float = 0.01,
-    mvo_params: dict = None
+    mvo_params: dict = None,
+    progress_callback=None,
+    use_cache: bool = True
 ) -> dict:
     """
     Compares different rebalancing strategies against a baseline.
@@ -273,14 +358,36 @@ def compare_strategies(
     Args:
         Same as run_backtest, plus:
         baseline_weights (dict): Target weights for the baseline portfolio (e.g., 60/40).
+        progress_callback (callable): Optional function called as
+                                      progress_callback(strategy, dates_processed, total_dates, rebalances)
+                                      while each strategy runs.
 
     Returns:
         dict: A dictionary with results for each strategy and the baseline.
     """
+    def strategy_progress(strategy):
+        if progress_callback is None:
+            return None
+        return functools.partial(progress_callback, strategy)
+
+    cache_key = None
+    if use_cache:
+        cache_key = fingerprint(
+            'compare_strategies', BACKTEST_CACHE_VERSION, price_panel_version(price_history), initial_portfolio, target_weights,
+            baseline_weights, rebalance_frequency, drift_threshold, fees_per_trade, min_trade_threshold, risk_free_rate, mvo_params
+        )
+        cached_results = backtest_cache.get(cache_key)
+        if cached_results is not None:
+            if progress_callback:
+                for strategy, result in cached_results.items():
+                    total_dates = len(result['portfolio_value_history']) - 1
+                    progress_callback(strategy, total_dates, total_dates, result.get('rebalance_count'))
+            return cached_results
+
     results = {}
 
     # Run for deterministic engine
-    print("Running backtest for Deterministic Rebalancing...")
+    logger.debug("Running backtest for Deterministic Rebalancing...")
     results['deterministic'] = run_backtest(
         price_history=price_history,
         initial_portfolio=initial_portfolio,
@@ -290,11 +397,13 @@ def compare_strategies(
         rebalance_engine='deterministic',
         fees_per_trade=fees_per_trade,
         min_trade_threshold=min_trade_threshold,
-        risk_free_rate=risk_free_rate
+        risk_free_rate=risk_free_rate,
+        progress_callback=strategy_progress('deterministic'),
+        use_cache=use_cache
     )
 
     # Run for cvxpy engine
-    print("Running backtest for Cvxpy Rebalancing...")
+    logger.debug("Running backtest for Cvxpy Rebalancing...")
     results['cvxpy'] = run_backtest(
         price_history=price_history,
         initial_portfolio=initial_portfolio,
@@ -304,11 +413,13 @@ def compare_strategies(
         rebalance_engine='cvxpy',
         fees_per_trade=fees_per_trade,
         min_trade_threshold=min_trade_threshold,
-        risk_free_rate=risk_free_rate
+        risk_free_rate=risk_free_rate,
+        progress_callback=strategy_progress('cvxpy'),
+        use_cache=use_cache
     )
 
     # Run for MVO engine
-    print("Running backtest for MVO Rebalancing...")
+    logger.debug("Running backtest for MVO Rebalancing...")
     results['mvo'] = run_backtest(
         price_history=price_history,
         initial_portfolio=initial_portfolio,
@@ -319,36 +430,49 @@ def compare_strategies(
         mvo_params=mvo_params,
         fees_per_trade=fees_per_trade,
         min_trade_threshold=min_trade_threshold,
-        risk_free_rate=risk_free_rate
+        risk_free_rate=risk_free_rate,
+        progress_callback=strategy_progress('mvo'),
+        use_cache=use_cache
     )
 
     # Run for baseline (static allocation, rebalanced quarterly)
-    print("Running backtest for Baseline (Static Allocation)...")
-    # Adjust initial portfolio for baseline to match its assets
+    logger.debug("Running backtest for Baseline (Static Allocation)...")
+    # The baseline does not depend on the user's holdings, only on their value. It is simulated on the baseline
+    # tickers' prices at a reference notional, in fractional shares and with the fixed fees and minimum trade
+    # size taken relative to the user's value, so it scales exactly to that value. Users whose fees and minimum
+    # trade size are the same fraction of their value (e.g. no fees) share one cached run.
+    baseline_price_history = price_history[[ticker for ticker in baseline_weights if ticker in price_history.columns]]
+    user_total_value = sum(_holding_value(item) for item in initial_portfolio.values())
+    value_scale = user_total_value / BASELINE_REFERENCE_VALUE
     baseline_initial_portfolio = {}
     for ticker, weight in baseline_weights.items():
         # Need to get initial price for baseline assets
         initial_price = price_history.loc[price_history.index[0], ticker] if ticker in price_history.columns else 1 # Default to 1 for cash or missing
-        # Distribute initial total value based on baseline weights
-        initial_value_for_asset = (sum(item['amount'] * item['price'] for item in initial_portfolio.values()) * weight)
+        # Distribute the reference value based on baseline weights
+        initial_value_for_asset = BASELINE_REFERENCE_VALUE * weight
         baseline_initial_portfolio[ticker] = {'amount': initial_value_for_asset / initial_price, 'price': initial_price}
     
     # Add cash to baseline initial portfolio if not present
     if 'CASH' not in baseline_initial_portfolio and 'CASH' in baseline_weights:
-        initial_cash_value = (sum(item['amount'] * item['price'] for item in initial_portfolio.values()) * baseline_weights['CASH'])
-        baseline_initial_portfolio['CASH'] = {'value': initial_cash_value}
+        baseline_initial_portfolio['CASH'] = {'value': BASELINE_REFERENCE_VALUE * baseline_weights['CASH']}
 
-    results['baseline'] = run_backtest(
-        price_history=price_history,
+    baseline_result = run_backtest(
+        price_history=baseline_price_history,
         initial_portfolio=baseline_initial_portfolio,
         target_weights=baseline_weights, # Baseline uses its own fixed target weights
         rebalance_frequency='quarterly', # Baseline is typically rebalanced periodically
         rebalance_engine='deterministic', # Use deterministic rebalancer for baseline
-        fees_per_trade=fees_per_trade,
-        min_trade_threshold=min_trade_threshold,
-        risk_free_rate=risk_free_rate
+        fees_per_trade=fees_per_trade / value_scale if value_scale > 0 else 0.0,
+        min_trade_threshold=min_trade_threshold / value_scale if value_scale > 0 else 0.0,
+        risk_free_rate=risk_free_rate,
+        progress_callback=strategy_progress('baseline'),
+        use_cache=use_cache,
+        round_to_nearest_share=False
     )
+    results['baseline'] = _scale_backtest_result(baseline_result, value_scale)
 
+    if cache_key:
+        backtest_cache.set(cache_key, results)
     return results
 
 def generate_backtest_report(backtest_results: dict) -> dict:
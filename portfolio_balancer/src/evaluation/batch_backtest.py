@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.optimization.batch_rebalancer import batch_deterministic_rebalance
+
+def _rebalance_due(rebalance_frequency: str, month: int, last_rebalance_months: np.ndarray) -> np.ndarray:
+    """Calendar rebalance rule of run_backtest, evaluated for every portfolio at once."""
+    if rebalance_frequency == 'quarterly':
+        return ((month - last_rebalance_months) % 3 == 0) & (month != last_rebalance_months)
+    if rebalance_frequency == 'monthly':
+        return month != last_rebalance_months
+    return np.zeros(last_rebalance_months.shape, dtype=bool)
+
+def _drifted(values: np.ndarray, cash: np.ndarray, target_weights: np.ndarray, cash_weights: np.ndarray, drift_threshold: float) -> np.ndarray:
+    """Drift rule of run_backtest (relative drift for targeted assets, absolute weight for untargeted ones), cash included."""
+    totals = values.sum(axis=1) + cash
+    safe_totals = np.where(totals > 0, totals, 1.0)
+    weights = np.where(totals[:, None] > 0, np.column_stack([values, cash]) / safe_totals[:, None], 0.0)
+    targets = np.column_stack([target_weights, cash_weights])
+    safe_targets = np.where(targets > 0, targets, 1.0)
+    drifted = np.where(targets > 0, np.abs(weights - targets) / safe_targets > drift_threshold, weights > drift_threshold)
+    return drifted.any(axis=1)
+
+def batch_backtest(
+    price_history: pd.DataFrame,
+    holdings: np.ndarray,
+    target_weights: np.ndarray,
+    cash: np.ndarray = None,
+    cash_weights: np.ndarray = None,
+    rebalance_frequency: str = 'quarterly',
+    drift_threshold: float = 0.05,
+    fees_per_trade: float = 0.0,
+    min_trade_threshold: float = 0.01,
+    risk_free_rate: float = 0.01,
+    round_to_nearest_share: bool = True
+) -> dict:
+    """
+    Backtests many portfolios against one price history in a single pass.
+
+    Follows run_backtest with the deterministic engine, but keeps all portfolios in a
+    (portfolios x assets) shares matrix: each date values every portfolio with one matrix product,
+    and the portfolios due for a rebalance (calendar rule or drift) are selected with a mask and
+    rebalanced together with batch_deterministic_rebalance.
+
+    Args:
+        price_history (pd.DataFrame): Historical closing prices. Index is datetime, columns are the assets.
+                                      Missing prices are carried forward.
+        holdings (np.ndarray): (portfolios x assets) initial share amounts, columns in price_history order.
+        target_weights (np.ndarray): (portfolios x assets) target weights, or one (assets,) row shared by all.
+        cash (np.ndarray): (portfolios,) initial cash. Defaults to zero.
+        cash_weights (np.ndarray): (portfolios,) target cash weights. Defaults to zero.
+        rebalance_frequency (str): 'quarterly', 'monthly' or 'drift'.
+        drift_threshold (float): Relative drift from target that triggers a rebalance (for 'drift').
+        fees_per_trade (float): Fixed fee per trade.
+        min_trade_threshold (float): Minimum dollar amount for a trade.
+        risk_free_rate (float): Annualized risk-free rate for the Sharpe Ratio.
+        round_to_nearest_share (bool): Trade whole shares, as run_backtest does.
+
+    Returns:
+        dict: A dictionary containing:
+            - "dates": List of simulated dates.
+            - "portfolio_values": (portfolios x dates) end-of-day portfolio values.
+            - "metrics": Dictionary of (portfolios,) arrays: CAGR, Sharpe_Ratio, Max_Drawdown, Turnover.
+            - "rebalance_counts": (portfolios,) number of rebalances per portfolio.
+            - "final_holdings": (portfolios x assets) shares held at the end.
+            - "final_cash": (portfolios,) cash held at the end.
+    """
+    price_history = price_history.sort_index().ffill()
+    dates = price_history.index.unique().tolist()
+    prices = price_history.loc[dates].to_numpy(dtype=float)
+    num_dates, num_assets = prices.shape
+
+    shares = np.atleast_2d(np.array(holdings, dtype=float))
+    num_portfolios = shares.shape[0]
+    if shares.shape[1] != num_assets:
+        raise ValueError("holdings must have one column per price_history column.")
+    target_weights = np.broadcast_to(np.asarray(target_weights, dtype=float), shares.shape)
+    cash = np.zeros(num_portfolios) if cash is None else np.broadcast_to(np.asarray(cash, dtype=float), (num_portfolios,)).copy()
+    cash_weights = np.zeros(num_portfolios) if cash_weights is None else np.broadcast_to(np.asarray(cash_weights, dtype=float), (num_portfolios,))
+
+    portfolio_values = np.empty((num_portfolios, num_dates))
+    valued_prices = np.nan_to_num(prices, nan=0.0)
+    portfolio_values[:, 0] = shares @ valued_prices[0] + cash
+
+    last_rebalance_months = np.full(num_portfolios, dates[0].month)
+    rebalance_counts = np.zeros(num_portfolios, dtype=int)
+    traded_amounts = np.zeros(num_portfolios)
+
+    for i in range(1, num_dates):
+        current_date = dates[i]
+        day_prices = valued_prices[i]
+
+        if rebalance_frequency == 'drift':
+            due = _drifted(shares * day_prices, cash, target_weights, cash_weights, drift_threshold)
+        else:
+            due = _rebalance_due(rebalance_frequency, current_date.month, last_rebalance_months)
+
+        if due.any():
+            rows = np.flatnonzero(due)
+            result = batch_deterministic_rebalance(
+                shares[rows], target_weights[rows], prices[i],
+                cash=cash[rows], cash_weights=cash_weights[rows],
+                min_trade_threshold=min_trade_threshold, fees_per_trade=fees_per_trade,
+                round_to_nearest_share=round_to_nearest_share
+            )
+            safe_prices = np.where(day_prices > 0, day_prices, np.inf)
+            shares[rows] += (result['buy_amounts'] - result['sell_amounts']) / safe_prices
+            cash[rows] = result['post_trade_cash']
+            traded_amounts[rows] += result['buy_amounts'].sum(axis=1) + result['sell_amounts'].sum(axis=1) + result['cash_sell_amounts']
+            rebalance_counts[rows] += 1
+            last_rebalance_months[rows] = current_date.month
+
+        # Record portfolio values at end of day
+        portfolio_values[:, i] = shares @ day_prices + cash
+
+    # Performance metrics, computed as in run_backtest for every portfolio at once
+    num_returns = num_dates - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_returns = portfolio_values[:, 1:] / portfolio_values[:, :-1] - 1
+        growth = portfolio_values[:, -1] / portfolio_values[:, 0]
+        cagr = growth**(252 / num_returns) - 1 if num_returns > 0 else np.zeros(num_portfolios)
+        volatility = daily_returns.std(axis=1, ddof=1) * np.sqrt(252) if num_returns > 1 else np.zeros(num_portfolios)
+        sharpe = np.where(volatility > 0, (cagr - risk_free_rate) / volatility, 0.0)
+        running_max = np.maximum.accumulate(portfolio_values, axis=1)
+        max_drawdown = (portfolio_values / running_max - 1.0).min(axis=1)
+        average_values = portfolio_values.mean(axis=1)
+        turnover = np.where(average_values > 0, traded_amounts / average_values, 0.0)
+
+    return {
+        "dates": dates,
+        "portfolio_values": portfolio_values,
+        "metrics": {
+            "CAGR": cagr,
+            "Sharpe_Ratio": sharpe,
+            "Max_Drawdown": max_drawdown,
+            "Turnover": turnover
+        },
+        "rebalance_counts": rebalance_counts,
+        "final_holdings": shares,
+        "final_cash": cash
+    }
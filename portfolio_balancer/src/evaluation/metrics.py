@@ -108,4 +108,141 @@ def calculate_risk_metrics(price_history: pd.DataFrame, weights: np.ndarray, ris
         "risk_score": risk_score,
         "volatility": portfolio_volatility_val,
         "sharpe_ratio": sharpe_ratio_val
-    }
\ No newline at end of file
+    }
+
+
+# Batched variants: each takes a (k x n) matrix with one candidate weighting per row, so a frontier sweep
+# or a batch of what-ifs against the same covariance is evaluated with a handful of matrix products.
+
+def cholesky_factor(cov_matrix: np.ndarray) -> np.ndarray:
+    """
+    Lower-triangular L with L @ L.T equal to the covariance matrix.
+
+    Sample covariances of collinear assets are only positive semi-definite; for those the smallest
+    diagonal jitter that makes the factorization succeed is added.
+    """
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
+    jitter = 0.0
+    scale = np.mean(np.diag(cov_matrix)) if cov_matrix.size else 1.0
+    for _ in range(10):
+        try:
+            return np.linalg.cholesky(cov_matrix + jitter * np.eye(len(cov_matrix)))
+        except np.linalg.LinAlgError:
+            jitter = max(jitter * 10, scale * 1e-10)
+    # Fall back to the symmetric square root of the matrix with negative eigenvalues clipped
+    eigenvalues, eigenvectors = np.linalg.eigh(cov_matrix)
+    return eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))
+
+def calculate_portfolio_volatilities(weights: np.ndarray, cov_matrix: pd.DataFrame = None, cov_factor: np.ndarray = None) -> np.ndarray:
+    """
+    Calculates the volatility of many portfolios at once.
+
+    Args:
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row (a single (n,) vector is allowed).
+        cov_matrix (pd.DataFrame): Covariance matrix of asset returns.
+        cov_factor (np.ndarray): Pre-factored covariance L with L @ L.T = cov_matrix (see cholesky_factor),
+                                 used instead of cov_matrix when given.
+
+    Returns:
+        np.ndarray: (k,) portfolio volatilities.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if cov_factor is not None:
+        return np.linalg.norm(weights @ np.asarray(cov_factor, dtype=float), axis=1)
+    if cov_matrix is None:
+        raise ValueError("Either cov_matrix or cov_factor is required.")
+    portfolio_variances = np.einsum('ij,ij->i', weights @ np.asarray(cov_matrix, dtype=float), weights)
+    return np.sqrt(np.maximum(portfolio_variances, 0.0))
+
+def calculate_portfolio_returns(weights: np.ndarray, mean_returns: pd.Series) -> np.ndarray:
+    """
+    Calculates the expected return of many portfolios at once.
+
+    Args:
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        mean_returns (pd.Series): Mean return of each asset (any period).
+
+    Returns:
+        np.ndarray: (k,) portfolio mean returns over the same period.
+    """
+    return np.atleast_2d(np.asarray(weights, dtype=float)) @ np.asarray(mean_returns, dtype=float)
+
+def calculate_sharpe_ratios(weights: np.ndarray, daily_returns: pd.DataFrame, portfolio_volatilities: np.ndarray, risk_free_rate: float = 0.01) -> np.ndarray:
+    """
+    Calculates the Sharpe Ratio of many portfolios at once, as calculate_sharpe_ratio does for one.
+
+    Args:
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        daily_returns (pd.DataFrame): DataFrame with daily asset returns.
+        portfolio_volatilities (np.ndarray): (k,) portfolio volatilities.
+        risk_free_rate (float): Risk-free rate (annualized).
+
+    Returns:
+        np.ndarray: (k,) Sharpe Ratios (0 where the volatility is 0).
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    portfolio_daily_returns = np.asarray(daily_returns, dtype=float) @ weights.T # (days x k)
+    annualized_mean_returns = np.prod(1 + portfolio_daily_returns, axis=0)**(252/len(portfolio_daily_returns)) - 1
+    portfolio_volatilities = np.asarray(portfolio_volatilities, dtype=float)
+    safe_volatilities = np.where(portfolio_volatilities == 0, 1.0, portfolio_volatilities)
+    return np.where(portfolio_volatilities == 0, 0.0, (annualized_mean_returns - risk_free_rate) / safe_volatilities)
+
+def calculate_risk_contributions(weights: np.ndarray, cov_matrix: pd.DataFrame = None, cov_factor: np.ndarray = None) -> np.ndarray:
+    """
+    Calculates each asset's contribution to portfolio volatility for many portfolios at once.
+
+    Contributions are w_i * (cov_matrix @ w)_i / volatility, so each row sums to the portfolio's volatility.
+
+    Args:
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        cov_matrix (pd.DataFrame): Covariance matrix of asset returns.
+        cov_factor (np.ndarray): Pre-factored covariance L with L @ L.T = cov_matrix, used instead of cov_matrix when given.
+
+    Returns:
+        np.ndarray: (k x n) risk contributions (0 for portfolios with zero volatility).
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if cov_factor is not None:
+        cov_factor = np.asarray(cov_factor, dtype=float)
+        factor_exposures = weights @ cov_factor
+        marginal_risk = factor_exposures @ cov_factor.T
+        portfolio_volatilities = np.linalg.norm(factor_exposures, axis=1)
+    elif cov_matrix is not None:
+        marginal_risk = weights @ np.asarray(cov_matrix, dtype=float)
+        portfolio_volatilities = np.sqrt(np.maximum(np.einsum('ij,ij->i', marginal_risk, weights), 0.0))
+    else:
+        raise ValueError("Either cov_matrix or cov_factor is required.")
+    safe_volatilities = np.where(portfolio_volatilities == 0, 1.0, portfolio_volatilities)
+    return np.where(portfolio_volatilities[:, None] == 0, 0.0, weights * marginal_risk / safe_volatilities[:, None])
+
+def calculate_batch_risk_metrics(price_history: pd.DataFrame, weights: np.ndarray, risk_free_rate: float = 0.01) -> dict:
+    """
+    Computes the metrics of calculate_risk_metrics for many weightings of the same assets.
+
+    Args:
+        price_history (pd.DataFrame): DataFrame with asset prices, indexed by date.
+                                      Each column represents an asset.
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        risk_free_rate (float): Annualized risk-free rate.
+
+    Returns:
+        dict: A dictionary of (k,) arrays 'risk_score', 'volatility', 'sharpe_ratio' and 'mean_daily_return',
+              plus the (k x n) 'risk_contributions'.
+    """
+    daily_returns = calculate_daily_returns(price_history)
+    cov_matrix = calculate_covariance_matrix(daily_returns)
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+
+    if weights.shape[1] != cov_matrix.shape[0]:
+        raise ValueError("Number of weights must match the number of assets in the covariance matrix.")
+
+    cov_factor = cholesky_factor(cov_matrix.to_numpy())
+    portfolio_volatilities = calculate_portfolio_volatilities(weights, cov_factor=cov_factor)
+
+    return {
+        "risk_score": portfolio_volatilities,
+        "volatility": portfolio_volatilities,
+        "sharpe_ratio": calculate_sharpe_ratios(weights, daily_returns, portfolio_volatilities, risk_free_rate),
+        "mean_daily_return": calculate_portfolio_returns(weights, daily_returns.mean()),
+        "risk_contributions": calculate_risk_contributions(weights, cov_factor=cov_factor)
+    }
@@ -0,0 +1,175 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.evaluation.metrics import calculate_daily_returns, calculate_covariance_matrix, cholesky_factor
+
+TRADING_DAYS_PER_YEAR = 252
+
+# Upper bound on the random numbers drawn at once per chunk (paths x assets x steps held in memory)
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+# Paths per random stream; chunks are whole numbers of blocks, so results do not depend on the chunk size
+PATHS_PER_STREAM = 1024
+MONTE_CARLO_WORKERS = int(os.environ.get("MONTE_CARLO_WORKERS", 1))
+
+def estimate_step_returns(price_history: pd.DataFrame, steps_per_year: int = 12) -> tuple:
+    """
+    Scales the daily mean returns and covariance of a price history to one simulation step.
+
+    Args:
+        price_history (pd.DataFrame): DataFrame with asset prices, indexed by date.
+        steps_per_year (int): Simulation steps per year (12 for monthly).
+
+    Returns:
+        tuple: (mean step returns as np.ndarray, step covariance matrix as np.ndarray)
+    """
+    daily_returns = calculate_daily_returns(price_history)
+    days_per_step = TRADING_DAYS_PER_YEAR / steps_per_year
+    mean_returns = daily_returns.mean().to_numpy() * days_per_step
+    cov_matrix = calculate_covariance_matrix(daily_returns).to_numpy() * days_per_step
+    return mean_returns, cov_matrix
+
+def _standard_normal(rngs: list, block_sizes: list, shape: tuple, axis: int) -> np.ndarray:
+    """Draws each block of paths from its own stream and joins the blocks along the path axis."""
+    return np.concatenate([
+        rng.standard_normal(shape[:axis] + (size,) + shape[axis:]) for rng, size in zip(rngs, block_sizes)
+    ], axis=axis)
+
+def _simulate_chunk(args) -> np.ndarray:
+    """
+    Simulates one chunk of paths and returns their portfolio value at the end of every year.
+
+    A chunk is a run of consecutive blocks of paths, each with its own seed sequence.
+    Runs in worker processes too, so it takes a single picklable tuple.
+    """
+    (seed_sequences, block_sizes, weights, mean_returns, factor, initial_value, years, steps_per_year,
+     rebalance_every, contribution_per_step) = args
+    rngs = [np.random.default_rng(seed_sequence) for seed_sequence in seed_sequences]
+    num_paths = sum(block_sizes)
+    num_assets = len(weights)
+    yearly_values = np.empty((num_paths, years + 1))
+    yearly_values[:, 0] = initial_value
+
+    if rebalance_every == 1:
+        # Rebalancing every step makes each step's portfolio return a single normal variable
+        portfolio_mean = mean_returns @ weights
+        portfolio_std = np.linalg.norm(factor.T @ weights)
+        values = np.full(num_paths, float(initial_value))
+        for year in range(years):
+            step_returns = portfolio_mean + portfolio_std * _standard_normal(rngs, block_sizes, (steps_per_year,), axis=0)
+            growth = np.maximum(1 + step_returns, 0.0)
+            for step in range(steps_per_year):
+                values = values * growth[:, step] + contribution_per_step
+            yearly_values[:, year + 1] = values
+        return yearly_values
+
+    positions = np.outer(np.full(num_paths, float(initial_value)), weights)
+    for year in range(years):
+        # One matrix product correlates the whole year's shocks; an asset cannot lose more than its value
+        shocks = _standard_normal(rngs, block_sizes, (steps_per_year, num_assets), axis=1)
+        growth = np.maximum(1 + mean_returns + shocks @ factor.T, 0.0)
+        for step in range(steps_per_year):
+            positions *= growth[step]
+            # Contributions are invested at the target weights
+            if contribution_per_step:
+                positions += contribution_per_step * weights
+            if rebalance_every and (year * steps_per_year + step + 1) % rebalance_every == 0:
+                positions = positions.sum(axis=1)[:, None] * weights
+        yearly_values[:, year + 1] = positions.sum(axis=1)
+    return yearly_values
+
+def monte_carlo_projection(
+    weights: np.ndarray,
+    mean_returns: np.ndarray,
+    cov_matrix: np.ndarray,
+    initial_value: float,
+    years: int = 30,
+    steps_per_year: int = 12,
+    num_paths: int = 10000,
+    rebalance_every: int = 1,
+    annual_contribution: float = 0.0,
+    goal_value: float = None,
+    percentiles: tuple = (5, 25, 50, 75, 95),
+    seed: int = None,
+    chunk_size: int = None,
+    num_workers: int = None
+) -> dict:
+    """
+    Projects a portfolio's value forward by simulating correlated asset return paths.
+
+    Step returns are drawn as mean_returns + L z, with L the Cholesky factor of cov_matrix and z
+    standard normal. Paths are simulated in chunks so memory stays bounded whatever num_paths is.
+    Every block of PATHS_PER_STREAM paths has its own random stream spawned from seed, so results are
+    reproducible and do not depend on chunk_size, chunk scheduling or num_workers.
+
+    Args:
+        weights (np.ndarray): Target portfolio weights (summing to 1).
+        mean_returns (np.ndarray): Mean asset return per step (see estimate_step_returns).
+        cov_matrix (np.ndarray): Covariance of asset returns per step.
+        initial_value (float): Portfolio value today.
+        years (int): Projection horizon in years.
+        steps_per_year (int): Simulation steps per year.
+        num_paths (int): Number of simulated paths.
+        rebalance_every (int): Rebalance to the target weights every this many steps (1 = every step,
+                               12 = annually for monthly steps, 0 or None = buy and hold).
+        annual_contribution (float): Amount added each year, spread evenly over its steps.
+        goal_value (float): Optional target value; the probability of reaching it is reported.
+        percentiles (tuple): Percentiles of the value distribution reported for each year.
+        seed (int): Seed for reproducible projections.
+        chunk_size (int): Paths per chunk, rounded down to whole blocks of PATHS_PER_STREAM (at least one).
+                          Defaults to the largest chunk within MAX_CHUNK_BYTES.
+        num_workers (int): Worker processes for the chunks (1 runs in the calling process).
+                           Defaults to MONTE_CARLO_WORKERS.
+
+    Returns:
+        dict: A dictionary containing:
+            - "years": Year offsets 0..years.
+            - "percentiles": {"p5": [...], ...} portfolio value per year at each percentile.
+            - "mean": Mean portfolio value per year.
+            - "goal_probability": Probability of ending at or above goal_value (None without a goal).
+            - "goal_probability_by_year": Probability of being at or above goal_value at each year.
+            - "num_paths", "seed", "elapsed_ms": Run details.
+    """
+    started_at = time.perf_counter()
+    weights = np.asarray(weights, dtype=float)
+    mean_returns = np.asarray(mean_returns, dtype=float)
+    factor = cholesky_factor(cov_matrix)
+    rebalance_every = int(rebalance_every or 0)
+    contribution_per_step = float(annual_contribution or 0.0) / steps_per_year
+    num_workers = MONTE_CARLO_WORKERS if num_workers is None else num_workers
+
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_BYTES // (8 * steps_per_year * max(len(weights), 1)))
+    blocks_per_chunk = max(1, chunk_size // PATHS_PER_STREAM)
+    block_sizes = [min(PATHS_PER_STREAM, num_paths - start) for start in range(0, num_paths, PATHS_PER_STREAM)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(block_sizes))
+    chunk_args = [
+        (seed_sequences[start:start + blocks_per_chunk], block_sizes[start:start + blocks_per_chunk], weights,
+         mean_returns, factor, initial_value, years, steps_per_year, rebalance_every, contribution_per_step)
+        for start in range(0, len(block_sizes), blocks_per_chunk)
+    ]
+
+    if num_workers and num_workers > 1 and len(chunk_args) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunks = list(executor.map(_simulate_chunk, chunk_args))
+    else:
+        chunks = [_simulate_chunk(args) for args in chunk_args]
+    yearly_values = np.concatenate(chunks, axis=0)
+
+    percentile_values = np.percentile(yearly_values, percentiles, axis=0)
+    result = {
+        "years": list(range(years + 1)),
+        "percentiles": {f"p{p:g}": values.tolist() for p, values in zip(percentiles, percentile_values)},
+        "mean": yearly_values.mean(axis=0).tolist(),
+        "goal_probability": None,
+        "goal_probability_by_year": None,
+        "num_paths": num_paths,
+        "seed": seed
+    }
+    if goal_value is not None:
+        reached = yearly_values >= goal_value
+        result["goal_probability"] = float(reached[:, -1].mean())
+        result["goal_probability_by_year"] = reached.mean(axis=0).tolist()
+    result["elapsed_ms"] = (time.perf_counter() - started_at) * 1000
+    return result
@@ -0,0 +1,250 @@
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+ONLINE_METRICS_DIR = os.environ.get("ONLINE_METRICS_DIR", os.path.join(tempfile.gettempdir(), "portfolio_balancer_online_metrics"))
+
+# RiskMetrics decay factor for daily EWMA volatility
+EWMA_DECAY = 0.94
+
+class OnlineRiskMetrics:
+    """
+    Risk metrics of a fixed set of assets, updated one day of prices at a time.
+
+    Keeps Welford accumulators for the mean and covariance of daily asset returns, an EWMA covariance,
+    and the portfolio's compounded growth, peak and drawdown. Each update costs O(n^2) in the number of
+    assets instead of a pass over the whole price history. metrics() matches calculate_risk_metrics in
+    metrics.py for the same prices and weights; only the path-dependent values (Sharpe growth and
+    drawdown) follow the weights in force on each day when the weights are changed along the way.
+    """
+
+    def __init__(self, tickers: list, weights: np.ndarray, ewma_decay: float = EWMA_DECAY):
+        self.tickers = list(tickers)
+        self.weights = np.asarray(weights, dtype=float)
+        self.ewma_decay = ewma_decay
+        num_assets = len(self.tickers)
+        self.count = 0
+        self.mean = np.zeros(num_assets)
+        self.comoment = np.zeros((num_assets, num_assets)) # Sum of outer products of deviations from the mean
+        self.ewma_cov = np.zeros((num_assets, num_assets))
+        self.log_growth = 0.0 # Sum of log(1 + portfolio return)
+        self.value = 1.0 # Portfolio value index, starting at 1
+        self.peak = 1.0
+        self.max_drawdown = 0.0
+        self.last_prices = None
+        self.last_date = None
+
+    def set_weights(self, weights: np.ndarray):
+        """Changes the portfolio weights used from the next update on (covariance statistics are kept)."""
+        weights = np.asarray(weights, dtype=float)
+        if len(weights) != len(self.tickers):
+            raise ValueError("Number of weights must match the number of tickers.")
+        self.weights = weights
+
+    def update(self, date, prices) -> bool:
+        """
+        Adds one day of closing prices.
+
+        Args:
+            date: Date of the prices; days at or before the last update are ignored.
+            prices: Closing prices aligned with tickers (array-like), or a dict keyed by ticker.
+
+        Returns:
+            bool: True if the day was applied. The first day and days with missing prices only set the
+                  reference prices (missing days are skipped, so the next return spans the gap).
+        """
+        date = pd.Timestamp(date)
+        if self.last_date is not None and date <= self.last_date:
+            return False
+        if isinstance(prices, dict):
+            prices = [prices.get(ticker, np.nan) for ticker in self.tickers]
+        prices = np.asarray(prices, dtype=float)
+        if np.isnan(prices).any():
+            return False
+        if self.last_prices is None:
+            self.last_prices, self.last_date = prices, date
+            return False
+
+        returns = prices / self.last_prices - 1
+        self.last_prices, self.last_date = prices, date
+
+        # Welford update of the mean and co-moment matrix
+        self.count += 1
+        delta = returns - self.mean
+        self.mean += delta / self.count
+        self.comoment += np.outer(delta, returns - self.mean)
+
+        if self.count == 1:
+            self.ewma_cov = np.outer(returns, returns)
+        else:
+            self.ewma_cov = self.ewma_decay * self.ewma_cov + (1 - self.ewma_decay) * np.outer(returns, returns)
+
+        portfolio_return = returns @ self.weights
+        self.log_growth += np.log1p(portfolio_return)
+        self.value *= 1 + portfolio_return
+        self.peak = max(self.peak, self.value)
+        self.max_drawdown = min(self.max_drawdown, self.value / self.peak - 1)
+        return True
+
+    def update_from_price_history(self, price_history: pd.DataFrame) -> int:
+        """
+        Applies every row of a price history newer than the last update.
+
+        Returns:
+            int: Number of days applied.
+        """
+        price_history = price_history[self.tickers].sort_index()
+        if self.last_date is not None:
+            price_history = price_history[price_history.index > self.last_date]
+        applied = 0
+        for date, row in zip(price_history.index, price_history.to_numpy(dtype=float)):
+            applied += self.update(date, row)
+        return applied
+
+    @property
+    def cov_matrix(self) -> np.ndarray:
+        """Sample covariance of daily returns (as calculate_covariance_matrix)."""
+        if self.count < 2:
+            return np.full_like(self.comoment, np.nan)
+        return self.comoment / (self.count - 1)
+
+    def metrics(self, risk_free_rate: float = 0.01) -> dict:
+        """
+        Current risk metrics.
+
+        Returns:
+            dict: A dictionary containing:
+                - "risk_score", "volatility", "sharpe_ratio": As calculate_risk_metrics (daily portfolio volatility).
+                - "mean_daily_return": Mean daily portfolio return.
+                - "ewma_volatility": Daily portfolio volatility from the EWMA covariance.
+                - "max_drawdown", "current_drawdown": Drawdowns of the portfolio value index.
+                - "observations": Number of daily returns seen.
+                - "as_of": Date of the last update (ISO format).
+        """
+        portfolio_volatility = float(np.sqrt(self.weights @ self.cov_matrix @ self.weights)) if self.count > 1 else 0.0
+        if self.count > 0 and portfolio_volatility != 0:
+            annualized_mean_return = np.exp(self.log_growth * 252 / self.count) - 1
+            sharpe_ratio = (annualized_mean_return - risk_free_rate) / portfolio_volatility
+        else:
+            sharpe_ratio = 0
+        return {
+            "risk_score": portfolio_volatility,
+            "volatility": portfolio_volatility,
+            "sharpe_ratio": float(sharpe_ratio),
+            "mean_daily_return": float(self.mean @ self.weights),
+            "ewma_volatility": float(np.sqrt(max(self.weights @ self.ewma_cov @ self.weights, 0.0))),
+            "max_drawdown": self.max_drawdown,
+            "current_drawdown": self.value / self.peak - 1,
+            "observations": self.count,
+            "as_of": self.last_date.isoformat() if self.last_date is not None else None
+        }
+
+    def to_dict(self) -> dict:
+        """JSON-serializable state, restored with from_dict."""
+        return {
+            "tickers": self.tickers,
+            "weights": self.weights.tolist(),
+            "ewma_decay": self.ewma_decay,
+            "count": self.count,
+            "mean": self.mean.tolist(),
+            "comoment": self.comoment.tolist(),
+            "ewma_cov": self.ewma_cov.tolist(),
+            "log_growth": self.log_growth,
+            "value": self.value,
+            "peak": self.peak,
+            "max_drawdown": self.max_drawdown,
+            "last_prices": self.last_prices.tolist() if self.last_prices is not None else None,
+            "last_date": self.last_date.isoformat() if self.last_date is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'OnlineRiskMetrics':
+        metrics = cls(state["tickers"], state["weights"], state.get("ewma_decay", EWMA_DECAY))
+        metrics.count = state["count"]
+        metrics.mean = np.array(state["mean"], dtype=float)
+        metrics.comoment = np.array(state["comoment"], dtype=float).reshape(len(metrics.tickers), len(metrics.tickers))
+        metrics.ewma_cov = np.array(state["ewma_cov"], dtype=float).reshape(len(metrics.tickers), len(metrics.tickers))
+        metrics.log_growth = state["log_growth"]
+        metrics.value = state["value"]
+        metrics.peak = state["peak"]
+        metrics.max_drawdown = state["max_drawdown"]
+        metrics.last_prices = np.array(state["last_prices"], dtype=float) if state["last_prices"] is not None else None
+        metrics.last_date = pd.Timestamp(state["last_date"]) if state["last_date"] is not None else None
+        return metrics
+
+class OnlineMetricsStore:
+    """Keeps one OnlineRiskMetrics state per portfolio as a JSON file under state_dir."""
+
+    def __init__(self, state_dir: str = ONLINE_METRICS_DIR):
+        self.state_dir = state_dir
+
+    def _path(self, portfolio_key) -> str:
+        return os.path.join(self.state_dir, f"{portfolio_key}.json")
+
+    def load(self, portfolio_key):
+        """Returns the saved OnlineRiskMetrics for a portfolio, or None if there is none (or it is unreadable)."""
+        try:
+            with open(self._path(portfolio_key), 'r') as f:
+                return OnlineRiskMetrics.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read online metrics state for %s: %s", portfolio_key, e)
+            return None
+
+    def save(self, portfolio_key, metrics: OnlineRiskMetrics):
+        """Writes a portfolio's state atomically."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(metrics.to_dict(), f)
+        os.replace(tmp_path, self._path(portfolio_key))
+
+    def delete(self, portfolio_key):
+        try:
+            os.remove(self._path(portfolio_key))
+        except FileNotFoundError:
+            pass
+
+online_metrics_store = OnlineMetricsStore()
+
+def update_online_metrics(portfolio_key, price_history: pd.DataFrame, weights: np.ndarray,
+                          risk_free_rate: float = 0.01, store: OnlineMetricsStore = None) -> dict:
+    """
+    Brings a portfolio's saved online metrics up to date and returns them.
+
+    Only the days of price_history after the saved state's last update are applied, so callers holding
+    a state only need to pass the recent prices (from the state's "as_of" date on). The state is rebuilt
+    from the full price_history when there is none yet or the portfolio's set of tickers changed.
+
+    Args:
+        portfolio_key: Identifier the state is saved under (e.g. the user id).
+        price_history (pd.DataFrame): Closing prices indexed by date, one column per asset.
+        weights (np.ndarray): Current weights aligned with price_history's columns.
+        risk_free_rate (float): Annualized risk-free rate for the Sharpe Ratio.
+        store (OnlineMetricsStore): State store. Defaults to online_metrics_store.
+
+    Returns:
+        dict: OnlineRiskMetrics.metrics(), plus "days_applied" and "rebuilt".
+    """
+    store = store or online_metrics_store
+    weights = pd.Series(np.asarray(weights, dtype=float), index=price_history.columns)
+    metrics = store.load(portfolio_key)
+    rebuilt = metrics is None or set(metrics.tickers) != set(price_history.columns)
+    if rebuilt:
+        metrics = OnlineRiskMetrics(list(price_history.columns), weights.to_numpy())
+    else:
+        metrics.set_weights(weights[metrics.tickers].to_numpy())
+
+    days_applied = metrics.update_from_price_history(price_history)
+    store.save(portfolio_key, metrics)
+
+    result = metrics.metrics(risk_free_rate)
+    result["days_applied"] = days_applied
+    result["rebuilt"] = rebuilt
+    return result
@@ -0,0 +1,242 @@
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.evaluation.metrics import calculate_daily_returns, calculate_covariance_matrix, cholesky_factor, calculate_portfolio_volatilities
+
+# Historical stress windows: name -> (start date, end date, description)
+STRESS_SCENARIOS = {
+    "gfc_2008": ("2008-09-12", "2009-03-09", "Global financial crisis: Lehman collapse to the March 2009 low"),
+    "covid_2020": ("2020-02-19", "2020-03-23", "COVID-19 crash: February 2020 peak to the March low"),
+    "rates_2022": ("2022-01-03", "2022-10-12", "2022 rate shock: stocks and bonds falling together")
+}
+
+VAR_METHODS = ('historical', 'parametric', 'monte_carlo')
+
+# Upper bound on the (samples x portfolios) return matrix valued at once
+MAX_BLOCK_ELEMENTS = 4_000_000
+
+def check_var_parameters(confidence: float, horizon_days: int):
+    """Raises ValueError unless 0 < confidence < 1 and horizon_days is a whole number of days >= 1."""
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1 (exclusive).")
+    if not (horizon_days >= 1 and float(horizon_days).is_integer()):
+        raise ValueError("horizon_days must be a whole number of at least 1.")
+
+def _weight_matrix(weights) -> np.ndarray:
+    return np.atleast_2d(np.asarray(weights, dtype=float))
+
+def _tail_loss(asset_returns: np.ndarray, weights: np.ndarray, confidence: float) -> tuple:
+    """
+    VaR and CVaR (as positive losses) of each portfolio over a (samples x assets) matrix of asset returns.
+
+    Portfolios are valued in blocks, one matrix product per block, so memory stays bounded for large batches.
+    """
+    num_samples = len(asset_returns)
+    block_size = max(1, MAX_BLOCK_ELEMENTS // max(num_samples, 1))
+    value_at_risk = np.empty(len(weights))
+    conditional_var = np.empty(len(weights))
+    for start in range(0, len(weights), block_size):
+        portfolio_returns = asset_returns @ weights[start:start + block_size].T
+        cutoffs = np.quantile(portfolio_returns, 1 - confidence, axis=0)
+        in_tail = portfolio_returns <= cutoffs
+        tail_means = np.where(in_tail, portfolio_returns, 0.0).sum(axis=0) / np.maximum(in_tail.sum(axis=0), 1)
+        value_at_risk[start:start + block_size] = -cutoffs
+        conditional_var[start:start + block_size] = -tail_means
+    return value_at_risk, conditional_var
+
+def historical_var(daily_returns: pd.DataFrame, weights: np.ndarray, confidence: float = 0.95, horizon_days: int = 1) -> dict:
+    """
+    Historical VaR and CVaR of many portfolios from the empirical distribution of daily returns.
+
+    Args:
+        daily_returns (pd.DataFrame): DataFrame with daily asset returns.
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        confidence (float): Confidence level, e.g. 0.95.
+        horizon_days (int): Horizon in trading days (daily figures are scaled by the square root of time).
+
+    Returns:
+        dict: (k,) arrays "var" and "cvar", as fractions of portfolio value.
+    """
+    check_var_parameters(confidence, horizon_days)
+    value_at_risk, conditional_var = _tail_loss(np.asarray(daily_returns, dtype=float), _weight_matrix(weights), confidence)
+    scale = np.sqrt(horizon_days)
+    return {"var": value_at_risk * scale, "cvar": conditional_var * scale}
+
+def parametric_var(mean_returns: np.ndarray, cov_matrix: np.ndarray, weights: np.ndarray, confidence: float = 0.95,
+                   horizon_days: int = 1, cov_factor: np.ndarray = None) -> dict:
+    """
+    Variance-covariance (normal) VaR and CVaR of many portfolios.
+
+    Args:
+        mean_returns (np.ndarray): Mean daily asset returns.
+        cov_matrix (np.ndarray): Covariance of daily asset returns.
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        confidence (float): Confidence level, e.g. 0.95.
+        horizon_days (int): Horizon in trading days.
+        cov_factor (np.ndarray): Optional pre-factored covariance, used instead of cov_matrix.
+
+    Returns:
+        dict: (k,) arrays "var" and "cvar", as fractions of portfolio value.
+    """
+    check_var_parameters(confidence, horizon_days)
+    weights = _weight_matrix(weights)
+    portfolio_means = weights @ np.asarray(mean_returns, dtype=float) * horizon_days
+    portfolio_volatilities = calculate_portfolio_volatilities(weights, cov_matrix, cov_factor) * np.sqrt(horizon_days)
+    normal = NormalDist()
+    z_score = normal.inv_cdf(1 - confidence)
+    tail_factor = normal.pdf(z_score) / (1 - confidence)
+    return {
+        "var": -(portfolio_means + z_score * portfolio_volatilities),
+        "cvar": -(portfolio_means - tail_factor * portfolio_volatilities)
+    }
+
+def monte_carlo_var(mean_returns: np.ndarray, cov_matrix: np.ndarray, weights: np.ndarray, confidence: float = 0.95,
+                    horizon_days: int = 1, num_paths: int = 10000, seed: int = None, cov_factor: np.ndarray = None) -> dict:
+    """
+    Monte Carlo VaR and CVaR of many portfolios from correlated normal asset returns over the horizon.
+
+    One set of simulated asset returns is shared by all portfolios and valued with matrix products.
+
+    Args:
+        mean_returns (np.ndarray): Mean daily asset returns.
+        cov_matrix (np.ndarray): Covariance of daily asset returns.
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        confidence (float): Confidence level, e.g. 0.95.
+        horizon_days (int): Horizon in trading days.
+        num_paths (int): Number of simulated scenarios.
+        seed (int): Seed for reproducible results.
+        cov_factor (np.ndarray): Optional pre-factored covariance, used instead of cov_matrix.
+
+    Returns:
+        dict: (k,) arrays "var" and "cvar", as fractions of portfolio value.
+    """
+    check_var_parameters(confidence, horizon_days)
+    if cov_factor is None:
+        cov_factor = cholesky_factor(cov_matrix)
+    cov_factor = np.asarray(cov_factor, dtype=float)
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((num_paths, cov_factor.shape[1]))
+    asset_returns = np.asarray(mean_returns, dtype=float) * horizon_days + (shocks @ cov_factor.T) * np.sqrt(horizon_days)
+    value_at_risk, conditional_var = _tail_loss(asset_returns, _weight_matrix(weights), confidence)
+    return {"var": value_at_risk, "cvar": conditional_var}
+
+def scenario_shocks(price_history: pd.DataFrame, scenarios: dict = None) -> tuple:
+    """
+    Cumulative asset returns over each stress window, taken from stored price history.
+
+    Each window runs from an asset's first to its last price inside it. Assets without any price in a
+    window have no shock for that scenario.
+
+    Args:
+        price_history (pd.DataFrame): Closing prices indexed by date, one column per asset, covering the windows.
+        scenarios (dict): name -> (start date, end date, description). Defaults to STRESS_SCENARIOS.
+
+    Returns:
+        tuple: (shocks, covered): (scenarios x assets) DataFrames with the cumulative returns (0 where
+               missing) and whether the asset has prices for the window.
+    """
+    scenarios = STRESS_SCENARIOS if scenarios is None else scenarios
+    price_history = price_history.sort_index()
+    shocks = pd.DataFrame(np.nan, index=list(scenarios), columns=price_history.columns)
+    for name, (start, end, _) in scenarios.items():
+        window = price_history.loc[pd.Timestamp(start):pd.Timestamp(end)]
+        if window.empty:
+            continue
+        # Per asset: first and last available price in the window
+        shocks.loc[name] = window.ffill().iloc[-1] / window.bfill().iloc[0] - 1
+    covered = shocks.notna()
+    return shocks.fillna(0.0), covered
+
+def stress_test(shocks: pd.DataFrame, weights: np.ndarray, covered: pd.DataFrame = None) -> dict:
+    """
+    Applies every stress scenario to every portfolio with one matrix product.
+
+    Args:
+        shocks (pd.DataFrame): (scenarios x assets) cumulative asset returns (see scenario_shocks).
+        weights (np.ndarray): (k x n) matrix of asset weights, columns in shocks' asset order.
+        covered (pd.DataFrame): Optional (scenarios x assets) mask of assets with data for each scenario.
+
+    Returns:
+        dict: A dictionary containing:
+            - "scenarios": Scenario names.
+            - "losses": (scenarios x k) portfolio losses as fractions of value (negative for gains).
+            - "coverage": (scenarios x k) weight of each portfolio with data for the scenario (None without covered).
+    """
+    weights = _weight_matrix(weights)
+    losses = -(np.asarray(shocks, dtype=float) @ weights.T)
+    coverage = np.asarray(covered, dtype=float) @ np.abs(weights).T if covered is not None else None
+    return {"scenarios": list(shocks.index), "losses": losses, "coverage": coverage}
+
+def calculate_var_metrics(price_history: pd.DataFrame, weights: np.ndarray, confidence: float = 0.95, horizon_days: int = 1,
+                          methods: tuple = VAR_METHODS, num_paths: int = 10000, seed: int = None) -> dict:
+    """
+    VaR and CVaR of many weightings of the same assets with each requested method.
+
+    Args:
+        price_history (pd.DataFrame): DataFrame with asset prices, indexed by date.
+        weights (np.ndarray): (k x n) matrix of asset weights, one portfolio per row.
+        confidence (float): Confidence level, e.g. 0.95.
+        horizon_days (int): Horizon in trading days.
+        methods (tuple): Any of 'historical', 'parametric' and 'monte_carlo'.
+        num_paths (int): Simulated scenarios for the Monte Carlo method.
+        seed (int): Seed for the Monte Carlo method.
+
+    Returns:
+        dict: method -> {"var": (k,) array, "cvar": (k,) array}, plus "confidence" and "horizon_days".
+    """
+    check_var_parameters(confidence, horizon_days)
+    unknown_methods = set(methods) - set(VAR_METHODS)
+    if unknown_methods:
+        raise ValueError(f"Unknown VaR methods: {', '.join(sorted(unknown_methods))}")
+
+    daily_returns = calculate_daily_returns(price_history)
+    weights = _weight_matrix(weights)
+    if weights.shape[1] != daily_returns.shape[1]:
+        raise ValueError("Number of weights must match the number of assets in the price history.")
+
+    results = {"confidence": confidence, "horizon_days": horizon_days}
+    if 'historical' in methods:
+        results['historical'] = historical_var(daily_returns, weights, confidence, horizon_days)
+    if 'parametric' in methods or 'monte_carlo' in methods:
+        mean_returns = daily_returns.mean().to_numpy()
+        cov_factor = cholesky_factor(calculate_covariance_matrix(daily_returns).to_numpy())
+        if 'parametric' in methods:
+            results['parametric'] = parametric_var(mean_returns, None, weights, confidence, horizon_days, cov_factor=cov_factor)
+        if 'monte_carlo' in methods:
+            results['monte_carlo'] = monte_carlo_var(mean_returns, None, weights, confidence, horizon_days,
+                                                     num_paths=num_paths, seed=seed, cov_factor=cov_factor)
+    return results
+
+def portfolio_risk_report(var_metrics: dict = None, stress_results: dict = None, index: int = 0) -> dict:
+    """
+    Extracts one portfolio's figures from batch results into a JSON-serializable dict.
+
+    Args:
+        var_metrics (dict): Optional result of calculate_var_metrics.
+        stress_results (dict): Optional result of stress_test.
+        index (int): Row of the portfolio in the weight matrix.
+
+    Returns:
+        dict: A dictionary containing (for the results given):
+            - "var": {method: {"var", "cvar"}, "confidence", "horizon_days"}.
+            - "stress": List of {"scenario", "description", "loss", "coverage"}.
+    """
+    report = {}
+    if var_metrics is not None:
+        report["var"] = {
+            method: {"var": float(values["var"][index]), "cvar": float(values["cvar"][index])}
+            for method, values in var_metrics.items() if method in VAR_METHODS
+        }
+        report["var"]["confidence"] = var_metrics["confidence"]
+        report["var"]["horizon_days"] = var_metrics["horizon_days"]
+    if stress_results is not None:
+        report["stress"] = [
+            {
+                "scenario": name,
+                "description": STRESS_SCENARIOS.get(name, (None, None, name))[2],
+                "loss": float(stress_results["losses"][i, index]),
+                "coverage": float(stress_results["coverage"][i, index]) if stress_results["coverage"] is not None else None
+            }
+            for i, name in enumerate(stress_results["scenarios"])
+        ]
+    return report
@@ -0,0 +1,229 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Jobs are kept on disk so that worker processes can publish progress and results,
+# and so that finished results survive the web process restarting.
+BACKTEST_JOBS_DIR = os.environ.get("BACKTEST_JOBS_DIR", os.path.join(tempfile.gettempdir(), "portfolio_balancer_backtest_jobs"))
+BACKTEST_WORKERS = int(os.environ.get("BACKTEST_WORKERS", min(2, os.cpu_count() or 1)))
+BACKTEST_QUEUE_SIZE = int(os.environ.get("BACKTEST_QUEUE_SIZE", 16)) # Queued + running jobs accepted at once
+
+# Minimum seconds between two progress writes from a worker
+PROGRESS_INTERVAL = 0.5
+
+STRATEGIES = ['deterministic', 'cvxpy', 'mvo', 'baseline']
+FINISHED_STATUSES = {'completed', 'failed', 'cancelled'}
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds its maximum number of jobs."""
+
+class BacktestCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled."""
+
+def _json_default(value):
+    """Serializes the timestamps and numpy scalars found in backtest results."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _write_json(path: str, data: dict):
+    """Writes JSON atomically, so readers never see a partially written file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, default=_json_default)
+    os.replace(tmp_path, path)
+
+def _read_json(path: str):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _status_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+def _result_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.result.json")
+
+def _cancel_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.cancel")
+
+def _run_backtest_job(job_id: str, jobs_dir: str, backtest_kwargs: dict, job_status: dict):
+    """
+    Worker process entry point: runs compare_strategies and publishes progress and the report to disk.
+
+    Args:
+        job_id (str): Job identifier.
+        jobs_dir (str): Directory holding the job files.
+        backtest_kwargs (dict): Keyword arguments for compare_strategies.
+        job_status (dict): The job's status record as written at submission.
+    """
+    # Imported here so the web process does not pay for the optimization stack until a job runs
+    from portfolio_balancer.src.evaluation.backtest import compare_strategies, generate_backtest_report
+    from portfolio_balancer.src.api.structured_logging import configure_logging
+
+    configure_logging() # Spawned workers start without the web process's logging setup
+
+    status_path = _status_path(jobs_dir, job_id)
+    cancel_path = _cancel_path(jobs_dir, job_id)
+    if os.path.exists(cancel_path):
+        _write_json(status_path, {**job_status, "status": "cancelled", "finished_at": datetime.now().isoformat()})
+        return
+
+    job_status = {**job_status, "status": "running", "started_at": datetime.now().isoformat()}
+    _write_json(status_path, job_status)
+    last_write = [0.0]
+
+    def publish_progress(strategy, dates_processed, total_dates, rebalances):
+        now = time.monotonic()
+        if now - last_write[0] < PROGRESS_INTERVAL and dates_processed < total_dates:
+            return
+        last_write[0] = now
+        if os.path.exists(cancel_path):
+            raise BacktestCancelled()
+        job_status["progress"] = {
+            "strategy": strategy,
+            "strategies_done": STRATEGIES.index(strategy) if strategy in STRATEGIES else None,
+            "total_strategies": len(STRATEGIES),
+            "dates_processed": dates_processed,
+            "total_dates": total_dates,
+            "rebalances": rebalances
+        }
+        _write_json(status_path, job_status)
+
+    try:
+        backtest_results = compare_strategies(**backtest_kwargs, progress_callback=publish_progress)
+        _write_json(_result_path(jobs_dir, job_id), generate_backtest_report(backtest_results))
+        job_status.update({"status": "completed", "progress": {**job_status.get("progress", {}), "strategies_done": len(STRATEGIES)}})
+    except BacktestCancelled:
+        job_status["status"] = "cancelled"
+    except Exception as e:
+        job_status.update({"status": "failed", "error": f"Error running backtest: {str(e)}"})
+
+    job_status["finished_at"] = datetime.now().isoformat()
+    _write_json(status_path, job_status)
+
+class BacktestJobQueue:
+    """
+    Bounded queue of backtest jobs run by a local process pool.
+
+    Jobs are submitted with the compare_strategies arguments and identified by a job id. Workers write
+    the job's status, progress and result to files in jobs_dir, which get_job reads back.
+    """
+
+    def __init__(self, jobs_dir: str = BACKTEST_JOBS_DIR, max_workers: int = BACKTEST_WORKERS, max_queue_size: int = BACKTEST_QUEUE_SIZE):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Workers are spawned rather than forked so they do not inherit the web server's threads
+        if self._executor is None:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _on_job_done(self, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or error is not None:
+            # Dropped before it started (cancel or shutdown), or the worker process died before recording an outcome
+            job_status = _read_json(_status_path(self.jobs_dir, job_id)) or {"job_id": job_id}
+            if job_status.get("status") not in FINISHED_STATUSES:
+                if error is None:
+                    job_status["status"] = "cancelled"
+                else:
+                    job_status.update({"status": "failed", "error": f"Backtest worker failed: {str(error)}"})
+                job_status["finished_at"] = datetime.now().isoformat()
+                _write_json(_status_path(self.jobs_dir, job_id), job_status)
+
+    def submit(self, user_id, backtest_kwargs: dict) -> dict:
+        """
+        Queues a backtest.
+
+        Args:
+            user_id: Owner of the job.
+            backtest_kwargs (dict): Keyword arguments for compare_strategies.
+
+        Returns:
+            dict: The job's status record, including its "job_id".
+
+        Raises:
+            JobQueueFull: If max_queue_size jobs are already queued or running.
+        """
+        with self._lock:
+            if len(self._futures) >= self.max_queue_size:
+                raise JobQueueFull(f"Backtest queue is full ({self.max_queue_size} jobs). Try again later.")
+
+            job_id = uuid.uuid4().hex
+            job_status = {
+                "job_id": job_id,
+                "user_id": str(user_id),
+                "status": "queued",
+                "submitted_at": datetime.now().isoformat(),
+                "progress": {}
+            }
+            executor = self._get_executor()
+            _write_json(_status_path(self.jobs_dir, job_id), job_status)
+            future = executor.submit(_run_backtest_job, job_id, self.jobs_dir, backtest_kwargs, job_status)
+            self._futures[job_id] = future
+
+        future.add_done_callback(lambda f: self._on_job_done(job_id, f))
+        return job_status
+
+    def get_job(self, job_id: str, include_result: bool = True) -> dict:
+        """
+        Returns the job's status record, with its "result" once completed, or None if the job is unknown.
+        """
+        job_status = _read_json(_status_path(self.jobs_dir, job_id))
+        if job_status is None:
+            return None
+        if include_result and job_status.get("status") == "completed":
+            job_status["result"] = _read_json(_result_path(self.jobs_dir, job_id))
+        return job_status
+
+    def cancel(self, job_id: str) -> dict:
+        """
+        Cancels a job. Queued jobs are dropped immediately; running jobs stop at their next progress update.
+
+        Returns:
+            dict: The job's status record ("cancelled", or "cancelling" while a running job winds down),
+                  or None if the job is unknown.
+        """
+        job_status = _read_json(_status_path(self.jobs_dir, job_id))
+        if job_status is None or job_status.get("status") in FINISHED_STATUSES:
+            return job_status
+
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            # _on_job_done records the cancellation
+            return self.get_job(job_id, include_result=False)
+
+        # Already running (possibly in another web process): ask the worker to stop
+        with open(_cancel_path(self.jobs_dir, job_id), 'w') as f:
+            f.write(datetime.now().isoformat())
+        job_status["status"] = "cancelling"
+        return job_status
+
+    def shutdown(self, wait: bool = False):
+        """Stops the worker pool, cancelling jobs that have not started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+backtest_jobs = BacktestJobQueue()
@@ -1,13 +1,13 @@
 from datetime import datetime, timedelta
 from portfolio_balancer.src.api.price_service import PriceService
-from portfolio_balancer.src.api.models import Snapshot, Portfolio, User
-from portfolio_balancer.src.api.services import calculate_portfolio_value, calculate_asset_allocation
-from supabase import create_client, Client
-import os
+from portfolio_balancer.src.api.services import get_asset_class_mapping, get_online_risk_metrics, get_portfolio_snapshot, get_scenario_price_history, snapshot_position_values
+from portfolio_balancer.src.evaluation.risk_engine import calculate_var_metrics, scenario_shocks, stress_test, portfolio_risk_report
+from portfolio_balancer.src.data.repository import repository
+import numpy as np
+import pandas as pd
+from portfolio_balancer.src.api.structured_logging import configure_logging, get_logger
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger(__name__)
 
 price_service = PriceService()
 
@@ -16,20 +16,10 @@ def refresh_historical_and_latest_prices():
     Daily job to refresh historical and latest prices for all unique tickers
     across all portfolios.
     """
-    print("Starting daily job: Refreshing historical and latest prices...")
-
-    # Fetch all portfolios to get unique tickers
-    response = supabase.table('portfolios').select("assets").execute()
-    all_assets = []
-    if response.data:
-        for portfolio_data in response.data:
-            if portfolio_data and 'assets' in portfolio_data:
-                all_assets.extend(portfolio_data['assets'])
-    
-    unique_tickers = set()
-    for asset in all_assets:
-        if 'ticker' in asset:
-            unique_tickers.add(asset['ticker'])
+    logger.info("Starting daily job: Refreshing historical and latest prices...")
+
+    # Fetch all holdings to get unique tickers, as 'portfolios' table does not exist
+    unique_tickers = sorted({holding['ticker'] for holding in repository.get_all_holdings()})
 
     today = datetime.now().date()
     # For historical data, fetch for the last 7 days to ensure we catch any missed updates
@@ -37,54 +27,134 @@ def refresh_historical_and_latest_prices():
     start_date = today - timedelta(days=7) 
 
     for ticker in unique_tickers:
-        print(f"Refreshing data for ticker: {ticker}")
+        logger.info("Refreshing data for ticker: %s", ticker)
         # Fetch historical prices (this will use cache or fetch from provider)
         price_service.get_historical_prices(ticker, start_date.isoformat(), today.isoformat())
         # Fetch latest price (this will use cache or fetch from provider)
         price_service.get_latest_price(ticker)
     
-    print("Finished daily job: Refreshing historical and latest prices.")
+    logger.info("Finished daily job: Refreshing historical and latest prices.")
 
 def recompute_snapshots():
     """
     Daily job to recompute portfolio snapshots for all users.
     """
-    print("Starting daily job: Recomputing snapshots...")
+    logger.info("Starting daily job: Recomputing snapshots...")
 
-    response = supabase.table('users').select("id").execute()
-    user_ids = [user['id'] for user in response.data] if response.data else []
+    # Each user's holdings make up one portfolio, as 'users' and 'portfolios' tables do not exist
+    user_ids = sorted({holding['user_id'] for holding in repository.get_all_holdings()})
 
     for user_id in user_ids:
-        print(f"Recomputing snapshots for user: {user_id}")
-        # Fetch user's portfolios
-        response = supabase.table('portfolios').select("*").eq("user_id", user_id).execute()
-        user_portfolios = response.data if response.data else []
-
-        for portfolio_data in user_portfolios:
-            portfolio = Portfolio(**portfolio_data)
-            
-            # Calculate current value and allocation
-            current_value = calculate_portfolio_value(portfolio)
-            current_allocation = calculate_asset_allocation(portfolio)
-
-            # Create new snapshot entry
-            snapshot_entry = {
-                "user_id": user_id,
-                "portfolio_id": portfolio.id,
-                "date": datetime.now().date().isoformat(),
-                "total_value": current_value,
-                "asset_allocation": current_allocation # Store as JSONB in Supabase
-            }
-
-            # Insert into Supabase
-            response = supabase.table('snapshots').insert(snapshot_entry).execute()
-            if response.data:
-                print(f"Saved snapshot for portfolio {portfolio.id} of user {user_id}.")
-            else:
-                print(f"Failed to save snapshot for portfolio {portfolio.id} of user {user_id}: {response.error}")
+        logger.info("Recomputing snapshots for user: %s", user_id)
+        snapshot = get_portfolio_snapshot(user_id)
+
+        # Weight of each asset class in the current value
+        current_allocation = {}
+        position_values = snapshot_position_values(snapshot)
+        for ticker, asset_class in get_asset_class_mapping(list(position_values)).items():
+            current_allocation[asset_class] = current_allocation.get(asset_class, 0.0) + position_values[ticker] / snapshot['total_value']
+
+        # Create new snapshot entry
+        snapshot_entry = {
+            "user_id": user_id,
+            "date": datetime.now().date().isoformat(),
+            "total_value": snapshot['total_value'],
+            "asset_allocation": current_allocation # Stored as JSONB in Supabase, JSON text in SQLite
+        }
+
+        # Insert into the snapshots table
+        if repository.insert_snapshot(snapshot_entry):
+            logger.info("Saved snapshot for user %s.", user_id)
+        else:
+            logger.warning("Failed to save snapshot for user %s.", user_id)
     
-    print("Finished daily job: Recomputing snapshots.")
+    logger.info("Finished daily job: Recomputing snapshots.")
+
+def update_online_risk_metrics():
+    """
+    Daily job to extend every user's online risk metrics with the latest day of prices.
+    """
+    logger.info("Starting daily job: Updating online risk metrics...")
+
+    user_ids = sorted({holding['user_id'] for holding in repository.get_all_holdings()})
+
+    for user_id in user_ids:
+        try:
+            online_metrics = get_online_risk_metrics(user_id)
+        except Exception as e:
+            logger.warning("Failed to update online risk metrics for user %s: %s", user_id, e)
+            continue
+        if online_metrics is None:
+            logger.info("No priced holdings for user %s; skipping online risk metrics.", user_id)
+        else:
+            logger.info("Updated online risk metrics for user %s (%s new days).", user_id, online_metrics['days_applied'])
+
+    logger.info("Finished daily job: Updating online risk metrics.")
+
+def compute_risk_reports(confidence: float = 0.95, horizon_days: int = 1):
+    """
+    Daily job to compute VaR/CVaR and stress-scenario losses for all users in one batch.
+
+    Every user's portfolio becomes a row of one weight matrix over the union of held tickers,
+    so the risk engine values all portfolios together instead of once per user.
+    """
+    logger.info("Starting daily job: Computing risk reports...")
+
+    user_ids = sorted({holding['user_id'] for holding in repository.get_all_holdings()})
+
+    user_weights = {}
+    for user_id in user_ids:
+        snapshot = get_portfolio_snapshot(user_id)
+        if snapshot['total_value'] > 0:
+            user_weights[user_id] = {ticker: value / snapshot['total_value'] for ticker, value in snapshot_position_values(snapshot).items()}
+    if not user_weights:
+        logger.info("No priced portfolios found; skipping risk reports.")
+        return
+
+    tickers = sorted({ticker for weights in user_weights.values() for ticker in weights})
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=365 * 5)
+    price_history_data = {}
+    for ticker in tickers:
+        history = price_service.get_historical_prices(ticker, start_date.isoformat(), end_date.isoformat())
+        if history:
+            df = pd.DataFrame(history)
+            df['date'] = pd.to_datetime(df['date'])
+            df.set_index('date', inplace=True)
+            price_history_data[ticker] = df['close']
+    price_history_df = pd.DataFrame(price_history_data).ffill().dropna()
+    if price_history_df.empty:
+        logger.info("Not enough overlapping price history; skipping risk reports.")
+        return
+
+    # One row per user, normalized over the tickers with price history
+    weight_matrix = np.array([[weights.get(ticker, 0.0) for ticker in price_history_df.columns] for weights in user_weights.values()])
+    weight_sums = weight_matrix.sum(axis=1, keepdims=True)
+    weight_matrix = np.divide(weight_matrix, weight_sums, out=np.zeros_like(weight_matrix), where=weight_sums > 0)
+
+    var_metrics = calculate_var_metrics(price_history_df, weight_matrix, confidence=confidence, horizon_days=horizon_days, seed=0)
+    shocks, covered = scenario_shocks(get_scenario_price_history(list(price_history_df.columns)).reindex(columns=price_history_df.columns))
+    stress_results = stress_test(shocks, weight_matrix, covered)
+
+    for index, user_id in enumerate(user_weights):
+        if weight_sums[index, 0] <= 0:
+            logger.info("No priced holdings with history for user %s; skipping risk report.", user_id)
+            continue
+        report_entry = {
+            "user_id": user_id,
+            "date": end_date.isoformat(),
+            "report": portfolio_risk_report(var_metrics, stress_results, index) # Stored as JSONB in Supabase, JSON text in SQLite
+        }
+        if repository.insert_risk_report(report_entry):
+            logger.info("Saved risk report for user %s.", user_id)
+        else:
+            logger.warning("Failed to save risk report for user %s.", user_id)
+
+    logger.info("Finished daily job: Computing risk reports.")
 
 if __name__ == "__main__":
+    configure_logging()
     refresh_historical_and_latest_prices()
-    recompute_snapshots()
\ No newline at end of file
+    recompute_snapshots()
+    update_online_risk_metrics()
+    compute_risk_reports()
\ No newline at end of file
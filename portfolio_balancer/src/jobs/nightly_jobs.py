@@ -1,14 +1,15 @@
 from datetime import datetime, timedelta
-from portfolio_balancer.src.api.models import Asset # Removed Portfolio as it's not used
 from portfolio_balancer.src.api.price_service import PriceService
-from portfolio_balancer.src.evaluation.metrics import calculate_volatility, calculate_correlation # Corrected import path
-from supabase import create_client, Client
+from portfolio_balancer.src.evaluation.metrics import calculate_daily_returns, calculate_annualized_volatility
+from portfolio_balancer.src.api.services import get_asset_class_mapping
+from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
+from portfolio_balancer.src.optimization.mvo_cache import DEFAULT_MVO_PARAMS, mvo_window, group_by_ticker_set, get_cached_mvo, store_mvo_result
+from portfolio_balancer.src.data.repository import repository
 import os
-import json
+import pandas as pd
+from portfolio_balancer.src.api.structured_logging import configure_logging, get_logger
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+logger = get_logger(__name__)
 
 price_service = PriceService()
 
@@ -17,20 +18,18 @@ def precompute_common_stats():
     Nightly job to precompute common financial statistics (volatility, correlations)
     for all unique assets across all portfolios.
     """
-    print("Starting nightly job: Precomputing common stats...")
+    logger.info("Starting nightly job: Precomputing common stats...")
 
     # Fetch all portfolios to get unique assets
     # Fetch all holdings to get unique assets, as 'portfolios' table does not exist
-    response = supabase.table('holding').select("ticker").execute()
+    holdings_data = repository.get_all_holdings()
     unique_tickers = set()
-    if response.data:
-        for holding_data in response.data:
+    if holdings_data:
+        for holding_data in holdings_data:
             if 'ticker' in holding_data:
                 unique_tickers.add(holding_data['ticker'])
     
-    tickers = list(unique_tickers)
-
-    tickers = list(unique_assets.keys())
+    tickers = sorted(unique_tickers)
 
     # Fetch historical prices for all unique tickers for the last year
     # This assumes we need a year's worth of data for volatility/correlation
@@ -40,18 +39,18 @@ def precompute_common_stats():
     historical_prices = {}
     for ticker in tickers:
         prices = price_service.get_historical_prices(ticker, one_year_ago.isoformat(), today.isoformat())
-        historical_prices[ticker] = {p['date']: p['close_price'] for p in prices}
+        historical_prices[ticker] = {p['date']: p['close'] for p in prices}
 
-    # Precompute Volatility
+    # Precompute Volatility (annualized, of daily returns)
     volatility_data = {}
     for ticker in tickers:
         prices_df = price_service._prices_to_dataframe(historical_prices[ticker])
-        if not prices_df.empty:
-            volatility = calculate_volatility(prices_df['close_price'])
+        if len(prices_df) > 2:
+            volatility = float(calculate_annualized_volatility(calculate_daily_returns(prices_df))['close_price'])
             volatility_data[ticker] = volatility
-            print(f"Volatility for {ticker}: {volatility:.4f}")
+            logger.debug("Volatility for %s: %.4f", ticker, volatility)
         else:
-            print(f"Not enough data to calculate volatility for {ticker}")
+            logger.warning("Not enough data to calculate volatility for %s", ticker)
 
     # Precompute Correlations
     correlation_data = {}
@@ -67,17 +66,18 @@ def precompute_common_stats():
             else:
                 all_prices_df = all_prices_df.join(temp_df, how='outer')
         
-        all_prices_df.fillna(method='ffill', inplace=True) # Forward fill missing data
-        all_prices_df.fillna(method='bfill', inplace=True) # Backward fill remaining missing data
+        all_prices_df = all_prices_df.sort_index().ffill() # Forward fill missing data
+        all_prices_df = all_prices_df.bfill() # Backward fill remaining missing data
 
-        if not all_prices_df.empty:
-            correlations_df = calculate_correlation(all_prices_df)
+        if len(all_prices_df) > 2:
+            # Correlations of daily returns
+            correlations_df = calculate_daily_returns(all_prices_df).corr()
             correlation_data = correlations_df.to_dict()
-            print("Correlations:\n", correlations_df)
+            logger.debug("Correlations:\n%s", correlations_df)
         else:
-            print("Not enough common data to calculate correlations.")
+            logger.info("Not enough common data to calculate correlations.")
     else:
-        print("Need at least two assets to calculate correlations.")
+        logger.info("Need at least two assets to calculate correlations.")
 
     # Save precomputed stats to Supabase (e.g., in a 'precomputed_stats' table)
     # This table would need to be created in Supabase
@@ -87,13 +87,78 @@ def precompute_common_stats():
         "correlations": correlation_data
     }
 
-    response = supabase.table('precomputed_stats').insert(stats_entry).execute()
-    if response.data:
-        print("Saved precomputed stats to Supabase.")
+    if repository.insert_precomputed_stats(stats_entry):
+        logger.info("Saved precomputed stats to the database.")
     else:
-        print(f"Failed to save precomputed stats to Supabase: {response.error}")
+        logger.warning("Failed to save precomputed stats to the database.")
+
+    logger.info("Finished nightly job: Precomputing common stats.")
+
+# Generous budget: precomputed results are only stored when the solver completes
+MVO_PRECOMPUTE_TIME_LIMIT = float(os.environ.get("MVO_PRECOMPUTE_TIME_LIMIT", 120))
+
+def precompute_mvo_results(param_sets: list = None):
+    """
+    Nightly job to solve Markowitz MVO once per distinct set of held tickers.
+
+    Users holding exactly the same tickers get identical results for the same window and parameters,
+    so users are grouped by ticker set and each group is solved once. Results go to the MVO result
+    cache, which /api/portfolio/mvo/<user_id> reads before solving.
+
+    Args:
+        param_sets (list): MVO parameter dicts (see mvo_params) to precompute. Defaults to the endpoint's defaults.
+    """
+    logger.info("Starting nightly job: Precomputing MVO results...")
+    param_sets = param_sets or [DEFAULT_MVO_PARAMS]
+
+    user_tickers = {}
+    for holding_data in repository.get_all_holdings():
+        user_tickers.setdefault(holding_data['user_id'], []).append(holding_data['ticker'])
+    groups = group_by_ticker_set(user_tickers)
+    logger.info("%s users hold %s distinct ticker sets.", len(user_tickers), len(groups))
+
+    window = mvo_window()
+    price_series = {} # Each ticker's prices are fetched once across groups
+    solved = 0
+    for tickers, user_ids in groups.items():
+        for params in param_sets:
+            if get_cached_mvo(tickers, params, window) is not None:
+                continue
+
+            for ticker in tickers:
+                if ticker not in price_series:
+                    history = price_service.get_historical_prices(ticker, window[0], window[1])
+                    if history:
+                        df = pd.DataFrame(history)
+                        df['date'] = pd.to_datetime(df['date'])
+                        df.set_index('date', inplace=True)
+                        price_series[ticker] = df['close']
+                    else:
+                        price_series[ticker] = None
+
+            # Same inputs as the endpoint: liquid tickers only, overlapping dates only
+            price_history_df = pd.DataFrame({t: price_series[t] for t in tickers if price_series[t] is not None}).dropna()
+            if price_history_df.empty:
+                logger.info("Not enough price history for ticker set %s; skipping.", list(tickers))
+                continue
+
+            try:
+                mvo_result = markowitz_mvo(
+                    price_history=price_history_df,
+                    asset_class_mapping=get_asset_class_mapping(list(tickers)),
+                    time_limit=MVO_PRECOMPUTE_TIME_LIMIT,
+                    **params
+                )
+            except Exception as e:
+                logger.warning("MVO failed for ticker set %s: %s", list(tickers), e)
+                continue
+            if store_mvo_result(tickers, params, window, mvo_result):
+                solved += 1
+                logger.debug("Precomputed MVO for %s (%s users).", list(tickers), len(user_ids))
 
-    print("Finished nightly job: Precomputing common stats.")
+    logger.info("Finished nightly job: Precomputing MVO results (%s solved).", solved)
 
 if __name__ == "__main__":
-    precompute_common_stats()
\ No newline at end of file
+    configure_logging()
+    precompute_common_stats()
+    precompute_mvo_results()
\ No newline at end of file
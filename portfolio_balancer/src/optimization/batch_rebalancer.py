@@ -0,0 +1,187 @@
+import numpy as np
+from portfolio_balancer.src.optimization.lot_rounding import round_to_lots
+
+def batch_deterministic_rebalance(
+    holdings: np.ndarray,
+    target_weights: np.ndarray,
+    prices: np.ndarray,
+    cash: np.ndarray = None,
+    cash_weights: np.ndarray = None,
+    total_values: np.ndarray = None,
+    min_trade_threshold: float = 0.01,
+    min_cash_reserve=0.0,
+    fees_per_trade: float = 0.0,
+    round_to_nearest_share: bool = False
+) -> dict:
+    """
+    Vectorized version of deterministic_rebalance for many accounts sharing one ticker set.
+
+    Every account is rebalanced with the same rules as deterministic_rebalance (sells first,
+    then buys from smallest to largest while cash lasts), but all accounts are processed
+    together with array operations instead of one dict-based call per account.
+
+    Args:
+        holdings (np.ndarray): (accounts x tickers) matrix of share amounts, excluding cash.
+        target_weights (np.ndarray): (accounts x tickers) matrix of target weights for the non-cash tickers.
+        prices (np.ndarray): (tickers,) vector of current prices. Tickers with a missing or zero price
+                             are valued at zero and never rounded to whole shares.
+        cash (np.ndarray): (accounts,) cash balances. Defaults to zero.
+        cash_weights (np.ndarray): (accounts,) target cash weights (the 'CASH' entry of target_weights
+                                   in deterministic_rebalance). Defaults to zero.
+        total_values (np.ndarray): (accounts,) total portfolio values. Defaults to holdings @ prices + cash.
+        min_trade_threshold (float): Minimum dollar amount for a trade to be executed.
+        min_cash_reserve (float or np.ndarray): Minimum cash amount to maintain, scalar or per account.
+        fees_per_trade (float): Fixed fee per trade (buy or sell).
+        round_to_nearest_share (bool): If True, trades in priced tickers are whole shares, chosen together
+                                       by round_to_lots as in deterministic_rebalance.
+
+    Returns:
+        dict: A dictionary of arrays:
+            - "buy_amounts": (accounts x tickers) dollar amounts bought.
+            - "sell_amounts": (accounts x tickers) dollar amounts sold.
+            - "cash_sell_amounts": (accounts,) excess cash released, as the 'CASH' sell trade of deterministic_rebalance.
+            - "skipped_buys": (accounts x tickers) buys that were wanted but not affordable.
+            - "post_trade_values": (accounts x tickers) estimated post-trade position values.
+            - "post_trade_cash": (accounts,) estimated post-trade cash.
+            - "post_trade_weights_est": (accounts x tickers) estimated post-trade weights.
+            - "post_trade_cash_weight_est": (accounts,) estimated post-trade cash weight.
+    """
+    holdings = np.atleast_2d(np.asarray(holdings, dtype=float))
+    target_weights = np.atleast_2d(np.asarray(target_weights, dtype=float))
+    prices = np.asarray(prices, dtype=float)
+    num_accounts, num_tickers = holdings.shape
+
+    if target_weights.shape != holdings.shape:
+        raise ValueError("target_weights must have the same (accounts x tickers) shape as holdings.")
+    if prices.shape != (num_tickers,):
+        raise ValueError("prices must have one entry per ticker column of holdings.")
+
+    cash = np.zeros(num_accounts) if cash is None else np.broadcast_to(np.asarray(cash, dtype=float), (num_accounts,)).copy()
+    cash_weights = np.zeros(num_accounts) if cash_weights is None else np.broadcast_to(np.asarray(cash_weights, dtype=float), (num_accounts,))
+    min_cash_reserve = np.broadcast_to(np.asarray(min_cash_reserve, dtype=float), (num_accounts,))
+
+    values = holdings * np.where(np.isfinite(prices), prices, 0.0)
+    if total_values is None:
+        total_values = values.sum(axis=1) + cash
+    else:
+        total_values = np.broadcast_to(np.asarray(total_values, dtype=float), (num_accounts,))
+
+    # Calculate delta dollars
+    delta = target_weights * total_values[:, None] - values
+    cash_delta = cash_weights * total_values - cash
+
+    # Adjust for minimum cash reserve
+    below_reserve = (cash + cash_delta < min_cash_reserve) & (cash_delta < 0)
+    cash_delta = np.where(below_reserve, np.maximum(cash_delta, min_cash_reserve - cash), cash_delta)
+
+    # Whole-share trades in priced tickers are chosen together by the lot-rounding stage after the sells,
+    # so they are left out of the per-trade sells and buys.
+    priced = np.isfinite(prices) & (prices > 0)
+    lot_trades = (priced & (np.abs(delta) >= min_trade_threshold)) if round_to_nearest_share else np.zeros_like(delta, dtype=bool)
+
+    # Process sells first to generate cash for buys. Sells never depend on cash, so they are
+    # applied all at once.
+    sell_wanted = np.where(delta < 0, -delta, 0.0)
+    sell_amounts = np.where((sell_wanted >= min_trade_threshold) & ~lot_trades, sell_wanted, 0.0)
+
+    # A negative cash delta is recorded as a 'CASH' sell; like the single-account engine it only costs a fee.
+    cash_sell_wanted = np.where(cash_delta < 0, -cash_delta, 0.0)
+    cash_sell_amounts = np.where(cash_sell_wanted >= min_trade_threshold, cash_sell_wanted, 0.0)
+
+    num_sells = np.count_nonzero(sell_amounts, axis=1) + (cash_sell_amounts > 0)
+    available_cash = cash + sell_amounts.sum(axis=1) - fees_per_trade * num_sells
+
+    buy_wanted = np.where((delta > 0) & (delta >= min_trade_threshold) & ~lot_trades, delta, 0.0)
+    buy_candidates = buy_wanted > 0
+
+    # Round the priced trades to whole shares, leaving the cash the remaining buys still need
+    lot_buy_amounts = np.zeros_like(delta)
+    if lot_trades.any():
+        pending_buys = buy_wanted.sum(axis=1) + fees_per_trade * buy_candidates.sum(axis=1)
+        lots = round_to_lots(
+            target_values=target_weights * total_values[:, None],
+            current_shares=holdings,
+            prices=prices,
+            cash=available_cash,
+            cash_targets=cash + cash_delta + pending_buys,
+            tradable=lot_trades,
+            fees_per_trade=fees_per_trade,
+            min_cash_reserve=min_cash_reserve
+        )
+        lot_amounts = lots['trade_shares'] * np.where(priced, prices, 0.0)
+        sell_amounts = sell_amounts + np.where(lot_amounts < 0, -lot_amounts, 0.0)
+        lot_buy_amounts = np.where(lot_amounts > 0, lot_amounts, 0.0)
+        available_cash = lots['cash']
+
+    # Process buys from smallest to largest, each account spending its own cash.
+    order = np.argsort(np.where(buy_candidates, delta, np.inf), axis=1, kind='stable')
+    rows = np.arange(num_accounts)
+    executed = np.zeros_like(buy_candidates)
+    for rank in range(num_tickers):
+        cols = order[:, rank]
+        candidate = buy_candidates[rows, cols]
+        if not candidate.any():
+            break
+        required_cash = buy_wanted[rows, cols] + fees_per_trade
+        affordable = candidate & (available_cash >= required_cash)
+        available_cash = np.where(affordable, available_cash - required_cash, available_cash)
+        executed[rows[affordable], cols[affordable]] = True
+
+    buy_amounts = np.where(executed, buy_wanted, 0.0) + lot_buy_amounts
+    lot_buys_missed = lot_trades & (delta >= min_trade_threshold) & (lot_buy_amounts == 0)
+
+    post_trade_values = values - sell_amounts + buy_amounts
+    post_trade_cash = available_cash
+    final_total_values = post_trade_values.sum(axis=1) + post_trade_cash
+    safe_totals = np.where(final_total_values > 0, final_total_values, 1.0)
+
+    return {
+        "buy_amounts": buy_amounts,
+        "sell_amounts": sell_amounts,
+        "cash_sell_amounts": cash_sell_amounts,
+        "skipped_buys": (buy_candidates & ~executed) | lot_buys_missed,
+        "post_trade_values": post_trade_values,
+        "post_trade_cash": post_trade_cash,
+        "post_trade_weights_est": np.where(final_total_values[:, None] > 0, post_trade_values / safe_totals[:, None], 0.0),
+        "post_trade_cash_weight_est": np.where(final_total_values > 0, post_trade_cash / safe_totals, 0.0)
+    }
+
+def batch_result_to_trades(batch_result: dict, tickers: list, account_index: int) -> dict:
+    """
+    Converts one account of a batch_deterministic_rebalance result into the dict format returned by
+    deterministic_rebalance.
+
+    Args:
+        batch_result (dict): Output of batch_deterministic_rebalance.
+        tickers (list): Ticker names for the columns of the batch matrices.
+        account_index (int): Row of the account to convert.
+
+    Returns:
+        dict: A dictionary containing:
+            - "trades": List of trade dictionaries (action, ticker, amount), sells first.
+            - "post_trade_weights_est": Estimated post-trade weights for tickers with a position or trade, plus CASH.
+    """
+    buys = batch_result['buy_amounts'][account_index]
+    sells = batch_result['sell_amounts'][account_index]
+    cash_sell = batch_result['cash_sell_amounts'][account_index]
+
+    sell_trades = [(tickers[i], sells[i]) for i in np.flatnonzero(sells)]
+    if cash_sell > 0:
+        sell_trades.append(('CASH', cash_sell))
+    buy_trades = [(tickers[i], buys[i]) for i in np.flatnonzero(buys)]
+
+    trades = [{"action": "SELL", "ticker": ticker, "amount": float(amount)}
+              for ticker, amount in sorted(sell_trades, key=lambda item: item[1], reverse=True)]
+    trades += [{"action": "BUY", "ticker": ticker, "amount": float(amount)}
+               for ticker, amount in sorted(buy_trades, key=lambda item: item[1])]
+
+    weights = batch_result['post_trade_weights_est'][account_index]
+    values = batch_result['post_trade_values'][account_index]
+    post_trade_weights_est = {tickers[i]: float(weights[i]) for i in range(len(tickers))
+                              if values[i] != 0 or buys[i] > 0 or sells[i] > 0}
+    post_trade_weights_est['CASH'] = float(batch_result['post_trade_cash_weight_est'][account_index])
+
+    return {
+        "trades": trades,
+        "post_trade_weights_est": post_trade_weights_est
+    }
@@ -1,7 +1,210 @@
+import threading
+import time
 import cvxpy as cp
 import numpy as np
 import pandas as pd
+from portfolio_balancer.src.optimization.rebalancer import deterministic_rebalance
+from portfolio_balancer.src.optimization.batch_rebalancer import batch_deterministic_rebalance
+from portfolio_balancer.src.optimization.lot_rounding import round_to_lots
+from portfolio_balancer.src.optimization.solver_budget import solve_with_budget, is_budget_exhausted, elapsed_ms
+from portfolio_balancer.src.optimization.solver_policy import select_solver
+from portfolio_balancer.src.api.tracing import traced
+from portfolio_balancer.src.api.structured_logging import get_logger
 
+logger = get_logger(__name__)
+
+# Compiled rebalance problems keyed by the number of non-cash assets. The problem data lives in
+# cp.Parameters, so cvxpy canonicalizes each problem once and later solves only swap in new values.
+_REBALANCE_PROBLEMS = {}
+_REBALANCE_PROBLEMS_LOCK = threading.Lock()
+
+# Cost per unit of L2 deviation beyond the epsilon band. It is far above the marginal cost of trading
+# (at most a few units per unit of weight), so the band holds exactly whenever it can be met, and targets
+# that cannot be met (e.g. weights not summing to 1) still give the closest answer instead of none.
+_BAND_PENALTY = 1e3
+
+def _build_rebalance_problem(num_assets: int) -> dict:
+    """
+    Builds the parameterized (DPP) rebalance problem for num_assets non-cash assets.
+
+    Everything is expressed in weights (dollars / total_value) so the problem is scale-free:
+        w_new    = current_w + buy - sell
+        cash_new = cash_w + sum(sell) - sum(buy) - fees
+    The fixed fee per trade is not convex, so it is modelled by its convex envelope on [0, trade_cap]:
+    fee_slope_i = fee_w / trade_cap_i, with trade_cap_i the largest trade we expect for asset i.
+    The minimum trade threshold is applied after solving; the L1 turnover cost already keeps the
+    number of small trades down. The epsilon band on the deviation from the targets is an exact penalty
+    rather than a constraint, so the problem stays feasible for any targets.
+    """
+    current_w = cp.Parameter(num_assets, nonneg=True, name="current_w")
+    target_w = cp.Parameter(num_assets, nonneg=True, name="target_w")
+    fee_slope = cp.Parameter(num_assets, nonneg=True, name="fee_slope")
+    cash_w = cp.Parameter(name="cash_w")
+    target_cash_w = cp.Parameter(nonneg=True, name="target_cash_w")
+    reserve_w = cp.Parameter(nonneg=True, name="reserve_w")
+    epsilon = cp.Parameter(nonneg=True, name="epsilon")
+
+    buy = cp.Variable(num_assets, nonneg=True, name="buy")
+    sell = cp.Variable(num_assets, nonneg=True, name="sell")
+
+    turnover = buy + sell
+    fees = fee_slope @ turnover
+    w_new = current_w + buy - sell
+    cash_new = cash_w + cp.sum(sell) - cp.sum(buy) - fees
+    deviation = cp.hstack([w_new - target_w, cp.reshape(cash_new - target_cash_w, (1,), order='C')])
+
+    # Minimize trading (turnover plus estimated fees) while staying within epsilon of the target weights.
+    band_excess = cp.pos(cp.norm(deviation, 2) - epsilon)
+    objective = cp.Minimize(cp.sum(turnover) + fees + cp.sum_squares(deviation) + _BAND_PENALTY * band_excess)
+    constraints = [
+        w_new >= 0,                         # No short selling
+        cash_new >= reserve_w               # Buys and fees are funded by cash and sells, keeping the reserve
+    ]
+
+    return {
+        "problem": cp.Problem(objective, constraints),
+        "parameters": {
+            "current_w": current_w,
+            "target_w": target_w,
+            "fee_slope": fee_slope,
+            "cash_w": cash_w,
+            "target_cash_w": target_cash_w,
+            "reserve_w": reserve_w,
+            "epsilon": epsilon
+        },
+        "buy": buy,
+        "sell": sell,
+        "lock": threading.Lock()
+    }
+
+def _get_rebalance_problem(num_assets: int) -> dict:
+    """Returns the cached compiled rebalance problem for num_assets non-cash assets, building it on first use."""
+    with _REBALANCE_PROBLEMS_LOCK:
+        entry = _REBALANCE_PROBLEMS.get(num_assets)
+        if entry is None:
+            entry = _build_rebalance_problem(num_assets)
+            _REBALANCE_PROBLEMS[num_assets] = entry
+        return entry
+
+def _solve_rebalance(
+    current_values: np.ndarray,
+    current_cash: float,
+    target_w: np.ndarray,
+    target_cash_w: float,
+    total_value: float,
+    min_trade_threshold: float,
+    min_cash_reserve: float,
+    fees_per_trade: float,
+    epsilon: float,
+    time_limit: float = None,
+    max_iters: int = None,
+    started_at: float = None,
+    solver: str = None
+) -> tuple:
+    """
+    Solves the cached rebalance problem for one account within the given solver budget.
+
+    Returns:
+        tuple: (solve_result, buy_amounts, sell_amounts) where solve_result comes from solve_with_budget
+               and the dollar arrays are None if the problem was not solved.
+    """
+    entry = _get_rebalance_problem(len(current_values))
+    params = entry["parameters"]
+
+    current_w = np.maximum(current_values / total_value, 0)
+    fee_w = fees_per_trade / total_value
+    # Largest trade we expect per asset: the full drift plus the allowed band.
+    trade_cap = np.maximum(np.abs(target_w - current_w) + epsilon, max(min_trade_threshold / total_value, 1e-9))
+
+    with entry["lock"]:
+        params["current_w"].value = current_w
+        params["target_w"].value = np.maximum(target_w, 0)
+        params["fee_slope"].value = fee_w / trade_cap
+        params["cash_w"].value = current_cash / total_value
+        params["target_cash_w"].value = max(target_cash_w, 0)
+        params["reserve_w"].value = max(min_cash_reserve, 0) / total_value
+        params["epsilon"].value = max(epsilon, 0)
+
+        solver = solver or select_solver('rebalance', len(current_values))
+        solve_result = solve_with_budget(entry["problem"], time_limit=time_limit, max_iters=max_iters, solver=solver, started_at=started_at)
+        if not solve_result["solved"]:
+            return solve_result, None, None
+        # Early-stopped iterates can carry tiny negative trades; clip them before thresholding.
+        buy_amounts = np.maximum(entry["buy"].value, 0) * total_value
+        sell_amounts = np.maximum(entry["sell"].value, 0) * total_value
+        return solve_result, buy_amounts, sell_amounts
+
+def _apply_trade_threshold(buy_amounts: np.ndarray, sell_amounts: np.ndarray, min_trade_threshold: float) -> tuple:
+    """Drops trades below min_trade_threshold and nets out any simultaneous buy and sell of one asset."""
+    buy_amounts = np.where(buy_amounts >= min_trade_threshold, buy_amounts, 0.0)
+    sell_amounts = np.where(sell_amounts >= min_trade_threshold, sell_amounts, 0.0)
+    net = buy_amounts - sell_amounts
+    return np.maximum(net, 0.0), np.maximum(-net, 0.0)
+
+def _round_trades_to_lots(holdings, buy_amounts, sell_amounts, prices, cash, min_cash_reserve, fees_per_trade) -> tuple:
+    """
+    Turns solver trades into whole shares with round_to_lots, aiming at the post-trade positions and cash
+    the solver chose. Only traded positions with a known price are rounded; other trades are kept as they are.
+    All arrays are (accounts x tickers), except prices (tickers,) and cash (accounts,).
+    """
+    priced = np.isfinite(prices) & (prices > 0)
+    traded = (buy_amounts > 0) | (sell_amounts > 0)
+    tradable = traded & priced
+    unrounded = traded & ~tradable
+
+    # Cash before the rounded trades, and the cash the solver's trades would have left
+    start_cash = cash + np.where(unrounded, sell_amounts - buy_amounts, 0.0).sum(axis=1) - fees_per_trade * unrounded.sum(axis=1)
+    cash_targets = cash + (sell_amounts - buy_amounts).sum(axis=1) - fees_per_trade * traded.sum(axis=1)
+
+    lots = round_to_lots(
+        target_values=holdings * np.where(priced, prices, 0.0) + buy_amounts - sell_amounts,
+        current_shares=holdings,
+        prices=prices,
+        cash=start_cash,
+        cash_targets=cash_targets,
+        tradable=tradable,
+        fees_per_trade=fees_per_trade,
+        min_cash_reserve=min_cash_reserve
+    )
+    lot_amounts = lots['trade_shares'] * np.where(priced, prices, 0.0)
+    return (np.where(tradable, np.maximum(lot_amounts, 0.0), buy_amounts),
+            np.where(tradable, np.maximum(-lot_amounts, 0.0), sell_amounts))
+
+def _fund_buys_after_fees(buy_amounts, sell_amounts, cash, min_cash_reserve, fees_per_trade, min_trade_threshold, share_prices=None):
+    """
+    Cuts back buys that would leave cash below the reserve once every trade pays its full fixed fee.
+
+    The solver only sees the convex envelope of the fees, which undercounts them for small trades, so
+    its cash constraint can be off by up to a fee per trade. Buys are cut smallest first, since dropping
+    a trade also saves its fee; a buy cut below min_trade_threshold is dropped. Positions with a share
+    price in share_prices (rounded to whole shares) are cut by whole shares.
+    All arrays are (accounts x tickers), except cash (accounts,) and share_prices (tickers,).
+
+    Returns:
+        np.ndarray: The funded buy amounts. Accounts still short after dropping every buy keep their sells.
+    """
+    buy_amounts = buy_amounts.copy()
+    num_trades = np.count_nonzero(buy_amounts, axis=1) + np.count_nonzero(sell_amounts, axis=1)
+    post_cash = cash + sell_amounts.sum(axis=1) - buy_amounts.sum(axis=1) - fees_per_trade * num_trades
+    for i in np.flatnonzero(post_cash < min_cash_reserve - 1e-9):
+        shortfall = min_cash_reserve - post_cash[i]
+        for j in np.argsort(buy_amounts[i], kind='stable'):
+            if shortfall <= 1e-9:
+                break
+            amount = buy_amounts[i, j]
+            if amount <= 0:
+                continue
+            price = share_prices[j] if share_prices is not None else np.nan
+            cut = np.ceil(shortfall / price - 1e-9) * price if np.isfinite(price) and price > 0 else shortfall
+            if amount - cut < max(min_trade_threshold, 1e-9):
+                buy_amounts[i, j] = 0.0
+                shortfall -= amount + fees_per_trade
+            else:
+                buy_amounts[i, j] = amount - cut
+                shortfall -= cut
+    return buy_amounts
+
+@traced()
 def cvxpy_rebalance(
     current_portfolio: dict,
     target_weights: dict,
@@ -10,7 +213,11 @@ def cvxpy_rebalance(
     min_trade_threshold: float = 0.01,
     min_cash_reserve: float = 0.0,
     fees_per_trade: float = 0.0,
-    epsilon: float = 0.01 # Tolerance for deviation from target weights
+    epsilon: float = 0.01, # Tolerance for deviation from target weights
+    time_limit: float = None,
+    max_iters: int = None,
+    solver: str = None,
+    round_to_nearest_share: bool = False
 ) -> dict:
     """
     Calculates trades needed to rebalance a portfolio to target weights using cvxpy optimization.
@@ -28,185 +235,104 @@ def cvxpy_rebalance(
         min_cash_reserve (float): Minimum cash amount to maintain in the portfolio.
         fees_per_trade (float): Fixed fee per trade (buy or sell).
         epsilon (float): Maximum allowed deviation from target weights (L2 norm).
+        time_limit (float): Optional wall-clock budget in seconds for the whole call.
+        max_iters (int): Optional cap on solver iterations.
+        solver (str): cvxpy solver to use. Defaults to select_solver('rebalance', num_assets).
+        round_to_nearest_share (bool): If True, the optimized trades in assets with a known price are
+                                       turned into whole shares with round_to_lots.
 
     Returns:
         dict: A dictionary containing:
             - "trades": List of trade dictionaries (action, ticker, amount).
             - "post_trade_weights_est": Estimated post-trade weights.
+            - "solve_path": "solver", "solver_partial" (best feasible iterate when the budget ran out)
+                            or "fallback_deterministic" (deterministic_rebalance, when the solver found no
+                            feasible answer, e.g. because of the budget or a cash reserve above the portfolio value).
+            - "solve_time_ms": Wall-clock time taken to produce the answer.
+            - "solver", "solver_iterations": Solver that ran and its iteration count, when it ran.
     """
-    
-    # Prepare data
-    tickers = sorted(list(set(current_portfolio.keys()) | set(target_weights.keys())))
-    
-    current_values = np.array([current_portfolio.get(t, {}).get('value', current_portfolio.get(t, {}).get('amount', 0) * current_portfolio.get(t, {}).get('price', 0)) for t in tickers])
-    current_weights = current_values / total_value if total_value > 0 else np.zeros_like(current_values)
-    
-    target_w = np.array([target_weights.get(t, 0) for t in tickers])
-    
-    prices = np.array([asset_prices.get(t, 1) for t in tickers]) # Use 1 for cash or if price not available
-
-    # Define optimization variables
-    # w_new: new portfolio weights
-    # x_buy: dollar amount to buy for each asset
-    # x_sell: dollar amount to sell for each asset
-    w_new = cp.Variable(len(tickers), name="w_new")
-    x_buy = cp.Variable(len(tickers), name="x_buy")
-    x_sell = cp.Variable(len(tickers), name="x_sell")
-
-    # Objective: Minimize transaction costs (sum of buys and sells)
-    # We also want to stay close to target weights.
-    # A common approach is to minimize the L1 norm of trades, or a combination.
-    # Let's minimize the sum of absolute trades (buys + sells)
-    # and also penalize deviation from target weights.
-    
-    # Penalize deviation from target weights (L2 norm)
-    objective = cp.Minimize(cp.sum(x_buy) + cp.sum(x_sell) + cp.sum_squares(w_new - target_w))
-
-    # Constraints
-    constraints = []
-
-    # 1. New weights must sum to 1
-    constraints.append(cp.sum(w_new) == 1)
-
-    # 2. Non-negativity of new weights and trades
-    constraints.append(w_new >= 0)
-    constraints.append(x_buy >= 0)
-    constraints.append(x_sell >= 0)
-
-    # 3. Relationship between current value, trades, and new value
-    # current_value_i + x_buy_i - x_sell_i = new_value_i
-    # new_value_i / total_value = w_new_i
-    # So, (current_value_i + x_buy_i - x_sell_i) / total_value = w_new_i
-    # Assuming total_value remains constant for simplicity in this equation,
-    # or we can make total_value a variable if we want to optimize for it.
-    # For rebalancing, total_value is usually given.
-    
-    # If total_value is fixed, then new_value_i = w_new_i * total_value
-    # current_values[i] + x_buy[i] - x_sell[i] == w_new[i] * total_value
-    constraints.append(current_values + x_buy - x_sell == w_new * total_value)
-
-    # 4. Cannot simultaneously buy and sell the same asset
-    # This is implicitly handled by x_buy and x_sell being non-negative and separate variables.
-    # However, for numerical stability or to enforce strictness, one might add:
-    # x_buy[i] * x_sell[i] == 0 (non-convex) or using indicator variables (more complex).
-    # For simplicity, we rely on the solver to find a solution where this is true.
-
-    # 5. Cash constraint
-    # Calculate cash after trades
-    # Initial cash: current_portfolio.get('CASH', {}).get('value', 0)
-    # Cash from sells: sum(x_sell)
-    # Cash used for buys: sum(x_buy)
-    # Fees: sum(indicator_buy) * fees_per_trade + sum(indicator_sell) * fees_per_trade
-    
-    # For simplicity, let's assume fees are deducted from cash.
-    # This requires knowing which trades actually happen.
-    # A common way to handle fixed fees in convex optimization is to use a penalty
-    # or to approximate them. For now, let's simplify the cash constraint.
-    
-    # Total cash available for buys (from initial cash + sells)
-    total_cash_available = current_portfolio.get('CASH', {}).get('value', 0) + cp.sum(x_sell)
-    
-    # Total cash needed for buys + fees
-    total_cash_needed = cp.sum(x_buy) + fees_per_trade * (cp.sum(cp.ceil(x_buy / min_trade_threshold)) + cp.sum(cp.ceil(x_sell / min_trade_threshold))) # Approximation for number of trades
-    
-    # Ensure cash after trades meets minimum reserve
-    # This is tricky because cash is also an asset.
-    # Let's treat CASH as a regular asset in `tickers` and `w_new`.
-    # The `min_cash_reserve` can be enforced by setting a minimum target weight for CASH
-    # or by adding a specific constraint for the cash variable.
-    
-    # If 'CASH' is one of the tickers:
-    cash_idx = -1
-    if 'CASH' in tickers:
-        cash_idx = tickers.index('CASH')
-        # Ensure cash weight is at least min_cash_reserve / total_value
-        constraints.append(w_new[cash_idx] * total_value >= min_cash_reserve)
-        
-        # Ensure total cash available covers non-cash buys and fees
-        # This is a more robust way to handle cash.
-        # Sum of all non-cash buys + fees <= current cash + sum of non-cash sells
-        non_cash_buy_sum = cp.sum([x_buy[i] for i in range(len(tickers)) if i != cash_idx])
-        non_cash_sell_sum = cp.sum([x_sell[i] for i in range(len(tickers)) if i != cash_idx])
-        
-        # Approximate number of trades for fees
-        num_buys = cp.sum([cp.ceil(x_buy[i] / min_trade_threshold) for i in range(len(tickers)) if i != cash_idx])
-        num_sells = cp.sum([cp.ceil(x_sell[i] / min_trade_threshold) for i in range(len(tickers)) if i != cash_idx])
-        
-        total_fees = fees_per_trade * (num_buys + num_sells)
-        
-        constraints.append(non_cash_buy_sum + total_fees <= current_values[cash_idx] + non_cash_sell_sum)
-    
-    # 6. Ignore tiny trades (using big-M formulation or similar for binary variables)
-    # This is complex in pure convex optimization without mixed-integer programming.
-    # For a purely convex problem, we can't strictly enforce "ignore tiny trades"
-    # without introducing binary variables (which makes it mixed-integer convex program).
-    # A common approximation is to penalize small trades in the objective.
-    # Or, we can apply the threshold *after* solving the optimization.
-    
-    # Let's apply the threshold after solving for simplicity, as the prompt implies
-    # a purely convex optimization.
-    
-    # Problem definition
-    problem = cp.Problem(objective, constraints)
-
-    # Solve the problem
-    try:
-        problem.solve()
-    except Exception as e:
-        print(f"Error solving cvxpy problem: {e}")
-        return {
-            "trades": [],
-            "post_trade_weights_est": {},
-            "error": str(e)
-        }
+    started_at = time.perf_counter()
+
+    # Prepare data. CASH is the funding account rather than a traded asset.
+    tickers = sorted(list((set(current_portfolio.keys()) | set(target_weights.keys())) - {'CASH'}))
+
+    def position_value(ticker):
+        position = current_portfolio.get(ticker, {})
+        if 'value' in position:
+            return position['value']
+        return position.get('amount', 0) * position.get('price', asset_prices.get(ticker, 0))
 
-    if problem.status not in ["optimal", "optimal_near"]:
-        print(f"Problem status: {problem.status}")
+    current_values = np.array([position_value(t) for t in tickers], dtype=float)
+    current_cash = position_value('CASH')
+    target_w = np.array([target_weights.get(t, 0) for t in tickers], dtype=float)
+
+    if total_value <= 0 or not tickers:
         return {
             "trades": [],
             "post_trade_weights_est": {},
-            "error": f"Optimization problem could not be solved to optimality. Status: {problem.status}"
+            "solve_path": None,
+            "solve_time_ms": elapsed_ms(started_at)
         }
 
-    # Extract results
-    new_weights = w_new.value
-    buy_amounts = x_buy.value
-    sell_amounts = x_sell.value
+    solve_result, buy_amounts, sell_amounts = _solve_rebalance(
+        current_values, current_cash, target_w, target_weights.get('CASH', 0), total_value,
+        min_trade_threshold, min_cash_reserve, fees_per_trade, epsilon,
+        time_limit=time_limit, max_iters=max_iters, started_at=started_at, solver=solver
+    )
+    solver_stats = {"solver": solve_result.get("solver"), "solver_iterations": solve_result.get("num_iters")}
+
+    if buy_amounts is None:
+        if is_budget_exhausted(solve_result):
+            logger.warning("cvxpy rebalance stopped without a feasible answer (status: %s). Falling back to deterministic rebalance.", solve_result['status'])
+        else:
+            logger.warning("cvxpy rebalance problem has no feasible answer (status: %s). Falling back to deterministic rebalance.", solve_result['status'])
+        fallback_result = deterministic_rebalance(
+            current_portfolio=current_portfolio,
+            target_weights=target_weights,
+            total_value=total_value,
+            min_trade_threshold=min_trade_threshold,
+            min_cash_reserve=min_cash_reserve,
+            fees_per_trade=fees_per_trade,
+            round_to_nearest_share=round_to_nearest_share,
+            asset_prices=asset_prices
+        )
+        fallback_result.update({
+            "solve_path": "fallback_deterministic",
+            "solver_status": solve_result['status'],
+            "solve_time_ms": elapsed_ms(started_at),
+            **solver_stats
+        })
+        return fallback_result
+
+    buy_amounts, sell_amounts = _apply_trade_threshold(buy_amounts, sell_amounts, min_trade_threshold)
+    share_prices = None
+    if round_to_nearest_share:
+        share_prices = np.array([asset_prices.get(t, np.nan) or np.nan for t in tickers], dtype=float)
+        holdings = np.array([current_portfolio.get(t, {}).get('amount', current_values[i] / share_prices[i] if share_prices[i] > 0 else 0.0)
+                             for i, t in enumerate(tickers)], dtype=float)
+        buy_amounts, sell_amounts = _round_trades_to_lots(
+            holdings[None, :], buy_amounts[None, :], sell_amounts[None, :], share_prices,
+            np.array([current_cash], dtype=float), min_cash_reserve, fees_per_trade
+        )
+        buy_amounts, sell_amounts = buy_amounts[0], sell_amounts[0]
+    buy_amounts = _fund_buys_after_fees(
+        buy_amounts[None, :], sell_amounts[None, :], np.array([current_cash], dtype=float),
+        min_cash_reserve, fees_per_trade, min_trade_threshold, share_prices
+    )[0]
 
     trades = []
     post_trade_values = {}
-
     for i, ticker in enumerate(tickers):
-        current_val = current_values[i]
-        
-        # Apply min_trade_threshold
-        buy_val = buy_amounts[i] if buy_amounts[i] >= min_trade_threshold else 0
-        sell_val = sell_amounts[i] if sell_amounts[i] >= min_trade_threshold else 0
-
-        # Ensure we don't buy and sell the same asset (due to thresholding)
-        if buy_val > 0 and sell_val > 0:
-            if buy_val > sell_val:
-                buy_val -= sell_val
-                sell_val = 0
-            else:
-                sell_val -= buy_val
-                buy_val = 0
-
-        if buy_val > 0:
-            trades.append({"action": "BUY", "ticker": ticker, "amount": buy_val})
-            current_val += buy_val
-        if sell_val > 0:
-            trades.append({"action": "SELL", "ticker": ticker, "amount": sell_val})
-            current_val -= sell_val
-        
-        post_trade_values[ticker] = current_val
-
-    # Adjust for fees (simplified: deduct from cash after all trades)
-    total_fees_incurred = len(trades) * fees_per_trade
-    if 'CASH' in post_trade_values:
-        post_trade_values['CASH'] -= total_fees_incurred
-        if post_trade_values['CASH'] < min_cash_reserve:
-            print(f"Warning: Cash reserve fell below minimum after fees. Current cash: {post_trade_values['CASH']}")
+        if sell_amounts[i] > 0:
+            trades.append({"action": "SELL", "ticker": ticker, "amount": float(sell_amounts[i])})
+        if buy_amounts[i] > 0:
+            trades.append({"action": "BUY", "ticker": ticker, "amount": float(buy_amounts[i])})
+        post_trade_values[ticker] = current_values[i] + buy_amounts[i] - sell_amounts[i]
+
+    # Buys are funded from cash, sells go to cash, and fees are deducted from cash.
+    post_trade_values['CASH'] = current_cash + sell_amounts.sum() - buy_amounts.sum() - len(trades) * fees_per_trade
+    if post_trade_values['CASH'] < min_cash_reserve:
+        logger.warning("Cash reserve fell below minimum after fees. Current cash: %s", post_trade_values['CASH'])
 
     # Estimate post-trade weights
     final_total_value = sum(post_trade_values.values())
@@ -215,5 +341,143 @@ def cvxpy_rebalance(
 
     return {
         "trades": trades,
-        "post_trade_weights_est": post_trade_weights_est
-    }
\ No newline at end of file
+        "post_trade_weights_est": post_trade_weights_est,
+        "solve_path": solve_result['solve_path'],
+        "solve_time_ms": elapsed_ms(started_at),
+        **solver_stats
+    }
+
+@traced()
+def cvxpy_rebalance_batch(
+    holdings: np.ndarray,
+    target_weights: np.ndarray,
+    prices: np.ndarray,
+    cash: np.ndarray = None,
+    cash_weights: np.ndarray = None,
+    min_trade_threshold: float = 0.01,
+    min_cash_reserve: float = 0.0,
+    fees_per_trade: float = 0.0,
+    epsilon: float = 0.01,
+    time_limit: float = None,
+    max_iters: int = None,
+    solver: str = None,
+    round_to_nearest_share: bool = False
+) -> dict:
+    """
+    Runs cvxpy_rebalance for many accounts sharing one ticker set.
+
+    The rebalance problem is compiled once for the ticker count; each account only updates the
+    problem parameters and re-solves. Inputs and outputs follow batch_deterministic_rebalance,
+    so batch_result_to_trades can convert any row to the single-account format.
+
+    Args:
+        holdings (np.ndarray): (accounts x tickers) matrix of share amounts, excluding cash.
+        target_weights (np.ndarray): (accounts x tickers) matrix of target weights for the non-cash tickers.
+        prices (np.ndarray): (tickers,) vector of current prices.
+        cash (np.ndarray): (accounts,) cash balances. Defaults to zero.
+        cash_weights (np.ndarray): (accounts,) target cash weights. Defaults to zero.
+        min_trade_threshold (float): Minimum dollar amount for a trade to be executed.
+        min_cash_reserve (float): Minimum cash amount to maintain in each portfolio.
+        fees_per_trade (float): Fixed fee per trade (buy or sell).
+        epsilon (float): Maximum allowed deviation from target weights (L2 norm).
+        time_limit (float): Optional wall-clock budget in seconds per account.
+        max_iters (int): Optional cap on solver iterations per account.
+        solver (str): cvxpy solver to use. Defaults to select_solver('rebalance', num_tickers).
+        round_to_nearest_share (bool): If True, trades in priced tickers are turned into whole shares
+                                       with round_to_lots.
+
+    Returns:
+        dict: A dictionary of arrays with the keys of batch_deterministic_rebalance, plus:
+            - "status": List of solver statuses, one per account. Accounts that could not be solved are
+                        rebalanced with batch_deterministic_rebalance instead.
+            - "solve_path": List of solve paths, one per account, as in cvxpy_rebalance.
+            - "solve_time_ms": Wall-clock time taken for the whole batch.
+    """
+    batch_started_at = time.perf_counter()
+    holdings = np.atleast_2d(np.asarray(holdings, dtype=float))
+    target_weights = np.atleast_2d(np.asarray(target_weights, dtype=float))
+    prices = np.asarray(prices, dtype=float)
+    num_accounts, num_tickers = holdings.shape
+
+    if target_weights.shape != holdings.shape:
+        raise ValueError("target_weights must have the same (accounts x tickers) shape as holdings.")
+    if prices.shape != (num_tickers,):
+        raise ValueError("prices must have one entry per ticker column of holdings.")
+
+    cash = np.zeros(num_accounts) if cash is None else np.broadcast_to(np.asarray(cash, dtype=float), (num_accounts,))
+    cash_weights = np.zeros(num_accounts) if cash_weights is None else np.broadcast_to(np.asarray(cash_weights, dtype=float), (num_accounts,))
+
+    values = holdings * np.where(np.isfinite(prices), prices, 0.0)
+    total_values = values.sum(axis=1) + cash
+
+    buy_amounts = np.zeros_like(values)
+    sell_amounts = np.zeros_like(values)
+    cash_sell_amounts = np.zeros(num_accounts)
+    statuses = []
+    solve_paths = []
+    fallback_rows = []
+    for i in range(num_accounts):
+        if total_values[i] <= 0:
+            statuses.append("empty")
+            solve_paths.append(None)
+            continue
+        solve_result, buys, sells = _solve_rebalance(
+            values[i], cash[i], target_weights[i], cash_weights[i], total_values[i],
+            min_trade_threshold, min_cash_reserve, fees_per_trade, epsilon,
+            time_limit=time_limit, max_iters=max_iters, solver=solver
+        )
+        statuses.append(solve_result['status'])
+        solve_paths.append(solve_result['solve_path'])
+        if buys is not None:
+            buy_amounts[i], sell_amounts[i] = _apply_trade_threshold(buys, sells, min_trade_threshold)
+        else:
+            fallback_rows.append(i)
+
+    solved = np.array([path in ['solver', 'solver_partial'] for path in solve_paths], dtype=bool)
+    if solved.any():
+        if round_to_nearest_share:
+            buy_amounts[solved], sell_amounts[solved] = _round_trades_to_lots(
+                holdings[solved], buy_amounts[solved], sell_amounts[solved], prices,
+                cash[solved], min_cash_reserve, fees_per_trade
+            )
+        buy_amounts[solved] = _fund_buys_after_fees(
+            buy_amounts[solved], sell_amounts[solved], cash[solved], min_cash_reserve, fees_per_trade,
+            min_trade_threshold, prices if round_to_nearest_share else None
+        )
+
+    num_trades = np.count_nonzero(buy_amounts, axis=1) + np.count_nonzero(sell_amounts, axis=1)
+    post_trade_values = values + buy_amounts - sell_amounts
+    post_trade_cash = cash + sell_amounts.sum(axis=1) - buy_amounts.sum(axis=1) - num_trades * fees_per_trade
+
+    # Accounts the solver could not answer (budget, or no feasible trades) are rebalanced deterministically,
+    # all in one vectorized call.
+    if fallback_rows:
+        fallback = batch_deterministic_rebalance(
+            holdings[fallback_rows], target_weights[fallback_rows], prices,
+            cash=cash[fallback_rows], cash_weights=cash_weights[fallback_rows],
+            min_trade_threshold=min_trade_threshold, min_cash_reserve=min_cash_reserve,
+            fees_per_trade=fees_per_trade, round_to_nearest_share=round_to_nearest_share
+        )
+        buy_amounts[fallback_rows] = fallback['buy_amounts']
+        sell_amounts[fallback_rows] = fallback['sell_amounts']
+        cash_sell_amounts[fallback_rows] = fallback['cash_sell_amounts']
+        post_trade_values[fallback_rows] = fallback['post_trade_values']
+        post_trade_cash[fallback_rows] = fallback['post_trade_cash']
+        for i in fallback_rows:
+            solve_paths[i] = "fallback_deterministic"
+    final_total_values = post_trade_values.sum(axis=1) + post_trade_cash
+    safe_totals = np.where(final_total_values > 0, final_total_values, 1.0)
+
+    return {
+        "buy_amounts": buy_amounts,
+        "sell_amounts": sell_amounts,
+        "cash_sell_amounts": cash_sell_amounts,
+        "skipped_buys": np.zeros_like(values, dtype=bool),
+        "post_trade_values": post_trade_values,
+        "post_trade_cash": post_trade_cash,
+        "post_trade_weights_est": np.where(final_total_values[:, None] > 0, post_trade_values / safe_totals[:, None], 0.0),
+        "post_trade_cash_weight_est": np.where(final_total_values > 0, post_trade_cash / safe_totals, 0.0),
+        "status": statuses,
+        "solve_path": solve_paths,
+        "solve_time_ms": elapsed_ms(batch_started_at)
+    }
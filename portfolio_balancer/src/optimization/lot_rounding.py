@@ -0,0 +1,198 @@
+import time
+import numpy as np
+
+# Weight of the squared cash shortfall below the reserve, relative to squared tracking error in dollars.
+# Large enough that restoring the reserve always wins over tracking the targets more closely.
+_RESERVE_PENALTY = 1e3
+
+# Positions considered on each side of a swap; every pair among them is evaluated.
+_SWAP_CANDIDATES = 8
+
+def _move_deltas(direction, trade_shares, prices, errors, cash, cash_gap, min_cash_reserve, fees_per_trade):
+    """
+    Objective change and post-move cash for trading one more share of every position in `direction` (+1 buy, -1 sell).
+
+    The objective is sum((value - target)^2) + (cash - cash_target)^2 + penalty * shortfall^2. A move also
+    adds a fee when it turns an untouched position into a trade, and refunds one when it cancels a trade.
+    """
+    fee_change = fees_per_trade * ((trade_shares + direction != 0).astype(float) - (trade_shares != 0))
+    new_cash = cash[:, None] - direction * prices - fee_change
+    position_delta = 2 * direction * prices * errors + prices**2
+    cash_targets = (cash - cash_gap)[:, None]
+    cash_delta = (new_cash - cash_targets)**2 - cash_gap[:, None]**2
+    old_shortfall = np.maximum(min_cash_reserve - cash, 0.0)[:, None]
+    new_shortfall = np.maximum(min_cash_reserve[:, None] - new_cash, 0.0)
+    penalty_delta = _RESERVE_PENALTY * (new_shortfall**2 - old_shortfall**2)
+    return position_delta + cash_delta + penalty_delta, new_cash
+
+def round_to_lots(
+    target_values: np.ndarray,
+    current_shares: np.ndarray,
+    prices: np.ndarray,
+    cash: np.ndarray,
+    cash_targets: np.ndarray = None,
+    tradable: np.ndarray = None,
+    fees_per_trade: float = 0.0,
+    min_cash_reserve=0.0,
+    max_iters: int = None,
+    time_limit: float = None
+) -> dict:
+    """
+    Turns fractional dollar targets into whole-share trades for many accounts at once.
+
+    Minimizes the squared dollar tracking error of the positions and of cash, without letting cash fall
+    below the reserve (or further below it, if it already is). This is a heuristic rather than a MIP:
+        1. Buys are rounded down and sells to the nearest whole share.
+        2. Greedy knapsack fill: in order of tracking gain per dollar, each position buys one more
+           share if that lowers the error and the cash allows it.
+        3. Bounded local search: each step applies, per account, the best of buying one share,
+           selling one share, or swapping one share for another, until nothing improves or the
+           account's iteration budget runs out.
+    All steps are vectorized across accounts and tickers. Holdings may be fractional; only the trades
+    are whole shares, and a position is never sold below zero. Without a time_limit an account's result
+    depends only on its own row, so rounding it alone or in a batch gives the same trades.
+
+    Args:
+        target_values (np.ndarray): (accounts x tickers) desired post-trade dollar value of each position.
+        current_shares (np.ndarray): (accounts x tickers) shares held before trading.
+        prices (np.ndarray): (tickers,) share prices. Columns without a positive price are never traded.
+        cash (np.ndarray): (accounts,) cash available before these trades.
+        cash_targets (np.ndarray): (accounts,) desired post-trade cash. Defaults to the cash the fractional
+                                   targets would leave, so trades are self-financing.
+        tradable (np.ndarray): (accounts x tickers) positions that may be traded. Others keep their shares.
+                               Defaults to every position with a positive price.
+        fees_per_trade (float): Fixed fee per position traded, deducted from cash.
+        min_cash_reserve (float or np.ndarray): Minimum cash to keep, scalar or per account.
+        max_iters (int): Maximum local search steps per account. Defaults to twice the number of positions
+                         the account may trade.
+        time_limit (float): Optional wall-clock budget in seconds, counted from the call; the local search stops
+                            once it is spent. This makes the trades depend on machine load, so it is off by default.
+
+    Returns:
+        dict: A dictionary containing:
+            - "trade_shares": (accounts x tickers) whole shares bought (positive) or sold (negative).
+            - "shares": (accounts x tickers) shares held after trading.
+            - "cash": (accounts,) cash after trading and fees.
+            - "tracking_error": (accounts,) root of the squared dollar tracking error, cash included.
+            - "iterations": Local search steps taken (by the account that took the most).
+    """
+    started_at = time.perf_counter()
+    target_values = np.atleast_2d(np.asarray(target_values, dtype=float))
+    current_shares = np.atleast_2d(np.asarray(current_shares, dtype=float))
+    prices = np.asarray(prices, dtype=float)
+    num_accounts, num_tickers = target_values.shape
+
+    cash = np.broadcast_to(np.asarray(cash, dtype=float), (num_accounts,))
+    min_cash_reserve = np.broadcast_to(np.asarray(min_cash_reserve, dtype=float), (num_accounts,))
+    priced = np.isfinite(prices) & (prices > 0)
+    tradable = np.broadcast_to(priced, target_values.shape) if tradable is None else (np.asarray(tradable, dtype=bool) & priced)
+    safe_prices = np.where(priced, prices, 1.0)
+    current_values = current_shares * safe_prices
+    target_values = np.where(tradable, target_values, current_values)
+    # Whole shares that can be sold without going short. The small tolerance keeps holdings that are
+    # whole numbers up to float error from losing a share.
+    sellable_shares = np.floor(np.maximum(current_shares, 0.0) + 1e-9)
+
+    if cash_targets is None:
+        cash_targets = cash + np.where(tradable, current_values - target_values, 0.0).sum(axis=1)
+    cash_targets = np.broadcast_to(np.asarray(cash_targets, dtype=float), (num_accounts,))
+
+    def settle(trade_shares):
+        """Cash after the trades, fees included."""
+        return cash - (trade_shares * safe_prices).sum(axis=1) - fees_per_trade * (trade_shares != 0).sum(axis=1)
+
+    # 1. Round buys down and sells to the nearest share, so the starting point never spends cash it has
+    #    not raised. The same tolerance keeps buys that are whole up to float error.
+    desired_shares = (target_values - current_values) / safe_prices
+    trade_shares = np.where(desired_shares > 0, np.floor(desired_shares + 1e-9), np.round(desired_shares))
+    trade_shares = np.where(tradable, np.maximum(trade_shares, -sellable_shares), 0.0)
+    post_cash = settle(trade_shares)
+
+    # 2. Greedy knapsack fill, one rank at a time across all accounts.
+    errors = (current_shares + trade_shares) * safe_prices - target_values
+    gain_per_dollar = np.where(tradable, -errors / safe_prices - 0.5, -np.inf)
+    order = np.argsort(-gain_per_dollar, axis=1, kind='stable')
+    rows = np.arange(num_accounts)
+    for rank in range(num_tickers):
+        cols = order[:, rank]
+        candidate = tradable[rows, cols]
+        if not candidate.any():
+            break
+        errors_rank = ((current_shares[rows, cols] + trade_shares[rows, cols]) * safe_prices[cols] - target_values[rows, cols])[:, None]
+        delta, new_cash = _move_deltas(
+            1, trade_shares[rows, cols][:, None], safe_prices[cols][:, None],
+            errors_rank, post_cash, post_cash - cash_targets, min_cash_reserve, fees_per_trade
+        )
+        accept = candidate & (delta[:, 0] < 0) & (new_cash[:, 0] >= np.minimum(min_cash_reserve, post_cash))
+        trade_shares[rows[accept], cols[accept]] += 1
+        post_cash = np.where(accept, new_cash[:, 0], post_cash)
+
+    # 3. Bounded local search over single-share buys, sells and swaps.
+    # The default budget is counted per account, from its own tradable positions, so it does not depend on
+    # the other accounts or columns of the batch.
+    max_iters = 2 * tradable.sum(axis=1) if max_iters is None else np.full(num_accounts, max_iters)
+    num_candidates = min(num_tickers, _SWAP_CANDIDATES)
+    active = max_iters > 0
+    iterations = 0
+    while active.any() and (time_limit is None or time.perf_counter() - started_at < time_limit):
+        iterations += 1
+        errors = (current_shares + trade_shares) * safe_prices - target_values
+        cash_gap = post_cash - cash_targets
+        cash_floor = np.minimum(min_cash_reserve, post_cash)[:, None]
+        can_sell = tradable & (trade_shares > -sellable_shares)
+
+        buy_delta, buy_cash = _move_deltas(1, trade_shares, safe_prices, errors, post_cash, cash_gap, min_cash_reserve, fees_per_trade)
+        sell_delta, _ = _move_deltas(-1, trade_shares, safe_prices, errors, post_cash, cash_gap, min_cash_reserve, fees_per_trade)
+        buy_delta = np.where(tradable & (buy_cash >= cash_floor), buy_delta, np.inf)
+        sell_delta = np.where(can_sell, sell_delta, np.inf)
+
+        # Swaps: pair the best few positions to buy with the best few to sell (ranked by their own tracking
+        # gain, ignoring cash) and evaluate every pair exactly.
+        position_buy = np.where(tradable, 2 * safe_prices * errors + safe_prices**2, np.inf)
+        position_sell = np.where(can_sell, -2 * safe_prices * errors + safe_prices**2, np.inf)
+        buy_cols = np.argpartition(position_buy, num_candidates - 1, axis=1)[:, :num_candidates]
+        sell_cols = np.argpartition(position_sell, num_candidates - 1, axis=1)[:, :num_candidates]
+        pair_rows = rows[:, None, None]
+        buy_i, sell_j = buy_cols[:, :, None], sell_cols[:, None, :]
+        fee_change = fees_per_trade * ((trade_shares[pair_rows, buy_i] + 1 != 0).astype(float) - (trade_shares[pair_rows, buy_i] != 0)
+                                       + (trade_shares[pair_rows, sell_j] - 1 != 0) - (trade_shares[pair_rows, sell_j] != 0))
+        swap_cash = post_cash[:, None, None] - safe_prices[buy_i] + safe_prices[sell_j] - fee_change
+        swap_delta = (position_buy[pair_rows, buy_i] + position_sell[pair_rows, sell_j]
+                      + (swap_cash - cash_targets[:, None, None])**2 - cash_gap[:, None, None]**2
+                      + _RESERVE_PENALTY * (np.maximum(min_cash_reserve[:, None, None] - swap_cash, 0.0)**2
+                                            - np.maximum(min_cash_reserve - post_cash, 0.0)[:, None, None]**2))
+        swap_ok = np.isfinite(swap_delta) & (buy_i != sell_j) & (swap_cash >= cash_floor[:, :, None])
+        swap_delta = np.where(swap_ok, swap_delta, np.inf).reshape(num_accounts, -1)
+        best_pair = np.argmin(swap_delta, axis=1)
+        swap_buy = buy_cols[rows, best_pair // num_candidates]
+        swap_sell = sell_cols[rows, best_pair % num_candidates]
+        swap_delta = swap_delta[rows, best_pair]
+
+        best_buy = np.argmin(buy_delta, axis=1)
+        best_sell = np.argmin(sell_delta, axis=1)
+        candidates = np.stack([buy_delta[rows, best_buy], sell_delta[rows, best_sell], swap_delta], axis=1)
+        move = np.argmin(candidates, axis=1)
+        # Relative tolerance so float noise cannot make two moves undo each other forever.
+        improves = active & (candidates[rows, move] < -1e-9 * (1 + np.abs(target_values).sum(axis=1)))
+
+        buy_rows = improves & (move == 0)
+        trade_shares[rows[buy_rows], best_buy[buy_rows]] += 1
+        sell_rows = improves & (move == 1)
+        trade_shares[rows[sell_rows], best_sell[sell_rows]] -= 1
+        swap_rows = improves & (move == 2)
+        trade_shares[rows[swap_rows], swap_buy[swap_rows]] += 1
+        trade_shares[rows[swap_rows], swap_sell[swap_rows]] -= 1
+
+        post_cash = np.where(improves, settle(trade_shares), post_cash)
+        active = improves & (iterations < max_iters)
+
+    shares = current_shares + trade_shares
+    tracking_error = np.sqrt(((shares * safe_prices - target_values)**2).sum(axis=1) + (post_cash - cash_targets)**2)
+
+    return {
+        "trade_shares": trade_shares,
+        "shares": shares,
+        "cash": post_cash,
+        "tracking_error": tracking_error,
+        "iterations": iterations
+    }
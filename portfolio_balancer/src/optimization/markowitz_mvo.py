@@ -1,8 +1,81 @@
+import time
 import cvxpy as cp
 import numpy as np
 import pandas as pd
 from portfolio_balancer.src.evaluation.metrics import calculate_daily_returns, calculate_covariance_matrix
+from portfolio_balancer.src.optimization.solver_budget import solve_with_budget, is_budget_exhausted, elapsed_ms
+from portfolio_balancer.src.optimization.solver_policy import select_solver
+from portfolio_balancer.src.api.tracing import traced
+from portfolio_balancer.src.api.structured_logging import get_logger
 
+logger = get_logger(__name__)
+
+def minimum_variance_weights(cov_matrix: np.ndarray) -> np.ndarray:
+    """
+    Fast path for the long-only minimum-variance portfolio without a solver.
+
+    Solves the closed-form minimum-variance weights (Sigma^-1 1 / 1' Sigma^-1 1) and drops assets that
+    come out negative until all remaining weights are non-negative. This is a close approximation of
+    the constrained optimum and ignores asset class limits.
+
+    Args:
+        cov_matrix (np.ndarray): Covariance matrix of asset returns.
+
+    Returns:
+        np.ndarray: Long-only weights summing to 1.
+    """
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
+    num_assets = cov_matrix.shape[0]
+    # Small ridge so singular covariance matrices (duplicate or constant assets) stay solvable.
+    ridge = 1e-10 * max(np.trace(cov_matrix) / max(num_assets, 1), 1e-12)
+    active = np.ones(num_assets, dtype=bool)
+    weights = np.zeros(num_assets)
+
+    for _ in range(num_assets):
+        active_cov = cov_matrix[np.ix_(active, active)] + ridge * np.eye(active.sum())
+        active_weights = np.linalg.solve(active_cov, np.ones(active.sum()))
+        if np.all(active_weights >= 0):
+            weights[active] = active_weights
+            break
+        active_indices = np.flatnonzero(active)
+        active[active_indices[active_weights < 0]] = False
+        if not active.any():
+            break
+
+    if weights.sum() <= 0:
+        weights = np.ones(num_assets)
+    return weights / weights.sum()
+
+def _mvo_result(
+    optimal_weights_array: np.ndarray,
+    assets: list,
+    expected_daily_returns: pd.Series,
+    cov_matrix: pd.DataFrame,
+    risk_free_rate: float,
+    status: str
+) -> dict:
+    """Builds the markowitz_mvo result dictionary for a weight vector."""
+    optimal_weights = {assets[i]: w for i, w in enumerate(optimal_weights_array)}
+
+    # Calculate actual expected return and volatility for the optimal portfolio
+    final_expected_daily_return = np.sum(expected_daily_returns.values * optimal_weights_array)
+    final_portfolio_variance_daily = np.dot(optimal_weights_array.T, np.dot(cov_matrix.values, optimal_weights_array))
+    final_portfolio_volatility_daily = np.sqrt(final_portfolio_variance_daily)
+
+    final_expected_annual_return = (1 + final_expected_daily_return)**252 - 1
+    final_portfolio_volatility_annual = final_portfolio_volatility_daily * np.sqrt(252)
+
+    final_sharpe_ratio = (final_expected_annual_return - risk_free_rate) / final_portfolio_volatility_annual if final_portfolio_volatility_annual > 0 else 0
+
+    return {
+        "optimal_weights": optimal_weights,
+        "expected_return": final_expected_annual_return,
+        "expected_volatility": final_portfolio_volatility_annual,
+        "sharpe_ratio": final_sharpe_ratio,
+        "status": status
+    }
+
+@traced()
 def markowitz_mvo(
     price_history: pd.DataFrame,
     risk_free_rate: float = 0.01,
@@ -10,7 +83,10 @@ def markowitz_mvo(
     max_equities_weight: float = None, # Constraint for conservative profiles
     max_bonds_weight: float = None,
     max_cash_weight: float = None,
-    asset_class_mapping: dict = None # Ticker to asset class mapping
+    asset_class_mapping: dict = None, # Ticker to asset class mapping
+    time_limit: float = None, # Wall-clock budget in seconds
+    max_iters: int = None,
+    solver: str = None # cvxpy solver name; chosen from the solver policy by default
 ) -> dict:
     """
     Performs Markowitz Mean-Variance Optimization to find optimal portfolio weights.
@@ -25,6 +101,9 @@ def markowitz_mvo(
         max_bonds_weight (float): Maximum allowed weight for bonds.
         max_cash_weight (float): Maximum allowed weight for cash.
         asset_class_mapping (dict): Dictionary mapping tickers to their asset classes.
+        time_limit (float): Optional wall-clock budget in seconds for the whole call.
+        max_iters (int): Optional cap on solver iterations.
+        solver (str): cvxpy solver to use. Defaults to select_solver('mvo', num_assets).
 
     Returns:
         dict: A dictionary containing:
@@ -33,8 +112,13 @@ def markowitz_mvo(
             - "expected_volatility": Annualized expected volatility of the optimal portfolio.
             - "sharpe_ratio": Sharpe Ratio of the optimal portfolio.
             - "status": Optimization status.
+            - "solve_path": "solver", "solver_partial" (best feasible iterate when the budget ran out)
+                            or "fallback_min_variance" (minimum_variance_weights, when no feasible iterate was found).
+            - "solve_time_ms": Wall-clock time taken to produce the answer.
+            - "solver", "solver_iterations": Solver that ran and its iteration count, when it ran.
     """
-    
+    started_at = time.perf_counter()
+
     daily_returns = calculate_daily_returns(price_history)
     
     # Calculate expected returns (historical mean) and covariance matrix
@@ -76,17 +160,30 @@ def markowitz_mvo(
 
     # Portfolio expected return and volatility
     portfolio_expected_return_daily = cp.sum(cp.multiply(expected_daily_returns.values, weights))
-    portfolio_variance_daily = cp.quad_form(weights, cov_matrix.values)
+    if len(daily_returns) - 1 < num_assets:
+        # Fewer observations than assets: w' S w equals the squared norm of the centered returns
+        # times w, which is a much smaller problem than the dense n x n quadratic form.
+        centered_returns = (daily_returns - expected_daily_returns).values / np.sqrt(max(len(daily_returns) - 1, 1))
+        portfolio_variance_daily = cp.sum_squares(centered_returns @ weights)
+    else:
+        # A sample covariance matrix is PSD by construction; psd_wrap skips cvxpy's eigenvalue check,
+        # which is slow and can fail to converge for large or badly conditioned matrices.
+        portfolio_variance_daily = cp.quad_form(weights, cp.psd_wrap(cov_matrix.values))
     portfolio_volatility_daily = cp.sqrt(portfolio_variance_daily)
 
-    # Annualized portfolio return and volatility
-    portfolio_expected_return_annual = (1 + portfolio_expected_return_daily)**252 - 1
+    # Daily variances are ~1e-5, below the default tolerances of first-order solvers (OSQP, SCS).
+    # Scaling the objective by the average asset variance does not move the optimum but keeps
+    # every solver accurate.
+    variance_scale = 1 / max(float(np.mean(np.diag(cov_matrix.values))), 1e-12)
+
+    # Annualized portfolio volatility
     portfolio_volatility_annual = portfolio_volatility_daily * np.sqrt(252)
 
     if target_return is not None:
-        # Minimize variance for a target return
-        constraints.append(portfolio_expected_return_annual >= target_return)
-        objective = cp.Minimize(portfolio_variance_daily)
+        # Minimize variance for a target return. (1 + r)**252 is increasing, so the annual target is
+        # applied as the equivalent daily return, which keeps the constraint linear (and DCP).
+        constraints.append(portfolio_expected_return_daily >= (1 + target_return)**(1 / 252) - 1)
+        objective = cp.Minimize(variance_scale * portfolio_variance_daily)
     else:
         # Maximize Sharpe Ratio
         # This is a fractional programming problem, which can be transformed into a convex one.
@@ -129,55 +226,50 @@ def markowitz_mvo(
         # For a simpler implementation, let's maximize expected return for a given risk budget,
         # or minimize risk for a given return target.
         # If no target_return, let's find the minimum volatility portfolio.
-        objective = cp.Minimize(portfolio_variance_daily)
+        objective = cp.Minimize(variance_scale * portfolio_variance_daily)
 
 
     # Problem definition
     problem = cp.Problem(objective, constraints)
 
     # Solve the problem
-    try:
-        problem.solve()
-    except Exception as e:
-        print(f"Error solving cvxpy MVO problem: {e}")
-        return {
-            "optimal_weights": {},
-            "expected_return": 0,
-            "expected_volatility": 0,
-            "sharpe_ratio": 0,
-            "status": "error",
-            "message": str(e)
-        }
+    solver = solver or select_solver('mvo', num_assets)
+    solve_result = solve_with_budget(problem, time_limit=time_limit, max_iters=max_iters, solver=solver, started_at=started_at)
+    solver_stats = {"solver": solve_result.get("solver"), "solver_iterations": solve_result.get("num_iters")}
 
-    if problem.status not in ["optimal", "optimal_near"]:
-        print(f"Problem status: {problem.status}")
+    if not solve_result["solved"]:
+        if is_budget_exhausted(solve_result):
+            # Out of budget (or the solver failed): answer with the minimum-variance fast path instead.
+            logger.warning("MVO solve stopped without a feasible answer (status: %s). Falling back to minimum-variance weights.", solve_result['status'])
+            result = _mvo_result(minimum_variance_weights(cov_matrix.values), assets, expected_daily_returns, cov_matrix, risk_free_rate, solve_result["status"])
+            result.update({
+                "solve_path": "fallback_min_variance",
+                "solve_time_ms": elapsed_ms(started_at),
+                **solver_stats
+            })
+            return result
+
+        logger.debug("Problem status: %s", solve_result['status'])
         return {
             "optimal_weights": {},
             "expected_return": 0,
             "expected_volatility": 0,
             "sharpe_ratio": 0,
-            "status": problem.status,
-            "message": f"Optimization problem could not be solved to optimality. Status: {problem.status}"
+            "status": solve_result["status"],
+            "message": f"Optimization problem could not be solved to optimality. Status: {solve_result['status']}",
+            "solve_path": None,
+            "solve_time_ms": elapsed_ms(started_at),
+            **solver_stats
         }
 
-    # Extract results
-    optimal_weights_array = weights.value
-    optimal_weights = {assets[i]: w for i, w in enumerate(optimal_weights_array)}
-
-    # Calculate actual expected return and volatility for the optimal portfolio
-    final_expected_daily_return = np.sum(expected_daily_returns.values * optimal_weights_array)
-    final_portfolio_variance_daily = np.dot(optimal_weights_array.T, np.dot(cov_matrix.values, optimal_weights_array))
-    final_portfolio_volatility_daily = np.sqrt(final_portfolio_variance_daily)
-
-    final_expected_annual_return = (1 + final_expected_daily_return)**252 - 1
-    final_portfolio_volatility_annual = final_portfolio_volatility_daily * np.sqrt(252)
-    
-    final_sharpe_ratio = (final_expected_annual_return - risk_free_rate) / final_portfolio_volatility_annual if final_portfolio_volatility_annual > 0 else 0
+    # Extract results. Early-stopped iterates can be very slightly negative; clip and renormalize.
+    optimal_weights_array = np.maximum(weights.value, 0)
+    optimal_weights_array = optimal_weights_array / optimal_weights_array.sum()
 
-    return {
-        "optimal_weights": optimal_weights,
-        "expected_return": final_expected_annual_return,
-        "expected_volatility": final_portfolio_volatility_annual,
-        "sharpe_ratio": final_sharpe_ratio,
-        "status": problem.status
-    }
\ No newline at end of file
+    result = _mvo_result(optimal_weights_array, assets, expected_daily_returns, cov_matrix, risk_free_rate, problem.status)
+    result.update({
+        "solve_path": solve_result["solve_path"],
+        "solve_time_ms": elapsed_ms(started_at),
+        **solver_stats
+    })
+    return result
\ No newline at end of file
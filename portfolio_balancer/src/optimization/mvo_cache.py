@@ -0,0 +1,76 @@
+import os
+from datetime import datetime, timedelta
+from portfolio_balancer.src.data.result_cache import ResultCache, fingerprint
+
+# Bump when markowitz_mvo or the way its inputs are built changes, so stale results are not served
+MVO_CACHE_VERSION = 1
+MVO_HISTORY_DAYS = 365 * 5 # Price window used for MVO
+
+# Results are shared between the nightly precompute and the web processes through the disk tier
+mvo_cache = ResultCache("mvo", max_bytes=int(os.environ.get("MVO_CACHE_BYTES", 16 * 1024 * 1024)))
+
+def mvo_params(risk_free_rate: float = 0.01, target_return: float = None, max_equities_weight: float = None,
+               max_bonds_weight: float = None, max_cash_weight: float = None) -> dict:
+    """The markowitz_mvo parameters that determine its result, in canonical form."""
+    return {
+        "risk_free_rate": float(risk_free_rate),
+        "target_return": float(target_return) if target_return is not None else None,
+        "max_equities_weight": float(max_equities_weight) if max_equities_weight is not None else None,
+        "max_bonds_weight": float(max_bonds_weight) if max_bonds_weight is not None else None,
+        "max_cash_weight": float(max_cash_weight) if max_cash_weight is not None else None
+    }
+
+DEFAULT_MVO_PARAMS = mvo_params()
+
+def mvo_window(as_of: datetime = None, history_days: int = MVO_HISTORY_DAYS) -> tuple:
+    """
+    Price window for MVO ending on as_of (default: now).
+
+    Returns:
+        tuple: (start date, end date) as 'YYYY-MM-DD' strings.
+    """
+    end_date = as_of or datetime.now()
+    start_date = end_date - timedelta(days=history_days)
+    return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+def ticker_set(tickers) -> tuple:
+    """Sorted, de-duplicated tickers: users holding the same assets share one ticker set."""
+    return tuple(sorted(set(tickers)))
+
+def mvo_cache_key(tickers, params: dict, window: tuple) -> str:
+    """Cache key of an MVO result: ticker set, parameters and price window."""
+    return fingerprint("markowitz_mvo", MVO_CACHE_VERSION, list(ticker_set(tickers)), params, list(window))
+
+def group_by_ticker_set(user_tickers: dict) -> dict:
+    """
+    Groups users holding exactly the same assets.
+
+    Args:
+        user_tickers (dict): user id -> tickers held.
+
+    Returns:
+        dict: ticker set (tuple) -> list of user ids.
+    """
+    groups = {}
+    for user_id, tickers in user_tickers.items():
+        groups.setdefault(ticker_set(tickers), []).append(user_id)
+    return groups
+
+def get_cached_mvo(tickers, params: dict, window: tuple):
+    """Returns the stored MVO result for the ticker set, parameters and window, or None."""
+    return mvo_cache.get(mvo_cache_key(tickers, params, window))
+
+def store_mvo_result(tickers, params: dict, window: tuple, result: dict) -> bool:
+    """
+    Stores an MVO result for later requests with the same ticker set, parameters and window.
+
+    Only results the solver completed are stored: budget-limited partial answers and fallbacks
+    depend on the time limit of the call that produced them.
+
+    Returns:
+        bool: Whether the result was stored.
+    """
+    if result.get("solve_path") != "solver":
+        return False
+    mvo_cache.set(mvo_cache_key(tickers, params, window), result)
+    return True
@@ -1,5 +1,9 @@
 import pandas as pd
 import numpy as np
+from portfolio_balancer.src.optimization.lot_rounding import round_to_lots
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
 
 def deterministic_rebalance(
     current_portfolio: dict,
@@ -24,7 +28,8 @@ def deterministic_rebalance(
         min_trade_threshold (float): Minimum dollar amount for a trade to be executed.
         min_cash_reserve (float): Minimum cash amount to maintain in the portfolio.
         fees_per_trade (float): Fixed fee per trade (buy or sell).
-        round_to_nearest_share (bool): If True, trade amounts will be rounded to nearest whole share.
+        round_to_nearest_share (bool): If True, trades in assets with a known price are whole shares, chosen
+                                       together by round_to_lots to track the targets as closely as the cash allows.
         asset_prices (dict): Dictionary of current asset prices {'ticker': price}.
                              Required if round_to_nearest_share is True.
 
@@ -34,7 +39,7 @@ def deterministic_rebalance(
             - "post_trade_weights_est": Estimated post-trade weights.
     """
     trades = []
-    post_trade_values = {ticker: data.get('value', data['amount'] * data['price'])
+    post_trade_values = {ticker: data['value'] if 'value' in data else data['amount'] * data['price']
                          for ticker, data in current_portfolio.items()}
     
     # Calculate target dollar per asset
@@ -62,24 +67,52 @@ def deterministic_rebalance(
     buys = {ticker: amount for ticker, amount in delta_dollars.items() if amount > 0}
     sells = {ticker: abs(amount) for ticker, amount in delta_dollars.items() if amount < 0}
 
+    # Whole-share trades in priced assets are chosen together by the lot-rounding stage after the sells,
+    # so they are taken out of the per-trade loops below.
+    lot_tickers = []
+    if round_to_nearest_share:
+        asset_prices = asset_prices or {}
+        lot_tickers = sorted(ticker for ticker, amount in delta_dollars.items()
+                             if ticker != 'CASH' and asset_prices.get(ticker, 0) > 0 and abs(amount) >= min_trade_threshold)
+        buys = {ticker: amount for ticker, amount in buys.items() if ticker not in lot_tickers}
+        sells = {ticker: amount for ticker, amount in sells.items() if ticker not in lot_tickers}
+
     # Process sells first to generate cash for buys
     for ticker, amount in sorted(sells.items(), key=lambda item: item[1], reverse=True):
         if amount >= min_trade_threshold:
             trade_amount = amount
             if round_to_nearest_share and ticker != 'CASH':
-                if ticker not in asset_prices or asset_prices[ticker] == 0:
-                    print(f"Warning: Price for {ticker} not found, cannot round to nearest share for sell. Selling exact amount.")
-                else:
-                    num_shares = trade_amount / asset_prices[ticker]
-                    trade_amount = round(num_shares) * asset_prices[ticker]
-                    if trade_amount == 0 and num_shares > 0: # Ensure we don't round down to 0 if there's something to sell
-                        trade_amount = asset_prices[ticker] # Sell at least one share
+                logger.warning("Price for %s not found, cannot round to nearest share for sell. Selling exact amount.", ticker)
             
             if trade_amount > 0:
                 trades.append({"action": "SELL", "ticker": ticker, "amount": trade_amount})
                 post_trade_values[ticker] -= trade_amount
                 post_trade_values['CASH'] = post_trade_values.get('CASH', 0) + trade_amount - fees_per_trade
 
+    # Round the priced trades to whole shares, leaving the cash the remaining buys still need
+    if lot_tickers:
+        pending_buys = sum(amount + fees_per_trade for ticker, amount in buys.items()
+                           if ticker != 'CASH' and amount >= min_trade_threshold)
+        lot_prices = np.array([asset_prices[ticker] for ticker in lot_tickers], dtype=float)
+        current_shares = np.array([current_portfolio[ticker]['amount'] if 'amount' in current_portfolio.get(ticker, {})
+                                   else post_trade_values.get(ticker, 0) / asset_prices[ticker] for ticker in lot_tickers])
+        lots = round_to_lots(
+            target_values=np.array([[target_dollars.get(ticker, 0) for ticker in lot_tickers]]),
+            current_shares=current_shares[None, :],
+            prices=lot_prices,
+            cash=post_trade_values.get('CASH', 0),
+            cash_targets=current_cash + delta_dollars.get('CASH', 0) + pending_buys,
+            fees_per_trade=fees_per_trade,
+            min_cash_reserve=min_cash_reserve
+        )
+        lot_trades = [(ticker, shares * price) for ticker, shares, price in zip(lot_tickers, lots['trade_shares'][0], lot_prices) if shares != 0]
+
+        for ticker, amount in sorted(lot_trades, key=lambda item: item[1]):
+            action = "SELL" if amount < 0 else "BUY"
+            trades.append({"action": action, "ticker": ticker, "amount": abs(float(amount))})
+            post_trade_values[ticker] = post_trade_values.get(ticker, 0) + amount
+            post_trade_values['CASH'] = post_trade_values.get('CASH', 0) - amount - fees_per_trade
+
     # Process buys
     for ticker, amount in sorted(buys.items(), key=lambda item: item[1]):
         if ticker == 'CASH':
@@ -89,13 +122,7 @@ def deterministic_rebalance(
         if amount >= min_trade_threshold:
             trade_amount = amount
             if round_to_nearest_share:
-                if ticker not in asset_prices or asset_prices[ticker] == 0:
-                    print(f"Warning: Price for {ticker} not found, cannot round to nearest share for buy. Buying exact amount.")
-                else:
-                    num_shares = trade_amount / asset_prices[ticker]
-                    trade_amount = round(num_shares) * asset_prices[ticker]
-                    if trade_amount == 0 and num_shares > 0: # Ensure we buy at least one share if needed
-                        trade_amount = asset_prices[ticker]
+                logger.warning("Price for %s not found, cannot round to nearest share for buy. Buying exact amount.", ticker)
             
             # Ensure we have enough cash for the trade + fees
             required_cash = trade_amount + fees_per_trade
@@ -104,11 +131,11 @@ def deterministic_rebalance(
                 post_trade_values[ticker] = post_trade_values.get(ticker, 0) + trade_amount
                 post_trade_values['CASH'] -= required_cash
             else:
-                print(f"Not enough cash to buy {ticker}. Needed: {required_cash}, Available: {post_trade_values.get('CASH', 0)}")
+                logger.warning("Not enough cash to buy %s. Needed: %s, Available: %s", ticker, required_cash, post_trade_values.get('CASH', 0))
 
     # Final check for cash reserve after all trades
     if post_trade_values.get('CASH', 0) < min_cash_reserve:
-        print(f"Warning: Cash reserve fell below minimum after trades. Current cash: {post_trade_values.get('CASH', 0)}")
+        logger.warning("Cash reserve fell below minimum after trades. Current cash: %s", post_trade_values.get('CASH', 0))
 
     # Estimate post-trade weights
     final_total_value = sum(post_trade_values.values())
@@ -0,0 +1,113 @@
+import time
+import cvxpy as cp
+import numpy as np
+from portfolio_balancer.src.api.instrumentation import record_stage
+from portfolio_balancer.src.api.tracing import span
+
+# Names of the wall-clock and iteration limit options for each solver cvxpy can call.
+# ECOS has no time limit option; only its iteration cap is applied.
+SOLVER_LIMIT_OPTIONS = {
+    'CLARABEL': ('time_limit', 'max_iter'),
+    'OSQP': ('time_limit', 'max_iter'),
+    'SCS': ('time_limit_secs', 'max_iters'),
+    'ECOS': (None, 'max_iters')
+}
+
+# Solver used for budgeted solves when the caller does not pick one. Clarabel and SCS ship with cvxpy
+# and accept every problem this package builds (QPs and second-order cone constraints).
+_DEFAULT_BUDGET_SOLVERS = ['CLARABEL', 'SCS']
+
+# Maximum constraint violation for an early-stopped iterate to count as feasible.
+FEASIBILITY_TOLERANCE = 1e-6
+
+def _default_budget_solver():
+    installed = cp.installed_solvers()
+    for solver in _DEFAULT_BUDGET_SOLVERS:
+        if solver in installed:
+            return solver
+    return None
+
+def _iterate_is_feasible(problem: cp.Problem, tolerance: float) -> bool:
+    """Checks whether the variables left behind by an early-stopped solve satisfy every constraint."""
+    if any(variable.value is None for variable in problem.variables()):
+        return False
+    try:
+        return all(np.max(constraint.violation(), initial=0.0) <= tolerance for constraint in problem.constraints)
+    except (ValueError, TypeError):
+        return False
+
+def solve_with_budget(
+    problem: cp.Problem,
+    time_limit: float = None,
+    max_iters: int = None,
+    solver: str = None,
+    started_at: float = None
+) -> dict:
+    """
+    Solves a cvxpy problem under an optional wall-clock deadline and iteration cap.
+
+    Args:
+        problem (cp.Problem): The problem to solve.
+        time_limit (float): Wall-clock budget in seconds, measured from started_at.
+        max_iters (int): Maximum number of solver iterations.
+        solver (str): cvxpy solver name. Defaults to cvxpy's own choice without a budget,
+                      and to Clarabel (or SCS) with one, since those accept time limits.
+        started_at (float): time.perf_counter() value the deadline is measured from. Defaults to now,
+                            so callers can count their own setup time against the budget.
+
+    Returns:
+        dict: A dictionary containing:
+            - "solved": True if the problem variables hold a usable answer.
+            - "solve_path": "solver" for an optimal answer, "solver_partial" for an inaccurate or
+                            early-stopped but feasible iterate, None otherwise.
+            - "status": The cvxpy status, "timeout" if the budget ran out before solving, or "error".
+            - "error": The exception message if the solver raised.
+            - "solver": Name of the solver that ran, when it ran.
+            - "num_iters": Iterations reported by the solver, when available.
+    """
+    started_at = time.perf_counter() if started_at is None else started_at
+    options = {}
+
+    if time_limit is not None or max_iters is not None:
+        solver = solver or _default_budget_solver()
+        time_option, iters_option = SOLVER_LIMIT_OPTIONS.get(solver, (None, None))
+        if time_limit is not None:
+            remaining = time_limit - (time.perf_counter() - started_at)
+            if remaining <= 0:
+                return {"solved": False, "solve_path": None, "status": "timeout"}
+            if time_option:
+                options[time_option] = remaining
+        if max_iters is not None and iters_option:
+            options[iters_option] = int(max_iters)
+
+    solve_started_at = time.perf_counter()
+    with span('solver', requested_solver=solver or 'default', **options) as solve_span:
+        try:
+            problem.solve(solver=solver, **options)
+        except Exception as e:
+            record_stage('solver', solver or 'default', time.perf_counter() - solve_started_at)
+            if solve_span:
+                solve_span.set(status="error", error=str(e))
+            return {"solved": False, "solve_path": None, "status": "error", "error": str(e)}
+
+        status = problem.status
+        stats = {
+            "solver": problem.solver_stats.solver_name if problem.solver_stats else solver,
+            "num_iters": problem.solver_stats.num_iters if problem.solver_stats else None
+        }
+        record_stage('solver', stats["solver"] or 'default', time.perf_counter() - solve_started_at)
+        if solve_span:
+            solve_span.set(status=status, **stats)
+    if status == cp.OPTIMAL:
+        return {"solved": True, "solve_path": "solver", "status": status, **stats}
+    if status in [cp.OPTIMAL_INACCURATE, cp.USER_LIMIT] and _iterate_is_feasible(problem, FEASIBILITY_TOLERANCE):
+        return {"solved": True, "solve_path": "solver_partial", "status": status, **stats}
+    return {"solved": False, "solve_path": None, "status": status, **stats}
+
+def is_budget_exhausted(solve_result: dict) -> bool:
+    """True if a solve_with_budget result failed because of the budget or a solver error, not the problem itself."""
+    return not solve_result["solved"] and solve_result["status"] in ["timeout", "error", cp.USER_LIMIT, cp.OPTIMAL_INACCURATE, cp.SOLVER_ERROR]
+
+def elapsed_ms(started_at: float) -> float:
+    """Milliseconds elapsed since a time.perf_counter() reading."""
+    return round((time.perf_counter() - started_at) * 1000, 3)
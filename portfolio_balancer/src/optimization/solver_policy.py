@@ -0,0 +1,88 @@
+import functools
+import json
+import os
+import threading
+import cvxpy as cp
+from portfolio_balancer.src.api.structured_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Policy file written by scripts/benchmark_solvers.py. It maps each problem kind ('mvo', 'rebalance')
+# to size buckets, each with the solver that benchmarked fastest at that size:
+# {"problems": {"mvo": [{"max_assets": 50, "solver": "CLARABEL"}, ...], "rebalance": [...]}}
+DEFAULT_SOLVER_POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "solver_policy.json")
+
+_policy_cache = {}
+_policy_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _installed_solvers() -> frozenset:
+    return frozenset(cp.installed_solvers())
+
+def get_solver_policy_path() -> str:
+    """Returns the policy file path, overridable with the SOLVER_POLICY_PATH environment variable."""
+    return os.environ.get("SOLVER_POLICY_PATH", DEFAULT_SOLVER_POLICY_PATH)
+
+def load_solver_policy(path: str = None) -> dict:
+    """
+    Loads (and caches) the solver policy file.
+
+    Args:
+        path (str): Policy file path. Defaults to get_solver_policy_path().
+
+    Returns:
+        dict: The policy, or an empty policy if the file does not exist or cannot be read.
+    """
+    path = path or get_solver_policy_path()
+    with _policy_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return {"problems": {}}
+
+        cached = _policy_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with open(path, 'r') as f:
+                policy = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read solver policy %s: %s", path, e)
+            policy = {"problems": {}}
+
+        _policy_cache[path] = (mtime, policy)
+        return policy
+
+def save_solver_policy(policy: dict, path: str = None) -> str:
+    """Writes a solver policy file and returns its path."""
+    path = path or get_solver_policy_path()
+    with open(path, 'w') as f:
+        json.dump(policy, f, indent=2, sort_keys=True)
+    return path
+
+def select_solver(problem_kind: str, num_assets: int, policy: dict = None) -> str:
+    """
+    Chooses the solver for a problem from the benchmarked policy.
+
+    Args:
+        problem_kind (str): 'mvo' or 'rebalance'.
+        num_assets (int): Number of assets in the problem.
+        policy (dict): Policy to use instead of the policy file.
+
+    Returns:
+        str: cvxpy solver name, or None to let cvxpy choose (no policy entry, or the solver is not installed).
+    """
+    policy = load_solver_policy() if policy is None else policy
+    buckets = sorted(policy.get("problems", {}).get(problem_kind, []), key=lambda bucket: bucket["max_assets"])
+    if not buckets:
+        return None
+
+    chosen = buckets[-1]
+    for bucket in buckets:
+        if num_assets <= bucket["max_assets"]:
+            chosen = bucket
+            break
+
+    solver = chosen.get("solver")
+    return solver if solver in _installed_solvers() else None
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+
+WHAT_IF_SESSION_TTL = int(os.environ.get("WHAT_IF_SESSION_TTL", 30 * 60)) # Seconds a session lives after its last use
+WHAT_IF_MAX_SESSIONS = int(os.environ.get("WHAT_IF_MAX_SESSIONS", 1000))
+
+# Tolerance for selling slightly more than the position's value (rounding in client-side amounts)
+SELL_TOLERANCE = 1e-6
+
+class WhatIfSession:
+    """
+    Hypothetical trades applied one at a time on top of a portfolio, with risk and drift kept up to date.
+
+    The covariance slice of the session's assets, the dollar exposure vector cov_matrix @ values and the
+    dollar variance are computed once. A trade changes a single position, so each one is a rank-one update
+    of those cached quantities: O(n) per trade instead of recomputing the n x n quadratic form.
+    Cash is treated as riskless.
+
+    Trades, undos and summaries hold the session's lock, so concurrent requests on one session cannot
+    interleave the updates. Callers applying several trades as one unit hold session.lock around them.
+    """
+
+    def __init__(self, tickers: list, values: np.ndarray, cash: float, cov_matrix: np.ndarray,
+                 target_weights: dict = None, fees_per_trade: float = 0.0):
+        """
+        Args:
+            tickers (list): Assets that can be traded in the session.
+            values (np.ndarray): Current dollar value of each asset, aligned with tickers.
+            cash (float): Current cash.
+            cov_matrix (np.ndarray): Covariance of the assets' returns, aligned with tickers.
+            target_weights (dict): Target weight per ticker (and 'CASH') for drift. Defaults to the current weights.
+            fees_per_trade (float): Fixed fee charged to cash for every trade.
+        """
+        self.tickers = list(tickers)
+        self._index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.values = np.array(values, dtype=float)
+        self.cash = float(cash)
+        self.cov_matrix = np.asarray(cov_matrix, dtype=float)
+        self.fees_per_trade = float(fees_per_trade)
+        self.trades = []
+        self.lock = threading.RLock()
+
+        if target_weights is None:
+            total_value = self.values.sum() + self.cash
+            target_weights = {ticker: value / total_value for ticker, value in zip(self.tickers, self.values)} if total_value > 0 else {}
+            target_weights['CASH'] = self.cash / total_value if total_value > 0 else 0.0
+        self.target_weights = np.array([float(target_weights.get(ticker, 0.0)) for ticker in self.tickers])
+        self.cash_target_weight = float(target_weights.get('CASH', 0.0))
+
+        self._cov_values = self.cov_matrix @ self.values # Sigma x, in dollars
+        self._variance = float(self.values @ self._cov_values) # x' Sigma x, in dollars squared
+
+    def _apply(self, index: int, delta: float, fee: float):
+        """Rank-one update for a change of delta dollars in one position."""
+        self._variance += 2 * delta * self._cov_values[index] + delta * delta * self.cov_matrix[index, index]
+        self._cov_values += delta * self.cov_matrix[:, index]
+        self.values[index] += delta
+        self.cash -= delta + fee
+
+    def apply_trade(self, ticker: str, action: str, amount: float) -> dict:
+        """
+        Applies a hypothetical trade.
+
+        Args:
+            ticker (str): Asset to trade; must be one of the session's tickers.
+            action (str): 'BUY' or 'SELL'.
+            amount (float): Dollar amount of the trade.
+
+        Returns:
+            dict: The session summary after the trade.
+
+        Raises:
+            ValueError: If the ticker is not in the session, the action is unknown, the amount is not positive,
+                        or a sell exceeds the position.
+        """
+        if ticker not in self._index:
+            raise ValueError(f"{ticker} is not part of this what-if session.")
+        action = str(action).upper()
+        if action not in ('BUY', 'SELL'):
+            raise ValueError("action must be 'BUY' or 'SELL'.")
+        amount = float(amount)
+        if not amount > 0:
+            raise ValueError("amount must be positive.")
+
+        index = self._index[ticker]
+        with self.lock:
+            if action == 'SELL' and amount > self.values[index] + SELL_TOLERANCE:
+                raise ValueError(f"Cannot sell {amount:.2f} of {ticker}; only {self.values[index]:.2f} is held.")
+
+            delta = amount if action == 'BUY' else -amount
+            self._apply(index, delta, self.fees_per_trade)
+            self.trades.append({"action": action, "ticker": ticker, "amount": amount, "fee": self.fees_per_trade})
+            return self.summary()
+
+    def undo(self) -> dict:
+        """Reverts the last trade and returns the session summary (unchanged if there are no trades)."""
+        with self.lock:
+            if self.trades:
+                trade = self.trades.pop()
+                delta = trade['amount'] if trade['action'] == 'BUY' else -trade['amount']
+                self._apply(self._index[trade['ticker']], -delta, -trade['fee'])
+            return self.summary()
+
+    def summary(self) -> dict:
+        """
+        Current state of the session.
+
+        Returns:
+            dict: A dictionary containing:
+                - "total_value", "cash": Portfolio value and cash after the trades.
+                - "volatility": Portfolio volatility (in the units of cov_matrix) of the current weights.
+                - "weights", "drift": Weight and drift from target per ticker, and for 'CASH'.
+                - "risk_contributions": Each ticker's contribution to volatility (summing to "volatility").
+                - "max_abs_drift": Largest absolute drift.
+                - "trades": The trades applied so far.
+        """
+        with self.lock:
+            return self._summary()
+
+    def _summary(self) -> dict:
+        total_value = self.values.sum() + self.cash
+        safe_total = total_value if total_value > 0 else 1.0
+        weights = self.values / safe_total
+        cash_weight = self.cash / safe_total
+        dollar_volatility = np.sqrt(max(self._variance, 0.0))
+        volatility = dollar_volatility / safe_total
+        if dollar_volatility > 0:
+            risk_contributions = self.values * self._cov_values / dollar_volatility / safe_total
+        else:
+            risk_contributions = np.zeros_like(self.values)
+        drift = weights - self.target_weights
+        cash_drift = cash_weight - self.cash_target_weight
+
+        return {
+            "total_value": float(total_value),
+            "cash": self.cash,
+            "volatility": float(volatility),
+            "weights": {**dict(zip(self.tickers, weights.tolist())), 'CASH': cash_weight},
+            "drift": {**dict(zip(self.tickers, drift.tolist())), 'CASH': cash_drift},
+            "risk_contributions": dict(zip(self.tickers, risk_contributions.tolist())),
+            "max_abs_drift": float(max(np.abs(drift).max(initial=0.0), abs(cash_drift))),
+            "trades": list(self.trades)
+        }
+
+class WhatIfSessionStore:
+    """
+    In-memory what-if sessions of this process, keyed by session id.
+
+    Sessions expire ttl seconds after their last use; beyond max_sessions the least recently used is dropped.
+    Sessions are per worker process: with several API workers (e.g. gunicorn -w N) a session is only found
+    by the worker that created it, so the API must run with one worker, or route a client's requests to
+    the same worker (sticky sessions), for what-if sessions to be usable.
+    """
+
+    def __init__(self, ttl: int = WHAT_IF_SESSION_TTL, max_sessions: int = WHAT_IF_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict() # session_id -> (user_id, session, last_used)
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session_id, (_, _, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self, user_id, session: WhatIfSession) -> str:
+        """Stores a session for a user and returns its id."""
+        session_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (str(user_id), session, now)
+            self._expire(now)
+        return session_id
+
+    def get(self, session_id: str, user_id) -> WhatIfSession:
+        """Returns the user's session, or None if it does not exist, expired or belongs to another user."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] != str(user_id):
+                return None
+            self._sessions[session_id] = (entry[0], entry[1], now)
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def delete(self, session_id: str, user_id) -> bool:
+        """Deletes the user's session. Returns False if there was none."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] != str(user_id):
+                return False
+            del self._sessions[session_id]
+            return True
+
+what_if_sessions = WhatIfSessionStore()
@@ -0,0 +1,549 @@
+import io
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_balancer.src.api import app as app_module
+from portfolio_balancer.src.api import instrumentation
+from portfolio_balancer.src.api import loader as loader_module
+from portfolio_balancer.src.api import price_service as price_service_module
+from portfolio_balancer.src.api import snapshot_cache as snapshot_cache_module
+from portfolio_balancer.src.api import structured_logging
+from portfolio_balancer.src.api import tracing
+from portfolio_balancer.src.api.portfolio_import import import_holdings_csv
+from portfolio_balancer.src.api.snapshot_cache import SnapshotCache
+from portfolio_balancer.src.data import repository as repository_module
+from portfolio_balancer.src.data.repository import SQLiteRepository
+from portfolio_balancer.src.data.result_cache import ResultCache
+from portfolio_balancer.src.evaluation import backtest as backtest_module
+from portfolio_balancer.src.jobs.backtest_jobs import BacktestJobQueue
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = SQLiteRepository(':memory:')
+    monkeypatch.setattr(repository_module, '_repository', repo)
+    yield repo
+    repo.close()
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = SnapshotCache(cache_dir=str(tmp_path))
+    monkeypatch.setattr(snapshot_cache_module, 'snapshot_cache', cache)
+    monkeypatch.setattr(app_module, 'snapshot_cache', cache)
+    return cache
+
+@pytest.fixture
+def client(repo, cache):
+    return app_module.app.test_client()
+
+def _set_latest_price(repo, ticker: str, price: float, days_old: int = 0):
+    repo.upsert_latest_price({"ticker": ticker, "price": price, "as_of": (datetime.now() - timedelta(days=days_old)).isoformat()})
+
+def _snapshot(client) -> dict:
+    response = client.get('/portfolio/snapshot?user_id=1')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_snapshot_is_cached_until_holdings_or_prices_change(client, repo, cache, monkeypatch):
+    repo.add_holdings([
+        {"user_id": "1", "ticker": "AAA", "quantity": 4.0, "avg_cost": 90.0},
+        {"user_id": "1", "ticker": "AAA", "quantity": 6.0, "avg_cost": 95.0}, # A second lot of the same ticker
+        {"user_id": "1", "ticker": "BBB", "quantity": 5.0, "avg_cost": 40.0}
+    ])
+    _set_latest_price(repo, "AAA", 100.0)
+    _set_latest_price(repo, "BBB", 50.0)
+
+    snapshot = _snapshot(client)
+    assert snapshot["total_value"] == pytest.approx(1250.0)
+    assert {item["ticker"]: item["value"] for item in snapshot["breakdown"]} == {"AAA": 1000.0, "BBB": 250.0}
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    assert _snapshot(client) == snapshot
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    response = client.post('/holdings?user_id=1', json=[{"ticker": "AAA", "quantity": 10, "purchase_price": 90, "purchase_date": "2024-01-02"}])
+    assert response.status_code == 200
+    assert _snapshot(client)["total_value"] == pytest.approx(2250.0)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # An outdated stored price alone does not invalidate anything; refreshing it from the provider does
+    _set_latest_price(repo, "AAA", 100.0, days_old=1)
+    assert _snapshot(client)["total_value"] == pytest.approx(2250.0)
+    monkeypatch.setattr(price_service_module, 'get_latest_yfinance_price', lambda ticker: 200.0)
+    assert client.get('/api/prices/latest/AAA').get_json()["latest_price"] == 200.0
+
+    assert _snapshot(client)["total_value"] == pytest.approx(4250.0)
+    assert (cache.hits, cache.misses, cache.stale) == (2, 3, 1)
+    assert client.get('/api/cache/stats').get_json()["snapshots"]["invalidations"] == 2
+
+def test_snapshot_is_invalidated_when_a_held_ticker_gets_its_first_price(client, repo, monkeypatch):
+    provider_prices = {"AAA": 100.0}
+    monkeypatch.setattr(price_service_module, 'get_latest_yfinance_price', lambda ticker: provider_prices.get(ticker))
+    repo.add_holdings([{"user_id": "1", "ticker": "AAA", "quantity": 2.0}, {"user_id": "1", "ticker": "CCC", "quantity": 3.0}])
+
+    assert [item["ticker"] for item in _snapshot(client)["breakdown"]] == ["AAA"]
+    provider_prices["CCC"] = 10.0
+    client.get('/api/prices/latest/CCC')
+    assert _snapshot(client)["total_value"] == pytest.approx(230.0)
+
+@pytest.mark.parametrize("invalidate", [lambda cache: cache.invalidate_user(1), lambda cache: cache.invalidate_ticker("AAA")])
+def test_snapshot_computed_across_a_write_is_not_served(cache, invalidate):
+    def compute():
+        invalidate(cache) # A holdings write or price refresh lands while the snapshot is being computed
+        return {"total_value": 100.0, "breakdown": [{"ticker": "AAA", "value": 100.0}]}
+
+    cache.get_or_compute(1, lambda: ["AAA"], compute)
+    assert cache.get(1) is None
+    cache.get_or_compute(1, lambda: ["AAA"], lambda: {"total_value": 0, "breakdown": []})
+    assert cache.get(1) == {"total_value": 0, "breakdown": []}
+
+def test_advisor_snapshots_have_one_row_per_ticker(client, repo, cache):
+    for user_id in ("1", "2"):
+        repo.add_holdings([
+            {"user_id": user_id, "ticker": "AAPL", "quantity": 3.0},
+            {"user_id": user_id, "ticker": "AAPL", "quantity": 7.0},
+            {"user_id": user_id, "ticker": "BND", "quantity": 10.0}
+        ])
+        repo.upsert_target_allocation({"user_id": user_id, "equities": 0.6, "bonds": 0.4, "cash": 0.0})
+    _set_latest_price(repo, "AAPL", 150.0)
+    _set_latest_price(repo, "BND", 50.0)
+
+    single = _snapshot(client) # Cached for user 1, so the batch serves it and computes user 2
+    response = client.post('/advisor/snapshots', json={"user_ids": ["1", "2"]})
+    assert response.status_code == 200
+    body = response.get_json()
+    columns = body["holdings"]["columns"]
+    rows = [dict(zip(columns, row)) for row in body["holdings"]["rows"]]
+
+    assert [(row["user_id"], row["ticker"]) for row in rows] == [("1", "AAPL"), ("1", "BND"), ("2", "AAPL"), ("2", "BND")]
+    for row in rows:
+        expected = {"AAPL": (1500.0, 0.75, 0.6), "BND": (500.0, 0.25, 0.4)}[row["ticker"]]
+        assert (row["value"], row["weight"], row["target"]) == pytest.approx(expected)
+        assert row["drift"] == pytest.approx(expected[1] - expected[2])
+    assert cache.get("2") == single
+
+def _count_reads(repo, monkeypatch, *methods) -> dict:
+    counts = dict.fromkeys(methods, 0)
+    for method in methods:
+        read = getattr(repo, method)
+        def counted(*args, _method=method, _read=read, **kwargs):
+            counts[_method] += 1
+            return _read(*args, **kwargs)
+        monkeypatch.setattr(repo, method, counted)
+    return counts
+
+def test_data_loader_reads_each_user_once_and_batches_queued_ids(repo, monkeypatch):
+    repo.add_holdings([{"user_id": user_id, "ticker": "AAA", "quantity": 1.0} for user_id in ("1", "1", "2", "3")])
+    repo.upsert_target_allocation({"user_id": "2", "equities": 1.0, "bonds": 0.0, "cash": 0.0})
+    counts = _count_reads(repo, monkeypatch, 'get_holdings_for_users', 'get_target_allocations')
+    loader = loader_module.DataLoader(repo)
+
+    loader.prefetch('holding', [2, "3"])
+    assert len(loader.holdings(1)) == 2 # Fetched along with the queued ids
+    assert [len(loader.holdings(user_id)) for user_id in (2, "3", "1")] == [1, 1, 2]
+    assert counts['get_holdings_for_users'] == loader.queries == 1
+
+    loader.holdings(1).clear() # Callers get their own list
+    assert len(loader.holdings(1)) == 2
+
+    targets = loader.load_many('target_allocation', ["1", "2", "4"])
+    assert targets["1"] is None and targets["2"]["equities"] == 1.0 and targets["4"] is None
+    assert loader.target_allocation(4) is None
+    assert counts['get_target_allocations'] == 1
+
+    repo.add_holdings([{"user_id": "1", "ticker": "BBB", "quantity": 1.0}])
+    assert len(loader.holdings(1)) == 2
+    loader.clear('holding', 1)
+    assert len(loader.holdings(1)) == 3
+    assert counts['get_holdings_for_users'] == 2
+
+def test_data_loader_lives_for_one_request(client, repo, monkeypatch):
+    assert loader_module.get_loader() is not loader_module.get_loader()
+    for user_id in ("1", "2", "3"):
+        repo.add_holdings([{"user_id": user_id, "ticker": "AAPL", "quantity": 1.0}])
+    _set_latest_price(repo, "AAPL", 100.0)
+    counts = _count_reads(repo, monkeypatch, 'get_holdings', 'get_holdings_for_users', 'get_target_allocation', 'get_target_allocations')
+
+    response = client.post('/advisor/snapshots', json={"user_ids": ["1", "2", "3"]})
+    assert response.status_code == 200
+    assert counts == {'get_holdings': 0, 'get_holdings_for_users': 1, 'get_target_allocation': 0, 'get_target_allocations': 1}
+
+    with app_module.app.test_request_context():
+        loader = loader_module.get_loader()
+        assert loader_module.get_loader() is loader
+        loader.holdings(1)
+    with app_module.app.test_request_context():
+        assert loader_module.get_loader() is not loader
+
+def _seed_rebalance_inputs(repo):
+    repo.add_holdings([{"user_id": "1", "ticker": "AAPL", "quantity": 10.0}, {"user_id": "1", "ticker": "BND", "quantity": 10.0}])
+    repo.upsert_target_allocation({"user_id": "1", "equities": 0.6, "bonds": 0.4, "cash": 0.0})
+    _set_latest_price(repo, "AAPL", 100.0)
+    _set_latest_price(repo, "BND", 100.0)
+
+def test_rebalance_plans_are_stored_and_served_by_fingerprint(client, repo, monkeypatch):
+    _seed_rebalance_inputs(repo)
+    calls = []
+    rebalance = app_module.deterministic_rebalance
+    monkeypatch.setattr(app_module, 'deterministic_rebalance', lambda **kwargs: calls.append(kwargs) or rebalance(**kwargs))
+    body = {"target_allocation": {"equities": 0.6, "bonds": 0.4}}
+
+    first = client.post('/rebalance/suggest?user_id=1', json=body).get_json()
+    second = client.post('/rebalance/suggest?user_id=1', json=body).get_json()
+    assert len(calls) == 1
+    assert second == first
+    [row] = repo._query("SELECT * FROM rebalance_plan")
+    assert (row["user_id"], row["input_fingerprint"]) == ("1", first["input_fingerprint"])
+
+    # Other parameters are other inputs
+    client.post('/rebalance/suggest?user_id=1', json={**body, "min_trade_threshold": 5.0})
+    assert len(calls) == 2
+
+@pytest.mark.parametrize("solve_path", ["solver_partial", "fallback_deterministic"])
+def test_rebalance_plans_cut_short_or_from_a_fallback_are_not_stored(client, repo, monkeypatch, solve_path):
+    from portfolio_balancer.src.optimization import cvxpy_rebalancer
+
+    _seed_rebalance_inputs(repo)
+    calls = []
+    monkeypatch.setattr(cvxpy_rebalancer, 'cvxpy_rebalance',
+                        lambda **kwargs: calls.append(kwargs) or {"trades": [], "post_trade_weights_est": {}, "solve_path": solve_path})
+    body = {"target_allocation": {"equities": 0.6, "bonds": 0.4}, "rebalance_type": "cvxpy"}
+
+    for _ in range(2):
+        assert client.post('/rebalance/suggest?user_id=1', json=body).get_json()["solve_path"] == solve_path
+    assert len(calls) == 2
+    assert repo._query("SELECT * FROM rebalance_plan") == []
+
+def test_stored_outputs_are_looked_up_per_table_user_and_fingerprint(repo):
+    repo.insert_stored_output('recommendation', {"user_id": 1, "created_at": "2026-01-01T00:00:00", "payload_json": {"n": 1}, "input_fingerprint": "f"})
+    repo.insert_stored_output('recommendation', {"user_id": 1, "created_at": "2026-01-02T00:00:00", "payload_json": {"n": 2}, "input_fingerprint": "f"})
+    assert repo.get_stored_output('recommendation', "1", "f")["payload_json"] == {"n": 2}
+    assert repo.get_stored_output('recommendation', "2", "f") is None
+    assert repo.get_stored_output('recommendation', "1", "g") is None
+    assert repo.get_stored_output('rebalance_plan', "1", "f") is None
+    with pytest.raises(ValueError):
+        repo.get_stored_output('holding', "1", "f")
+
+def _seed_price_history(repo, tickers: list, days: int = 160):
+    rng = np.random.default_rng(3)
+    dates = pd.bdate_range(end=datetime.now().date() - timedelta(days=1), periods=days)
+    for ticker in tickers:
+        closes = 100 * np.cumprod(1 + rng.normal(0.0004, 0.01, days))
+        repo.save_price_history([{"ticker": ticker, "date": date.strftime('%Y-%m-%d'), "close": float(close)} for date, close in zip(dates, closes)])
+        _set_latest_price(repo, ticker, float(closes[-1]))
+
+def _wait_for_job(client, job_id: str, timeout: float = 180) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/backtest/jobs/{job_id}?user_id=1').get_json()
+        if job["status"] in ("completed", "failed", "cancelled") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.2)
+
+def test_backtest_jobs_run_in_the_background_and_belong_to_their_user(client, repo, monkeypatch, tmp_path):
+    monkeypatch.setattr(price_service_module, 'fetch_yfinance_data', lambda ticker, start_date, end_date: None)
+    monkeypatch.setenv("RESULT_CACHE_DIR", str(tmp_path / "cache")) # Inherited by the spawned workers
+    monkeypatch.setattr(backtest_module, 'backtest_cache', ResultCache("backtests", cache_dir=str(tmp_path / "cache")))
+    queue = BacktestJobQueue(jobs_dir=str(tmp_path / "jobs"), max_workers=1, max_queue_size=2)
+    monkeypatch.setattr(app_module, 'backtest_jobs', queue)
+    repo.add_holdings([{"user_id": "1", "ticker": "AAPL", "quantity": 10.0}, {"user_id": "1", "ticker": "BND", "quantity": 10.0}])
+    repo.upsert_target_allocation({"user_id": "1", "equities": 0.6, "bonds": 0.4, "cash": 0.0})
+    _seed_price_history(repo, ["AAPL", "GOOGL", "BND"])
+    body = {"strategy": "all", "from": "2020-01-01", "to": "2026-01-01"}
+
+    try:
+        submitted = [client.post('/backtest/jobs?user_id=1', json=body) for _ in range(3)]
+        assert [response.status_code for response in submitted] == [202, 202, 429]
+        first, second = (response.get_json() for response in submitted[:2])
+        assert first["status"] == "queued"
+        assert first["status_url"] == f"/backtest/jobs/{first['job_id']}?user_id=1"
+
+        # Other users cannot see or cancel the job
+        assert client.get(f"/backtest/jobs/{first['job_id']}?user_id=2").status_code == 404
+        assert client.delete(f"/backtest/jobs/{first['job_id']}?user_id=2").status_code == 404
+        assert client.get('/backtest/jobs/unknown?user_id=1').status_code == 404
+
+        cancelled = client.delete(f"/backtest/jobs/{second['job_id']}?user_id=1")
+        assert cancelled.status_code == 200
+        assert cancelled.get_json()["status"] in ("cancelled", "cancelling")
+
+        job = _wait_for_job(client, first["job_id"])
+        assert job["status"] == "completed", job
+        assert job["progress"]["strategies_done"] == job["progress"]["total_strategies"] == 4
+        assert set(job["result"]["summary_metrics"]) == {"deterministic", "cvxpy", "mvo", "baseline"}
+        expected = client.post('/backtest/run?user_id=1', json=body).get_json()["summary_metrics"]
+        for strategy, metrics in job["result"]["summary_metrics"].items():
+            assert metrics == pytest.approx(expected[strategy])
+        assert _wait_for_job(client, second["job_id"])["status"] == "cancelled"
+
+        # Finished jobs keep their outcome
+        assert client.delete(f"/backtest/jobs/{first['job_id']}?user_id=1").get_json()["status"] == "completed"
+    finally:
+        queue.shutdown(wait=True)
+
+def test_price_history_pages_stream_and_revalidate(client, repo):
+    dates = ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05", "2024-01-08"]
+    repo.save_price_history([{"ticker": "AAA", "date": date, "close": 10.0 + i} for i, date in enumerate(dates)])
+
+    response = client.get('/prices/AAA?from=2024-01-03')
+    assert response.status_code == 200
+    assert [row["date"] for row in response.get_json()["prices"]] == dates[1:]
+    assert "next_cursor" not in response.get_json()
+
+    # Following next_cursor returns every row once
+    pages, cursor = [], None
+    while True:
+        body = client.get('/prices/AAA?from=2024-01-03&limit=2' + (f'&cursor={cursor}' if cursor else '')).get_json()
+        pages.append([row["date"] for row in body["prices"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == [dates[1:3], dates[3:5], []]
+
+    response = client.get('/prices/AAA?from=2024-01-03&format=ndjson&limit=3')
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['X-Next-Cursor'] == "2024-01-05"
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {"date": date, "close": 10.0 + i} for i, date in enumerate(dates) if "2024-01-03" <= date <= "2024-01-05"]
+
+    # Unchanged data is revalidated with 304; a newly stored day changes the validators
+    response = client.get('/prices/AAA?from=2024-01-03')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified'] == 'Mon, 08 Jan 2024 00:00:00 GMT'
+    assert client.get('/prices/AAA?from=2024-01-03', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/prices/AAA?from=2024-01-03', headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    assert client.get('/prices/AAA?from=2024-01-03&format=ndjson', headers={'If-None-Match': etag}).status_code == 200
+    repo.save_price_history([{"ticker": "AAA", "date": "2024-01-09", "close": 15.0}])
+    response = client.get('/prices/AAA?from=2024-01-03', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert len(response.get_json()["prices"]) == 5
+
+@pytest.mark.parametrize("query", ["", "from=2024-13-01", "from=2024-01-02&format=csv", "from=2024-01-02&cursor=x",
+                                   "from=2024-01-02&limit=0", "from=2024-01-02&limit=1001"])
+def test_price_history_rejects_bad_parameters(client, query):
+    assert client.get(f'/prices/AAA?{query}').status_code == 400
+
+def test_metrics_label_requests_by_route_template(client, repo):
+    latency = instrumentation.REQUEST_LATENCY
+    before = latency.summary('/prices/<ticker>', 'GET', '200')['count']
+    unmatched = latency.summary('<unmatched>', 'GET', '404')['count']
+    queries = instrumentation.STAGE_LATENCY.summary('db_query', 'sqlite.get_last_price_date')['count']
+
+    for ticker in ("AAA", "BBB", "CCC"):
+        assert client.get(f'/prices/{ticker}?from=2024-01-02').status_code == 200
+    assert client.get('/no/such/route').status_code == 404
+
+    assert latency.summary('/prices/<ticker>', 'GET', '200')['count'] == before + 3
+    assert latency.summary('/prices/AAA', 'GET', '200')['count'] == 0
+    assert latency.summary('<unmatched>', 'GET', '404')['count'] == unmatched + 1
+    assert instrumentation.STAGE_LATENCY.summary('db_query', 'sqlite.get_last_price_date')['count'] == queries + 3
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == instrumentation.PROMETHEUS_CONTENT_TYPE
+    lines = response.get_data(as_text=True).splitlines()
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    assert f'http_request_duration_seconds_count{{route="/prices/<ticker>",method="GET",status="200"}} {before + 3}' in lines
+    assert 'http_request_duration_seconds_bucket{route="/prices/<ticker>",method="GET",status="200",le="+Inf"}' in \
+        {line.rsplit(' ', 1)[0] for line in lines}
+    assert not any('route="/prices/AAA"' in line for line in lines)
+
+def test_metrics_render_cumulative_buckets_and_escaped_labels():
+    histogram = instrumentation.Histogram("test_seconds", "Test.", ("name",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, 'a "quoted"\nname')
+    labels = 'name="a \\"quoted\\"\\nname"'
+    assert histogram.render()[2:] == [
+        f'test_seconds_bucket{{{labels},le="0.1"}} 1',
+        f'test_seconds_bucket{{{labels},le="1.0"}} 3',
+        f'test_seconds_bucket{{{labels},le="+Inf"}} 4',
+        f'test_seconds_sum{{{labels}}} 6.05',
+        f'test_seconds_count{{{labels}}} 4'
+    ]
+
+@tracing.traced("scale")
+def _traced_scale(value: float) -> float:
+    with tracing.span("multiply", factor=2):
+        return value * 2
+
+def test_spans_nest_under_the_current_span():
+    assert tracing.span("outside") is tracing.span("outside too") # The shared no-op
+    assert tracing.start_span("outside") is None and _traced_scale(1.0) == 2.0
+
+    root, token = tracing.start_trace("request", route="/test")
+    with tracing.span("load") as load:
+        load.set(rows=3)
+        active = tracing.start_span("rebalance", date="2024-01-02")
+        assert _traced_scale(2.0) == 4.0
+        tracing.end_span(active, trades=5)
+        assert tracing.current_span() is load
+    with pytest.raises(ValueError), tracing.span("fails"):
+        raise ValueError("bad input")
+    assert tracing.current_span() is root
+    tracing.finish_trace(root, token)
+    assert tracing.current_span() is None
+
+    def shape(node: dict) -> tuple:
+        return node["name"], node["attributes"], [shape(child) for child in node["children"]]
+    tree = tracing.trace_to_dict(root)["spans"]
+    assert shape(tree) == ("request", {"route": "/test"}, [
+        ("load", {"rows": 3}, [
+            ("rebalance", {"date": "2024-01-02", "trades": 5}, [
+                ("scale", {}, [("multiply", {"factor": 2}, [])])
+            ])
+        ]),
+        ("fails", {}, [])
+    ])
+    assert tree["children"][1]["error"] == "ValueError: bad input"
+    spans = list(root.walk())
+    assert all(item.duration is not None and item.trace is root.trace for item in spans)
+    assert all(child.parent is item for item in spans for child in item.children)
+    otlp = tracing.trace_to_otlp(root)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {item["name"]: item.get("parentSpanId") for item in otlp}["multiply"] == root.children[0].children[0].children[0].span_id
+
+def test_spans_beyond_the_trace_limit_are_counted_not_kept(monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACE_MAX_SPANS', 3)
+    root, token = tracing.start_trace("request")
+    for i in range(4):
+        with tracing.span(f"step {i}") as step:
+            assert (step is None) == (i >= 2)
+    tracing.finish_trace(root, token)
+    assert [child.name for child in root.children] == ["step 0", "step 1"]
+    assert root.attributes["dropped_spans"] == 2
+
+def test_debug_trace_returns_the_requests_span_tree(client, repo):
+    repo.save_price_history([{"ticker": "AAA", "date": "2024-01-02", "close": 10.0}])
+    response = client.get('/prices/AAA?from=2024-01-02&debug_trace=1')
+    body = response.get_json()
+    assert response.headers['X-Trace-Id'] == body["trace"]["trace_id"]
+    tree = body["trace"]["spans"]
+    assert (tree["name"], tree["attributes"]["status_code"]) == ("GET /prices/<ticker>", 200)
+    assert [child["name"] for child in tree["children"]] == ["db_query:sqlite.get_last_price_date", "db_query:sqlite.get_price_page"]
+    assert 'X-Trace-Id' not in client.get('/prices/AAA?from=2024-01-02').headers
+
+@pytest.fixture
+def log_records(monkeypatch):
+    """Records logged under 'portfolio_balancer.tests', as the queue handler hands them to the writer thread."""
+    logger = structured_logging.get_logger("tests")
+    handler = structured_logging.DroppingQueueHandler(queue.Queue(maxsize=10))
+    monkeypatch.setattr(logger, 'handlers', [handler])
+    monkeypatch.setattr(logger, 'propagate', False)
+    level = logger.level
+    logger.setLevel(logging.DEBUG) # setLevel also resets the loggers' cached levels
+    yield logger, handler
+    logger.setLevel(level)
+
+def _drain(handler) -> list:
+    entries = []
+    while not handler.queue.empty():
+        entries.append(json.loads(structured_logging.JsonFormatter().format(handler.queue.get_nowait())))
+    return entries
+
+def test_json_logs_carry_message_extra_fields_exception_and_trace_id(log_records):
+    logger, handler = log_records
+    assert logger.name == "portfolio_balancer.tests"
+
+    logger.info("Saved %d rows for %s", 3, "AAA", extra={"ticker": "AAA", "rows": 3, "as_of": datetime(2024, 1, 2)})
+    try:
+        raise ValueError("bad price")
+    except ValueError:
+        logger.exception("Could not save %s", "BBB")
+    root, token = tracing.start_trace("request")
+    logger.warning("Inside a trace")
+    tracing.finish_trace(root, token)
+
+    saved, failed, traced = _drain(handler)
+    assert datetime.strptime(saved.pop("time"), "%Y-%m-%dT%H:%M:%S.%f")
+    assert saved == {"level": "INFO", "logger": "portfolio_balancer.tests", "message": "Saved 3 rows for AAA",
+                     "ticker": "AAA", "rows": 3, "as_of": "2024-01-02 00:00:00"}
+    assert (failed["level"], failed["message"]) == ("ERROR", "Could not save BBB")
+    assert failed["exception"].startswith("Traceback") and failed["exception"].endswith("ValueError: bad price")
+    assert "trace_id" not in saved and traced["trace_id"] == root.trace.trace_id
+
+def test_repeated_log_messages_are_rate_limited(log_records):
+    logger, handler = log_records
+    handler.addFilter(structured_logging.RateLimitFilter(window=0.2, burst=2))
+    for ticker in ("AAA", "BBB", "CCC", "DDD"):
+        logger.warning("No price for %s", ticker)
+    logger.error("Failed %s", "AAA")
+    logger.error("Failed %s", "BBB")
+    logger.error("Failed %s", "CCC") # Errors are never dropped
+    time.sleep(0.25)
+    logger.warning("No price for %s", "EEE")
+
+    entries = _drain(handler)
+    assert [entry["message"] for entry in entries] == ["No price for AAA", "No price for BBB", "Failed AAA", "Failed BBB",
+                                                       "Failed CCC", "No price for EEE"]
+    assert entries[-1]["suppressed"] == 2 and "suppressed" not in entries[0]
+
+    for i in range(12):
+        logger.error("Row %d", i)
+    assert handler.queue.qsize() == 10 and handler.dropped == 2
+
+_IMPORT_CSV = """ticker,quantity,purchase_price,purchase_date
+AAPL,10,150.5,2024-01-02
+ BND ,"1,000",$72.10,01/03/2024
+,5,10,2024-01-02
+MSFT,-1,abc,2024-01-02
+XYZ,3,10,not a date
+XYZ,3,10,2024-01-04
+"""
+
+def _upload(client, csv_text: str, query: str = ''):
+    return client.post(f'/portfolio/import?user_id=1{query}', data={'file': (io.BytesIO(csv_text.encode()), 'holdings.csv')},
+                       content_type='multipart/form-data')
+
+def test_csv_import_reports_rejected_rows_by_line(client, repo):
+    _set_latest_price(repo, "AAPL", 150.0)
+    _set_latest_price(repo, "BND", 72.0)
+
+    response = _upload(client, _IMPORT_CSV)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["rows_read"], body["rows_imported"], body["rows_rejected"]) == (6, 3, 3)
+    assert body["errors"] == [
+        {"line": 4, "errors": ["ticker is missing"]},
+        {"line": 5, "errors": ["quantity must be positive", "purchase_price is not a number"]},
+        {"line": 6, "errors": ["purchase_date is not a valid date"]}
+    ]
+    assert body["unknown_tickers"] == ["MSFT", "XYZ"] and not body["errors_truncated"]
+    assert [(row["ticker"], row["quantity"], row["purchase_price"], row["purchase_date"]) for row in repo.get_holdings(1)] == [
+        ("AAPL", 10.0, 150.5, "2024-01-02"), ("BND", 1000.0, 72.1, "2024-01-03"), ("XYZ", 3.0, 10.0, "2024-01-04")]
+
+def test_csv_import_with_strict_tickers_rejects_unpriced_tickers(client, repo):
+    _set_latest_price(repo, "AAPL", 150.0)
+    _set_latest_price(repo, "BND", 72.0)
+
+    lines = [json.loads(line) for line in _upload(client, _IMPORT_CSV, '&strict_tickers=true&format=ndjson').get_data(as_text=True).splitlines()]
+    summary = lines[-1]
+    assert [line["event"] for line in lines] == ["progress", "done"]
+    assert (summary["rows_imported"], summary["rows_rejected"]) == (2, 4)
+    assert {"line": 7, "errors": ["ticker has no known price"]} in summary["errors"]
+    assert [row["ticker"] for row in repo.get_holdings(1)] == ["AAPL", "BND"]
+
+def test_csv_import_stops_with_an_error_event_when_a_batch_fails(repo, monkeypatch):
+    csv_text = "ticker,quantity,purchase_price,purchase_date\n" + "".join(f"T{i},1,10,2024-01-02\n" for i in range(7))
+    writes = []
+    def add_holdings(rows):
+        if writes:
+            raise RuntimeError("connection lost")
+        writes.append(rows)
+        return rows
+    monkeypatch.setattr(repo, 'add_holdings', add_holdings)
+
+    events = list(import_holdings_csv(io.BytesIO(csv_text.encode()), "1", repo=repo, chunk_size=2, write_batch=3))
+    assert [event["event"] for event in events] == ["progress", "error"]
+    assert events[0]["rows_imported"] == 3
+    assert (events[1]["error"], events[1]["rows_imported"], events[1]["rows_read"]) == ("connection lost", 3, 6)
+    assert [row["ticker"] for row in writes[0]] == ["T0", "T1", "T2"]
+
+@pytest.mark.parametrize("csv_text", ["", "ticker,quantity\nAAPL,1\n"])
+def test_csv_import_rejects_files_it_cannot_read(client, repo, csv_text):
+    response = _upload(client, csv_text)
+    assert response.status_code == 400
+    assert repo.get_holdings(1) == []
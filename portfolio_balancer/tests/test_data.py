@@ -0,0 +1,144 @@
+import os
+import pickle
+import stat
+import pytest
+
+from portfolio_balancer.src.data import repository as repository_module
+from portfolio_balancer.src.data.repository import SQLiteRepository
+from portfolio_balancer.src.data.result_cache import ResultCache
+
+_unpickled = []
+
+def _record_unpickled(name: str):
+    _unpickled.append(name)
+
+class _Planted:
+    """Records being unpickled, standing in for a payload that runs code."""
+
+    def __reduce__(self):
+        return (_record_unpickled, ("planted",))
+
+@pytest.fixture(autouse=True)
+def _reset_unpickled():
+    _unpickled.clear()
+
+def _plant(cache: ResultCache, key: str, mode: int = 0o600):
+    path = os.path.join(cache.cache_dir, f"{key}.pkl")
+    with open(path, 'wb') as f:
+        f.write(pickle.dumps(_Planted()))
+    os.chmod(path, mode)
+    return path
+
+def test_result_cache_disk_tier_is_private_and_shared_between_instances(tmp_path):
+    root = tmp_path / "cache"
+    cache = ResultCache("results", cache_dir=str(root))
+    cache.set("key", {"value": 1})
+
+    for path in (root, root / "results"):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    assert not os.stat(root / "results" / "key.pkl").st_mode & 0o077
+    assert ResultCache("results", cache_dir=str(root)).get("key") == {"value": 1}
+
+@pytest.mark.parametrize("shared", ["root", "subdirectory"])
+def test_result_cache_skips_directories_other_users_can_write(tmp_path, shared):
+    root = tmp_path / "cache"
+    cache = ResultCache("results", cache_dir=str(root))
+    cache.set("written", {"value": 1})
+    _plant(cache, "planted")
+    os.chmod(root if shared == "root" else root / "results", 0o777)
+
+    reader = ResultCache("results", cache_dir=str(root))
+    assert reader.get("planted") is None
+    assert reader.get("written") is None
+    reader.set("other", {"value": 2})
+    assert not os.path.exists(root / "results" / "other.pkl")
+    assert _unpickled == []
+
+def test_result_cache_does_not_unpickle_files_others_could_have_written(tmp_path):
+    cache = ResultCache("results", cache_dir=str(tmp_path / "cache"))
+    cache.set("written", {"value": 1})
+    _plant(cache, "group_writable", mode=0o664)
+    os.symlink(_plant(cache, "target"), os.path.join(cache.cache_dir, "linked.pkl"))
+
+    reader = ResultCache("results", cache_dir=str(tmp_path / "cache"))
+    assert reader.get("group_writable") is None
+    assert reader.get("linked") is None
+    assert _unpickled == []
+    assert reader.get("written") == {"value": 1}
+
+@pytest.fixture
+def repo():
+    repo = SQLiteRepository(':memory:')
+    yield repo
+    repo.close()
+
+def test_sqlite_repository_reads_back_holdings_and_target_allocations(repo, monkeypatch):
+    monkeypatch.setattr(repository_module, 'SQLITE_MAX_PARAMS', 2) # Several batches per 'in' query
+    added = repo.add_holdings([
+        {"user_id": 1, "ticker": "AAA", "quantity": 2.0},
+        {"user_id": "2", "ticker": "BBB", "quantity": 3.0},
+        {"user_id": "1", "ticker": "CCC", "quantity": 4.0},
+        {"user_id": "3", "ticker": "AAA", "quantity": 5.0}
+    ])
+    assert [row["id"] for row in added] == [1, 2, 3, 4]
+    assert [row["ticker"] for row in repo.get_holdings(1)] == ["AAA", "CCC"]
+    assert repo.get_holdings("1") == repo.get_holdings(1) and repo.get_holdings(1)[0]["user_id"] == "1"
+    assert len(repo.get_all_holdings()) == 4
+    assert sorted(row["id"] for row in repo.get_holdings_for_users(["3", 1, "1", "2", "9"])) == [1, 2, 3, 4]
+
+    repo.upsert_target_allocation({"user_id": 1, "equities": 0.6, "bonds": 0.3, "cash": 0.1})
+    repo.upsert_target_allocation({"user_id": "1", "equities": 0.5, "bonds": 0.5, "cash": 0.0})
+    repo.upsert_target_allocation({"user_id": "2", "equities": 1.0, "bonds": 0.0, "cash": 0.0})
+    assert repo.get_target_allocation(1)["equities"] == 0.5
+    assert repo.get_target_allocation("3") is None
+    assert sorted(row["user_id"] for row in repo.get_target_allocations(["1", "2", "3"])) == ["1", "2"]
+
+def test_sqlite_repository_reads_price_ranges_pages_and_latest_prices(repo, monkeypatch):
+    monkeypatch.setattr(repository_module, 'SQLITE_MAX_PARAMS', 2)
+    dates = ["2024-01-02", "2024-01-03", "2024-01-05"]
+    assert repo.save_price_history([{"ticker": ticker, "date": date, "close": close + i}
+                                    for ticker, close in (("AAA", 10.0), ("BBB", 20.0), ("CCC", 30.0)) for i, date in enumerate(dates)]) == 9
+    repo.save_price_history([{"ticker": "AAA", "date": "2024-01-05", "close": 15.0}]) # Replaces the stored close
+
+    rows = repo.get_price_history(["CCC", "AAA", "BBB"], start_date="2024-01-03", end_date="2024-01-04")
+    assert sorted((row["ticker"], row["close"]) for row in rows) == [("AAA", 11.0), ("BBB", 21.0), ("CCC", 31.0)]
+    assert repo.get_close_on_or_before("AAA", "2024-01-04") == 11.0
+    assert repo.get_close_on_or_before("AAA", "2024-01-01") is None
+    assert repo.get_last_price_date("AAA") == "2024-01-05"
+    assert repo.get_last_price_date("ZZZ") is None
+    assert [row["date"] for row in repo.get_price_page("AAA", after="2024-01-02", limit=1)] == ["2024-01-03"]
+    assert [row["close"] for row in repo.get_price_page("AAA", start_date="2024-01-03")] == [11.0, 15.0]
+
+    frame = repo.price_history_frame(["BBB", "AAA", "ZZZ"])
+    assert list(frame.columns) == ["BBB", "AAA"]
+    assert frame.loc["2024-01-05", "AAA"] == 15.0
+    assert repo.price_history_frame(["ZZZ"]).empty
+
+    repo.upsert_latest_price({"ticker": "AAA", "price": 16.0, "as_of": "2024-01-05T16:00:00"})
+    repo.upsert_latest_price({"ticker": "AAA", "price": 17.0, "as_of": "2024-01-06T16:00:00"})
+    repo.upsert_latest_price({"ticker": "BBB", "price": 23.0, "as_of": "2024-01-06T16:00:00"})
+    assert repo.get_latest_price("AAA")["price"] == 17.0
+    assert repo.get_latest_price("CCC") is None
+    assert {ticker: row["price"] for ticker, row in repo.get_latest_prices(["AAA", "BBB", "CCC"]).items()} == {"AAA": 17.0, "BBB": 23.0}
+
+def test_sqlite_repository_stores_json_columns(repo):
+    repo.insert_snapshot({"user_id": 1, "date": "2024-01-03", "total_value": 100.0, "asset_allocation": {"equities": 1.0}})
+    repo.insert_snapshot({"user_id": 1, "date": "2024-01-02", "total_value": 90.0, "asset_allocation": {"bonds": 1.0}})
+    assert [row["asset_allocation"] for row in repo.get_snapshots("1")] == [{"bonds": 1.0}, {"equities": 1.0}]
+    assert [row["total_value"] for row in repo.get_snapshots(1, start_date="2024-01-03")] == [100.0]
+
+    assert repo.get_latest_precomputed_stats() is None
+    repo.insert_precomputed_stats({"date": "2024-01-02", "volatility": {"AAA": 0.1}, "correlations": {}})
+    repo.insert_precomputed_stats({"date": "2024-01-03", "volatility": {"AAA": 0.2}, "correlations": {"AAA": {"AAA": 1.0}}})
+    stats = repo.get_latest_precomputed_stats()
+    assert (stats["volatility"], stats["correlations"]) == ({"AAA": 0.2}, {"AAA": {"AAA": 1.0}})
+
+    repo.insert_risk_report({"user_id": "1", "date": "2024-01-03", "report": {"var": {"confidence": 0.95}}})
+    assert repo.get_risk_reports(1)[0]["report"] == {"var": {"confidence": 0.95}}
+    assert repo.get_risk_reports(1, end_date="2024-01-02") == []
+
+def test_repository_backend_is_checked(monkeypatch):
+    monkeypatch.setattr(repository_module, '_repository', None)
+    monkeypatch.setattr(repository_module, 'DATA_BACKEND', 'postgres')
+    with pytest.raises(ValueError, match="Unknown DATA_BACKEND"):
+        repository_module.get_repository()
@@ -0,0 +1,151 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_balancer.src.data.result_cache import ResultCache
+from portfolio_balancer.src.evaluation import backtest as backtest_module
+from portfolio_balancer.src.evaluation.backtest import compare_strategies, run_backtest
+from portfolio_balancer.src.evaluation.batch_backtest import batch_backtest
+from portfolio_balancer.src.evaluation.metrics import calculate_batch_risk_metrics, calculate_risk_metrics
+from portfolio_balancer.src.evaluation.monte_carlo import estimate_step_returns, monte_carlo_projection
+from portfolio_balancer.src.evaluation.online_metrics import OnlineMetricsStore, OnlineRiskMetrics, update_online_metrics
+from portfolio_balancer.src.evaluation.risk_engine import VAR_METHODS, calculate_var_metrics
+
+def _price_history(seed: int, num_days: int, num_assets: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0003, 0.01, (num_days, num_assets))
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=pd.bdate_range('2019-01-01', periods=num_days),
+                        columns=[f"T{i}" for i in range(num_assets)])
+
+def _random_weights(seed: int, num_assets: int) -> np.ndarray:
+    weights = np.random.default_rng(seed).random(num_assets)
+    return weights / weights.sum()
+
+def test_batch_risk_metrics_match_per_portfolio_metrics():
+    price_history = _price_history(seed=10, num_days=500, num_assets=8)
+    weights = np.array([_random_weights(seed=11 + i, num_assets=8) for i in range(50)])
+    weights[0] = np.eye(8)[3] # A single-asset portfolio
+    batch = calculate_batch_risk_metrics(price_history, weights, risk_free_rate=0.02)
+
+    cov_matrix = price_history.pct_change().dropna().cov().to_numpy()
+    for index, row in enumerate(weights):
+        single = calculate_risk_metrics(price_history, row, risk_free_rate=0.02)
+        for key, value in single.items():
+            assert batch[key][index] == pytest.approx(value, rel=1e-9), (index, key)
+        volatility = np.sqrt(row @ cov_matrix @ row)
+        np.testing.assert_allclose(batch['risk_contributions'][index], row * (cov_matrix @ row) / volatility, rtol=1e-9, atol=1e-15)
+
+def test_batch_var_metrics_match_per_portfolio_var():
+    price_history = _price_history(seed=12, num_days=400, num_assets=5)
+    weights = np.array([_random_weights(seed=13 + i, num_assets=5) for i in range(20)])
+    batch = calculate_var_metrics(price_history, weights, confidence=0.99, horizon_days=10, num_paths=5000, seed=0)
+
+    for index, row in enumerate(weights):
+        single = calculate_var_metrics(price_history, row, confidence=0.99, horizon_days=10, num_paths=5000, seed=0)
+        for method in VAR_METHODS:
+            for measure in ('var', 'cvar'):
+                assert batch[method][measure][index] == pytest.approx(single[method][measure][0], rel=1e-9), (index, method, measure)
+
+def test_online_metrics_match_batch_metrics(tmp_path):
+    price_history = _price_history(seed=0, num_days=600, num_assets=6)
+    weights = _random_weights(seed=1, num_assets=6)
+    store = OnlineMetricsStore(str(tmp_path))
+
+    update_online_metrics(1, price_history.iloc[:400], weights, store=store)
+    for day in range(400, len(price_history)):
+        result = update_online_metrics(1, price_history.iloc[day - 1:day + 1], weights, store=store)
+
+    expected = calculate_risk_metrics(price_history, weights)
+    for key, value in expected.items():
+        assert result[key] == pytest.approx(value, rel=1e-9), key
+
+    growth = (price_history.pct_change().dropna() @ weights + 1).cumprod()
+    growth = pd.concat([pd.Series([1.0]), growth.reset_index(drop=True)])
+    assert result['max_drawdown'] == pytest.approx((growth / growth.cummax() - 1).min(), rel=1e-9)
+
+def test_online_covariance_matches_sample_covariance():
+    price_history = _price_history(seed=2, num_days=300, num_assets=4)
+    online = OnlineRiskMetrics(list(price_history.columns), _random_weights(seed=3, num_assets=4))
+    online.update_from_price_history(price_history)
+
+    np.testing.assert_allclose(online.cov_matrix, price_history.pct_change().dropna().cov().to_numpy(), rtol=1e-9)
+
+@pytest.mark.parametrize("confidence, horizon_days", [(0.0, 1), (1.0, 1), (1.5, 1), (float('nan'), 1), (0.95, 0), (0.95, 2.5)])
+def test_var_metrics_reject_out_of_range_parameters(confidence, horizon_days):
+    price_history = _price_history(seed=4, num_days=100, num_assets=3)
+    with pytest.raises(ValueError):
+        calculate_var_metrics(price_history, _random_weights(seed=5, num_assets=3), confidence=confidence, horizon_days=horizon_days)
+
+@pytest.mark.parametrize("rebalance_every", [1, 12, 0])
+def test_projection_does_not_depend_on_chunk_size(rebalance_every):
+    mean_returns, cov_matrix = estimate_step_returns(_price_history(seed=6, num_days=500, num_assets=4))
+    kwargs = dict(years=5, num_paths=3000, rebalance_every=rebalance_every, annual_contribution=100.0, goal_value=1500.0, seed=7)
+    expected = monte_carlo_projection(_random_weights(seed=8, num_assets=4), mean_returns, cov_matrix, 1000.0, **kwargs)
+    for chunk_size in (1, 1000, 2500):
+        result = monte_carlo_projection(_random_weights(seed=8, num_assets=4), mean_returns, cov_matrix, 1000.0,
+                                        chunk_size=chunk_size, **kwargs)
+        assert result['percentiles'] == expected['percentiles']
+        assert result['goal_probability_by_year'] == expected['goal_probability_by_year']
+
+def test_baseline_backtest_scales_a_unit_run_to_the_users_portfolio_value(monkeypatch, tmp_path):
+    monkeypatch.setattr(backtest_module, 'backtest_cache', ResultCache("backtests", cache_dir=str(tmp_path)))
+    price_history = _price_history(seed=9, num_days=300, num_assets=3)
+    tickers = list(price_history.columns)
+    baseline_weights = {tickers[0]: 0.6, tickers[1]: 0.4}
+
+    def baseline(shares: float, **kwargs) -> dict:
+        initial_portfolio = {ticker: {'amount': shares, 'price': price_history.iloc[0][ticker]} for ticker in tickers}
+        initial_portfolio['CASH'] = {'value': 20 * shares}
+        return compare_strategies(price_history, initial_portfolio, {ticker: 1 / 3 for ticker in tickers}, baseline_weights,
+                                  mvo_params={}, **kwargs)['baseline']
+
+    # Fees and the minimum trade size are in dollars, so the run matches a fractional-share simulation at the user's value
+    user_total_value = sum(10.0 * price_history.iloc[0]) + 200.0
+    result = baseline(10.0, fees_per_trade=5.0, min_trade_threshold=50.0)
+    expected = run_backtest(price_history[list(baseline_weights)], {ticker: {'amount': user_total_value * weight / price_history.iloc[0][ticker],
+                                                                             'price': price_history.iloc[0][ticker]}
+                                                                    for ticker, weight in baseline_weights.items()},
+                            baseline_weights, fees_per_trade=5.0, min_trade_threshold=50.0, use_cache=False, round_to_nearest_share=False)
+    assert result['portfolio_value_history'][0][1] == pytest.approx(user_total_value)
+    assert [value for _, value in result['portfolio_value_history']] == pytest.approx([value for _, value in expected['portfolio_value_history']])
+    assert [trade['amount'] for trade in result['trades_history']] == pytest.approx([trade['amount'] for trade in expected['trades_history']])
+    assert result['trades_history'] and all(trade['amount'] >= 50.0 for trade in result['trades_history'])
+    assert result['metrics'] == pytest.approx(expected['metrics'])
+
+    # Without fees the unit run does not depend on the value, so users of any size share it
+    def stored_runs() -> int:
+        return len(os.listdir(os.path.join(str(tmp_path), "backtests")))
+
+    small = baseline(1.0, min_trade_threshold=0.0)
+    runs = stored_runs()
+    large = baseline(1000.0, min_trade_threshold=0.0)
+    assert stored_runs() == runs + 4 # Three strategies and the comparison; the baseline run is reused
+    assert [value for _, value in large['portfolio_value_history']] == pytest.approx([1000 * value for _, value in small['portfolio_value_history']])
+
+@pytest.mark.parametrize("rebalance_frequency", ["quarterly", "monthly", "drift"])
+@pytest.mark.parametrize("round_to_nearest_share", [True, False])
+def test_batch_backtest_matches_per_portfolio_backtests(rebalance_frequency, round_to_nearest_share):
+    price_history = _price_history(seed=20, num_days=260, num_assets=4)
+    tickers = list(price_history.columns)
+    rng = np.random.default_rng(21)
+    holdings = rng.integers(5, 60, (6, 4)).astype(float)
+    holdings[0, 2] = 0.0 # A target asset not yet held
+    target_weights = np.array([_random_weights(seed=22 + i, num_assets=4) for i in range(6)])
+    batch = batch_backtest(price_history, holdings, target_weights, rebalance_frequency=rebalance_frequency, drift_threshold=0.1,
+                           fees_per_trade=1.0, min_trade_threshold=5.0, round_to_nearest_share=round_to_nearest_share)
+    assert batch['rebalance_counts'].all()
+
+    first_prices = price_history.iloc[0]
+    for index in range(len(holdings)):
+        single = run_backtest(
+            price_history,
+            {ticker: {'amount': holdings[index, j], 'price': first_prices[ticker]} for j, ticker in enumerate(tickers)},
+            dict(zip(tickers, target_weights[index])), rebalance_frequency=rebalance_frequency, drift_threshold=0.1,
+            fees_per_trade=1.0, min_trade_threshold=5.0, use_cache=False, round_to_nearest_share=round_to_nearest_share
+        )
+        values = [value for _, value in single['portfolio_value_history']]
+        np.testing.assert_allclose(batch['portfolio_values'][index], values, rtol=1e-9)
+        assert batch['rebalance_counts'][index] == single['rebalance_count']
+        for key, value in single['metrics'].items():
+            assert batch['metrics'][key][index] == pytest.approx(value, rel=1e-9, abs=1e-12), (index, key)
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_balancer.src.api import price_service as price_service_module
+from portfolio_balancer.src.api import snapshot_cache as snapshot_cache_module
+from portfolio_balancer.src.api.snapshot_cache import SnapshotCache
+from portfolio_balancer.src.data import repository as repository_module
+from portfolio_balancer.src.data.repository import SQLiteRepository
+from portfolio_balancer.src.data.result_cache import ResultCache
+from portfolio_balancer.src.evaluation.online_metrics import online_metrics_store
+from portfolio_balancer.src.evaluation.risk_engine import calculate_var_metrics
+from portfolio_balancer.src.jobs import daily_jobs, nightly_jobs
+from portfolio_balancer.src.optimization import mvo_cache as mvo_cache_module
+from portfolio_balancer.src.optimization.mvo_cache import DEFAULT_MVO_PARAMS, get_cached_mvo, mvo_window
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = SQLiteRepository(':memory:')
+    monkeypatch.setattr(repository_module, '_repository', repo)
+    # Stored prices are all the jobs get: the providers are unavailable
+    monkeypatch.setattr(price_service_module, 'fetch_yfinance_data', lambda ticker, start_date, end_date: None)
+    yield repo
+    repo.close()
+
+@pytest.fixture
+def mvo_cache(monkeypatch, tmp_path):
+    cache = ResultCache("mvo", cache_dir=str(tmp_path))
+    monkeypatch.setattr(mvo_cache_module, 'mvo_cache', cache)
+    return cache
+
+@pytest.fixture
+def snapshot_cache(monkeypatch, tmp_path):
+    cache = SnapshotCache(cache_dir=str(tmp_path / "snapshots"))
+    monkeypatch.setattr(snapshot_cache_module, 'snapshot_cache', cache)
+    return cache
+
+def _seed_prices(repo, tickers: list, days: int = 300, end=None):
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range(end=end or datetime.now().date() - timedelta(days=1), periods=days)
+    rows = []
+    for ticker in tickers:
+        closes = 100 * np.cumprod(1 + rng.normal(0.0004, 0.01, len(dates)))
+        rows += [{"ticker": ticker, "date": date.strftime('%Y-%m-%d'), "close": float(close)} for date, close in zip(dates, closes)]
+    repo.save_price_history(rows)
+
+def test_precompute_mvo_results_solves_each_ticker_set_once(repo, mvo_cache, monkeypatch):
+    repo.add_holdings([
+        {"user_id": "1", "ticker": "AAPL", "quantity": 1.0},
+        {"user_id": "1", "ticker": "BND", "quantity": 1.0},
+        {"user_id": "2", "ticker": "BND", "quantity": 2.0},
+        {"user_id": "2", "ticker": "AAPL", "quantity": 2.0},
+        {"user_id": "3", "ticker": "AAPL", "quantity": 1.0},
+        {"user_id": "3", "ticker": "MSFT", "quantity": 1.0},
+        {"user_id": "3", "ticker": "BND", "quantity": 1.0}
+    ])
+    _seed_prices(repo, ["AAPL", "BND", "MSFT"])
+    solves = []
+    solve = nightly_jobs.markowitz_mvo
+    monkeypatch.setattr(nightly_jobs, 'markowitz_mvo', lambda **kwargs: solves.append(kwargs) or solve(**kwargs))
+
+    nightly_jobs.precompute_mvo_results()
+    assert len(solves) == 2
+    window = mvo_window()
+    for tickers in (["AAPL", "BND"], ["BND", "AAPL", "MSFT"]):
+        result = get_cached_mvo(tickers, DEFAULT_MVO_PARAMS, window)
+        assert result["solve_path"] == "solver"
+        assert set(result["optimal_weights"]) == set(tickers)
+
+    nightly_jobs.precompute_mvo_results() # Everything is cached
+    assert len(solves) == 2
+
+def test_precompute_common_stats_stores_volatility_and_correlations(repo):
+    repo.add_holdings([{"user_id": "1", "ticker": "AAPL", "quantity": 1.0}, {"user_id": "2", "ticker": "BND", "quantity": 1.0}])
+    _seed_prices(repo, ["AAPL", "BND"])
+
+    nightly_jobs.precompute_common_stats()
+    stats = repo.get_latest_precomputed_stats()
+    assert stats["date"] == datetime.now().date().isoformat()
+    assert set(stats["volatility"]) == {"AAPL", "BND"}
+    assert stats["volatility"]["AAPL"] == pytest.approx(0.01 * np.sqrt(252), rel=0.2)
+    assert stats["correlations"]["AAPL"]["AAPL"] == pytest.approx(1.0)
+    assert abs(stats["correlations"]["AAPL"]["BND"]) < 0.3
+
+def test_update_online_risk_metrics_extends_each_users_state(repo, snapshot_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(online_metrics_store, 'state_dir', str(tmp_path / "online"))
+    repo.add_holdings([
+        {"user_id": "1", "ticker": "AAPL", "quantity": 10.0},
+        {"user_id": "1", "ticker": "BND", "quantity": 20.0},
+        {"user_id": "2", "ticker": "AAPL", "quantity": 5.0}
+    ])
+    for ticker in ("AAPL", "BND"):
+        repo.upsert_latest_price({"ticker": ticker, "price": 100.0, "as_of": datetime.now().isoformat()})
+    last_week = datetime.now().date() - timedelta(days=7)
+    _seed_prices(repo, ["AAPL", "BND"], end=last_week)
+
+    daily_jobs.update_online_risk_metrics()
+    states = {user_id: online_metrics_store.load(user_id) for user_id in ("1", "2")}
+    assert sorted(states["1"].tickers) == ["AAPL", "BND"] and states["2"].tickers == ["AAPL"]
+    assert states["1"].count == states["2"].count == 299
+    assert states["1"].last_date.date() <= last_week
+
+    # The next run only applies the days priced since
+    _seed_prices(repo, ["AAPL", "BND"], days=3, end=last_week + timedelta(days=7))
+    daily_jobs.update_online_risk_metrics()
+    for user_id in ("1", "2"):
+        state = online_metrics_store.load(user_id)
+        assert state.count == 302
+        assert state.last_date.date() > last_week
+
+def test_recompute_snapshots_stores_value_and_asset_class_weights(repo, snapshot_cache):
+    repo.add_holdings([{"user_id": "1", "ticker": "AAPL", "quantity": 3.0}, {"user_id": "1", "ticker": "BND", "quantity": 10.0}])
+    repo.upsert_latest_price({"ticker": "AAPL", "price": 200.0, "as_of": datetime.now().isoformat()})
+    repo.upsert_latest_price({"ticker": "BND", "price": 40.0, "as_of": datetime.now().isoformat()})
+
+    daily_jobs.recompute_snapshots()
+    [snapshot] = repo.get_snapshots("1")
+    assert snapshot["date"] == datetime.now().date().isoformat()
+    assert snapshot["total_value"] == pytest.approx(1000.0)
+    assert snapshot["asset_allocation"] == pytest.approx({"equities": 0.6, "bonds": 0.4})
+
+def test_compute_risk_reports_matches_per_user_var_and_stress(repo, snapshot_cache):
+    repo.add_holdings([
+        {"user_id": "1", "ticker": "AAPL", "quantity": 10.0},
+        {"user_id": "1", "ticker": "BND", "quantity": 20.0},
+        {"user_id": "2", "ticker": "AAPL", "quantity": 5.0}
+    ])
+    for ticker in ("AAPL", "BND"):
+        repo.upsert_latest_price({"ticker": ticker, "price": 100.0, "as_of": datetime.now().isoformat()})
+    _seed_prices(repo, ["AAPL", "BND"])
+    # Prices over the COVID-19 stress window only
+    repo.save_price_history([
+        {"ticker": "AAPL", "date": "2020-02-19", "close": 100.0}, {"ticker": "AAPL", "date": "2020-03-23", "close": 70.0},
+        {"ticker": "BND", "date": "2020-02-19", "close": 100.0}, {"ticker": "BND", "date": "2020-03-23", "close": 95.0}
+    ])
+
+    daily_jobs.compute_risk_reports(confidence=0.99, horizon_days=5)
+    end_date = datetime.now().date()
+    price_history = repo.price_history_frame(["AAPL", "BND"], (end_date - timedelta(days=365 * 5)).isoformat(), end_date.isoformat())
+    for user_id, weights in (("1", [1 / 3, 2 / 3]), ("2", [1.0, 0.0])):
+        [row] = repo.get_risk_reports(user_id)
+        assert row["date"] == end_date.isoformat()
+        report = row["report"]
+        expected = calculate_var_metrics(price_history, np.array([weights]), confidence=0.99, horizon_days=5, seed=0)
+        for method in ("historical", "parametric", "monte_carlo"):
+            assert report["var"][method]["var"] == pytest.approx(float(expected[method]["var"][0]))
+            assert report["var"][method]["cvar"] == pytest.approx(float(expected[method]["cvar"][0]))
+        assert (report["var"]["confidence"], report["var"]["horizon_days"]) == (0.99, 5)
+        stress = {item["scenario"]: item for item in report["stress"]}
+        assert stress["covid_2020"]["loss"] == pytest.approx(0.3 * weights[0] + 0.05 * weights[1])
+        assert stress["covid_2020"]["coverage"] == pytest.approx(1.0)
+        assert stress["gfc_2008"]["coverage"] == 0.0
@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_balancer.src.optimization import cvxpy_rebalancer
+from portfolio_balancer.src.optimization.batch_rebalancer import batch_deterministic_rebalance, batch_result_to_trades
+from portfolio_balancer.src.optimization.cvxpy_rebalancer import cvxpy_rebalance, cvxpy_rebalance_batch
+from portfolio_balancer.src.data.result_cache import ResultCache
+from portfolio_balancer.src.optimization import mvo_cache as mvo_cache_module
+from portfolio_balancer.src.optimization.lot_rounding import round_to_lots
+from portfolio_balancer.src.optimization.markowitz_mvo import markowitz_mvo
+from portfolio_balancer.src.optimization.mvo_cache import get_cached_mvo, group_by_ticker_set, mvo_cache_key, mvo_params, store_mvo_result
+from portfolio_balancer.src.optimization.rebalancer import deterministic_rebalance
+from portfolio_balancer.src.optimization.solver_policy import load_solver_policy, save_solver_policy, select_solver
+from portfolio_balancer.src.optimization.what_if import WhatIfSession
+
+def _random_accounts(seed: int, num_accounts: int, num_tickers: int) -> dict:
+    rng = np.random.default_rng(seed)
+    holdings = rng.integers(0, 50, (num_accounts, num_tickers)).astype(float) * (rng.random((num_accounts, num_tickers)) < 0.7)
+    cash = rng.uniform(0, 3000, num_accounts) * (rng.random(num_accounts) < 0.7)
+    weights = rng.random((num_accounts, num_tickers)) * (rng.random((num_accounts, num_tickers)) < 0.8)
+    cash_weights = rng.random(num_accounts) * 0.2
+    totals = weights.sum(axis=1) + cash_weights
+    return {
+        "tickers": [f"T{i}" for i in range(num_tickers)],
+        "holdings": holdings,
+        "prices": rng.uniform(5, 400, num_tickers),
+        "cash": cash,
+        "weights": weights / totals[:, None],
+        "cash_weights": cash_weights / totals
+    }
+
+def _single_account_rebalance(accounts: dict, index: int, **kwargs) -> dict:
+    tickers, holdings, prices = accounts["tickers"], accounts["holdings"][index], accounts["prices"]
+    current_portfolio = {ticker: {'amount': holdings[i], 'price': prices[i]} for i, ticker in enumerate(tickers) if holdings[i] > 0}
+    if accounts["cash"][index] > 0:
+        current_portfolio['CASH'] = {'value': accounts["cash"][index]}
+    target_weights = {ticker: accounts["weights"][index, i] for i, ticker in enumerate(tickers) if accounts["weights"][index, i] > 0}
+    target_weights['CASH'] = accounts["cash_weights"][index]
+    total_value = float(holdings @ prices + accounts["cash"][index])
+    return deterministic_rebalance(current_portfolio, target_weights, total_value, asset_prices=dict(zip(tickers, prices)), **kwargs)
+
+def _trade_amounts(result: dict) -> dict:
+    return {(trade['action'], trade['ticker']): trade['amount'] for trade in result['trades']}
+
+@pytest.mark.parametrize("round_to_nearest_share", [False, True])
+@pytest.mark.parametrize("fees_per_trade", [0.0, 1.0])
+@pytest.mark.parametrize("min_cash_reserve", [100.0, 2000.0])
+def test_batch_rebalance_matches_single_account(round_to_nearest_share, fees_per_trade, min_cash_reserve):
+    accounts = _random_accounts(seed=0, num_accounts=1500, num_tickers=6)
+    kwargs = dict(min_trade_threshold=10, min_cash_reserve=min_cash_reserve, fees_per_trade=fees_per_trade,
+                  round_to_nearest_share=round_to_nearest_share)
+    batch = batch_deterministic_rebalance(
+        accounts["holdings"], accounts["weights"], accounts["prices"],
+        cash=accounts["cash"], cash_weights=accounts["cash_weights"], **kwargs
+    )
+
+    for index in range(len(accounts["holdings"])):
+        single = _single_account_rebalance(accounts, index, **kwargs)
+        batched = batch_result_to_trades(batch, accounts["tickers"], index)
+        single_trades, batched_trades = _trade_amounts(single), _trade_amounts(batched)
+        assert single_trades.keys() == batched_trades.keys(), index
+        for key, amount in single_trades.items():
+            assert batched_trades[key] == pytest.approx(amount), (index, key)
+        for ticker, weight in single['post_trade_weights_est'].items():
+            assert batched['post_trade_weights_est'].get(ticker, 0.0) == pytest.approx(weight, abs=1e-9), (index, ticker)
+
+def test_round_to_lots_rows_do_not_depend_on_the_batch():
+    accounts = _random_accounts(seed=1, num_accounts=200, num_tickers=10)
+    rng = np.random.default_rng(2)
+    tradable = rng.random(accounts["holdings"].shape) < 0.6
+    target_values = accounts["weights"] * (accounts["holdings"] @ accounts["prices"] + accounts["cash"])[:, None]
+    kwargs = dict(fees_per_trade=1.0, min_cash_reserve=3000.0)
+
+    batch = round_to_lots(target_values, accounts["holdings"], accounts["prices"], accounts["cash"], tradable=tradable, **kwargs)
+    for index in range(len(target_values)):
+        # Only the tradable columns, as deterministic_rebalance passes them
+        columns = np.flatnonzero(tradable[index])
+        single = round_to_lots(target_values[index, columns], accounts["holdings"][index, columns], accounts["prices"][columns],
+                               accounts["cash"][index], **kwargs)
+        np.testing.assert_array_equal(single['trade_shares'][0], batch['trade_shares'][index, columns])
+        assert single['cash'][0] == pytest.approx(batch['cash'][index])
+
+def test_round_to_lots_trades_whole_shares_within_cash():
+    accounts = _random_accounts(seed=3, num_accounts=100, num_tickers=8)
+    target_values = accounts["weights"] * (accounts["holdings"] @ accounts["prices"] + accounts["cash"])[:, None]
+    lots = round_to_lots(target_values, accounts["holdings"], accounts["prices"], accounts["cash"], min_cash_reserve=50.0)
+
+    np.testing.assert_array_equal(lots['trade_shares'], np.round(lots['trade_shares']))
+    assert (lots['shares'] >= 0).all()
+    assert (lots['cash'] >= np.minimum(50.0, accounts["cash"]) - 1e-6).all()
+
+def _cash_after_trades(cash: float, trades: list, fees_per_trade: float) -> float:
+    sold = sum(trade['amount'] for trade in trades if trade['action'] == 'SELL')
+    bought = sum(trade['amount'] for trade in trades if trade['action'] == 'BUY')
+    return cash + sold - bought - fees_per_trade * len(trades)
+
+def test_cvxpy_rebalance_targets_not_summing_to_one():
+    current_portfolio = {'AAPL': {'amount': 10, 'price': 150}, 'BND': {'amount': 20, 'price': 72}, 'CASH': {'value': 500}}
+    result = cvxpy_rebalance(current_portfolio, {'AAPL': 0.6, 'BND': 0.4, 'CASH': 0.1}, 3440.0, {'AAPL': 150, 'BND': 72})
+
+    assert 'error' not in result
+    assert result['solve_path'] == 'solver'
+    assert {(trade['action'], trade['ticker']) for trade in result['trades']} == {('BUY', 'AAPL'), ('SELL', 'BND')}
+
+def test_cvxpy_rebalance_falls_back_when_infeasible():
+    current_portfolio = {'AAPL': {'amount': 10, 'price': 150}, 'CASH': {'value': 100}}
+    result = cvxpy_rebalance(current_portfolio, {'AAPL': 0.5, 'CASH': 0.5}, 1600.0, {'AAPL': 150}, min_cash_reserve=5000)
+
+    assert result['solve_path'] == 'fallback_deterministic'
+    assert result['solver_status'] == 'infeasible'
+
+@pytest.mark.parametrize("round_to_nearest_share", [False, True])
+def test_cvxpy_rebalance_keeps_reserve_after_fixed_fees(round_to_nearest_share):
+    rng = np.random.default_rng(4)
+    tickers = [f"T{i}" for i in range(6)]
+    for _ in range(100):
+        prices = rng.uniform(5, 400, len(tickers))
+        holdings = rng.integers(0, 5, len(tickers)).astype(float)
+        cash = rng.uniform(0, 300)
+        weights = rng.dirichlet(np.ones(len(tickers) + 1))
+        current_portfolio = {ticker: {'amount': holdings[i], 'price': prices[i]} for i, ticker in enumerate(tickers) if holdings[i] > 0}
+        current_portfolio['CASH'] = {'value': cash}
+        target_weights = {**dict(zip(tickers, weights)), 'CASH': weights[-1]}
+
+        result = cvxpy_rebalance(current_portfolio, target_weights, float(holdings @ prices + cash), dict(zip(tickers, prices)),
+                                 min_trade_threshold=1, min_cash_reserve=10, fees_per_trade=20,
+                                 round_to_nearest_share=round_to_nearest_share)
+        if result['trades']:
+            assert _cash_after_trades(cash, result['trades'], 20) >= min(10, cash) - 1e-6
+
+def test_cvxpy_rebalance_batch_keeps_reserve_and_falls_back():
+    accounts = _random_accounts(seed=5, num_accounts=30, num_tickers=5)
+    cash = accounts["cash"].copy()
+    cash[0], accounts["holdings"][0] = 10.0, 0.0 # Reserve above the whole portfolio: infeasible
+    result = cvxpy_rebalance_batch(accounts["holdings"], accounts["weights"], accounts["prices"], cash=cash,
+                                   cash_weights=accounts["cash_weights"], min_trade_threshold=1, min_cash_reserve=50,
+                                   fees_per_trade=20, round_to_nearest_share=True)
+
+    assert result['solve_path'][0] == 'fallback_deterministic'
+    solved = np.array([path == 'solver' for path in result['solve_path']])
+    assert solved[1:].all()
+    assert (result['post_trade_cash'][solved] >= np.minimum(50, cash[solved]) - 1e-6).all()
+
+def _what_if_session(seed: int, num_assets: int = 12) -> WhatIfSession:
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.01, (num_assets, num_assets))
+    tickers = [f"T{i}" for i in range(num_assets)]
+    return WhatIfSession(tickers, rng.uniform(1000, 5000, num_assets), 10000.0, factors @ factors.T, fees_per_trade=1.0)
+
+def _assert_matches_full_recompute(session: WhatIfSession):
+    summary = session.summary()
+    values = session.values
+    total_value = values.sum() + session.cash
+    dollar_volatility = np.sqrt(values @ session.cov_matrix @ values)
+    assert summary['volatility'] == pytest.approx(dollar_volatility / total_value, rel=1e-9)
+    expected_contributions = values * (session.cov_matrix @ values) / dollar_volatility / total_value
+    np.testing.assert_allclose([summary['risk_contributions'][t] for t in session.tickers], expected_contributions, rtol=1e-9)
+    assert summary['total_value'] == pytest.approx(total_value)
+
+def test_what_if_rank_one_updates_match_full_recompute():
+    session = _what_if_session(seed=6)
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        ticker = session.tickers[rng.integers(len(session.tickers))]
+        if rng.random() < 0.5 and session.values[session.tickers.index(ticker)] > 100:
+            session.apply_trade(ticker, 'SELL', 100 * rng.random())
+        else:
+            session.apply_trade(ticker, 'BUY', 100 * rng.random())
+        if rng.random() < 0.2:
+            session.undo()
+    _assert_matches_full_recompute(session)
+    assert session.cash == pytest.approx(10000.0 + sum(
+        (trade['amount'] if trade['action'] == 'SELL' else -trade['amount']) - trade['fee'] for trade in session.trades))
+
+def test_what_if_concurrent_trades_keep_state_consistent():
+    session = _what_if_session(seed=8)
+
+    def trade(ticker):
+        for _ in range(200):
+            session.apply_trade(ticker, 'BUY', 10.0)
+            session.apply_trade(ticker, 'SELL', 5.0)
+
+    threads = [threading.Thread(target=trade, args=(ticker,)) for ticker in session.tickers[:8]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(session.trades) == 8 * 400
+    _assert_matches_full_recompute(session)
+
+def test_mvo_cache_key_identifies_ticker_set_parameters_and_window():
+    window = ("2020-01-01", "2025-01-01")
+    key = mvo_cache_key(["BND", "AAPL", "AAPL"], mvo_params(), window)
+    assert key == mvo_cache_key(("AAPL", "BND"), mvo_params(risk_free_rate=0.01), window)
+    assert key != mvo_cache_key(["AAPL", "BND", "MSFT"], mvo_params(), window)
+    assert key != mvo_cache_key(["AAPL", "BND"], mvo_params(risk_free_rate=0.02), window)
+    assert key != mvo_cache_key(["AAPL", "BND"], mvo_params(max_bonds_weight=0.4), window)
+    assert key != mvo_cache_key(["AAPL", "BND"], mvo_params(), ("2020-01-02", "2025-01-02"))
+    assert group_by_ticker_set({1: ["BND", "AAPL"], 2: ["AAPL", "BND", "BND"], 3: ["AAPL"]}) == {("AAPL", "BND"): [1, 2], ("AAPL",): [3]}
+
+def test_only_completed_mvo_solves_are_stored(monkeypatch, tmp_path):
+    monkeypatch.setattr(mvo_cache_module, 'mvo_cache', ResultCache("mvo", cache_dir=str(tmp_path)))
+    window = ("2020-01-01", "2025-01-01")
+    for solve_path in ("solver_partial", "fallback_min_variance", None):
+        assert not store_mvo_result(["AAPL"], mvo_params(), window, {"optimal_weights": {"AAPL": 1.0}, "solve_path": solve_path})
+        assert get_cached_mvo(["AAPL"], mvo_params(), window) is None
+
+    result = {"optimal_weights": {"AAPL": 1.0}, "solve_path": "solver"}
+    assert store_mvo_result(["AAPL"], mvo_params(), window, result)
+    assert get_cached_mvo(["AAPL"], mvo_params(), window) == result
+    # The disk tier serves other processes
+    assert ResultCache("mvo", cache_dir=str(tmp_path)).get(mvo_cache_key(["AAPL"], mvo_params(), window)) == result
+
+def _policy(mvo_buckets: list) -> dict:
+    return {"problems": {"mvo": [{"max_assets": max_assets, "solver": solver} for max_assets, solver in mvo_buckets]}}
+
+def test_select_solver_picks_the_smallest_bucket_that_fits():
+    policy = _policy([(50, "SCS"), (10, "CLARABEL"), (500, "OSQP")])
+    assert select_solver('mvo', 3, policy) == "CLARABEL"
+    assert select_solver('mvo', 10, policy) == "CLARABEL"
+    assert select_solver('mvo', 11, policy) == "SCS"
+    assert select_solver('mvo', 5000, policy) == "OSQP" # Beyond the benchmarked sizes: the largest bucket
+    assert select_solver('rebalance', 3, policy) is None # No entry: cvxpy chooses
+    assert select_solver('mvo', 3, _policy([(10, "NOT_INSTALLED")])) is None
+
+def test_solver_policy_file_is_reloaded_when_it_changes_and_ignored_when_unreadable(tmp_path):
+    path = str(tmp_path / "solver_policy.json")
+    assert load_solver_policy(path) == {"problems": {}}
+
+    save_solver_policy(_policy([(10, "CLARABEL")]), path)
+    assert select_solver('mvo', 3, load_solver_policy(path)) == "CLARABEL"
+    save_solver_policy(_policy([(10, "SCS")]), path)
+    os.utime(path, (os.path.getmtime(path) + 1, os.path.getmtime(path) + 1))
+    assert select_solver('mvo', 3, load_solver_policy(path)) == "SCS"
+
+    with open(path, 'w') as f:
+        f.write("{not json")
+    os.utime(path, (os.path.getmtime(path) + 2, os.path.getmtime(path) + 2))
+    assert load_solver_policy(path) == {"problems": {}}
+
+@pytest.mark.parametrize("policy_solver, expected_solver", [("SCS", "SCS"), ("CLARABEL", "CLARABEL"), ("NOT_INSTALLED", None)])
+def test_markowitz_mvo_solves_with_the_policy_solver(monkeypatch, tmp_path, policy_solver, expected_solver):
+    path = str(tmp_path / "solver_policy.json")
+    with open(path, 'w') as f:
+        json.dump(_policy([(100, policy_solver)]), f)
+    monkeypatch.setenv("SOLVER_POLICY_PATH", path)
+    rng = np.random.default_rng(5)
+    price_history = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0.0004, 0.01, (400, 4)), axis=0)),
+                                 index=pd.bdate_range('2020-01-01', periods=400), columns=["A", "B", "C", "D"])
+
+    result = markowitz_mvo(price_history)
+    assert result["solve_path"] == "solver"
+    if expected_solver:
+        assert result["solver"] == expected_solver
+    assert sum(result["optimal_weights"].values()) == pytest.approx(1.0)
+
+def _rebalance_account(seed: int, num_tickers: int = 5) -> tuple:
+    rng = np.random.default_rng(seed)
+    tickers = [f"T{i}" for i in range(num_tickers)]
+    prices = dict(zip(tickers, rng.uniform(5, 400, num_tickers)))
+    current_portfolio = {ticker: {'amount': float(rng.integers(1, 20)), 'price': prices[ticker]} for ticker in tickers}
+    current_portfolio['CASH'] = {'value': float(rng.uniform(0, 500))}
+    weights = rng.dirichlet(np.ones(num_tickers + 1))
+    target_weights = {**dict(zip(tickers, weights)), 'CASH': weights[-1]}
+    total_value = sum(position.get('value', position.get('amount', 0) * position.get('price', 0)) for position in current_portfolio.values())
+    return current_portfolio, target_weights, total_value, prices
+
+def test_cvxpy_rebalance_reuses_one_compiled_problem_per_size(monkeypatch):
+    monkeypatch.setattr(cvxpy_rebalancer, '_REBALANCE_PROBLEMS', {})
+    kwargs = {"min_trade_threshold": 1.0, "fees_per_trade": 2.0, "min_cash_reserve": 20.0}
+    cvxpy_rebalance(*_rebalance_account(seed=1), **kwargs)
+    entry = cvxpy_rebalancer._REBALANCE_PROBLEMS[5]
+    assert entry["problem"].is_dcp(dpp=True)
+
+    # Each call swaps its own data into the shared parameters: results match a freshly compiled problem
+    reused = [cvxpy_rebalance(*_rebalance_account(seed=seed), **kwargs) for seed in range(2, 6)]
+    assert cvxpy_rebalancer._REBALANCE_PROBLEMS == {5: entry}
+    for seed, result in zip(range(2, 6), reused):
+        monkeypatch.setattr(cvxpy_rebalancer, '_REBALANCE_PROBLEMS', {})
+        fresh = cvxpy_rebalance(*_rebalance_account(seed=seed), **kwargs)
+        assert result['solve_path'] == fresh['solve_path'] == 'solver'
+        assert [(trade['action'], trade['ticker']) for trade in result['trades']] == [(trade['action'], trade['ticker']) for trade in fresh['trades']]
+        assert [trade['amount'] for trade in result['trades']] == pytest.approx([trade['amount'] for trade in fresh['trades']], rel=1e-4, abs=1e-3)
+
+def test_solvers_fall_back_when_the_budget_runs_out():
+    current_portfolio, target_weights, total_value, prices = _rebalance_account(seed=7)
+    result = cvxpy_rebalance(current_portfolio, target_weights, total_value, prices, time_limit=1e-9)
+    expected = deterministic_rebalance(current_portfolio, target_weights, total_value, asset_prices=prices)
+    assert (result['solve_path'], result['solver_status']) == ('fallback_deterministic', 'timeout')
+    assert result['trades'] == expected['trades']
+
+    rng = np.random.default_rng(8)
+    price_history = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0.0004, 0.01, (300, 4)), axis=0)),
+                                 index=pd.bdate_range('2020-01-01', periods=300), columns=["A", "B", "C", "D"])
+    mvo = markowitz_mvo(price_history, time_limit=1e-9)
+    assert (mvo['solve_path'], mvo['status']) == ('fallback_min_variance', 'timeout')
+    assert sum(mvo['optimal_weights'].values()) == pytest.approx(1.0)
+    assert markowitz_mvo(price_history, time_limit=30)['solve_path'] == 'solver'